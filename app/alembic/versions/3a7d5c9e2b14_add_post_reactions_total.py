@@ -0,0 +1,41 @@
+"""add_post_reactions_total
+
+Revision ID: 3a7d5c9e2b14
+Revises: e1a6b8c4d2f9
+Create Date: 2026-10-19 16:42:08.214377
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '3a7d5c9e2b14'
+down_revision: Union[str, None] = 'e1a6b8c4d2f9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('posts', sa.Column('reactions_total', sa.Integer(), server_default='0', nullable=False, comment='Сумма count по всем реакциям поста (пересчитывается сборщиком при записи reactions)'))
+    # Однократный пересчет по уже сохраненным reactions; дальше значение поддерживает сборщик
+    op.execute(
+        """
+        UPDATE posts AS p
+        SET reactions_total = rx.total
+        FROM (
+            SELECT posts.id AS post_id, COALESCE(SUM((elem ->> 'count')::integer), 0) AS total
+            FROM posts, jsonb_array_elements(posts.reactions) AS elem
+            WHERE posts.reactions IS NOT NULL AND jsonb_typeof(posts.reactions) = 'array'
+            GROUP BY posts.id
+        ) AS rx
+        WHERE p.id = rx.post_id AND rx.total <> 0
+        """
+    )
+    op.create_index(op.f('ix_posts_reactions_total'), 'posts', ['reactions_total'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_posts_reactions_total'), table_name='posts')
+    op.drop_column('posts', 'reactions_total')
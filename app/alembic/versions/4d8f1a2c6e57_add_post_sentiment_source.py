@@ -0,0 +1,38 @@
+"""add_post_sentiment_source
+
+Revision ID: 4d8f1a2c6e57
+Revises: 7b2e4d91a6c3
+Create Date: 2026-10-19 12:03:17.550912
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4d8f1a2c6e57'
+down_revision: Union[str, None] = '7b2e4d91a6c3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('posts', sa.Column('post_sentiment_source', sa.String(length=20), nullable=True, comment='Источник решения о тональности: local / llm / llm_batch / no_text'))
+    op.add_column('posts', sa.Column('post_sentiment_confidence', sa.Float(), nullable=True, comment='Уверенность локального классификатора тональности (для аудита каскада)'))
+    op.create_index(op.f('ix_posts_post_sentiment_source'), 'posts', ['post_sentiment_source'], unique=False)
+    # До появления каскада посты без текста помечались neutral без анализа, остальные размечал LLM
+    op.execute("""
+        UPDATE posts SET post_sentiment_source = CASE
+            WHEN COALESCE(NULLIF(TRIM(caption_text), ''), NULLIF(TRIM(text_content), '')) IS NULL THEN 'no_text'
+            ELSE 'llm'
+        END
+        WHERE post_sentiment_label IS NOT NULL
+    """)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_posts_post_sentiment_source'), table_name='posts')
+    op.drop_column('posts', 'post_sentiment_confidence')
+    op.drop_column('posts', 'post_sentiment_source')
@@ -0,0 +1,40 @@
+"""add_full_text_search_vectors
+
+Revision ID: 5d1c8e7f3a46
+Revises: 8b2f6d4a9c31
+Create Date: 2026-10-19 18:03:51.662409
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = '5d1c8e7f3a46'
+down_revision: Union[str, None] = '8b2f6d4a9c31'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Выражения должны совпадать с моделями Post.search_vector / Comment.search_vector и конфигурацией в app/services/text_search.py
+POST_SEARCH_VECTOR_SQL = (
+    "setweight(to_tsvector('russian'::regconfig, coalesce(text_content, '') || ' ' || coalesce(caption_text, '')), 'A') || "
+    "setweight(to_tsvector('russian'::regconfig, coalesce(summary_text, '')), 'B')"
+)
+COMMENT_SEARCH_VECTOR_SQL = "to_tsvector('russian'::regconfig, coalesce(text_content, ''))"
+
+
+def upgrade() -> None:
+    # Добавление STORED-колонки переписывает таблицу и заполняет ее для всех существующих строк
+    op.add_column('posts', sa.Column('search_vector', postgresql.TSVECTOR(), sa.Computed(POST_SEARCH_VECTOR_SQL, persisted=True), nullable=True, comment='tsvector для полнотекстового поиска по тексту, подписи и резюме поста'))
+    op.create_index('ix_posts_search_vector', 'posts', ['search_vector'], unique=False, postgresql_using='gin')
+    op.add_column('comments', sa.Column('search_vector', postgresql.TSVECTOR(), sa.Computed(COMMENT_SEARCH_VECTOR_SQL, persisted=True), nullable=True, comment='tsvector для полнотекстового поиска по тексту комментария'))
+    op.create_index('ix_comments_search_vector', 'comments', ['search_vector'], unique=False, postgresql_using='gin')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_comments_search_vector', table_name='comments', postgresql_using='gin')
+    op.drop_column('comments', 'search_vector')
+    op.drop_index('ix_posts_search_vector', table_name='posts', postgresql_using='gin')
+    op.drop_column('posts', 'search_vector')
@@ -0,0 +1,54 @@
+"""add_llm_batch_jobs
+
+Revision ID: 7b2e4d91a6c3
+Revises: cc382425fec6
+Create Date: 2026-10-19 10:12:41.208334
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = '7b2e4d91a6c3'
+down_revision: Union[str, None] = 'cc382425fec6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('llm_batch_jobs',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('kind', sa.String(length=50), nullable=False, comment='Тип пакета: post_summary / post_sentiment / comment_features'),
+        sa.Column('backend', sa.String(length=20), nullable=False, comment='Исполнитель пакета: openai (Batch API) или local (локальная замена)'),
+        sa.Column('provider_batch_id', sa.String(length=255), nullable=True, comment='ID пакета у провайдера (или локальный ID)'),
+        sa.Column('status', sa.String(length=30), nullable=False, comment='submitted / in_progress / completed / ingested / failed / expired / cancelled'),
+        sa.Column('input_file_path', sa.String(length=1024), nullable=False, comment='Путь к JSONL-файлу запросов'),
+        sa.Column('output_file_id', sa.String(length=255), nullable=True, comment='ID (или путь) файла результатов у провайдера'),
+        sa.Column('item_ids', postgresql.JSONB(astext_type=sa.Text()), nullable=False, comment='ID постов/комментариев в пакете (чтобы не отправлять их повторно, пока пакет в работе)'),
+        sa.Column('filters', postgresql.JSONB(astext_type=sa.Text()), nullable=True, comment='Параметры отбора бэклога (каналы, даты)'),
+        sa.Column('request_count', sa.Integer(), nullable=False),
+        sa.Column('succeeded_count', sa.Integer(), nullable=False, comment='Сколько результатов записано в БД'),
+        sa.Column('failed_count', sa.Integer(), nullable=False, comment='Сколько запросов завершились ошибкой или невалидным ответом'),
+        sa.Column('poll_attempts', sa.Integer(), nullable=False),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.Column('completed_at', sa.DateTime(timezone=True), nullable=True, comment='Когда провайдер завершил пакет'),
+        sa.Column('ingested_at', sa.DateTime(timezone=True), nullable=True, comment='Когда результаты записаны в posts/comments'),
+        sa.PrimaryKeyConstraint('id', name=op.f('pk_llm_batch_jobs'))
+    )
+    op.create_index(op.f('ix_llm_batch_jobs_id'), 'llm_batch_jobs', ['id'], unique=False)
+    op.create_index(op.f('ix_llm_batch_jobs_kind'), 'llm_batch_jobs', ['kind'], unique=False)
+    op.create_index(op.f('ix_llm_batch_jobs_provider_batch_id'), 'llm_batch_jobs', ['provider_batch_id'], unique=False)
+    op.create_index(op.f('ix_llm_batch_jobs_status'), 'llm_batch_jobs', ['status'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_llm_batch_jobs_status'), table_name='llm_batch_jobs')
+    op.drop_index(op.f('ix_llm_batch_jobs_provider_batch_id'), table_name='llm_batch_jobs')
+    op.drop_index(op.f('ix_llm_batch_jobs_kind'), table_name='llm_batch_jobs')
+    op.drop_index(op.f('ix_llm_batch_jobs_id'), table_name='llm_batch_jobs')
+    op.drop_table('llm_batch_jobs')
@@ -0,0 +1,132 @@
+"""partition_comments_by_month
+
+Revision ID: 7f3b1d9c5a28
+Revises: c2f7a9d3e864
+Create Date: 2026-10-19 21:06:41.582930
+
+"""
+from datetime import date, datetime, timezone
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '7f3b1d9c5a28'
+down_revision: Union[str, None] = 'c2f7a9d3e864'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Сколько месяцев вперед создать секции сразу (дальше их поддерживает задача tasks.maintain_comment_partitions)
+PREMAKE_MONTHS = 3
+
+LEGACY_TABLE = 'comments_unpartitioned'
+
+# Индексы comments (см. модель Comment); на секционированной таблице создаются на родителе и наследуются секциями
+COMMENT_INDEXES = [
+    ('ix_comments_id', ['id'], {}),
+    ('ix_comments_post_id', ['post_id'], {}),
+    ('ix_comments_telegram_comment_id', ['telegram_comment_id'], {}),
+    ('ix_comments_telegram_user_id', ['telegram_user_id'], {}),
+    ('ix_comments_commented_at', ['commented_at'], {}),
+    ('ix_comments_sentiment_label', ['sentiment_label'], {}),
+    ('ix_comments_reply_to_telegram_comment_id', ['reply_to_telegram_comment_id'], {}),
+    ('ix_comments_ai_analysis_completed_at', ['ai_analysis_completed_at'], {}),
+    ('ix_comments_text_simhash', ['text_simhash'], {}),
+    ('ix_comments_near_duplicate_of_id', ['near_duplicate_of_id'], {}),
+    ('ix_comments_simhash_band_0', [sa.text('(text_simhash & 65535)')], {}),
+    ('ix_comments_simhash_band_1', [sa.text('((text_simhash >> 16) & 65535)')], {}),
+    ('ix_comments_simhash_band_2', [sa.text('((text_simhash >> 32) & 65535)')], {}),
+    ('ix_comments_simhash_band_3', [sa.text('((text_simhash >> 48) & 65535)')], {}),
+    ('ix_comments_keyset_post_commented_at', ['post_id', 'commented_at', 'id'], {}),
+    ('ix_comments_search_vector', ['search_vector'], {'postgresql_using': 'gin'}),
+]
+
+
+def _add_months(month: date, months: int) -> date:
+    month_index = month.year * 12 + (month.month - 1) + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def _bound(month: date) -> str:
+    return f"'{month.isoformat()} 00:00:00+00'"
+
+
+def _copy_comments(source: str, target: str) -> None:
+    # Сгенерированную колонку search_vector вставлять нельзя - Postgres вычислит ее сам
+    columns = op.get_bind().execute(sa.text(
+        "SELECT column_name FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = :table AND is_generated = 'NEVER' ORDER BY ordinal_position"
+    ), {'table': source}).scalars().all()
+    column_list = ', '.join(f'"{name}"' for name in columns)
+    op.execute(f'INSERT INTO {target} ({column_list}) SELECT {column_list} FROM {source}')
+
+
+def _create_comment_indexes() -> None:
+    for index_name, columns, kwargs in COMMENT_INDEXES:
+        op.create_index(index_name, 'comments', columns, unique=False, **kwargs)
+
+
+def upgrade() -> None:
+    # 1. Ссылки на comments.id: на секционированную таблицу можно ссылаться только по полному первичному ключу (id, commented_at)
+    op.drop_constraint(op.f('fk_comment_insights_comment_id_comments'), 'comment_insights', type_='foreignkey')
+    op.drop_constraint(op.f('fk_comments_near_duplicate_of_id_comments'), 'comments', type_='foreignkey')
+
+    # 2. Старая таблица уходит под другое имя; последовательность id переживет ее удаление
+    op.rename_table('comments', LEGACY_TABLE)
+    op.execute(f'ALTER TABLE {LEGACY_TABLE} RENAME CONSTRAINT pk_comments TO pk_{LEGACY_TABLE}')
+    op.execute('ALTER SEQUENCE comments_id_seq OWNED BY NONE')
+
+    # 3. Секционированная таблица с теми же колонками (включая DEFAULT nextval, выражение search_vector и комментарии)
+    op.execute(
+        f'CREATE TABLE comments (LIKE {LEGACY_TABLE} INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING COMMENTS) '
+        'PARTITION BY RANGE (commented_at)'
+    )
+
+    # 4. Секции: по месяцу с самого раннего комментария до текущего + PREMAKE_MONTHS, и секция по умолчанию на всякий случай.
+    # Имена ({table}_pYYYYMM) и границы (UTC) должны совпадать с app/services/partitioning.py
+    first_commented_at = op.get_bind().execute(sa.text(f'SELECT min(commented_at) FROM {LEGACY_TABLE}')).scalar()
+    current_month = datetime.now(timezone.utc).date().replace(day=1)
+    month = first_commented_at.astimezone(timezone.utc).date().replace(day=1) if first_commented_at else current_month
+    last_month = _add_months(current_month, PREMAKE_MONTHS)
+    while month <= last_month:
+        next_month = _add_months(month, 1)
+        op.execute(
+            f'CREATE TABLE comments_p{month.year:04d}{month.month:02d} PARTITION OF comments '
+            f'FOR VALUES FROM ({_bound(month)}) TO ({_bound(next_month)})'
+        )
+        month = next_month
+    op.execute('CREATE TABLE comments_default PARTITION OF comments DEFAULT')
+
+    # 5. Перенос данных до создания индексов - так быстрее; затем старая таблица больше не нужна
+    _copy_comments(LEGACY_TABLE, 'comments')
+    op.drop_table(LEGACY_TABLE)
+    op.execute('ALTER SEQUENCE comments_id_seq OWNED BY comments.id')
+
+    # 6. Ключи и индексы на родителе
+    op.create_primary_key(op.f('pk_comments'), 'comments', ['id', 'commented_at'])
+    op.create_foreign_key(op.f('fk_comments_post_id_posts'), 'comments', 'posts', ['post_id'], ['id'], ondelete='CASCADE')
+    _create_comment_indexes()
+    op.create_foreign_key(
+        op.f('fk_comment_insights_comment_id_comments'), 'comment_insights', 'comments',
+        ['comment_id', 'commented_at'], ['id', 'commented_at'], ondelete='CASCADE'
+    )
+    op.execute('ANALYZE comments')
+
+
+def downgrade() -> None:
+    # Обратно в одну таблицу; отсоединенные (архивные) секции в нее не возвращаются
+    op.drop_constraint(op.f('fk_comment_insights_comment_id_comments'), 'comment_insights', type_='foreignkey')
+    op.rename_table('comments', 'comments_partitioned')
+    op.execute('ALTER TABLE comments_partitioned RENAME CONSTRAINT pk_comments TO pk_comments_partitioned')
+    op.execute('ALTER SEQUENCE comments_id_seq OWNED BY NONE')
+    op.execute('CREATE TABLE comments (LIKE comments_partitioned INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING COMMENTS)')
+    _copy_comments('comments_partitioned', 'comments')
+    op.drop_table('comments_partitioned') # Удаляет и все секции
+    op.execute('ALTER SEQUENCE comments_id_seq OWNED BY comments.id')
+
+    op.create_primary_key(op.f('pk_comments'), 'comments', ['id'])
+    op.create_foreign_key(op.f('fk_comments_post_id_posts'), 'comments', 'posts', ['post_id'], ['id'], ondelete='CASCADE')
+    op.create_foreign_key(op.f('fk_comments_near_duplicate_of_id_comments'), 'comments', 'comments', ['near_duplicate_of_id'], ['id'], ondelete='SET NULL')
+    _create_comment_indexes()
+    op.create_foreign_key(op.f('fk_comment_insights_comment_id_comments'), 'comment_insights', 'comments', ['comment_id'], ['id'], ondelete='CASCADE')
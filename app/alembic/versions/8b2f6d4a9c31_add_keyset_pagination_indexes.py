@@ -0,0 +1,39 @@
+"""add_keyset_pagination_indexes
+
+Revision ID: 8b2f6d4a9c31
+Revises: 3a7d5c9e2b14
+Create Date: 2026-10-19 17:20:44.908151
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '8b2f6d4a9c31'
+down_revision: Union[str, None] = '3a7d5c9e2b14'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Составные индексы (ключ сортировки, id) для keyset-пагинации /posts/ по всем полям PostSortByField.
+# Выражения coalesce(..., -1) должны совпадать с _post_sort_expression в app/main.py
+POST_KEYSET_INDEXES = {
+    'ix_posts_keyset_posted_at': ['posted_at', 'id'],
+    'ix_posts_keyset_comments_count': ['comments_count', 'id'],
+    'ix_posts_keyset_views_count': [sa.text('coalesce(views_count, -1)'), 'id'],
+    'ix_posts_keyset_forwards_count': [sa.text('coalesce(forwards_count, -1)'), 'id'],
+    'ix_posts_keyset_reactions_total': ['reactions_total', 'id'],
+}
+
+
+def upgrade() -> None:
+    for index_name, columns in POST_KEYSET_INDEXES.items():
+        op.create_index(index_name, 'posts', columns, unique=False)
+    op.create_index('ix_comments_keyset_post_commented_at', 'comments', ['post_id', 'commented_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_comments_keyset_post_commented_at', table_name='comments')
+    for index_name in POST_KEYSET_INDEXES:
+        op.drop_index(index_name, table_name='posts')
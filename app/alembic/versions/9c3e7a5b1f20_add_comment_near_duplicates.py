@@ -0,0 +1,47 @@
+"""add_comment_near_duplicates
+
+Revision ID: 9c3e7a5b1f20
+Revises: 4d8f1a2c6e57
+Create Date: 2026-10-19 14:05:17.530912
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '9c3e7a5b1f20'
+down_revision: Union[str, None] = '4d8f1a2c6e57'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Полосы 64-битной SimHash-подписи по 16 бит (см. app/services/near_duplicates.py)
+SIMHASH_BAND_EXPRESSIONS = {
+    'ix_comments_simhash_band_0': '(text_simhash & 65535)',
+    'ix_comments_simhash_band_1': '((text_simhash >> 16) & 65535)',
+    'ix_comments_simhash_band_2': '((text_simhash >> 32) & 65535)',
+    'ix_comments_simhash_band_3': '((text_simhash >> 48) & 65535)',
+}
+
+
+def upgrade() -> None:
+    op.add_column('comments', sa.Column('text_simhash', sa.BigInteger(), nullable=True, comment='64-битная SimHash-подпись нормализованного текста (знаковая)'))
+    op.add_column('comments', sa.Column('near_duplicate_of_id', sa.Integer(), nullable=True, comment='Представитель кластера почти-дубликатов (NULL - комментарий сам представитель)'))
+    op.create_foreign_key(op.f('fk_comments_near_duplicate_of_id_comments'), 'comments', 'comments', ['near_duplicate_of_id'], ['id'], ondelete='SET NULL')
+    op.create_index(op.f('ix_comments_text_simhash'), 'comments', ['text_simhash'], unique=False)
+    op.create_index(op.f('ix_comments_near_duplicate_of_id'), 'comments', ['near_duplicate_of_id'], unique=False)
+    for index_name, expression in SIMHASH_BAND_EXPRESSIONS.items():
+        op.create_index(index_name, 'comments', [sa.text(expression)], unique=False)
+    # Существующие комментарии остаются без подписи и считаются представителями самих себя;
+    # подписи для них заполняет задача tasks.backfill_comment_simhash
+
+
+def downgrade() -> None:
+    for index_name in SIMHASH_BAND_EXPRESSIONS:
+        op.drop_index(index_name, table_name='comments')
+    op.drop_index(op.f('ix_comments_near_duplicate_of_id'), table_name='comments')
+    op.drop_index(op.f('ix_comments_text_simhash'), table_name='comments')
+    op.drop_constraint(op.f('fk_comments_near_duplicate_of_id_comments'), 'comments', type_='foreignkey')
+    op.drop_column('comments', 'near_duplicate_of_id')
+    op.drop_column('comments', 'text_simhash')
@@ -0,0 +1,70 @@
+"""add_comment_insights
+
+Revision ID: a4e9f2c7b815
+Revises: 5d1c8e7f3a46
+Create Date: 2026-10-19 18:47:12.305518
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'a4e9f2c7b815'
+down_revision: Union[str, None] = '5d1c8e7f3a46'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Тип инсайта -> JSONB-колонка comments (см. app/services/comment_insights.py)
+INSIGHT_TYPE_TO_COMMENT_FIELD = {
+    'topic': 'extracted_topics',
+    'problem': 'extracted_problems',
+    'question': 'extracted_questions',
+    'suggestion': 'extracted_suggestions',
+}
+
+# Нормализация совпадает с normalized_insight_text_sql в app/services/comment_insights.py
+BACKFILL_SQL = r"""
+INSERT INTO comment_insights (comment_id, insight_type, normalized_text, display_text, commented_at, channel_id)
+SELECT DISTINCT ON (x.comment_id, x.normalized_text)
+       x.comment_id, '{insight_type}', x.normalized_text, x.display_text, x.commented_at, x.channel_id
+FROM (
+    SELECT c.id AS comment_id, c.commented_at, p.channel_id,
+           left(lower(regexp_replace(btrim(e.value), '\s+', ' ', 'g')), 300) AS normalized_text,
+           left(btrim(e.value), 300) AS display_text
+    FROM comments c
+    JOIN posts p ON p.id = c.post_id
+    CROSS JOIN LATERAL jsonb_array_elements_text(c.{field}) AS e(value)
+    WHERE c.{field} IS NOT NULL AND jsonb_typeof(c.{field}) = 'array'
+) AS x
+WHERE x.normalized_text <> ''
+"""
+
+
+def upgrade() -> None:
+    op.create_table('comment_insights',
+        sa.Column('id', sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column('comment_id', sa.Integer(), nullable=False),
+        sa.Column('insight_type', sa.String(length=20), nullable=False, comment='topic / problem / question / suggestion'),
+        sa.Column('normalized_text', sa.String(length=300), nullable=False, comment='Ключ группировки: trim, схлопнутые пробелы, нижний регистр'),
+        sa.Column('display_text', sa.String(length=300), nullable=False, comment='Текст инсайта в том виде, в каком его вернул AI'),
+        sa.Column('commented_at', sa.DateTime(timezone=True), nullable=False, comment='Копия Comment.commented_at'),
+        sa.Column('channel_id', sa.BigInteger(), nullable=False, comment='Копия Post.channel_id'),
+        sa.ForeignKeyConstraint(['comment_id'], ['comments.id'], name=op.f('fk_comment_insights_comment_id_comments'), ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['channel_id'], ['channels.id'], name=op.f('fk_comment_insights_channel_id_channels'), ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id', name=op.f('pk_comment_insights'))
+    )
+    # Заполнение из уже проанализированных комментариев - до индексов, так быстрее
+    for insight_type, field in INSIGHT_TYPE_TO_COMMENT_FIELD.items():
+        op.execute(BACKFILL_SQL.format(insight_type=insight_type, field=field))
+    op.create_index(op.f('ix_comment_insights_comment_id'), 'comment_insights', ['comment_id'], unique=False)
+    op.create_index('ix_comment_insights_type_commented_at', 'comment_insights', ['insight_type', 'commented_at'], unique=False, postgresql_include=['normalized_text', 'display_text', 'channel_id'])
+    op.create_index('ix_comment_insights_type_normalized_text', 'comment_insights', ['insight_type', 'normalized_text', 'commented_at'], unique=False, postgresql_include=['channel_id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_comment_insights_type_normalized_text', table_name='comment_insights')
+    op.drop_index('ix_comment_insights_type_commented_at', table_name='comment_insights')
+    op.drop_index(op.f('ix_comment_insights_comment_id'), table_name='comment_insights')
+    op.drop_table('comment_insights')
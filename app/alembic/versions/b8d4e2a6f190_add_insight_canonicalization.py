@@ -0,0 +1,63 @@
+"""add_insight_canonicalization
+
+Revision ID: b8d4e2a6f190
+Revises: 7f3b1d9c5a28
+Create Date: 2026-10-19 22:14:09.418263
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'b8d4e2a6f190'
+down_revision: Union[str, None] = '7f3b1d9c5a28'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('insight_canonicals',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('insight_type', sa.String(length=20), nullable=False, comment='topic / problem / question / suggestion'),
+        sa.Column('canonical_key', sa.String(length=300), nullable=False, comment='Леммы значимых слов по алфавиту (см. canonical_insight_key)'),
+        sa.Column('display_text', sa.String(length=300), nullable=False, comment='Формулировка для показа - первая встреченная'),
+        sa.Column('embedding', sa.LargeBinary(), nullable=True, comment='Эмбеддинг display_text (float16, L2-нормирован) для присоединения синонимов'),
+        sa.Column('embedding_model', sa.String(length=200), nullable=True, comment='Провайдер/модель эмбеддинга'),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('id', name=op.f('pk_insight_canonicals')),
+        sa.UniqueConstraint('insight_type', 'canonical_key', name='uq_insight_canonicals_type_key')
+    )
+    op.create_table('insight_aliases',
+        sa.Column('insight_type', sa.String(length=20), nullable=False),
+        sa.Column('normalized_text', sa.String(length=300), nullable=False),
+        sa.Column('canonical_id', sa.Integer(), nullable=False),
+        sa.Column('similarity', sa.Integer(), nullable=True, comment='Близость эмбеддингов x1000, если присоединен по эмбеддингу; NULL - по ключу'),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.ForeignKeyConstraint(['canonical_id'], ['insight_canonicals.id'], name=op.f('fk_insight_aliases_canonical_id_insight_canonicals'), ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('insight_type', 'normalized_text', name=op.f('pk_insight_aliases'))
+    )
+    op.create_index(op.f('ix_insight_aliases_canonical_id'), 'insight_aliases', ['canonical_id'], unique=False)
+    op.create_index(op.f('ix_insight_aliases_created_at'), 'insight_aliases', ['created_at'], unique=False)
+
+    # Словарь заполняет задача tasks.canonicalize_insights (лемматизация и эмбеддинги - в Python), здесь только колонка и индексы
+    op.add_column('comment_insights', sa.Column('canonical_id', sa.Integer(), nullable=True, comment='Канонический инсайт (insight_canonicals); NULL - еще не канонизирован'))
+    op.create_foreign_key(op.f('fk_comment_insights_canonical_id_insight_canonicals'), 'comment_insights', 'insight_canonicals', ['canonical_id'], ['id'], ondelete='SET NULL')
+    op.drop_index('ix_comment_insights_type_commented_at', table_name='comment_insights')
+    op.create_index('ix_comment_insights_type_commented_at', 'comment_insights', ['insight_type', 'commented_at'], unique=False, postgresql_include=['canonical_id', 'normalized_text', 'display_text', 'channel_id'])
+    op.create_index('ix_comment_insights_canonical_commented_at', 'comment_insights', ['canonical_id', 'commented_at'], unique=False, postgresql_include=['channel_id'])
+    op.create_index('ix_comment_insights_not_canonicalized', 'comment_insights', ['insight_type', 'normalized_text'], unique=False, postgresql_where=sa.text('canonical_id IS NULL'))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_comment_insights_not_canonicalized', table_name='comment_insights')
+    op.drop_index('ix_comment_insights_canonical_commented_at', table_name='comment_insights')
+    op.drop_index('ix_comment_insights_type_commented_at', table_name='comment_insights')
+    op.create_index('ix_comment_insights_type_commented_at', 'comment_insights', ['insight_type', 'commented_at'], unique=False, postgresql_include=['normalized_text', 'display_text', 'channel_id'])
+    op.drop_constraint(op.f('fk_comment_insights_canonical_id_insight_canonicals'), 'comment_insights', type_='foreignkey')
+    op.drop_column('comment_insights', 'canonical_id')
+    op.drop_index(op.f('ix_insight_aliases_created_at'), table_name='insight_aliases')
+    op.drop_index(op.f('ix_insight_aliases_canonical_id'), table_name='insight_aliases')
+    op.drop_table('insight_aliases')
+    op.drop_table('insight_canonicals')
@@ -0,0 +1,74 @@
+"""add_channel_daily_stats
+
+Revision ID: c2f7a9d3e864
+Revises: a4e9f2c7b815
+Create Date: 2026-10-19 19:31:40.117823
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'c2f7a9d3e864'
+down_revision: Union[str, None] = 'a4e9f2c7b815'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Начальное заполнение по всей истории; дальше агрегаты поддерживают задачи (см. tasks._refresh_channel_daily_stats)
+BACKFILL_SQL = """
+INSERT INTO channel_daily_stats (
+    channel_id, day, post_count, comment_count, posts_sentiment_analyzed,
+    posts_positive, posts_negative, posts_neutral, posts_mixed, views_sum, reactions_sum
+)
+SELECT channel_id, day,
+       sum(post_count), sum(comment_count), sum(posts_sentiment_analyzed),
+       sum(posts_positive), sum(posts_negative), sum(posts_neutral), sum(posts_mixed), sum(views_sum), sum(reactions_sum)
+FROM (
+    SELECT p.channel_id, (p.posted_at AT TIME ZONE 'UTC')::date AS day,
+           count(*) AS post_count, 0 AS comment_count,
+           count(p.post_sentiment_label) AS posts_sentiment_analyzed,
+           count(*) FILTER (WHERE p.post_sentiment_label = 'positive') AS posts_positive,
+           count(*) FILTER (WHERE p.post_sentiment_label = 'negative') AS posts_negative,
+           count(*) FILTER (WHERE p.post_sentiment_label = 'neutral') AS posts_neutral,
+           count(*) FILTER (WHERE p.post_sentiment_label = 'mixed') AS posts_mixed,
+           coalesce(sum(p.views_count), 0) AS views_sum,
+           coalesce(sum(p.reactions_total), 0) AS reactions_sum
+    FROM posts p
+    GROUP BY 1, 2
+    UNION ALL
+    SELECT p.channel_id, (c.commented_at AT TIME ZONE 'UTC')::date AS day,
+           0, count(*), 0, 0, 0, 0, 0, 0, 0
+    FROM comments c
+    JOIN posts p ON p.id = c.post_id
+    GROUP BY 1, 2
+) AS per_source
+GROUP BY channel_id, day
+"""
+
+
+def upgrade() -> None:
+    op.create_table('channel_daily_stats',
+        sa.Column('channel_id', sa.BigInteger(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False, comment='UTC-день'),
+        sa.Column('post_count', sa.Integer(), nullable=False),
+        sa.Column('comment_count', sa.Integer(), nullable=False),
+        sa.Column('posts_sentiment_analyzed', sa.Integer(), nullable=False, comment='Постов с определенной тональностью (любой меткой)'),
+        sa.Column('posts_positive', sa.Integer(), nullable=False),
+        sa.Column('posts_negative', sa.Integer(), nullable=False),
+        sa.Column('posts_neutral', sa.Integer(), nullable=False),
+        sa.Column('posts_mixed', sa.Integer(), nullable=False),
+        sa.Column('views_sum', sa.BigInteger(), nullable=False),
+        sa.Column('reactions_sum', sa.BigInteger(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.ForeignKeyConstraint(['channel_id'], ['channels.id'], name=op.f('fk_channel_daily_stats_channel_id_channels'), ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('channel_id', 'day', name=op.f('pk_channel_daily_stats'))
+    )
+    op.create_index(op.f('ix_channel_daily_stats_day'), 'channel_daily_stats', ['day'], unique=False)
+    op.execute(BACKFILL_SQL)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_channel_daily_stats_day'), table_name='channel_daily_stats')
+    op.drop_table('channel_daily_stats')
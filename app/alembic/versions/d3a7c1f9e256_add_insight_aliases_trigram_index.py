@@ -0,0 +1,29 @@
+"""add_insight_aliases_trigram_index
+
+Revision ID: d3a7c1f9e256
+Revises: b8d4e2a6f190
+Create Date: 2026-10-19 22:51:37.602114
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'd3a7c1f9e256'
+down_revision: Union[str, None] = 'b8d4e2a6f190'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # pg_trgm входит в contrib; расширение остается и после downgrade - его могут использовать другие объекты
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index(
+        'ix_insight_aliases_normalized_text_trgm', 'insight_aliases', ['normalized_text'], unique=False,
+        postgresql_using='gin', postgresql_ops={'normalized_text': 'gin_trgm_ops'}
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_insight_aliases_normalized_text_trgm', table_name='insight_aliases')
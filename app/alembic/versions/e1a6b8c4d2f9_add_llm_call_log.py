@@ -0,0 +1,45 @@
+"""add_llm_call_log
+
+Revision ID: e1a6b8c4d2f9
+Revises: 9c3e7a5b1f20
+Create Date: 2026-10-19 15:31:02.774105
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'e1a6b8c4d2f9'
+down_revision: Union[str, None] = '9c3e7a5b1f20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('llm_call_log',
+        sa.Column('id', sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=False, comment='Время вызова (по часам воркера)'),
+        sa.Column('caller', sa.String(length=100), nullable=False, comment='Вызывающая задача Celery или эндпоинт API'),
+        sa.Column('model', sa.String(length=100), nullable=False),
+        sa.Column('outcome', sa.String(length=30), nullable=False, comment='ok / empty / throttled / http_error / network_error / error'),
+        sa.Column('status_code', sa.Integer(), nullable=True, comment='HTTP-статус ответа провайдера (NULL - ответа не было)'),
+        sa.Column('attempt', sa.Integer(), nullable=False, comment='Номер попытки в пределах одного логического запроса (с 1)'),
+        sa.Column('latency_ms', sa.Float(), nullable=False),
+        sa.Column('prompt_tokens', sa.Integer(), nullable=False),
+        sa.Column('completion_tokens', sa.Integer(), nullable=False),
+        sa.Column('estimated_prompt_tokens', sa.Integer(), nullable=False, comment='Локальная оценка tiktoken до отправки'),
+        sa.Column('cost_usd', sa.Float(), nullable=False, comment='Оценка стоимости по LLM_PRICING_USD_PER_1K_TOKENS'),
+        sa.PrimaryKeyConstraint('id', name=op.f('pk_llm_call_log'))
+    )
+    op.create_index(op.f('ix_llm_call_log_created_at'), 'llm_call_log', ['created_at'], unique=False)
+    op.create_index(op.f('ix_llm_call_log_caller'), 'llm_call_log', ['caller'], unique=False)
+    op.create_index(op.f('ix_llm_call_log_model'), 'llm_call_log', ['model'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_llm_call_log_model'), table_name='llm_call_log')
+    op.drop_index(op.f('ix_llm_call_log_caller'), table_name='llm_call_log')
+    op.drop_index(op.f('ix_llm_call_log_created_at'), table_name='llm_call_log')
+    op.drop_table('llm_call_log')
@@ -13,9 +13,39 @@ celery_instance = Celery(
     include=['app.tasks']
 )
 
-# --- ОТКЛЮЧЕНО ВСЕ ПЕРИОДИЧЕСКОЕ РАСПИСАНИЕ ДЛЯ ТЕСТИРОВАНИЯ ---
-# Задачи будут запускаться только вручную через API или прямым вызовом .delay()
-celery_instance.conf.beat_schedule = {}
+# --- ОТКЛЮЧЕНО ВСЕ ПЕРИОДИЧЕСКОЕ РАСПИСАНИЕ СБОРА/АНАЛИЗА ДЛЯ ТЕСТИРОВАНИЯ ---
+# Задачи сбора и анализа запускаются только вручную через API или прямым вызовом .delay().
+# В расписании только служебные задачи (телеметрия, сверка агрегатов).
+celery_instance.conf.beat_schedule = {
+    'flush-llm-call-log': {
+        'task': 'tasks.flush_llm_call_log',
+        'schedule': float(settings.LLM_CALL_LOG_FLUSH_INTERVAL_SECONDS),
+    },
+    'probe-llm-circuit': {
+        'task': 'tasks.probe_llm_circuit',
+        'schedule': float(settings.LLM_CIRCUIT_PROBE_INTERVAL_SECONDS),
+    },
+    'reconcile-channel-daily-stats': {
+        'task': 'tasks.reconcile_channel_daily_stats',
+        'schedule': float(settings.CHANNEL_STATS_RECONCILE_INTERVAL_SECONDS),
+    },
+    'maintain-comment-partitions': {
+        'task': 'tasks.maintain_comment_partitions',
+        'schedule': float(settings.COMMENTS_PARTITION_MAINTENANCE_INTERVAL_SECONDS),
+    },
+    'snapshot-analytics-lake': {
+        'task': 'tasks.snapshot_analytics_lake',
+        'schedule': float(settings.ANALYTICS_LAKE_SNAPSHOT_INTERVAL_SECONDS),
+    },
+    'update-semantic-index': {
+        'task': 'tasks.update_semantic_index',
+        'schedule': float(settings.SEMANTIC_INDEX_UPDATE_INTERVAL_SECONDS),
+    },
+    'canonicalize-insights': {
+        'task': 'tasks.canonicalize_insights',
+        'schedule': float(settings.INSIGHT_CANONICALIZATION_INTERVAL_SECONDS),
+    },
+}
 
 # Опционально: часовой пояс для Celery Beat (хотя beat сейчас неактивен)
 celery_instance.conf.timezone = 'UTC'
@@ -3,7 +3,7 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from datetime import datetime, timezone
 import os
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 class Settings(BaseSettings):
     APP_HOST: str = "0.0.0.0"
@@ -38,6 +38,7 @@ class Settings(BaseSettings):
 
     REDIS_HOST: str = "redis"
     REDIS_PORT: int = 6379
+    REDIS_APP_DB: int = 1 # Отдельная БД Redis для состояния приложения (0 занята брокером Celery)
 
     TELEGRAM_API_ID: Optional[int] = None
     TELEGRAM_API_HASH: Optional[str] = None
@@ -51,8 +52,74 @@ class Settings(BaseSettings):
     OPENAI_DEFAULT_MODEL_FOR_TASKS: Optional[str] = "gpt-3.5-turbo-1106" 
     OPENAI_API_URL: Optional[str] = "https://api.openai.com/v1/chat/completions"
     OPENAI_TIMEOUT_SECONDS: Optional[float] = 60.0
-    LLM_MAX_PROMPT_LENGTH: Optional[int] = 3800 
-    
+    LLM_MAX_PROMPT_LENGTH: Optional[int] = 3800 # Устарело: обрезка по символам заменена бюджетом токенов (LLM_MAX_INPUT_TOKENS)
+
+    # Бюджет токенов для промптов (подсчет локальным токенизатором tiktoken)
+    LLM_MAX_INPUT_TOKENS: int = 1500          # Максимум токенов вставляемого текста (поста/комментария) в одном промпте
+    LLM_PROMPT_SAFETY_MARGIN_TOKENS: int = 16 # Служебные токены формата чата
+    LLM_TRIM_HEAD_FRACTION: float = 0.7       # Доля бюджета под начало текста при обрезке "начало + конец"
+    LLM_TOKEN_CACHE_SIZE: int = 4096          # Размер LRU-кэша токенизации (по хэшу текста)
+
+    # Адаптивное управление параллелизмом запросов к LLM (AIMD), состояние общее для всех воркеров через Redis
+    LLM_CONCURRENCY_MIN: int = 1
+    LLM_CONCURRENCY_MAX: int = 16
+    LLM_CONCURRENCY_INITIAL: int = 4
+    LLM_AIMD_INCREASE_STEP: float = 1.0      # Прирост лимита за "окно" успешных запросов
+    LLM_AIMD_DECREASE_FACTOR: float = 0.5    # Во сколько раз уменьшать лимит при 429/5xx
+    LLM_AIMD_DECREASE_COOLDOWN_SECONDS: float = 2.0 # Не уменьшать лимит чаще, чем раз в N сек (одна перегрузка видна многим воркерам)
+    LLM_RATELIMIT_HEADROOM_FRACTION: float = 0.1 # Если осталось меньше этой доли квоты - лимит не растет
+    LLM_LEASE_TTL_SECONDS: float = 180.0     # Через сколько "зависший" слот упавшего воркера считается освобожденным
+    LLM_MAX_RETRIES: int = 4
+    LLM_RETRY_BASE_DELAY_SECONDS: float = 1.0
+    LLM_RETRY_MAX_DELAY_SECONDS: float = 60.0
+    LLM_GOVERNOR_REDIS_PREFIX: str = "insight_compass:llm_governor"
+
+    # Инструментирование вызовов LLM: гистограммы задержек и счетчики токенов/стоимости в Redis + журнал llm_call_log в БД
+    LLM_METRICS_ENABLED: bool = True
+    LLM_METRICS_REDIS_PREFIX: str = "insight_compass:llm_metrics"
+    LLM_LATENCY_BUCKETS_SECONDS: List[float] = [0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 8.0, 13.0, 20.0, 30.0, 45.0, 60.0, 90.0]
+    # Цена за 1000 токенов (prompt, completion) в USD; модель ищется по самому длинному префиксу
+    LLM_PRICING_USD_PER_1K_TOKENS: Dict[str, List[float]] = {
+        "gpt-3.5-turbo": [0.0005, 0.0015],
+        "gpt-3.5-turbo-1106": [0.001, 0.002],
+        "gpt-4o-mini": [0.00015, 0.0006],
+        "gpt-4o": [0.0025, 0.01],
+        "gpt-4-turbo": [0.01, 0.03],
+        "gpt-4": [0.03, 0.06],
+    }
+    LLM_CALL_LOG_ENABLED: bool = True
+    LLM_CALL_LOG_BUFFER_MAX: int = 200000      # Макс. записей в буфере Redis до сброса в таблицу
+    LLM_CALL_LOG_FLUSH_BATCH_SIZE: int = 5000  # Записей за одну вставку в llm_call_log
+    LLM_CALL_LOG_FLUSH_INTERVAL_SECONDS: int = 60
+    LLM_CALL_LOG_RETENTION_DAYS: int = 30
+
+    # Предохранитель (circuit breaker) для LLM: быстрый отказ при деградации провайдера вместо ожидания таймаута
+    LLM_CIRCUIT_BREAKER_ENABLED: bool = True
+    LLM_CIRCUIT_FAILURE_THRESHOLD: int = 5         # Сколько подряд 5xx/таймаутов (по всем воркерам) размыкают цепь
+    LLM_CIRCUIT_OPEN_SECONDS: float = 30.0         # Сколько цепь разомкнута до пробного запроса
+    LLM_CIRCUIT_PROBE_TIMEOUT_SECONDS: float = 10.0
+    LLM_CIRCUIT_PROBE_INTERVAL_SECONDS: int = 15   # Период фоновой проверки (Celery Beat)
+    LLM_CIRCUIT_REDIS_PREFIX: str = "insight_compass:llm_circuit"
+
+    # Хеджированные запросы для путей, чувствительных к задержке (NLQ): второй запрос, если первый дольше p95
+    LLM_HEDGE_ENABLED: bool = True
+    LLM_HEDGE_QUANTILE: float = 0.95
+    LLM_HEDGE_MIN_SAMPLES: int = 20               # Пока успешных вызовов меньше - используется задержка по умолчанию
+    LLM_HEDGE_DEFAULT_DELAY_SECONDS: float = 8.0
+    LLM_HEDGE_MIN_DELAY_SECONDS: float = 1.0
+    LLM_HEDGE_MAX_DELAY_SECONDS: float = 30.0
+
+    # Оффлайн-режим массовой обработки бэклога через Batch API провайдера (JSONL-файлы)
+    LLM_BATCH_BACKEND: str = "openai"         # "openai" - Batch API провайдера, "local" - локальная замена, обрабатывающая JSONL-файлы
+    LLM_BATCH_LOCAL_STAND_IN_ALLOWED: bool = False # Разрешить "local" (только для проверки и оффлайн-стенда): замена пишет в БД выдуманные резюме, тональность и инсайты
+    LLM_BATCH_WORK_DIR: str = "/tmp/insight_compass_llm_batches" # Каталог для JSONL-файлов запросов и результатов
+    LLM_BATCH_MAX_REQUESTS_PER_FILE: int = 20000 # Лимит запросов в одном пакете (у провайдера - до 50 000)
+    LLM_BATCH_MAX_ITEMS_PER_RUN: int = 100000 # Сколько элементов бэклога максимум отправлять за один запуск
+    LLM_BATCH_COMPLETION_WINDOW: str = "24h"
+    LLM_BATCH_POLL_INTERVAL_SECONDS: int = 300
+    LLM_BATCH_MAX_POLL_ATTEMPTS: int = 400    # ~33 часа при интервале 5 мин - дольше окна выполнения
+    LLM_BATCH_INGEST_CHUNK_SIZE: int = 1000   # Размер пачки bulk UPDATE при записи результатов
+
     # Эта настройка, возможно, уже не используется, если каналы управляются через БД
     TARGET_TELEGRAM_CHANNELS_LEGACY: List[str] = [] 
 
@@ -76,9 +143,133 @@ class Settings(BaseSettings):
     # Настройки для пакетного AI-анализа (Кнопка 3 и далее)
     AI_ANALYSIS_BATCH_SIZE: int = 100      # Общий лимит для постановки комментариев на детальный AI-анализ (используется в advanced_data_refresh)
     POST_ANALYSIS_BATCH_SIZE: int = 100    # Для задачи analyze_posts_sentiment_task (тональность постов)
+    SENTIMENT_LOCAL_CLASSIFIER_ENABLED: bool = True # Каскад: сначала локальный лексиконный классификатор, LLM - только для неуверенных
+    SENTIMENT_LOCAL_CONFIDENCE_THRESHOLD: float = 0.8 # Минимальная уверенность локального классификатора, чтобы не вызывать LLM
+    SENTIMENT_LOCAL_SHORT_TEXT_TOKENS: int = 3 # Реплики не длиннее N слов без полярных сигналов считаются нейтральными уверенно
     POST_SUMMARY_BATCH_SIZE: int = 25      # Для задачи summarize_top_posts_task (суммаризация постов)
+    MIN_POST_LENGTH_FOR_SUMMARY: int = 30  # Более короткие посты не суммаризируются (помечаются пустым резюме)
+    LLM_SUMMARY_MAX_TOKENS: int = 250      # Лимит токенов ответа при суммаризации поста
     COMMENT_ENQUEUE_BATCH_SIZE: int = 1000  # Для задачи enqueue_comments_for_ai_feature_analysis_task (постановка комментов в очередь)
 
+    # Поиск почти-дубликатов комментариев (SimHash) при сборе: AI-анализ только для одного представителя кластера
+    NEAR_DUP_ENABLED: bool = True
+    NEAR_DUP_MAX_HAMMING: int = 3          # Макс. расстояние Хэмминга между 64-битными подписями (не больше 3 - см. полосы индекса)
+    NEAR_DUP_MIN_TOKENS: int = 4           # Более короткие комментарии объединяются только при точном совпадении подписи
+    NEAR_DUP_LOOKBACK_DAYS: int = 14       # Среди комментариев за сколько дней искать представителя кластера
+    NEAR_DUP_MAX_CANDIDATES: int = 5000    # Ограничение выборки кандидатов из БД на одну пачку новых комментариев
+
+    # Дневные агрегаты channel_daily_stats для дашборда
+    CHANNEL_STATS_ENABLED: bool = True                  # Пересчет агрегатов задачами сбора и анализа
+    CHANNEL_STATS_RECONCILE_DAYS: int = 3               # Сверка пересчитывает последние N UTC-дней по сырым таблицам
+    CHANNEL_STATS_RECONCILE_INTERVAL_SECONDS: int = 3600
+
+    # Кэш ответов аналитических эндпоинтов в Redis; ключ включает версию данных, которую задачи увеличивают после коммита
+    RESPONSE_CACHE_ENABLED: bool = True
+    RESPONSE_CACHE_REDIS_PREFIX: str = "insight_compass:response_cache"
+    RESPONSE_CACHE_DEFAULT_TTL_SECONDS: int = 300
+    RESPONSE_CACHE_TTL_SECONDS: Dict[str, int] = { # TTL - страховка (окна "последние N дней" сдвигаются со временем), инвалидация - по версии
+        "dashboard_stats": 600,
+        "activity_over_time": 600,
+        "top_channels": 600,
+        "sentiment_distribution": 600,
+        "comment_insights": 900,
+        "insight_item_trend": 900,
+        "dashboard_bundle": 600,
+    }
+    RESPONSE_CACHE_LOCK_TTL_SECONDS: int = 30       # Сколько живет блокировка пересчета, если процесс-владелец упал
+    RESPONSE_CACHE_LOCK_WAIT_SECONDS: float = 10.0  # Сколько ждать чужого пересчета, прежде чем считать самим
+    RESPONSE_CACHE_LOCK_POLL_SECONDS: float = 0.05
+    DASHBOARD_BUNDLE_GZIP_MIN_BYTES: int = 1024     # Меньшие ответы /dashboard/bundle не сжимаются - выигрыш меньше накладных расходов
+
+    # Сжатие ответов API (app/core/responses.py: CompressionMiddleware) - brotli, если клиент принимает и пакет установлен, иначе gzip
+    API_COMPRESSION_MIN_BYTES: int = 1024 # Меньшие ответы не сжимаются
+    API_GZIP_LEVEL: int = 5               # 1-9: выше - меньше ответ, но больше CPU на запрос
+    API_BROTLI_QUALITY: int = 4           # 0-11: 4-5 сжимает JSON лучше gzip при сопоставимом CPU; 10-11 - только для статики
+
+    # Параллельное выполнение независимых читающих запросов одного HTTP-запроса на отдельных соединениях пула (app/db/parallel_queries.py)
+    DB_CONCURRENT_READS_PER_REQUEST: int = 4  # Не больше пула профиля api (DB_POOL_API_SIZE + DB_POOL_API_MAX_OVERFLOW), иначе запросы ждут соединение
+
+    # Профили пулов соединений (app/db/session.py: make_async_engine). api - процесс uvicorn, worker - задачи Celery (движок на запуск
+    # задачи), backfill - долгие массовые задачи (переиндексация, снимки, сверка): мало соединений, долгое ожидание вместо ошибки
+    DB_POOL_PROFILE: str = "api"              # Профиль основного движка процесса: api для uvicorn, worker для celery (задается в docker-compose)
+    DB_POOL_API_SIZE: int = 10
+    DB_POOL_API_MAX_OVERFLOW: int = 10
+    DB_POOL_API_TIMEOUT_SECONDS: float = 10.0   # Сколько запрос ждет свободное соединение, прежде чем упасть с TimeoutError
+    DB_POOL_API_RECYCLE_SECONDS: int = 1800     # Соединения старше пересоздаются (балансировщики и PgBouncer рвут долгоживущие)
+    DB_POOL_WORKER_SIZE: int = 3
+    DB_POOL_WORKER_MAX_OVERFLOW: int = 2
+    DB_POOL_WORKER_TIMEOUT_SECONDS: float = 30.0
+    DB_POOL_WORKER_RECYCLE_SECONDS: int = 1800
+    DB_POOL_BACKFILL_SIZE: int = 2
+    DB_POOL_BACKFILL_MAX_OVERFLOW: int = 0
+    DB_POOL_BACKFILL_TIMEOUT_SECONDS: float = 120.0
+    DB_POOL_BACKFILL_RECYCLE_SECONDS: int = 3600
+    DB_STATEMENT_CACHE_SIZE: int = 100          # Кэш подготовленных выражений asyncpg на соединение (0 - выключен)
+    DB_PGBOUNCER_MODE: bool = False             # PgBouncer в режиме transaction: без кэша подготовленных выражений и с уникальными их именами
+    DB_POOL_SLOW_CHECKOUT_MS: float = 200.0     # Ожидание соединения дольше порога пишется в лог предупреждением
+
+    # Реплики для чтения (app/db/session.py, зависимость get_async_read_db у GET-эндпоинтов): DSN через запятую, пусто - все на основную базу
+    DATABASE_REPLICA_URLS: str = ""
+    DB_REPLICA_MAX_LAG_SECONDS: float = 30.0          # Реплика с отставанием больше порога не используется - чтение идет на основную базу
+    DB_REPLICA_LAG_CHECK_INTERVAL_SECONDS: float = 5.0 # Как часто перепроверять отставание (результат кэшируется в процессе)
+    DB_REPLICA_LAG_CHECK_TIMEOUT_SECONDS: float = 2.0  # Не ответила за это время - считается недоступной до следующей проверки
+
+    # Помесячное секционирование comments по commented_at (секции создает и отсоединяет задача tasks.maintain_comment_partitions)
+    COMMENTS_PARTITION_PREMAKE_MONTHS: int = 3             # На сколько месяцев вперед держать готовые секции
+    COMMENTS_PARTITION_RETENTION_MONTHS: Optional[int] = None # Секции старше N полных месяцев отсоединяются; None - хранить все
+    COMMENTS_PARTITION_DROP_DETACHED: bool = False         # False - отсоединенные секции остаются таблицами для архивации (pg_dump -t)
+    COMMENTS_PARTITION_MAINTENANCE_INTERVAL_SECONDS: int = 86400
+
+    # Потоковая выгрузка /export/* (app/services/data_export.py)
+    EXPORT_CHUNK_ROWS: int = 5000                 # Строк за одну выборку серверного курсора; он же размер row group в Parquet
+    EXPORT_PARQUET_COMPRESSION: str = "zstd"
+
+    # Колоночные снимки posts/comments/comment_insights в Parquet для тяжелых отчетов через DuckDB (app/services/analytics_lake.py)
+    ANALYTICS_LAKE_ENABLED: bool = False
+    ANALYTICS_LAKE_PATH: str = "/data/analytics_lake"      # Общий каталог (том) для API и воркера Celery
+    ANALYTICS_LAKE_SNAPSHOT_INTERVAL_SECONDS: int = 3600
+    ANALYTICS_LAKE_RESNAPSHOT_DAYS: int = 2                # Последние N UTC-дней переснимаются всегда, даже без найденных изменений
+    ANALYTICS_LAKE_MAX_STALENESS_SECONDS: int = 3 * 3600   # Снимок старше - отчеты снова считаются в Postgres
+    ANALYTICS_LAKE_MIN_PERIOD_DAYS: int = 60               # Короче периоды считаются в Postgres
+    ANALYTICS_LAKE_COMPRESSION: str = "zstd"
+    ANALYTICS_LAKE_ROW_GROUP_SIZE: int = 100000
+    ANALYTICS_LAKE_DUCKDB_THREADS: int = 4
+
+    # Семантический поиск: эмбеддинги (app/services/embeddings.py) и файловый векторный индекс (app/services/vector_index.py)
+    SEMANTIC_SEARCH_ENABLED: bool = False
+    SEMANTIC_INDEX_PATH: str = "/data/semantic_index"      # Общий каталог (том) для API и воркера Celery
+    SEMANTIC_INDEX_UPDATE_INTERVAL_SECONDS: int = 300
+    SEMANTIC_INDEX_BATCH_ROWS: int = 1000                  # Строк из БД на пачку (одна пачка - один коммит индекса)
+    SEMANTIC_INDEX_MAX_ROWS_PER_RUN: int = 20000           # На вид документа за запуск; первичная индексация идет несколькими запусками
+    SEMANTIC_VECTOR_DTYPE: str = "int8"                    # int8 (масштаб на строку) или float16; смена - переиндексация
+    SEMANTIC_HNSW_ENABLED: bool = True                     # Граф HNSW (нужен hnswlib); иначе - точный перебор
+    SEMANTIC_HNSW_M: int = 16
+    SEMANTIC_HNSW_EF_CONSTRUCTION: int = 200
+    SEMANTIC_HNSW_EF_SEARCH: int = 100
+    SEMANTIC_EXACT_SCAN_MAX_ROWS: int = 200000             # Если фильтры оставили не больше N векторов - точный перебор вместо графа
+    SEMANTIC_COMPACT_DELETED_RATIO: float = 0.3
+    SEMANTIC_MIN_TEXT_CHARS: int = 3
+    SEMANTIC_MAX_TEXT_CHARS: int = 2000                    # Длиннее - обрезается перед векторизацией
+    SEMANTIC_SEARCH_OVERSAMPLE: int = 3                    # Кандидатов из индекса на один результат (часть отсеивается в Postgres)
+    EMBEDDING_PROVIDER: str = "local"                      # local (sentence-transformers на CPU), openai или свой - register_embedding_provider
+    EMBEDDING_LOCAL_MODEL: str = "intfloat/multilingual-e5-small"
+    EMBEDDING_QUERY_PREFIX: str = "query: "                # Префиксы, с которыми обучены модели e5; для других моделей - пустые
+    EMBEDDING_DOCUMENT_PREFIX: str = "passage: "
+    EMBEDDING_OPENAI_MODEL: str = "text-embedding-3-small"
+    EMBEDDING_OPENAI_DIMENSIONS: int = 512
+    EMBEDDING_OPENAI_URL: str = "https://api.openai.com/v1/embeddings"
+    EMBEDDING_BATCH_SIZE: int = 64
+
+    # Канонизация инсайтов (app/services/insight_canonicalization.py): словарь insight_canonicals / insight_aliases
+    INSIGHT_CANONICALIZATION_ENABLED: bool = True
+    INSIGHT_CANONICALIZATION_INTERVAL_SECONDS: int = 300
+    INSIGHT_CANONICALIZATION_BATCH_TEXTS: int = 2000        # Новых формулировок за пачку (пачки - до опустошения очереди или лимита)
+    INSIGHT_CANONICALIZATION_MAX_TEXTS_PER_RUN: int = 20000
+    INSIGHT_EMBEDDING_CLUSTERING_ENABLED: bool = True       # Присоединять синонимы по эмбеддингам (нужен провайдер EMBEDDING_PROVIDER)
+    INSIGHT_CLUSTER_SIMILARITY_THRESHOLD: float = 0.9       # Косинусная близость для присоединения к каноническому инсайту
+    INSIGHT_CANONICAL_GROUPING_ENABLED: bool = True         # Топы и тренды по canonical_id; False - по нормализованному тексту, как раньше
+    INSIGHT_TREND_MAX_MATCHED_TEXTS: int = 500              # Тренд contains: больше подходящих формулировок в словаре - поиск подстроки по comment_insights
+
 
     model_config = SettingsConfigDict(
         env_file=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '.env'), # Путь к .env относительно текущего файла
@@ -0,0 +1,31 @@
+# app/core/redis_client.py
+
+import asyncio
+import weakref
+
+import redis.asyncio as aioredis
+
+from app.core.config import settings
+
+REDIS_APP_URL = f"redis://{settings.REDIS_HOST}:{settings.REDIS_PORT}/{settings.REDIS_APP_DB}"
+
+# Клиенты кэшируются по event loop: задачи Celery запускают свой loop через asyncio.run(),
+# и соединения, созданные в одном loop, нельзя использовать в другом.
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aioredis.Redis]" = weakref.WeakKeyDictionary()
+
+
+def get_async_redis() -> aioredis.Redis:
+    """
+    Возвращает асинхронный клиент Redis (БД состояния приложения) для текущего event loop.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = aioredis.from_url(
+            REDIS_APP_URL,
+            decode_responses=True,
+            socket_timeout=2.0,
+            socket_connect_timeout=2.0,
+        )
+        _async_clients[loop] = client
+    return client
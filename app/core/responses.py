@@ -0,0 +1,108 @@
+# app/core/responses.py
+
+import gzip
+from typing import Any, Optional
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers, MutableHeaders
+
+from app.core.config import settings
+
+try:
+    import orjson
+except ImportError: # orjson не установлен - ответы сериализует стандартный json
+    orjson = None
+
+try:
+    import brotli
+except ImportError: # Без brotli ответы сжимаются только gzip
+    brotli = None
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSON-ответ через orjson (класс ответа API по умолчанию): в разы быстрее json.dumps на списках из сотен объектов,
+    сам сериализует datetime (UTC - с суффиксом Z, как pydantic), поэтому годится и для ответов из строк запроса без
+    моделей pydantic. Без orjson - стандартный JSONResponse поверх jsonable_encoder.
+    """
+
+    def render(self, content: Any) -> bytes:
+        if orjson is None:
+            return super().render(jsonable_encoder(content))
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z)
+
+
+def _is_compressible(content_type: str) -> bool:
+    content_type = content_type.split(";", 1)[0].strip().lower()
+    if content_type == "text/event-stream":
+        return False
+    return content_type.startswith("text/") or content_type.endswith("json")
+
+
+def _accepted_encoding(accept_encoding: str) -> Optional[str]:
+    """br, если клиент его принимает и brotli установлен, иначе gzip; кодировки с q=0 не выбираются."""
+    accepted = set()
+    for part in accept_encoding.lower().split(","):
+        token, _, params = part.strip().partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(token.strip())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+class CompressionMiddleware:
+    """
+    Сжатие ответов brotli/gzip (по Accept-Encoding) от API_COMPRESSION_MIN_BYTES. Сжимаются только ответы одним телом
+    (JSON и текст): потоковые (SSE, выгрузки /export/*) проходят как есть - буферизация сломала бы их потоковость, - как и
+    ответы, уже сжатые эндпоинтом (/dashboard/bundle).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = _accepted_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start_message, passthrough
+            if message["type"] == "http.response.start":
+                start_message = message # Заголовки отправляются вместе с первым куском тела: от него зависит, сжимать ли
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+            body = message.get("body", b"")
+            headers = MutableHeaders(raw=start_message["headers"])
+            if (
+                message.get("more_body", False) or "content-encoding" in headers
+                or len(body) < settings.API_COMPRESSION_MIN_BYTES or not _is_compressible(headers.get("content-type", ""))
+            ):
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+            if encoding == "br":
+                body = brotli.compress(body, quality=settings.API_BROTLI_QUALITY)
+            else:
+                body = gzip.compress(body, compresslevel=settings.API_GZIP_LEVEL)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(body))
+            headers.add_vary_header("Accept-Encoding")
+            await send(start_message)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_compressed)
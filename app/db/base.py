@@ -2,4 +2,9 @@
 # особенно полезно для Alembic env.py и для инициализации БД.
 
 from app.db.base_class import Base # Наш DeclarativeMeta
-from app.models.telegram_data import Channel, Post, Comment # Импортируем наши модели
\ No newline at end of file
+from app.models.telegram_data import Channel, Post, Comment # Импортируем наши модели
+from app.models.llm_batch import LLMBatchJob
+from app.models.llm_call_log import LLMCallLog
+from app.models.comment_insight import CommentInsight
+from app.models.channel_daily_stats import ChannelDailyStats
+from app.models.insight_canonical import InsightCanonical, InsightAlias
@@ -0,0 +1,41 @@
+# app/db/parallel_queries.py
+
+import asyncio
+import contextvars
+from typing import Any, Awaitable, Callable, List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.db.session import begin_read_only
+
+ReadCallable = Callable[[AsyncSession], Awaitable[Any]]
+
+# Выставляется внутри запуска run_concurrent_reads: вложенный вызов выполняется последовательно, а не занимает еще соединения
+# (иначе внешние чтения, держащие слоты, ждали бы вложенные, которым слотов не хватает)
+_inside_concurrent_read: contextvars.ContextVar[bool] = contextvars.ContextVar("inside_concurrent_read", default=False)
+
+
+async def run_concurrent_reads(db: AsyncSession, *reads: ReadCallable, max_concurrency: Optional[int] = None) -> List[Any]:
+    """
+    Выполняет независимые читающие функции reads (каждая получает AsyncSession) параллельно: каждая - на своей сессии
+    на том же движке, что и db (основная база или реплика из get_async_read_db), то есть на своем соединении из его пула,
+    не больше max_concurrency (DB_CONCURRENT_READS_PER_REQUEST) одновременно. Результаты - в порядке reads; время - максимум из запросов, а не сумма.
+    Одна сессия SQLAlchemy не допускает параллельных запросов, поэтому reads не должны использовать db и менять данные:
+    их сессии закрываются без коммита и наследуют от db маршрут и READ ONLY. Если параллелить нечего, лимит <= 1 или вызов вложенный - reads выполняются по очереди на db.
+    """
+    limit = max_concurrency if max_concurrency is not None else settings.DB_CONCURRENT_READS_PER_REQUEST
+    if len(reads) <= 1 or limit <= 1 or _inside_concurrent_read.get():
+        return [await read(db) for read in reads]
+
+    semaphore = asyncio.Semaphore(limit)
+
+    async def _run_one(read: ReadCallable) -> Any:
+        async with semaphore:
+            _inside_concurrent_read.set(True) # Контекст задачи - копия, на вызывающего не влияет
+            async with AsyncSession(bind=db.bind, expire_on_commit=False, autoflush=False, info=dict(db.info)) as session:
+                if db.info.get("read_only"): # Как у db: READ ONLY выставляют get_async_read_db и primary_read_session
+                    await begin_read_only(session)
+                return await read(session)
+
+    return list(await asyncio.gather(*[_run_one(read) for read in reads]))
@@ -0,0 +1,146 @@
+# app/db/pool_metrics.py
+
+import logging
+import threading
+import time
+from typing import Any, Dict, List
+
+from sqlalchemy import exc as sa_exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Границы гистограммы ожидания соединения из пула, секунды (последняя - +Inf)
+CHECKOUT_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+
+
+class PoolMetrics:
+    """
+    Метрики одного пула в процессе: ожидание соединения (гистограмма, сумма, максимум), таймауты, медленные выдачи,
+    пиковые занятость и overflow. Пулы задач Celery (движок на каждый запуск) пишут в общие метрики своего профиля.
+    """
+
+    def __init__(self, name: str, profile: str):
+        self.name = name
+        self.profile = profile
+        self.checkouts = 0
+        self.checkout_timeouts = 0
+        self.slow_checkouts = 0
+        self.wait_sum_seconds = 0.0
+        self.wait_max_seconds = 0.0
+        self.wait_bucket_counts = [0] * len(CHECKOUT_WAIT_BUCKETS)
+        self.in_use_peak = 0
+        self.overflow_peak = 0
+        self._lock = threading.Lock() # Пул задач может жить в другом потоке, чем эндпоинт метрик
+
+    def observe_checkout(self, wait_seconds: float, in_use: int, overflow: int, timed_out: bool = False) -> None:
+        with self._lock:
+            if timed_out:
+                self.checkout_timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_sum_seconds += wait_seconds
+            self.wait_max_seconds = max(self.wait_max_seconds, wait_seconds)
+            for position, bound in enumerate(CHECKOUT_WAIT_BUCKETS):
+                if wait_seconds <= bound:
+                    self.wait_bucket_counts[position] += 1
+                    break
+            self.in_use_peak = max(self.in_use_peak, in_use)
+            self.overflow_peak = max(self.overflow_peak, overflow)
+            slow = wait_seconds * 1000 >= settings.DB_POOL_SLOW_CHECKOUT_MS
+            if slow:
+                self.slow_checkouts += 1
+        if slow or timed_out:
+            outcome = "таймаут" if timed_out else "медленно"
+            logger.warning(
+                f"Пул {self.name} (профиль {self.profile}): соединение выдано за {wait_seconds * 1000:.0f} мс ({outcome}); "
+                f"занято {in_use}, overflow {overflow}."
+            )
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            observed = self.checkouts + self.checkout_timeouts
+            cumulative, buckets = 0, []
+            for bound, count in zip(CHECKOUT_WAIT_BUCKETS, self.wait_bucket_counts):
+                cumulative += count
+                buckets.append((bound, cumulative))
+            return {
+                "checkouts": self.checkouts,
+                "checkout_timeouts": self.checkout_timeouts,
+                "slow_checkouts": self.slow_checkouts,
+                "checkout_wait_avg_ms": round(self.wait_sum_seconds / observed * 1000, 3) if observed else None,
+                "checkout_wait_max_ms": round(self.wait_max_seconds * 1000, 3) if observed else None,
+                "checkout_wait_sum_seconds": self.wait_sum_seconds,
+                "checkout_wait_buckets": buckets,
+                "in_use_peak": self.in_use_peak,
+                "overflow_peak": self.overflow_peak,
+            }
+
+
+_registry: Dict[str, PoolMetrics] = {}
+_registry_lock = threading.Lock()
+
+
+def get_pool_metrics(name: str, profile: str) -> PoolMetrics:
+    with _registry_lock:
+        if name not in _registry:
+            _registry[name] = PoolMetrics(name, profile)
+        return _registry[name]
+
+
+def instrumented_pool_class(metrics: PoolMetrics):
+    """
+    Класс пула с замером ожидания соединения: выдача (_do_get) включает ожидание свободного слота и открытие нового
+    соединения. Метрики - атрибут класса, поэтому переживают pool.recreate() (dispose движка создает пул того же класса).
+    """
+
+    class InstrumentedAsyncAdaptedQueuePool(AsyncAdaptedQueuePool):
+        _metrics = metrics
+
+        def _do_get(self):
+            started = time.perf_counter()
+            try:
+                connection = super()._do_get()
+            except sa_exc.TimeoutError:
+                self._metrics.observe_checkout(time.perf_counter() - started, self.checkedout(), max(self.overflow(), 0), timed_out=True)
+                raise
+            self._metrics.observe_checkout(time.perf_counter() - started, self.checkedout(), max(self.overflow(), 0))
+            return connection
+
+    return InstrumentedAsyncAdaptedQueuePool
+
+
+def render_pool_metrics_prometheus(pools: List[Dict[str, Any]]) -> str:
+    """Текстовый формат экспозиции Prometheus из снимка пулов (app/db/session.py: ReadRouter.snapshot)."""
+    def labels(pool: Dict[str, Any], extra: str = "") -> str:
+        base = f'pool="{pool["name"]}",profile="{pool["profile"]}"'
+        return "{" + base + (f",{extra}" if extra else "") + "}"
+
+    lines = [
+        "# HELP db_pool_checkout_wait_seconds Time spent waiting for a connection from the pool.",
+        "# TYPE db_pool_checkout_wait_seconds histogram",
+    ]
+    for pool in pools:
+        for bound, cumulative in pool["checkout_wait_buckets"]:
+            le_label = 'le="+Inf"' if bound == float("inf") else f'le="{bound:g}"'
+            lines.append(f"db_pool_checkout_wait_seconds_bucket{labels(pool, le_label)} {cumulative}")
+        lines.append(f"db_pool_checkout_wait_seconds_sum{labels(pool)} {pool['checkout_wait_sum_seconds']:.6f}")
+        lines.append(f"db_pool_checkout_wait_seconds_count{labels(pool)} {pool['checkouts'] + pool['checkout_timeouts']}")
+    for metric, key, metric_type, help_text in (
+        ("db_pool_checkout_timeouts_total", "checkout_timeouts", "counter", "Checkouts that failed with a pool timeout."),
+        ("db_pool_slow_checkouts_total", "slow_checkouts", "counter", "Checkouts slower than DB_POOL_SLOW_CHECKOUT_MS."),
+        ("db_pool_size", "pool_size", "gauge", "Configured pool size."),
+        ("db_pool_max_overflow", "max_overflow", "gauge", "Configured overflow limit."),
+        ("db_pool_connections_in_use", "checked_out", "gauge", "Connections currently checked out."),
+        ("db_pool_overflow", "overflow", "gauge", "Connections currently open above pool_size."),
+        ("db_pool_connections_in_use_peak", "in_use_peak", "gauge", "Peak checked-out connections since process start."),
+    ):
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {metric_type}")
+        for pool in pools:
+            if pool.get(key) is not None:
+                lines.append(f"{metric}{labels(pool)} {pool[key]}")
+    return "\n".join(lines) + "\n"
+
@@ -1,10 +1,18 @@
 # app/db/session.py
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+import asyncio
+import logging
+import time
+import uuid
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, AsyncEngine
 from sqlalchemy.orm import sessionmaker
 from contextlib import asynccontextmanager # <--- ДОБАВЛЕНО
-from typing import AsyncGenerator         # <--- ДОБАВЛЕНО
+from typing import AsyncGenerator, Any, Dict, List, Optional, Tuple         # <--- ДОБАВЛЕНО
 
 from app.core.config import settings # Наши настройки, включая DATABASE_URL
+from app.db.pool_metrics import get_pool_metrics, instrumented_pool_class
+
+logger = logging.getLogger(__name__)
 
 # Асинхронный URL для PostgreSQL
 # Ваш config.py уже должен предоставлять settings.DATABASE_URL в формате postgresql+asyncpg://
@@ -17,11 +25,63 @@ if not ASYNC_DATABASE_URL.startswith("postgresql+asyncpg://"):
     ASYNC_DATABASE_URL = ASYNC_DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
 
 
-async_engine = create_async_engine(
-    ASYNC_DATABASE_URL,
-    echo=False, 
-    pool_pre_ping=True
-)
+# --- ПРОФИЛИ ПУЛОВ ---
+# Размер, overflow, таймаут ожидания и recycle задаются настройками DB_POOL_{API,WORKER,BACKFILL}_*. Каждый пул считает
+# ожидание соединения (app/db/pool_metrics.py) - метрики в /db/pools и /db/pools/prometheus (в процессе API; пулы задач
+# Celery живут в процессе воркера и видны только в его логе медленных выдач).
+POOL_PROFILES = ("api", "worker", "backfill")
+
+
+def pool_profile_options(profile: str) -> Dict[str, Any]:
+    if profile not in POOL_PROFILES:
+        raise ValueError(f"Неизвестный профиль пула соединений: {profile!r}")
+    prefix = f"DB_POOL_{profile.upper()}_"
+    return {
+        "pool_size": getattr(settings, prefix + "SIZE"),
+        "max_overflow": getattr(settings, prefix + "MAX_OVERFLOW"),
+        "pool_timeout": getattr(settings, prefix + "TIMEOUT_SECONDS"),
+        "pool_recycle": getattr(settings, prefix + "RECYCLE_SECONDS"),
+    }
+
+
+def _asyncpg_connect_args() -> Dict[str, Any]:
+    if settings.DB_PGBOUNCER_MODE:
+        # PgBouncer (transaction) отдает каждую транзакцию произвольному серверному соединению: подготовленное выражение
+        # с тем же именем может оказаться чужим или отсутствовать - кэши выключены, имена уникальны
+        return {
+            "statement_cache_size": 0,
+            "prepared_statement_cache_size": 0,
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__",
+        }
+    return {
+        "statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+        "prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+    }
+
+
+def make_async_engine(url: str, profile: str, name: Optional[str] = None) -> AsyncEngine:
+    """
+    Движок с пулом профиля profile. name - под каким именем пул виден в метриках (по умолчанию - имя профиля: движки задач
+    одного профиля, создаваемые на каждый запуск, копят общие метрики).
+    """
+    metrics = get_pool_metrics(name or profile, profile)
+    return create_async_engine(
+        _asyncpg_url(url),
+        echo=False,
+        pool_pre_ping=True,
+        poolclass=instrumented_pool_class(metrics),
+        connect_args=_asyncpg_connect_args(),
+        **pool_profile_options(profile),
+    )
+
+
+def _asyncpg_url(url: str) -> str:
+    if url.startswith("postgresql+asyncpg://"):
+        return url
+    return url.replace("postgresql://", "postgresql+asyncpg://", 1)
+
+
+async_engine = make_async_engine(ASYNC_DATABASE_URL, settings.DB_POOL_PROFILE, name="primary")
 
 # Создаем фабрику асинхронных сессий (остается вашей AsyncSessionFactory)
 AsyncSessionFactory = sessionmaker(
@@ -46,6 +106,173 @@ async def get_async_db() -> AsyncGenerator[AsyncSession, None]: # Изменил
         finally:
             await session.close()
 
+# --- РЕПЛИКИ ДЛЯ ЧТЕНИЯ ---
+# GET-эндпоинты (отчеты, списки, поиск, выгрузки) берут сессию из get_async_read_db: на реплике из DATABASE_REPLICA_URLS
+# с отставанием не больше DB_REPLICA_MAX_LAG_SECONDS, иначе на основной базе (транзакция READ ONLY). Кэшируемые под версией
+# данных виджеты дашборда - primary_read_session. Задачи Celery и пишущие эндпоинты работают только с основной базой.
+PRIMARY_ROUTE = "primary"
+
+# Отставание реплики: 0, если все полученное WAL уже применено (простаивающая реплика не "отстает" по времени последней транзакции);
+# pg_is_in_recovery() = false - это не реплика (например, после переключения), чтение с нее безопасно
+_REPLICA_LAG_SQL = text(
+    "SELECT pg_is_in_recovery() AS in_recovery, "
+    "CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END AS lag_seconds"
+)
+
+
+class _ReadReplica:
+    """Реплика: свой движок и пул, последнее измеренное отставание и счетчики для метрик."""
+
+    def __init__(self, position: int, url: str):
+        self.name = f"replica{position}"
+        self.engine: AsyncEngine = make_async_engine(url, "api", name=self.name)
+        self.session_factory = sessionmaker(bind=self.engine, class_=AsyncSession, expire_on_commit=False, autoflush=False, autocommit=False)
+        self.healthy = False
+        self.in_recovery: Optional[bool] = None
+        self.lag_seconds: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.sessions_routed = 0
+
+    async def probe(self) -> None:
+        try:
+            async with self.engine.connect() as connection:
+                row = (await asyncio.wait_for(connection.execute(_REPLICA_LAG_SQL), timeout=settings.DB_REPLICA_LAG_CHECK_TIMEOUT_SECONDS)).one()
+            self.in_recovery = bool(row.in_recovery)
+            self.lag_seconds = float(row.lag_seconds) if row.lag_seconds is not None else None # NULL - реплика еще ничего не применила
+            was_healthy, self.healthy, self.last_error = self.healthy, self.lag_seconds is not None, None
+        except Exception as e:
+            was_healthy, self.healthy, self.last_error = self.healthy, False, f"{type(e).__name__}: {e}"
+            self.lag_seconds = None
+        if was_healthy != self.healthy:
+            if self.healthy: logger.info(f"Реплика {self.name} доступна (отставание {self.lag_seconds:.1f} с).")
+            else: logger.warning(f"Реплика {self.name} недоступна для чтения: {self.last_error or 'нет данных об отставании'}.")
+
+    @property
+    def usable(self) -> bool:
+        return self.healthy and self.lag_seconds is not None and self.lag_seconds <= settings.DB_REPLICA_MAX_LAG_SECONDS
+
+
+class ReadRouter:
+    """
+    Выбор базы для читающей сессии: реплики с допустимым отставанием по кругу, иначе основная база. Отставание перепроверяется
+    не чаще DB_REPLICA_LAG_CHECK_INTERVAL_SECONDS (одна проверка на процесс, остальные запросы ждут ее или берут прошлый результат).
+    """
+
+    def __init__(self, replica_urls: List[str]):
+        self.replicas = [_ReadReplica(position, url) for position, url in enumerate(replica_urls, start=1)]
+        self._checked_at = 0.0
+        self._check_lock: Optional[asyncio.Lock] = None
+        self._next_replica = 0
+        self.primary_sessions_routed = 0
+        self.fallbacks_to_primary = 0
+
+    async def _refresh_lag(self) -> None:
+        if time.monotonic() - self._checked_at < settings.DB_REPLICA_LAG_CHECK_INTERVAL_SECONDS:
+            return
+        if self._check_lock is None:
+            self._check_lock = asyncio.Lock()
+        async with self._check_lock:
+            if time.monotonic() - self._checked_at < settings.DB_REPLICA_LAG_CHECK_INTERVAL_SECONDS:
+                return # Пока ждали блокировку, проверку сделал другой запрос
+            await asyncio.gather(*[replica.probe() for replica in self.replicas])
+            self._checked_at = time.monotonic()
+
+    async def choose(self) -> Tuple[str, Any]:
+        """(имя маршрута, фабрика сессий) для очередной читающей сессии."""
+        if not self.replicas:
+            self.primary_sessions_routed += 1
+            return PRIMARY_ROUTE, AsyncSessionFactory
+        await self._refresh_lag()
+        usable = [replica for replica in self.replicas if replica.usable]
+        if not usable:
+            self.fallbacks_to_primary += 1
+            self.primary_sessions_routed += 1
+            return PRIMARY_ROUTE, AsyncSessionFactory
+        replica = usable[self._next_replica % len(usable)]
+        self._next_replica += 1
+        replica.sessions_routed += 1
+        return replica.name, replica.session_factory
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """Состояние пулов, ожидание соединений и маршрутизация для метрик: основная база и каждая реплика."""
+        def pool_stats(engine: AsyncEngine) -> Dict[str, Any]:
+            pool = engine.sync_engine.pool
+            metrics = getattr(pool, "_metrics", None)
+            return {
+                "profile": metrics.profile if metrics is not None else None,
+                "pool_size": pool.size() if hasattr(pool, "size") else None,
+                "max_overflow": getattr(pool, "_max_overflow", None),
+                "pool_timeout_seconds": pool.timeout() if hasattr(pool, "timeout") else None,
+                "checked_out": pool.checkedout() if hasattr(pool, "checkedout") else None,
+                "overflow": max(pool.overflow(), 0) if hasattr(pool, "overflow") else None, # До заполнения пула overflow отрицателен
+                "checked_in": pool.checkedin() if hasattr(pool, "checkedin") else None,
+                **(metrics.snapshot() if metrics is not None else {}),
+            }
+        items = [{
+            "name": PRIMARY_ROUTE, "role": "primary", **pool_stats(async_engine), "healthy": True, "lag_seconds": 0.0,
+            "in_recovery": False, "sessions_routed": self.primary_sessions_routed, "fallbacks_to_primary": self.fallbacks_to_primary, "last_error": None,
+        }]
+        for replica in self.replicas:
+            items.append({
+                "name": replica.name, "role": "replica", **pool_stats(replica.engine), "healthy": replica.usable, "lag_seconds": replica.lag_seconds,
+                "in_recovery": replica.in_recovery, "sessions_routed": replica.sessions_routed, "fallbacks_to_primary": None, "last_error": replica.last_error,
+            })
+        return items
+
+
+read_router = ReadRouter([url.strip() for url in settings.DATABASE_REPLICA_URLS.split(",") if url.strip()])
+
+
+async def begin_read_only(session: AsyncSession) -> None:
+    """
+    Первая команда транзакции читающей сессии: запись в ней падает. Флаг session.info["read_only"] переносят
+    на свои сессии параллельные чтения (app/db/parallel_queries.py).
+    """
+    await session.execute(text("SET TRANSACTION READ ONLY"))
+    session.info["read_only"] = True
+
+
+async def get_async_read_db() -> AsyncGenerator[AsyncSession, None]:
+    """
+    Зависимость FastAPI для GET-эндпоинтов: читающая сессия на реплике (см. ReadRouter) или на основной базе.
+    Ничего не коммитит. Если реплики настроены, на основной базе транзакция READ ONLY: запись из читающего эндпоинта падает
+    одинаково, куда бы ни попал запрос. Имя маршрута - в session.info["db_route"].
+    """
+    route_name, session_factory = await read_router.choose()
+    async with session_factory() as session:
+        session.info["db_route"] = route_name
+        try:
+            if route_name == PRIMARY_ROUTE and read_router.replicas:
+                await begin_read_only(session)
+            yield session
+        finally:
+            await session.rollback()
+
+
+@asynccontextmanager
+async def primary_read_session() -> AsyncGenerator[AsyncSession, None]:
+    """
+    Читающая сессия всегда на основной базе (транзакция READ ONLY) - для ответов, кэшируемых под версией данных
+    (app/services/response_cache.py). Задачи повышают версию сразу после коммита на основной базе; реплика в пределах
+    допустимого отставания могла бы отдать данные до этого коммита, и они закэшировались бы под новой версией на весь TTL.
+    Основную базу это почти не нагружает: расчет идет один раз на версию и набор параметров.
+    Не зависимость FastAPI: сессию открывает сам расчет (общая задача single-flight), поэтому попадание в кэш не берет
+    соединение из пула, а разрыв соединения первым клиентом не закрывает сессию под расчетом для остальных.
+    """
+    async with AsyncSessionFactory() as session:
+        session.info["db_route"] = PRIMARY_ROUTE
+        try:
+            await begin_read_only(session)
+            yield session
+        finally:
+            await session.rollback()
+
+
+async def dispose_read_replicas() -> None:
+    for replica in read_router.replicas:
+        await replica.engine.dispose()
+
 # --- НАЧАЛО: НОВЫЙ КОНТЕКСТНЫЙ МЕНЕДЖЕР ДЛЯ CELERY ---
 @asynccontextmanager
 async def get_async_session_context_manager() -> AsyncGenerator[AsyncSession, None]:
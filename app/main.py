@@ -1,6 +1,9 @@
 # app/main.py
 
 import asyncio
+import gzip
+import hashlib
+import json
 import logging
 from datetime import datetime, timedelta, timezone, date
 from sqlalchemy import Date as SQLDate
@@ -8,33 +11,58 @@ from typing import List, Optional, Dict, Tuple, Any
 from enum import Enum as PyEnum
 import re
 
-from fastapi import FastAPI, BackgroundTasks, Depends, HTTPException, Query, APIRouter
+from fastapi import FastAPI, BackgroundTasks, Depends, HTTPException, Query, APIRouter, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse, Response
 from sqlalchemy.exc import IntegrityError
 import sqlalchemy as sa
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func, desc, asc, cast, literal_column, nullslast, update, delete, or_, text, Integer as SAInteger, Column as SAColumn
-from sqlalchemy.orm import selectinload, aliased
+from sqlalchemy import select, func, desc, cast, literal_column, update, delete, or_, text, Column as SAColumn
 from sqlalchemy.dialects.postgresql import JSONB
-from sqlalchemy.sql.expression import column
 
 from telethon import TelegramClient
 from telethon.errors import ChannelPrivateError, UsernameInvalidError, UsernameNotOccupiedError
 from telethon.tl.types import Channel as TelethonChannelType, Chat as TelethonChatType, User as TelethonUserType
 
-from .models import Post, Comment, Channel
+from .models import Post, Comment, Channel, LLMBatchJob, LLMCallLog
 from . import models as models_module
-from .db.session import get_async_db
+from .db.session import get_async_db, get_async_read_db, primary_read_session, read_router, dispose_read_replicas
+from .db.pool_metrics import render_pool_metrics_prometheus
+from .db.parallel_queries import run_concurrent_reads
 from .celery_app import celery_instance
 from .core.config import settings
+from .core.responses import FastJSONResponse, CompressionMiddleware
 from .schemas import ui_schemas
 
+from .services.llm_metrics import get_llm_metrics_snapshot, render_prometheus_text
+from .services.llm_circuit_breaker import get_llm_circuit_breaker
+from .services.llm_batch import ensure_batch_backend_allowed
+from .services.keyset_pagination import (
+    TOTAL_MODE_EXACT, TOTAL_MODE_APPROX, TOTAL_MODE_PATTERN, InvalidCursorError,
+    encode_cursor, decode_cursor, keyset_order_by, keyset_predicate, estimate_row_count,
+)
+from .services.text_search import ts_query_expression, ts_rank_expression, ts_headline_expression
+from .services.comment_insights import normalize_insight_text, escape_like_pattern
+from .services.response_cache import get_or_compute_json, bump_data_version
+from .services.analytics_lake import analytics_lake_usable_for, query_top_insights, query_insight_trend
+from .services.embeddings import EmbeddingProviderUnavailableError, get_embedding_provider
+from .services.vector_index import KIND_BY_NAME, KIND_POST, KIND_COMMENT, KIND_INSIGHT, VectorIndexUnavailableError, search_vector_index
+from .services.data_export import (
+    EXPORT_FORMAT_CSV, EXPORT_FORMAT_PATTERN, EXPORT_MEDIA_TYPES, ExportFormatUnavailableError,
+    ensure_export_format_available, stream_export,
+)
+
 try:
-    from .services.llm_service import одиночный_запрос_к_llm
+    from .services.llm_service import одиночный_запрос_к_llm, потоковый_запрос_к_llm, LLMThrottledError
 except ImportError:
+    class LLMThrottledError(Exception):
+        pass
     async def одиночный_запрос_к_llm(prompt: str, модель: str, **kwargs) -> Optional[str]:
         logger.error("ЗАГЛУШКА: llm_service не найден или функция одиночный_запрос_к_llm отсутствует.")
         return "Заглушка: Ошибка вызова LLM сервиса."
+    async def потоковый_запрос_к_llm(prompt: str, **kwargs):
+        logger.error("ЗАГЛУШКА: llm_service не найден или функция потоковый_запрос_к_llm отсутствует.")
+        yield "Заглушка: Ошибка вызова LLM сервиса."
 
 # Импорт Celery задач
 try:
@@ -44,7 +72,8 @@ try:
         send_daily_digest_task,
         analyze_posts_sentiment_task,
         enqueue_comments_for_ai_feature_analysis_task,
-        advanced_data_refresh_task
+        advanced_data_refresh_task,
+        submit_llm_bulk_batch_task
     )
 except ImportError as e:
     logging.getLogger(__name__).error(f"Ошибка импорта задач Celery: {e}")
@@ -55,6 +84,7 @@ except ImportError as e:
     def analyze_posts_sentiment_task(*args, **kwargs): return type('obj', (object,), {'id': 'fake_task_id_sentiment'})() # Note: prompt specified fake_task_id_sentiment_batch for заглушка if missing, but original was fake_task_id_sentiment. Keeping original for now.
     def enqueue_comments_for_ai_feature_analysis_task(*args, **kwargs): return type('obj', (object,), {'id': 'fake_task_id_comment_ai'})()
     def advanced_data_refresh_task(*args, **kwargs): return type('obj', (object,), {'id': 'fake_task_id_advanced_refresh'})()
+    def submit_llm_bulk_batch_task(*args, **kwargs): return type('obj', (object,), {'id': 'fake_task_id_llm_bulk_batch'})()
 
 from celery.result import AsyncResult # NEW: For task status endpoint
 from pydantic import BaseModel # NEW: For TaskStatusResponse schema
@@ -95,7 +125,8 @@ async def get_telegram_client() -> TelegramClient:
             raise HTTPException(status_code=503, detail="Telegram client not available. Startup may have failed.")
     return telegram_client_instance
 
-app = FastAPI(title=settings.PROJECT_NAME, version="0.1.0")
+app = FastAPI(title=settings.PROJECT_NAME, version="0.1.0", default_response_class=FastJSONResponse)
+app.add_middleware(CompressionMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"], # В продакшене лучше указать конкретные домены
@@ -142,6 +173,7 @@ async def shutdown_event():
         logger.info("Telegram client was initialized but not connected. No action needed for disconnection.")
     else:
         logger.info("Telegram client was not initialized. No action needed for disconnection.")
+    await dispose_read_replicas()
 
 
 api_v1_router = APIRouter(prefix=settings.API_V1_STR)
@@ -169,11 +201,11 @@ async def add_new_channel(channel_data: ui_schemas.ChannelCreateRequest, db: Asy
     if db_channel:
         if not db_channel.is_active:
             db_channel.is_active = True; db_channel.title = entity.title; db_channel.username = getattr(entity, 'username', None); db_channel.description = getattr(entity, 'about', None)
-            db.add(db_channel); await db.commit(); await db.refresh(db_channel); endpoint_logger.info(f"Channel ID {entity.id} ('{entity.title}') re-activated."); return db_channel
+            db.add(db_channel); await db.commit(); await db.refresh(db_channel); await bump_data_version("channel reactivated"); endpoint_logger.info(f"Channel ID {entity.id} ('{entity.title}') re-activated."); return db_channel
         else: endpoint_logger.info(f"Channel ID {entity.id} ('{entity.title}') already exists and is active."); raise HTTPException(status_code=409, detail=f"Channel '{entity.title}' (ID: {entity.id}) already tracked.")
     new_channel_model = models_module.Channel(id=entity.id, username=getattr(entity, 'username', None), title=entity.title, description=getattr(entity, 'about', None), is_active=True)
     db.add(new_channel_model)
-    try: await db.commit(); await db.refresh(new_channel_model); endpoint_logger.info(f"Channel '{new_channel_model.title}' (ID: {new_channel_model.id}) added to database.")
+    try: await db.commit(); await db.refresh(new_channel_model); await bump_data_version("channel added"); endpoint_logger.info(f"Channel '{new_channel_model.title}' (ID: {new_channel_model.id}) added to database.")
     except IntegrityError: await db.rollback(); endpoint_logger.warning(f"IntegrityError for channel ID {entity.id}. Race condition?"); raise HTTPException(status_code=409, detail=f"Channel '{entity.title}' (ID: {entity.id}) was added by another process or DB conflict.")
     return new_channel_model
 
@@ -201,7 +233,7 @@ async def update_channel_status(channel_id: int, channel_update_data: ui_schemas
     update_data = channel_update_data.model_dump(exclude_unset=True)
     if not update_data: raise HTTPException(status_code=400, detail="No update data provided.")
     for field, value in update_data.items(): setattr(channel, field, value)
-    db.add(channel); await db.commit(); await db.refresh(channel); endpoint_logger.info(f"Channel ID {channel_id} updated: {update_data}")
+    db.add(channel); await db.commit(); await db.refresh(channel); await bump_data_version("channel updated"); endpoint_logger.info(f"Channel ID {channel_id} updated: {update_data}")
     return channel
 
 @api_v1_router.delete("/channels/{channel_id}/", status_code=204)
@@ -209,131 +241,371 @@ async def delete_tracked_channel(channel_id: int, db: AsyncSession = Depends(get
     endpoint_logger.info(f"DELETE /channels/{channel_id}/")
     channel = await db.get(models_module.Channel, channel_id)
     if not channel: raise HTTPException(status_code=404, detail="Channel not found")
-    if channel.is_active: channel.is_active = False; db.add(channel); await db.commit(); endpoint_logger.info(f"Channel ID {channel_id} ('{channel.title}') deactivated.")
+    if channel.is_active: channel.is_active = False; db.add(channel); await db.commit(); await bump_data_version("channel deactivated"); endpoint_logger.info(f"Channel ID {channel_id} ('{channel.title}') deactivated.")
     else: endpoint_logger.info(f"Channel ID {channel_id} ('{channel.title}') already inactive.")
     return None
 
+def _on_primary_read_session(compute):
+    """
+    compute(db) -> расчет без аргументов для get_or_compute_json: сессию (primary_read_session, не реплика - кэш под версией
+    данных не должен хранить отстающий расчет) открывает сам расчет. Сессия запроса сюда не передается: общую задачу
+    single-flight ждут и другие клиенты, а сессию запроса FastAPI закрывает, как только ее клиент отключится.
+    """
+    async def _run():
+        async with primary_read_session() as db:
+            return await compute(db)
+    return _run
+
+async def _cached_analytics_response(endpoint: str, params: Dict[str, Any], compute) -> Response:
+    """
+    Ответ аналитического эндпоинта через кэш в Redis (app/services/response_cache.py): JSON отдается как есть, без повторной
+    валидации. В параметры добавляется текущий UTC-день - окна "последние N дней" не переживают смену суток.
+    compute(db) вызывается только при промахе кэша, на своей сессии (_on_primary_read_session).
+    """
+    payload = await get_or_compute_json(endpoint, {**params, "utc_day": datetime.now(timezone.utc).date()}, _on_primary_read_session(compute))
+    return Response(content=payload, media_type="application/json")
+
+def _active_channel_filter(channel_id_column, active_channel_ids: Optional[List[int]] = None):
+    """Условие "канал активен": подзапросом по channels или готовым списком id (бандл дашборда выбирает их один раз на все виджеты)."""
+    if active_channel_ids is not None:
+        return channel_id_column.in_(active_channel_ids)
+    return channel_id_column.in_(select(models_module.Channel.id).where(models_module.Channel.is_active == True))
+
+def _active_channel_daily_stats_query(*columns, since_day: Optional[date] = None, active_channel_ids: Optional[List[int]] = None):
+    """
+    Агрегат по channel_daily_stats (дневные суммы по каналам в UTC, поддерживаются задачами сбора и сверкой) для активных каналов:
+    дашборд читает по строке на канал-день вместо сканирования posts/comments.
+    """
+    StatsModel = models_module.ChannelDailyStats
+    stmt = select(*columns).where(_active_channel_filter(StatsModel.channel_id, active_channel_ids))
+    if since_day is not None:
+        stmt = stmt.where(StatsModel.day >= since_day)
+    return stmt
+
+async def _build_dashboard_stats(db: AsyncSession, active_channel_ids: Optional[List[int]] = None) -> ui_schemas.DashboardStatsResponse:
+    StatsModel = models_module.ChannelDailyStats
+    # Последние 7 дней - 7 календарных UTC-дней, включая сегодняшний (гранулярность агрегатов - день)
+    seven_days_start = datetime.now(timezone.utc).date() - timedelta(days=6)
+    totals_stmt = _active_channel_daily_stats_query(
+        func.coalesce(func.sum(StatsModel.post_count), 0).label("total_posts"),
+        func.coalesce(func.sum(StatsModel.comment_count), 0).label("total_comments"),
+        func.coalesce(func.sum(StatsModel.post_count).filter(StatsModel.day >= seven_days_start), 0).label("posts_last_7"),
+        func.coalesce(func.sum(StatsModel.comment_count).filter(StatsModel.day >= seven_days_start), 0).label("comments_last_7"),
+        active_channel_ids=active_channel_ids,
+    )
+    async def fetch_totals(session: AsyncSession):
+        return (await session.execute(totals_stmt)).one()
+    async def fetch_channels_count(session: AsyncSession) -> int:
+        channels_count_stmt = select(func.count(models_module.Channel.id)).where(models_module.Channel.is_active == True)
+        return (await session.execute(channels_count_stmt)).scalar_one_or_none() or 0
+    if active_channel_ids is not None:
+        totals = await fetch_totals(db); channels_monitoring_count = len(active_channel_ids)
+    else:
+        totals, channels_monitoring_count = await run_concurrent_reads(db, fetch_totals, fetch_channels_count)
+    return ui_schemas.DashboardStatsResponse(total_posts_all_time=int(totals.total_posts), total_comments_all_time=int(totals.total_comments), posts_last_7_days=int(totals.posts_last_7), comments_last_7_days=int(totals.comments_last_7), channels_monitoring_count=channels_monitoring_count)
+
+async def _build_activity_over_time(db: AsyncSession, days: int, active_channel_ids: Optional[List[int]] = None) -> ui_schemas.ActivityOverTimeResponse:
+    StatsModel = models_module.ChannelDailyStats
+    start_date_val = (datetime.now(timezone.utc) - timedelta(days=days - 1)).date()
+    activity_stmt = _active_channel_daily_stats_query(StatsModel.day.label("activity_day"), func.sum(StatsModel.post_count).label("post_count"), func.sum(StatsModel.comment_count).label("comment_count"), since_day=start_date_val, active_channel_ids=active_channel_ids).group_by(StatsModel.day)
+    activity_by_day = {row.activity_day: row for row in (await db.execute(activity_stmt)).all()}
+    activity_data: List[ui_schemas.ActivityOverTimePoint] = []
+    current_date_iter = start_date_val; end_date_val = datetime.now(timezone.utc).date()
+    while current_date_iter <= end_date_val:
+        day_row = activity_by_day.get(current_date_iter)
+        activity_data.append(ui_schemas.ActivityOverTimePoint(activity_date=current_date_iter, post_count=int(day_row.post_count) if day_row else 0, comment_count=int(day_row.comment_count) if day_row else 0))
+        current_date_iter += timedelta(days=1)
+    return ui_schemas.ActivityOverTimeResponse(data=activity_data)
+
+async def _build_top_channels(db: AsyncSession, metric: str, limit: int, days_period: int, active_channel_ids: Optional[List[int]] = None) -> ui_schemas.TopChannelsResponse:
+    StatsModel = models_module.ChannelDailyStats
+    start_date_val = (datetime.now(timezone.utc) - timedelta(days=days_period)).date()
+    if metric == "posts": metric_column = StatsModel.post_count
+    elif metric == "comments": metric_column = StatsModel.comment_count
+    else: raise HTTPException(status_code=400, detail="Invalid metric type specified.")
+    metric_sum = func.sum(metric_column)
+    stmt = (
+        select(models_module.Channel.id.label("channel_id"), models_module.Channel.title.label("channel_title"), models_module.Channel.username.label("channel_username"), metric_sum.label("metric_value"))
+        .join(StatsModel, StatsModel.channel_id == models_module.Channel.id)
+        .where(_active_channel_filter(StatsModel.channel_id, active_channel_ids) if active_channel_ids is not None else models_module.Channel.is_active == True)
+        .where(StatsModel.day >= start_date_val)
+        .group_by(models_module.Channel.id, models_module.Channel.title, models_module.Channel.username)
+        .having(metric_sum > 0) # Как и раньше, каналы без активности за период в топ не попадают
+        .order_by(desc(literal_column("metric_value")))
+        .limit(limit)
+    )
+    top_channels_data = (await db.execute(stmt)).all()
+    data_list = [ui_schemas.TopChannelItem(channel_id=row.channel_id, channel_title=row.channel_title, channel_username=row.channel_username, metric_value=int(row.metric_value)) for row in top_channels_data]
+    return ui_schemas.TopChannelsResponse(metric_name=metric, data=data_list)
+
+async def _build_sentiment_distribution(db: AsyncSession, days_period: int, active_channel_ids: Optional[List[int]] = None) -> ui_schemas.SentimentDistributionResponse:
+    StatsModel = models_module.ChannelDailyStats
+    start_date_val = (datetime.now(timezone.utc) - timedelta(days=days_period)).date()
+    label_columns = {"positive": StatsModel.posts_positive, "negative": StatsModel.posts_negative, "neutral": StatsModel.posts_neutral, "mixed": StatsModel.posts_mixed}
+    sums_stmt = _active_channel_daily_stats_query(
+        func.coalesce(func.sum(StatsModel.post_count), 0).label("all_posts"),
+        func.coalesce(func.sum(StatsModel.posts_sentiment_analyzed), 0).label("analyzed_posts"),
+        *[func.coalesce(func.sum(label_column), 0).label(label) for label, label_column in label_columns.items()],
+        since_day=start_date_val, active_channel_ids=active_channel_ids,
+    )
+    sums = (await db.execute(sums_stmt)).mappings().one()
+    total_analyzed_posts = int(sums["analyzed_posts"]); all_posts_in_period = int(sums["all_posts"])
+    data_list: List[ui_schemas.SentimentDistributionItem] = []
+    for label in label_columns:
+        count = int(sums[label]); percentage = round((count / total_analyzed_posts) * 100, 2) if total_analyzed_posts > 0 else 0.0
+        data_list.append(ui_schemas.SentimentDistributionItem(sentiment_label=label, count=count, percentage=percentage))
+    undefined_count = all_posts_in_period - total_analyzed_posts
+    if undefined_count > 0:
+        undefined_percentage = round((undefined_count / all_posts_in_period) * 100, 2) if all_posts_in_period > 0 else 0.0
+        data_list.append(ui_schemas.SentimentDistributionItem(sentiment_label="undefined", count=undefined_count, percentage=undefined_percentage))
+    return ui_schemas.SentimentDistributionResponse(total_analyzed_posts=total_analyzed_posts, data=data_list)
+
 @api_v1_router.get("/dashboard/stats", response_model=ui_schemas.DashboardStatsResponse)
-async def get_dashboard_stats(db: AsyncSession = Depends(get_async_db)):
+async def get_dashboard_stats():
     endpoint_logger.info("GET /api/v1/dashboard/stats")
-    try:
-        active_channels_subquery = select(models_module.Channel.id).where(models_module.Channel.is_active == True).subquery()
-        total_posts_stmt = select(func.count(models_module.Post.id)).join(active_channels_subquery, models_module.Post.channel_id == active_channels_subquery.c.id)
-        total_posts_all_time = (await db.execute(total_posts_stmt)).scalar_one_or_none() or 0
-        total_comments_stmt = (select(func.count(models_module.Comment.id)).join(models_module.Post, models_module.Comment.post_id == models_module.Post.id).join(active_channels_subquery, models_module.Post.channel_id == active_channels_subquery.c.id))
-        total_comments_all_time = (await db.execute(total_comments_stmt)).scalar_one_or_none() or 0
-        seven_days_ago = datetime.now(timezone.utc) - timedelta(days=7)
-        posts_last_7_stmt = (select(func.count(models_module.Post.id)).join(active_channels_subquery, models_module.Post.channel_id == active_channels_subquery.c.id).where(models_module.Post.posted_at >= seven_days_ago))
-        posts_last_7_days = (await db.execute(posts_last_7_stmt)).scalar_one_or_none() or 0
-        comments_last_7_stmt = (select(func.count(models_module.Comment.id)).join(models_module.Post, models_module.Comment.post_id == models_module.Post.id).join(active_channels_subquery, models_module.Post.channel_id == active_channels_subquery.c.id).where(models_module.Comment.commented_at >= seven_days_ago))
-        comments_last_7_days = (await db.execute(comments_last_7_stmt)).scalar_one_or_none() or 0
-        channels_count_stmt = select(func.count(models_module.Channel.id)).where(models_module.Channel.is_active == True)
-        channels_monitoring_count = (await db.execute(channels_count_stmt)).scalar_one_or_none() or 0
-        return ui_schemas.DashboardStatsResponse(total_posts_all_time=total_posts_all_time, total_comments_all_time=total_comments_all_time, posts_last_7_days=posts_last_7_days, comments_last_7_days=comments_last_7_days, channels_monitoring_count=channels_monitoring_count)
-    except Exception as e: endpoint_logger.error(f"Error in get_dashboard_stats: {e}", exc_info=True); raise HTTPException(status_code=500, detail="Internal server error while fetching dashboard stats")
+    async def _compute(db: AsyncSession) -> ui_schemas.DashboardStatsResponse:
+        try: return await _build_dashboard_stats(db)
+        except Exception as e: endpoint_logger.error(f"Error in get_dashboard_stats: {e}", exc_info=True); raise HTTPException(status_code=500, detail="Internal server error while fetching dashboard stats")
+    return await _cached_analytics_response("dashboard_stats", {}, _compute)
 
 @api_v1_router.get("/dashboard/activity_over_time", response_model=ui_schemas.ActivityOverTimeResponse)
-async def get_activity_over_time(days: int = Query(7, ge=1, le=90), db: AsyncSession = Depends(get_async_db)):
+async def get_activity_over_time(days: int = Query(7, ge=1, le=90)):
     endpoint_logger.info(f"GET /api/v1/dashboard/activity_over_time?days={days}")
-    try:
-        start_date_dt = datetime.now(timezone.utc) - timedelta(days=days -1); start_date_val = start_date_dt.date() # Renamed
-        active_channels_subquery = select(models_module.Channel.id).where(models_module.Channel.is_active == True).subquery()
-        posts_activity_stmt = (select(cast(models_module.Post.posted_at, SQLDate).label("activity_day"), func.count(models_module.Post.id).label("count")).join(active_channels_subquery, models_module.Post.channel_id == active_channels_subquery.c.id).where(cast(models_module.Post.posted_at, SQLDate) >= start_date_val).group_by(cast(models_module.Post.posted_at, SQLDate)).order_by(cast(models_module.Post.posted_at, SQLDate).asc()))
-        posts_by_day_result = await db.execute(posts_activity_stmt)
-        posts_by_day = {row.activity_day: row.count for row in posts_by_day_result.all()}
-        comments_activity_stmt = (select(cast(models_module.Comment.commented_at, SQLDate).label("activity_day"), func.count(models_module.Comment.id).label("count")).join(models_module.Post, models_module.Comment.post_id == models_module.Post.id).join(active_channels_subquery, models_module.Post.channel_id == active_channels_subquery.c.id).where(cast(models_module.Comment.commented_at, SQLDate) >= start_date_val).group_by(cast(models_module.Comment.commented_at, SQLDate)).order_by(cast(models_module.Comment.commented_at, SQLDate).asc()))
-        comments_by_day_result = await db.execute(comments_activity_stmt)
-        comments_by_day = {row.activity_day: row.count for row in comments_by_day_result.all()}
-        activity_data: List[ui_schemas.ActivityOverTimePoint] = []
-        current_date_iter = start_date_val; end_date_val = datetime.now(timezone.utc).date() # Renamed
-        while current_date_iter <= end_date_val:
-            activity_data.append(ui_schemas.ActivityOverTimePoint(activity_date=current_date_iter, post_count=posts_by_day.get(current_date_iter, 0), comment_count=comments_by_day.get(current_date_iter, 0)))
-            current_date_iter += timedelta(days=1)
-        return ui_schemas.ActivityOverTimeResponse(data=activity_data)
-    except Exception as e: endpoint_logger.error(f"Error in get_activity_over_time: {e}", exc_info=True); raise HTTPException(status_code=500, detail="Internal server error while fetching activity over time")
+    async def _compute(db: AsyncSession) -> ui_schemas.ActivityOverTimeResponse:
+        try: return await _build_activity_over_time(db, days)
+        except Exception as e: endpoint_logger.error(f"Error in get_activity_over_time: {e}", exc_info=True); raise HTTPException(status_code=500, detail="Internal server error while fetching activity over time")
+    return await _cached_analytics_response("activity_over_time", {"days": days}, _compute)
 
 @api_v1_router.get("/dashboard/top_channels", response_model=ui_schemas.TopChannelsResponse)
-async def get_top_channels(metric: str = Query("posts", pattern="^(posts|comments)$"), limit: int = Query(5, ge=1, le=20), days_period: int = Query(7, ge=1, le=365), db: AsyncSession = Depends(get_async_db)):
+async def get_top_channels(metric: str = Query("posts", pattern="^(posts|comments)$"), limit: int = Query(5, ge=1, le=20), days_period: int = Query(7, ge=1, le=365)):
     endpoint_logger.info(f"GET /api/v1/dashboard/top_channels?metric={metric}&limit={limit}&days_period={days_period}")
-    try:
-        start_date_val = datetime.now(timezone.utc) - timedelta(days=days_period) # Renamed
-        base_query_channels = select(models_module.Channel.id.label("channel_id"), models_module.Channel.title.label("channel_title"), models_module.Channel.username.label("channel_username")).where(models_module.Channel.is_active == True)
-        if metric == "posts":
-            stmt = (base_query_channels.add_columns(func.count(models_module.Post.id).label("metric_value")).join(models_module.Post, models_module.Channel.id == models_module.Post.channel_id).where(models_module.Post.posted_at >= start_date_val).group_by(models_module.Channel.id, models_module.Channel.title, models_module.Channel.username).order_by(desc(literal_column("metric_value"))).limit(limit))
-        elif metric == "comments":
-            stmt = (base_query_channels.add_columns(func.count(models_module.Comment.id).label("metric_value")).join(models_module.Post, models_module.Channel.id == models_module.Post.channel_id).join(models_module.Comment, models_module.Post.id == models_module.Comment.post_id).where(models_module.Comment.commented_at >= start_date_val).group_by(models_module.Channel.id, models_module.Channel.title, models_module.Channel.username).order_by(desc(literal_column("metric_value"))).limit(limit))
-        else: raise HTTPException(status_code=400, detail="Invalid metric type specified.")
-        top_channels_data_result = await db.execute(stmt)
-        top_channels_data = top_channels_data_result.all()
-        data_list = [ui_schemas.TopChannelItem(channel_id=row.channel_id, channel_title=row.channel_title, channel_username=row.channel_username, metric_value=row.metric_value) for row in top_channels_data]
-        return ui_schemas.TopChannelsResponse(metric_name=metric, data=data_list)
-    except Exception as e: endpoint_logger.error(f"Error in get_top_channels: {e}", exc_info=True); raise HTTPException(status_code=500, detail="Internal server error while fetching top channels")
+    async def _compute(db: AsyncSession) -> ui_schemas.TopChannelsResponse:
+        try: return await _build_top_channels(db, metric, limit, days_period)
+        except HTTPException: raise
+        except Exception as e: endpoint_logger.error(f"Error in get_top_channels: {e}", exc_info=True); raise HTTPException(status_code=500, detail="Internal server error while fetching top channels")
+    return await _cached_analytics_response("top_channels", {"metric": metric, "limit": limit, "days_period": days_period}, _compute)
 
 @api_v1_router.get("/dashboard/sentiment_distribution", response_model=ui_schemas.SentimentDistributionResponse)
-async def get_sentiment_distribution(days_period: int = Query(7, ge=1, le=365), db: AsyncSession = Depends(get_async_db)):
+async def get_sentiment_distribution(days_period: int = Query(7, ge=1, le=365)):
     endpoint_logger.info(f"GET /api/v1/dashboard/sentiment_distribution?days_period={days_period}")
+    async def _compute(db: AsyncSession) -> ui_schemas.SentimentDistributionResponse:
+        try: return await _build_sentiment_distribution(db, days_period)
+        except Exception as e: endpoint_logger.error(f"Error in get_sentiment_distribution: {e}", exc_info=True); raise HTTPException(status_code=500, detail="Internal server error while fetching sentiment distribution")
+    return await _cached_analytics_response("sentiment_distribution", {"days_period": days_period}, _compute)
+
+async def _fetch_top_comment_insights(
+    db: AsyncSession,
+    insight_type: str,
+    start_at: datetime,
+    limit: int,
+    end_at: Optional[datetime] = None,
+    channel_ids_subquery: Optional[Any] = None,
+    active_channel_ids: Optional[List[int]] = None,
+) -> List[Tuple[str, int]]:
+    """
+    Топ-N инсайтов типа insight_type за период из comment_insights: агрегат по индексу ix_comment_insights_type_commented_at.
+    Считается число комментариев с инсайтом. При INSIGHT_CANONICAL_GROUPING_ENABLED группировка по canonical_id - объединяются
+    формулировки одного канонического инсайта (словоформы, пунктуация, синонимы), текст - из insight_canonicals; еще не
+    канонизированные строки группируются по нормализованному тексту. Иначе - только по нормализованному тексту (регистр и пробелы).
+    По умолчанию - только активные каналы.
+    """
+    CurrentInsightModel = models_module.CommentInsight
+    if channel_ids_subquery is not None:
+        channel_condition = CurrentInsightModel.channel_id.in_(select(channel_ids_subquery.c.id))
+    else:
+        channel_condition = _active_channel_filter(CurrentInsightModel.channel_id, active_channel_ids)
+    if settings.INSIGHT_CANONICAL_GROUPING_ENABLED:
+        group_columns = (CurrentInsightModel.canonical_id, sa.case((CurrentInsightModel.canonical_id.is_(None), CurrentInsightModel.normalized_text)))
+    else:
+        group_columns = (CurrentInsightModel.normalized_text,)
+    stmt = (
+        select(
+            func.min(CurrentInsightModel.canonical_id).label("canonical_id"), func.min(CurrentInsightModel.display_text).label("item_text"),
+            func.min(CurrentInsightModel.normalized_text).label("sort_text"), func.count().label("item_count"),
+        )
+        .where(CurrentInsightModel.insight_type == insight_type)
+        .where(CurrentInsightModel.commented_at >= start_at)
+        .where(channel_condition)
+        .group_by(*group_columns)
+        .order_by(desc(literal_column("item_count")), literal_column("sort_text").asc())
+        .limit(limit)
+    )
+    if end_at is not None:
+        stmt = stmt.where(CurrentInsightModel.commented_at <= end_at)
+    rows = (await db.execute(stmt)).all()
+    display_texts = await _canonical_display_texts(db, [row.canonical_id for row in rows])
+    return [(display_texts.get(row.canonical_id, str(row.item_text)), row.item_count) for row in rows]
+
+async def _canonical_display_texts(db: AsyncSession, canonical_ids: List[Optional[int]]) -> Dict[int, str]:
+    """Тексты для показа канонических инсайтов (на топ-N - один короткий запрос по первичному ключу)."""
+    canonical_ids = [canonical_id for canonical_id in canonical_ids if canonical_id is not None]
+    if not canonical_ids:
+        return {}
+    CanonicalModel = models_module.InsightCanonical
+    rows = (await db.execute(select(CanonicalModel.id, CanonicalModel.display_text).where(CanonicalModel.id.in_(canonical_ids)))).all()
+    return {row.id: row.display_text for row in rows}
+
+async def _active_channel_ids(db: AsyncSession) -> List[int]:
+    return list((await db.execute(select(models_module.Channel.id).where(models_module.Channel.is_active == True))).scalars().all())
+
+async def _lake_top_comment_insights(
+    db: AsyncSession, insight_types: List[str], start_at: datetime, limit: int, end_at: Optional[datetime] = None, channel_ids: Optional[List[int]] = None
+) -> Optional[List[List[Tuple[str, int]]]]:
+    """
+    Топы инсайтов нескольких типов по колоночным снимкам через DuckDB (app/services/analytics_lake.py) - для длинных периодов
+    при свежих снимках; та же семантика, что у _fetch_top_comment_insights. None - считать в Postgres.
+    """
+    if not analytics_lake_usable_for(start_at.astimezone(timezone.utc).date(), end_at.astimezone(timezone.utc).date() if end_at else None):
+        return None
     try:
-        start_date_val = datetime.now(timezone.utc) - timedelta(days=days_period) # Renamed
-        active_channels_subquery = select(models_module.Channel.id).where(models_module.Channel.is_active == True).subquery()
-        total_analyzed_stmt = (select(func.count(models_module.Post.id)).join(active_channels_subquery, models_module.Post.channel_id == active_channels_subquery.c.id).where(models_module.Post.posted_at >= start_date_val).where(models_module.Post.post_sentiment_label.isnot(None)))
-        total_analyzed_posts = (await db.execute(total_analyzed_stmt)).scalar_one_or_none() or 0
-        stmt = (select(models_module.Post.post_sentiment_label.label("sentiment_label"), func.count(models_module.Post.id).label("count")).join(active_channels_subquery, models_module.Post.channel_id == active_channels_subquery.c.id).where(models_module.Post.posted_at >= start_date_val).group_by(models_module.Post.post_sentiment_label).order_by(nullslast(models_module.Post.post_sentiment_label.asc())))
-        sentiment_counts_result = await db.execute(stmt)
-        sentiment_counts = sentiment_counts_result.all()
-        data_list: List[ui_schemas.SentimentDistributionItem] = []
-        defined_labels = ["positive", "negative", "neutral", "mixed"]; counts_map = {row.sentiment_label: row.count for row in sentiment_counts if row.sentiment_label is not None}; undefined_count = next((row.count for row in sentiment_counts if row.sentiment_label is None), 0)
-        for label in defined_labels:
-            count = counts_map.get(label, 0); percentage = round((count / total_analyzed_posts) * 100, 2) if total_analyzed_posts > 0 else 0.0
-            data_list.append(ui_schemas.SentimentDistributionItem(sentiment_label=label, count=count, percentage=percentage))
-        if undefined_count > 0:
-            all_posts_in_period_stmt = select(func.count(models_module.Post.id)).join(active_channels_subquery, models_module.Post.channel_id == active_channels_subquery.c.id).where(models_module.Post.posted_at >= start_date_val)
-            all_posts_in_period = (await db.execute(all_posts_in_period_stmt)).scalar_one_or_none() or 0
-            undefined_percentage = round((undefined_count / all_posts_in_period) * 100, 2) if all_posts_in_period > 0 else 0.0
-            data_list.append(ui_schemas.SentimentDistributionItem(sentiment_label="undefined", count=undefined_count, percentage=undefined_percentage))
-        return ui_schemas.SentimentDistributionResponse(total_analyzed_posts=total_analyzed_posts, data=data_list)
-    except Exception as e: endpoint_logger.error(f"Error in get_sentiment_distribution: {e}", exc_info=True); raise HTTPException(status_code=500, detail="Internal server error while fetching sentiment distribution")
+        if channel_ids is None: channel_ids = await _active_channel_ids(db)
+        results = await asyncio.gather(*[query_top_insights(insight_type, start_at, limit, channel_ids, end_at=end_at) for insight_type in insight_types])
+        display_texts = await _canonical_display_texts(db, [canonical_id for items in results for canonical_id, _, _ in items])
+        return [[(display_texts.get(canonical_id, item_text), item_count) for canonical_id, item_text, item_count in items] for items in results]
+    except Exception as e:
+        endpoint_logger.warning(f"Аналитическое хранилище: запрос топа инсайтов не выполнен, считаем в Postgres ({type(e).__name__}: {e})")
+        return None
+
+async def _build_comment_insights(db: AsyncSession, days_period: int, top_n: int, active_channel_ids: Optional[List[int]] = None) -> ui_schemas.CommentInsightsResponse:
+    start_date_val = datetime.now(timezone.utc) - timedelta(days=days_period)
+    insight_types = (ui_schemas.InsightItemType.TOPIC, ui_schemas.InsightItemType.PROBLEM, ui_schemas.InsightItemType.QUESTION, ui_schemas.InsightItemType.SUGGESTION)
+    lake_results = await _lake_top_comment_insights(db, [insight_type.value for insight_type in insight_types], start_date_val, top_n, channel_ids=active_channel_ids)
+    if lake_results is not None:
+        top_topics, top_problems, top_questions, top_suggestions = [[ui_schemas.InsightItem(text=item_text, count=item_count) for item_text, item_count in items] for items in lake_results]
+        return ui_schemas.CommentInsightsResponse(period_days=days_period, top_topics=top_topics, top_problems=top_problems, top_questions=top_questions, top_suggestions=top_suggestions)
+    def top_insight_items_reader(insight_type: ui_schemas.InsightItemType):
+        async def read(session: AsyncSession) -> List[ui_schemas.InsightItem]:
+            top_items = await _fetch_top_comment_insights(session, insight_type.value, start_date_val, top_n, active_channel_ids=active_channel_ids)
+            return [ui_schemas.InsightItem(text=item_text, count=item_count) for item_text, item_count in top_items]
+        return read
+    top_topics, top_problems, top_questions, top_suggestions = await run_concurrent_reads(db, *[top_insight_items_reader(insight_type) for insight_type in insight_types])
+    return ui_schemas.CommentInsightsResponse(period_days=days_period, top_topics=top_topics, top_problems=top_problems, top_questions=top_questions, top_suggestions=top_suggestions)
 
 @api_v1_router.get("/dashboard/comment_insights", response_model=ui_schemas.CommentInsightsResponse)
 async def get_comment_insights(
     days_period: int = Query(7, ge=1, le=365, description="Период в днях для анализа"),
-    top_n: int = Query(10, ge=1, le=50, description="Количество топовых элементов для каждой категории"),
-    db: AsyncSession = Depends(get_async_db)
+    top_n: int = Query(10, ge=1, le=50, description="Количество топовых элементов для каждой категории")
 ):
     endpoint_logger.info(f"GET /api/v1/dashboard/comment_insights?days_period={days_period}&top_n={top_n}")
-    start_date_val = datetime.now(timezone.utc) - timedelta(days=days_period) # Renamed
-    active_channels_subquery = select(models_module.Channel.id).where(models_module.Channel.is_active == True).subquery("active_channels_for_insights")
-    async def fetch_top_jsonb_array_elements(jsonb_field_name: str) -> List[ui_schemas.InsightItem]:
-        comment_jsonb_field = getattr(models_module.Comment, jsonb_field_name)
-        item_text_expression = func.jsonb_array_elements_text(comment_jsonb_field).label("item_text")
-        stmt = (
-            select(item_text_expression, func.count().label("item_count"))
-            .select_from(models_module.Comment)
-            .join(models_module.Post, models_module.Comment.post_id == models_module.Post.id)
-            .join(active_channels_subquery, models_module.Post.channel_id == active_channels_subquery.c.id)
-            .where(models_module.Comment.commented_at >= start_date_val)
-            .where(comment_jsonb_field.isnot(None))
-            .where(func.jsonb_typeof(comment_jsonb_field) == 'array')
-            .group_by(item_text_expression)
-            .order_by(desc(literal_column("item_count")), literal_column("item_text").asc())
-            .limit(top_n)
-        )
-        results = await db.execute(stmt)
-        return [ui_schemas.InsightItem(text=str(row.item_text), count=row.item_count) for row in results.all()]
+    async def _compute(db: AsyncSession) -> ui_schemas.CommentInsightsResponse:
+        try:
+            return await _build_comment_insights(db, days_period, top_n)
+        except Exception as e:
+            endpoint_logger.error(f"Error in get_comment_insights: {e}", exc_info=True)
+            raise HTTPException(status_code=500, detail="Internal server error while fetching comment insights")
+    return await _cached_analytics_response("comment_insights", {"days_period": days_period, "top_n": top_n}, _compute)
+
+@api_v1_router.get("/dashboard/bundle", response_model=ui_schemas.DashboardBundleResponse)
+async def get_dashboard_bundle(
+    request: Request,
+    activity_days: int = Query(7, ge=1, le=90),
+    top_channels_metric: str = Query("posts", pattern="^(posts|comments)$"),
+    top_channels_limit: int = Query(5, ge=1, le=20),
+    top_channels_days: int = Query(7, ge=1, le=365),
+    sentiment_days: int = Query(7, ge=1, le=365),
+    insights_days: int = Query(30, ge=1, le=365),
+    insights_top_n: int = Query(5, ge=1, le=50)
+):
+    """
+    Все виджеты дашборда одним запросом: список активных каналов выбирается один раз, виджеты считаются параллельно
+    на отдельных соединениях из пула. Ответ кэшируется (как отдельные эндпоинты), отдается с ETag (304 при совпадении
+    If-None-Match) и сжимается gzip, если клиент это поддерживает.
+    """
+    endpoint_logger.info(f"GET /api/v1/dashboard/bundle?activity_days={activity_days}&top_channels_metric={top_channels_metric}&top_channels_limit={top_channels_limit}&top_channels_days={top_channels_days}&sentiment_days={sentiment_days}&insights_days={insights_days}&insights_top_n={insights_top_n}")
+    async def _compute(db: AsyncSession) -> ui_schemas.DashboardBundleResponse:
+        try:
+            active_channel_ids = await _active_channel_ids(db)
+            stats, activity, top_channels, sentiment, comment_insights = await run_concurrent_reads(
+                db,
+                lambda session: _build_dashboard_stats(session, active_channel_ids=active_channel_ids),
+                lambda session: _build_activity_over_time(session, activity_days, active_channel_ids=active_channel_ids),
+                lambda session: _build_top_channels(session, top_channels_metric, top_channels_limit, top_channels_days, active_channel_ids=active_channel_ids),
+                lambda session: _build_sentiment_distribution(session, sentiment_days, active_channel_ids=active_channel_ids),
+                lambda session: _build_comment_insights(session, insights_days, insights_top_n, active_channel_ids=active_channel_ids),
+            )
+            return ui_schemas.DashboardBundleResponse(stats=stats, activity=activity, top_channels=top_channels, sentiment=sentiment, comment_insights=comment_insights)
+        except HTTPException: raise
+        except Exception as e:
+            endpoint_logger.error(f"Error in get_dashboard_bundle: {e}", exc_info=True)
+            raise HTTPException(status_code=500, detail="Internal server error while fetching dashboard bundle")
+    bundle_params = {"activity_days": activity_days, "top_channels_metric": top_channels_metric, "top_channels_limit": top_channels_limit, "top_channels_days": top_channels_days, "sentiment_days": sentiment_days, "insights_days": insights_days, "insights_top_n": insights_top_n, "utc_day": datetime.now(timezone.utc).date()}
+    payload = await get_or_compute_json("dashboard_bundle", bundle_params, _on_primary_read_session(_compute))
+    etag = f'W/"{hashlib.sha1(payload.encode("utf-8")).hexdigest()}"' # Слабый: тот же ETag и для сжатого, и для несжатого представления
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Accept-Encoding"}
+    if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    body = payload.encode("utf-8")
+    if "gzip" in request.headers.get("accept-encoding", "").lower() and len(body) >= settings.DASHBOARD_BUNDLE_GZIP_MIN_BYTES:
+        body = gzip.compress(body, compresslevel=5)
+        headers["Content-Encoding"] = "gzip"
+    return Response(content=body, media_type="application/json", headers=headers)
+
+# Триграммный индекс ускоряет поиск подстроки, только если в ней есть хотя бы одна триграмма
+_TRIGRAM_MIN_QUERY_LENGTH = 3
+
+async def _insight_contains_condition(db: AsyncSession, insight_type: str, normalized_item_text: str):
+    """
+    Условие "формулировка содержит подстроку" для comment_insights: подходящие формулировки сначала ищутся в словаре
+    insight_aliases (GIN ix_insight_aliases_normalized_text_trgm), затем строки берутся по ix_comment_insights_type_normalized_text;
+    еще не канонизированные строки (их нет в словаре) - подстрокой по частичному индексу ix_comment_insights_not_canonicalized.
+    Слишком короткий запрос или слишком много совпадений - прежний поиск подстроки по всем строкам периода.
+    """
+    CurrentInsightModel = models_module.CommentInsight; AliasModel = models_module.InsightAlias
+    pattern = f"%{escape_like_pattern(normalized_item_text)}%"
+    like_condition = CurrentInsightModel.normalized_text.like(pattern, escape="\\")
+    if len(normalized_item_text) < _TRIGRAM_MIN_QUERY_LENGTH:
+        return like_condition
+    matched_texts = (await db.execute(
+        select(AliasModel.normalized_text)
+        .where(AliasModel.insight_type == insight_type, AliasModel.normalized_text.like(pattern, escape="\\"))
+        .limit(settings.INSIGHT_TREND_MAX_MATCHED_TEXTS + 1)
+    )).scalars().all()
+    if len(matched_texts) > settings.INSIGHT_TREND_MAX_MATCHED_TEXTS:
+        return like_condition
+    not_canonicalized = sa.and_(CurrentInsightModel.canonical_id.is_(None), like_condition)
+    if not matched_texts:
+        return not_canonicalized
+    return or_(CurrentInsightModel.normalized_text.in_(matched_texts), not_canonicalized)
+
+@api_v1_router.get("/insights/autocomplete", response_model=ui_schemas.InsightAutocompleteResponse, summary="Подсказки формулировок инсайтов для поиска тренда")
+async def autocomplete_insights(
+    q: str = Query(..., min_length=1, max_length=200, description="Начало или часть формулировки"),
+    insight_type: Optional[ui_schemas.InsightItemType] = Query(None, description="Только инсайты этого типа"),
+    limit: int = Query(10, ge=1, le=50),
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    """
+    Формулировки из словаря insight_aliases, содержащие q (триграммный GIN-индекс): сначала начинающиеся с q, затем по похожести
+    (similarity из pg_trgm); по одной на канонический инсайт, текст - канонический.
+    """
+    endpoint_logger.info(f"GET /api/v1/insights/autocomplete - q='{q}', insight_type={insight_type.value if insight_type else None}, limit={limit}")
+    normalized_query = normalize_insight_text(q)
+    if not normalized_query:
+        return ui_schemas.InsightAutocompleteResponse(query=q, items=[])
     try:
-        top_topics_data = await fetch_top_jsonb_array_elements("extracted_topics")
-        top_problems_data = await fetch_top_jsonb_array_elements("extracted_problems")
-        top_questions_data = await fetch_top_jsonb_array_elements("extracted_questions")
-        top_suggestions_data = await fetch_top_jsonb_array_elements("extracted_suggestions")
-        return ui_schemas.CommentInsightsResponse(
-            period_days=days_period,
-            top_topics=top_topics_data,
-            top_problems=top_problems_data,
-            top_questions=top_questions_data,
-            top_suggestions=top_suggestions_data
+        AliasModel = models_module.InsightAlias; CanonicalModel = models_module.InsightCanonical
+        escaped_query = escape_like_pattern(normalized_query)
+        prefix_match = AliasModel.normalized_text.like(f"{escaped_query}%", escape="\\")
+        stmt = (
+            select(AliasModel.insight_type, AliasModel.normalized_text, AliasModel.canonical_id, CanonicalModel.display_text)
+            .join(CanonicalModel, AliasModel.canonical_id == CanonicalModel.id)
+            .order_by(desc(prefix_match), desc(func.similarity(AliasModel.normalized_text, normalized_query)), func.length(AliasModel.normalized_text), AliasModel.normalized_text)
+            .limit(limit * 3) # Запас: несколько формулировок одного канонического инсайта схлопываются в одну подсказку
         )
+        if len(normalized_query) < _TRIGRAM_MIN_QUERY_LENGTH: stmt = stmt.where(prefix_match) # Без триграмм - только префикс
+        else: stmt = stmt.where(AliasModel.normalized_text.like(f"%{escaped_query}%", escape="\\"))
+        if insight_type is not None: stmt = stmt.where(AliasModel.insight_type == insight_type.value)
+        items: List[ui_schemas.InsightAutocompleteItem] = []
+        seen_canonical_ids = set()
+        for row in (await db.execute(stmt)).all():
+            if row.canonical_id in seen_canonical_ids: continue
+            seen_canonical_ids.add(row.canonical_id)
+            items.append(ui_schemas.InsightAutocompleteItem(insight_type=row.insight_type, text=row.display_text, matched_text=row.normalized_text, canonical_id=row.canonical_id))
+            if len(items) >= limit: break
+        return ui_schemas.InsightAutocompleteResponse(query=q, items=items)
     except Exception as e:
-        endpoint_logger.error(f"Error in get_comment_insights: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail="Internal server error while fetching comment insights")
+        endpoint_logger.error(f"Error in autocomplete_insights (q='{q}'): {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal server error while autocompleting insights")
 
 @api_v1_router.get("/dashboard/insight_item_trend", response_model=ui_schemas.InsightItemTrendResponse)
 async def get_insight_item_trend(
@@ -341,71 +613,82 @@ async def get_insight_item_trend(
     item_text: str = Query(..., min_length=1, max_length=200, description="Текст искомого инсайта"),
     days_period: int = Query(30, ge=1, le=365, description="Период в днях для анализа"),
     granularity: ui_schemas.TrendGranularity = Query(ui_schemas.TrendGranularity.DAY, description="Гранулярность: day или week"),
-    db: AsyncSession = Depends(get_async_db)
+    match_mode: str = Query("contains", pattern="^(contains|exact)$", description="contains - подстрока, exact - точное совпадение (без учета регистра и лишних пробелов)")
 ):
-    endpoint_logger.info(f"GET /dashboard/insight_item_trend - item_type={item_type.value}, item_text='{item_text}', days_period={days_period}, granularity={granularity.value}")
-    today = datetime.now(timezone.utc).date()
-    query_start_date = today - timedelta(days=days_period -1)
-    jsonb_field_map = {
-        ui_schemas.InsightItemType.TOPIC: models_module.Comment.extracted_topics,
-        ui_schemas.InsightItemType.PROBLEM: models_module.Comment.extracted_problems,
-        ui_schemas.InsightItemType.QUESTION: models_module.Comment.extracted_questions,
-        ui_schemas.InsightItemType.SUGGESTION: models_module.Comment.extracted_suggestions,
-    }
-    comment_jsonb_field = jsonb_field_map.get(item_type)
-    if comment_jsonb_field is None: raise HTTPException(status_code=400, detail="Invalid item_type specified.")
-    active_channels_subquery = select(models_module.Channel.id).where(models_module.Channel.is_active == True).subquery("active_channels_for_trend")
-    date_group_expression_col: SAColumn; date_format_str: str
-    if granularity == ui_schemas.TrendGranularity.DAY:
-        date_group_expression_col = cast(models_module.Comment.commented_at, SQLDate).label("trend_date_label")
-        date_format_str = "%Y-%m-%d"
-    elif granularity == ui_schemas.TrendGranularity.WEEK:
-        date_group_expression_col = func.to_char(models_module.Comment.commented_at, 'YYYY-WW').label("trend_date_label") # Используем 'YYYY-WW' для недели
-        date_format_str = "YYYY-WW" # Соответствующий формат для ключа
-    else: raise HTTPException(status_code=400, detail="Invalid granularity specified.")
-
-    extracted_element_alias = func.jsonb_array_elements_text(comment_jsonb_field).alias("extracted_insight_element")
-    stmt = (
-        select(date_group_expression_col, func.count(models_module.Comment.id).label("item_count"))
-        .select_from(models_module.Comment)
-        .join(models_module.Post, models_module.Comment.post_id == models_module.Post.id)
-        .join(active_channels_subquery, models_module.Post.channel_id == active_channels_subquery.c.id)
-        .join(extracted_element_alias, sa.true())
-        .where(cast(models_module.Comment.commented_at, SQLDate) >= query_start_date)
-        .where(comment_jsonb_field.isnot(None)).where(func.jsonb_typeof(comment_jsonb_field) == 'array')
-        .where(column("extracted_insight_element").ilike(f"%{item_text}%"))
-        .group_by(date_group_expression_col).order_by(date_group_expression_col.asc())
-    )
-    results = await db.execute(stmt)
-    existing_data_map: Dict[str, int] = {str(row.trend_date_label): row.item_count for row in results.all()}
-    trend_data_points: List[ui_schemas.InsightTrendDataPoint] = []
-
-    if granularity == ui_schemas.TrendGranularity.DAY:
-        current_iter_date = query_start_date
-        while current_iter_date <= today:
-            date_key = current_iter_date.strftime(date_format_str)
-            trend_data_points.append(ui_schemas.InsightTrendDataPoint(date=date_key, count=existing_data_map.get(date_key, 0)))
-            current_iter_date += timedelta(days=1)
-    elif granularity == ui_schemas.TrendGranularity.WEEK:
-        all_week_keys_in_period = set()
-        temp_date = query_start_date
-        while temp_date <= today: # Итерируемся по дням, чтобы получить все недели в периоде
-            all_week_keys_in_period.add(temp_date.strftime(date_format_str)) # PostgreSQL to_char 'YYYY-WW'
-            temp_date += timedelta(days=1)
-        for week_key in sorted(list(all_week_keys_in_period)): # Сортируем недели
-            trend_data_points.append(ui_schemas.InsightTrendDataPoint(date=week_key, count=existing_data_map.get(week_key,0)))
-
-    return ui_schemas.InsightItemTrendResponse(item_type=item_type, item_text=item_text, period_days=days_period, granularity=granularity, trend_data=trend_data_points)
+    endpoint_logger.info(f"GET /dashboard/insight_item_trend - item_type={item_type.value}, item_text='{item_text}', days_period={days_period}, granularity={granularity.value}, match_mode={match_mode}")
+    async def _compute(db: AsyncSession) -> ui_schemas.InsightItemTrendResponse:
+        today = datetime.now(timezone.utc).date()
+        query_start_date = today - timedelta(days=days_period -1)
+        query_start_datetime = datetime(query_start_date.year, query_start_date.month, query_start_date.day, tzinfo=timezone.utc)
+        CurrentInsightModel = models_module.CommentInsight
+        date_group_expression_col: SAColumn; date_format_str: str
+        if granularity == ui_schemas.TrendGranularity.DAY:
+            date_group_expression_col = cast(CurrentInsightModel.commented_at, SQLDate).label("trend_date_label")
+            date_format_str = "%Y-%m-%d"
+        elif granularity == ui_schemas.TrendGranularity.WEEK:
+            date_group_expression_col = func.to_char(CurrentInsightModel.commented_at, 'YYYY-WW').label("trend_date_label") # Используем 'YYYY-WW' для недели
+            date_format_str = "YYYY-WW" # Соответствующий формат для ключа
+        else: raise HTTPException(status_code=400, detail="Invalid granularity specified.")
+
+        normalized_item_text = normalize_insight_text(item_text)
+        canonical_id: Optional[int] = None
+        if match_mode == "exact" and settings.INSIGHT_CANONICAL_GROUPING_ENABLED: # Точный инсайт - со всеми формулировками его канонического
+            canonical_id = (await db.execute(
+                select(models_module.InsightAlias.canonical_id)
+                .where(models_module.InsightAlias.insight_type == item_type.value, models_module.InsightAlias.normalized_text == normalized_item_text)
+            )).scalar_one_or_none()
+        existing_data_map: Optional[Dict[str, int]] = None
+        if analytics_lake_usable_for(query_start_date): # Длинный период - по колоночным снимкам через DuckDB
+            try:
+                existing_data_map = await query_insight_trend(item_type.value, normalized_item_text, match_mode == "exact", query_start_datetime, granularity.value, await _active_channel_ids(db), canonical_id=canonical_id)
+            except Exception as e:
+                endpoint_logger.warning(f"Аналитическое хранилище: запрос тренда не выполнен, считаем в Postgres ({type(e).__name__}: {e})")
+        if existing_data_map is None: # Условие строится только здесь: для contains это запрос к insight_aliases
+            if canonical_id is not None: # ix_comment_insights_canonical_commented_at + еще не канонизированные строки с тем же текстом
+                text_condition = or_(CurrentInsightModel.canonical_id == canonical_id, sa.and_(CurrentInsightModel.canonical_id.is_(None), CurrentInsightModel.normalized_text == normalized_item_text))
+            elif match_mode == "exact": text_condition = CurrentInsightModel.normalized_text == normalized_item_text # ix_comment_insights_type_normalized_text
+            else: text_condition = await _insight_contains_condition(db, item_type.value, normalized_item_text)
+            stmt = (
+                select(date_group_expression_col, func.count(CurrentInsightModel.id).label("item_count"))
+                .where(CurrentInsightModel.insight_type == item_type.value)
+                .where(CurrentInsightModel.commented_at >= query_start_datetime) # Без cast к date - иначе индекс по commented_at не используется
+                .where(CurrentInsightModel.channel_id.in_(select(models_module.Channel.id).where(models_module.Channel.is_active == True)))
+                .where(text_condition)
+                .group_by(date_group_expression_col).order_by(date_group_expression_col.asc())
+            )
+            results = await db.execute(stmt)
+            existing_data_map = {str(row.trend_date_label): row.item_count for row in results.all()}
+        trend_data_points: List[ui_schemas.InsightTrendDataPoint] = []
+
+        if granularity == ui_schemas.TrendGranularity.DAY:
+            current_iter_date = query_start_date
+            while current_iter_date <= today:
+                date_key = current_iter_date.strftime(date_format_str)
+                trend_data_points.append(ui_schemas.InsightTrendDataPoint(date=date_key, count=existing_data_map.get(date_key, 0)))
+                current_iter_date += timedelta(days=1)
+        elif granularity == ui_schemas.TrendGranularity.WEEK:
+            all_week_keys_in_period = set()
+            temp_date = query_start_date
+            while temp_date <= today: # Итерируемся по дням, чтобы получить все недели в периоде
+                all_week_keys_in_period.add(temp_date.strftime(date_format_str)) # PostgreSQL to_char 'YYYY-WW'
+                temp_date += timedelta(days=1)
+            for week_key in sorted(list(all_week_keys_in_period)): # Сортируем недели
+                trend_data_points.append(ui_schemas.InsightTrendDataPoint(date=week_key, count=existing_data_map.get(week_key,0)))
+
+        return ui_schemas.InsightItemTrendResponse(item_type=item_type, item_text=item_text, period_days=days_period, granularity=granularity, trend_data=trend_data_points)
+    return await _cached_analytics_response("insight_item_trend", {"item_type": item_type.value, "item_text": item_text, "days_period": days_period, "granularity": granularity.value, "match_mode": match_mode}, _compute)
 
 # --- ЭНДПОИНТ ДЛЯ ВОПРОСОВ НА ЕСТЕСТВЕННОМ ЯЗЫКЕ ---
-@api_v1_router.post("/natural_language_query/", response_model=ui_schemas.NLQueryResponse)
-async def natural_language_query(
-    request_data: ui_schemas.NLQueryRequest,
-    db: AsyncSession = Depends(get_async_db)
-):
+NLQ_UNSUPPORTED_QUERY_ANSWER = "Извините, я пока не могу ответить на такой тип вопроса. Попробуйте спросить про основные темы, проблемы, вопросы или предложения за определенный период (например, 'Какие темы обсуждали за 7 дней?')."
+NLQ_THROTTLED_ANSWER = "AI-сервис сейчас перегружен. Пожалуйста, повторите запрос через минуту."
+NLQ_NO_LLM_ANSWER = "Не удалось получить ответ от AI."
+
+async def _prepare_nlq_context(request_data: ui_schemas.NLQueryRequest, db: AsyncSession) -> Tuple[Dict[str, Any], Optional[str], Optional[str]]:
+    """
+    Разбор вопроса и выборка данных для NLQ. Возвращает (контекст для клиента, промпт для LLM, готовый ответ):
+    если промпт None - ответ уже известен без LLM (тип вопроса не поддерживается или данных нет).
+    """
     query_text_lower = request_data.query_text.lower()
-    endpoint_logger.info(f"POST /natural_language_query/ - query: '{request_data.query_text}', explicit_days_period: {request_data.days_period}")
-
     days_period_nlq = request_data.days_period
 
     if days_period_nlq is None:
@@ -448,67 +731,159 @@ async def natural_language_query(
         insight_name_for_prompt = "основные предложения"
         insight_name_plural_for_prompt = "основных предложений"
 
-    ai_answer: str
+    context_info: Dict[str, Any] = {
+        "original_query": request_data.query_text,
+        "days_period": days_period_nlq,
+        "insight_type": insight_type_nlq.value if insight_type_nlq else None,
+        "top_items": [],
+    }
+    if not (insight_type_nlq and jsonb_field_nlq):
+        return context_info, None, NLQ_UNSUPPORTED_QUERY_ANSWER
+
+    start_date_nlq = datetime.now(timezone.utc) - timedelta(days=days_period_nlq)
+    top_insights_data = [{"text": item_text, "count": item_count} for item_text, item_count in await _fetch_top_comment_insights(db, insight_type_nlq.value, start_date_nlq, 5)]
+    context_info["top_items"] = top_insights_data
+
+    if not top_insights_data:
+        return context_info, None, f"За последние {days_period_nlq} дней не найдено информации по запрошенному типу '{insight_name_plural_for_prompt}'."
+
+    context_for_llm = f"Данные о топ-{len(top_insights_data)} {insight_name_for_prompt.replace('ые', 'ых')} за последние {days_period_nlq} дней:\n"
+    for item in top_insights_data:
+        context_for_llm += f"- \"{item['text']}\" (упоминаний: {item['count']})\n"
+
+    prompt_for_llm = (
+        f"Ты — AI-аналитик данных из Telegram-каналов. "
+        f"Твоя задача — ответить на вопрос пользователя, используя предоставленные данные. "
+        f"Предоставленные данные актуальны за период: последние {days_period_nlq} дней. "
+        f"Отвечай кратко и по существу, основываясь ИСКЛЮЧИТЕЛЬНО на этих данных и указанном периоде ({days_period_nlq} дней).\n\n"
+        f"ПРЕДОСТАВЛЕННЫЕ ДАННЫЕ (для ответа на вопрос):\n{context_for_llm}\n"
+        f"ВОПРОС ПОЛЬЗОВАТЕЛЯ: \"{request_data.query_text}\"\n\n"
+        f"ТВОЙ ОТВЕТ (сформулируй его как естественный текстовый ответ, упоминая, что информация относится к последним {days_period_nlq} дням, если это не противоречит сути вопроса; не используй период из текста вопроса пользователя, если он отличается от {days_period_nlq} дней; не перечисляй просто данные, а дай связный ответ):"
+    )
+    endpoint_logger.info(f"Промпт для LLM (NLQ):\n{prompt_for_llm}")
+    return context_info, prompt_for_llm, None
 
-    if insight_type_nlq and jsonb_field_nlq:
-        try:
-            start_date_nlq = datetime.now(timezone.utc) - timedelta(days=days_period_nlq)
-            active_channels_subquery_nlq = select(models_module.Channel.id).where(models_module.Channel.is_active == True).subquery()
-            comment_jsonb_field_model = getattr(models_module.Comment, jsonb_field_nlq)
-            item_text_expr_nlq = func.jsonb_array_elements_text(comment_jsonb_field_model).label("item_text")
-            stmt_nlq = (
-                select(item_text_expr_nlq, func.count().label("item_count"))
-                .select_from(models_module.Comment)
-                .join(models_module.Post, models_module.Comment.post_id == models_module.Post.id)
-                .join(active_channels_subquery_nlq, models_module.Post.channel_id == active_channels_subquery_nlq.c.id)
-                .where(models_module.Comment.commented_at >= start_date_nlq)
-                .where(comment_jsonb_field_model.isnot(None))
-                .where(func.jsonb_typeof(comment_jsonb_field_model) == 'array')
-                .group_by(item_text_expr_nlq)
-                .order_by(desc(literal_column("item_count")))
-                .limit(5)
-            )
-            results_nlq = await db.execute(stmt_nlq)
-            top_insights_data = [{"text": str(row.item_text), "count": row.item_count} for row in results_nlq.all()]
-
-            if not top_insights_data:
-                ai_answer = f"За последние {days_period_nlq} дней не найдено информации по запрошенному типу '{insight_name_plural_for_prompt}'."
-            else:
-                context_for_llm = f"Данные о топ-{len(top_insights_data)} {insight_name_for_prompt.replace('ые', 'ых')} за последние {days_period_nlq} дней:\n"
-                for item in top_insights_data:
-                    context_for_llm += f"- \"{item['text']}\" (упоминаний: {item['count']})\n"
-
-                prompt_for_llm = (
-                    f"Ты — AI-аналитик данных из Telegram-каналов. "
-                    f"Твоя задача — ответить на вопрос пользователя, используя предоставленные данные. "
-                    f"Предоставленные данные актуальны за период: последние {days_period_nlq} дней. "
-                    f"Отвечай кратко и по существу, основываясь ИСКЛЮЧИТЕЛЬНО на этих данных и указанном периоде ({days_period_nlq} дней).\n\n"
-                    f"ПРЕДОСТАВЛЕННЫЕ ДАННЫЕ (для ответа на вопрос):\n{context_for_llm}\n"
-                    f"ВОПРОС ПОЛЬЗОВАТЕЛЯ: \"{request_data.query_text}\"\n\n"
-                    f"ТВОЙ ОТВЕТ (сформулируй его как естественный текстовый ответ, упоминая, что информация относится к последним {days_period_nlq} дням, если это не противоречит сути вопроса; не используй период из текста вопроса пользователя, если он отличается от {days_period_nlq} дней; не перечисляй просто данные, а дай связный ответ):"
-                )
-                endpoint_logger.info(f"Промпт для LLM (NLQ):\n{prompt_for_llm}")
+@api_v1_router.post("/natural_language_query/", response_model=ui_schemas.NLQueryResponse)
+async def natural_language_query(
+    request_data: ui_schemas.NLQueryRequest,
+    db: AsyncSession = Depends(get_async_db)
+):
+    endpoint_logger.info(f"POST /natural_language_query/ - query: '{request_data.query_text}', explicit_days_period: {request_data.days_period}")
 
-                llm_response = await одиночный_запрос_к_llm(
-                    prompt_for_llm,
-                    модель=settings.OPENAI_DEFAULT_MODEL_FOR_TASKS or "gpt-3.5-turbo-1106",
-                    is_json_response_expected=False
-                )
-                ai_answer = llm_response or "Не удалось получить ответ от AI."
-        except Exception as e_nlq_data:
-            endpoint_logger.error(f"Ошибка при подготовке данных или вызове LLM для NLQ: {e_nlq_data}", exc_info=True)
-            ai_answer = "Произошла внутренняя ошибка при обработке вашего запроса. Не удалось получить данные или связаться с AI."
-    else:
-        ai_answer = "Извините, я пока не могу ответить на такой тип вопроса. Попробуйте спросить про основные темы, проблемы, вопросы или предложения за определенный период (например, 'Какие темы обсуждали за 7 дней?')."
+    ai_answer: str
+    try:
+        _, prompt_for_llm, ready_answer = await _prepare_nlq_context(request_data, db)
+        if prompt_for_llm is None:
+            ai_answer = ready_answer or NLQ_UNSUPPORTED_QUERY_ANSWER
+        else:
+            llm_response = await одиночный_запрос_к_llm(
+                prompt_for_llm,
+                модель=settings.OPENAI_DEFAULT_MODEL_FOR_TASKS or "gpt-3.5-turbo-1106",
+                is_json_response_expected=False,
+                caller="api.natural_language_query",
+                hedge=True # Пользователь ждет ответа: при "хвостовой" задержке дублируем запрос
+            )
+            ai_answer = llm_response or NLQ_NO_LLM_ANSWER
+    except LLMThrottledError as e_throttled:
+        endpoint_logger.warning(f"LLM перегружен при обработке NLQ: {e_throttled}")
+        ai_answer = NLQ_THROTTLED_ANSWER
+    except Exception as e_nlq_data:
+        endpoint_logger.error(f"Ошибка при подготовке данных или вызове LLM для NLQ: {e_nlq_data}", exc_info=True)
+        ai_answer = "Произошла внутренняя ошибка при обработке вашего запроса. Не удалось получить данные или связаться с AI."
 
     return ui_schemas.NLQueryResponse(
         original_query=request_data.query_text,
         ai_answer=ai_answer
     )
 
+# --- ПОТОКОВЫЕ (SSE) ВАРИАНТЫ NLQ И АНАЛИТИЧЕСКОГО ОТЧЕТА ---
+def _sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+async def _stream_llm_answer_as_sse(
+    context_payload: Dict[str, Any],
+    prompt_for_llm: Optional[str],
+    ready_answer: Optional[str],
+    caller: str,
+    температура: float,
+    макс_токены: int,
+    empty_answer_text: str,
+    throttled_answer_text: str,
+):
+    """
+    События SSE: 'context' (данные из БД - сразу), затем 'token' по мере генерации, в конце 'done' с полным текстом
+    или 'error' (status_code 503 - LLM перегружен / предохранитель разомкнут).
+    """
+    yield _sse_event("context", context_payload)
+    if prompt_for_llm is None:
+        yield _sse_event("done", {"text": ready_answer or empty_answer_text})
+        return
+    answer_parts: List[str] = []
+    try:
+        async for token_text in потоковый_запрос_к_llm(
+            prompt_for_llm,
+            модель=settings.OPENAI_DEFAULT_MODEL_FOR_TASKS or "gpt-3.5-turbo-1106",
+            температура=температура,
+            макс_токены=макс_токены,
+            caller=caller
+        ):
+            answer_parts.append(token_text)
+            yield _sse_event("token", {"text": token_text})
+    except LLMThrottledError as e_throttled:
+        endpoint_logger.warning(f"LLM перегружен при потоковой генерации ({caller}): {e_throttled}")
+        yield _sse_event("error", {"status_code": 503, "detail": throttled_answer_text, "partial_text": "".join(answer_parts)})
+        return
+    except Exception as e_stream:
+        endpoint_logger.error(f"Ошибка потоковой генерации ({caller}): {e_stream}", exc_info=True)
+        yield _sse_event("error", {"status_code": 500, "detail": "Внутренняя ошибка при генерации ответа.", "partial_text": "".join(answer_parts)})
+        return
+    yield _sse_event("done", {"text": "".join(answer_parts).strip() or empty_answer_text})
+
+def _sse_response(event_generator) -> StreamingResponse:
+    return StreamingResponse(
+        event_generator,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"} # Без буферизации в nginx
+    )
+
+@api_v1_router.post("/natural_language_query/stream", summary="Вопрос на естественном языке: потоковый ответ (SSE)")
+async def natural_language_query_stream(
+    request_data: ui_schemas.NLQueryRequest,
+    db: AsyncSession = Depends(get_async_db)
+):
+    endpoint_logger.info(f"POST /natural_language_query/stream - query: '{request_data.query_text}', explicit_days_period: {request_data.days_period}")
+    try:
+        # Запросы к БД - до начала потока: сессия из Depends не переживает ответ, а ошибки данных отдаются обычным HTTP-статусом
+        context_info, prompt_for_llm, ready_answer = await _prepare_nlq_context(request_data, db)
+    except Exception as e_nlq_data:
+        endpoint_logger.error(f"Ошибка при подготовке данных для потокового NLQ: {e_nlq_data}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Не удалось получить данные для ответа на вопрос.")
+    return _sse_response(_stream_llm_answer_as_sse(
+        context_info, prompt_for_llm, ready_answer,
+        caller="api.natural_language_query_stream",
+        температура=0.2,
+        макс_токены=350,
+        empty_answer_text=NLQ_NO_LLM_ANSWER,
+        throttled_answer_text=NLQ_THROTTLED_ANSWER,
+    ))
+
 # --- ENUMs для сортировки ---
 class PostSortByField(PyEnum):
-    posted_at = "posted_at"; comments_count = "comments_count"; views_count = "views_count"; forwards_count = "forwards_count"; reactions_total_sum = "reactions_total_sum"
+    posted_at = "posted_at"; comments_count = "comments_count"; views_count = "views_count"; forwards_count = "forwards_count"; reactions_total_sum = "reactions_total_sum"; relevance = "relevance"
+
+def _post_sort_expression(sort_by: PostSortByField, rank_expression=None):
+    """
+    Выражение ключа сортировки постов - то же, что в индексах ix_posts_keyset_*. NULL в views_count/forwards_count
+    заменяется на -1 литералом (не параметром), иначе Postgres не сопоставит выражение с индексом; порядок при этом
+    прежний: NULL первыми при asc и последними при desc. relevance (ts_rank) имеет смысл только при поиске, без него - posted_at.
+    """
+    CurrentPostModel = models_module.Post
+    if sort_by == PostSortByField.relevance and rank_expression is not None: return rank_expression
+    if sort_by == PostSortByField.reactions_total_sum: return CurrentPostModel.reactions_total
+    if sort_by == PostSortByField.views_count: return func.coalesce(CurrentPostModel.views_count, literal_column("-1"))
+    if sort_by == PostSortByField.forwards_count: return func.coalesce(CurrentPostModel.forwards_count, literal_column("-1"))
+    if sort_by == PostSortByField.comments_count: return CurrentPostModel.comments_count
+    return CurrentPostModel.posted_at
 
 # --- ФУНКЦИЯ get_comment_author_display_name ---
 def get_comment_author_display_name(comment: models_module.Comment) -> str:
@@ -517,66 +892,408 @@ def get_comment_author_display_name(comment: models_module.Comment) -> str:
     if hasattr(comment, 'telegram_user_id') and comment.telegram_user_id: return f"User_{str(comment.telegram_user_id)}"
     return "Unknown Author"
 
+# --- РАЗРЕЖЕННЫЕ НАБОРЫ ПОЛЕЙ (fields=) ---
+# Списки постов и комментариев читают из БД только колонки запрошенных полей и отдаются словарями через FastJSONResponse,
+# минуя модели pydantic (валидация сотни объектов на страницу - заметная доля CPU запроса). Без fields - все поля схемы.
+# Вложенный объект (channel) - колонки с метками "channel__id", "channel__title", ...
+_POST_LIST_FIELDS = tuple(ui_schemas.PostListItem.model_fields)
+_COMMENT_LIST_FIELDS = tuple(ui_schemas.CommentListItem.model_fields)
+
+def _parse_sparse_fields(fields: Optional[str], allowed: Tuple[str, ...]) -> Tuple[str, ...]:
+    """Запрошенные поля в порядке схемы; id - всегда. Неизвестное поле - 400."""
+    if not fields: return allowed
+    requested = {field_name.strip() for field_name in fields.split(",") if field_name.strip()}
+    unknown = requested - set(allowed)
+    if unknown: raise HTTPException(status_code=400, detail=f"Неизвестные поля: {', '.join(sorted(unknown))}. Доступны: {', '.join(allowed)}.")
+    return tuple(field_name for field_name in allowed if field_name in requested or field_name == "id")
+
+def _sparse_item(row, selected_fields: Tuple[str, ...]) -> Dict[str, Any]:
+    values = row._mapping; item: Dict[str, Any] = {}
+    for field_name in selected_fields:
+        if field_name in values: item[field_name] = values[field_name]
+        elif f"{field_name}__id" in values: item[field_name] = {key.split("__", 1)[1]: value for key, value in values.items() if key.startswith(f"{field_name}__")}
+        else: item[field_name] = None # Поле, которое не вычислялось (search_rank без поиска)
+    return item
+
 # --- ОБНОВЛЕННЫЙ ЭНДПОИНТ ДЛЯ ПОЛУЧЕНИЯ ПОСТОВ С СОРТИРОВКОЙ И ПОИСКОМ ---
+# Пагинация по ключу (keyset): next_cursor из ответа передается в cursor следующего запроса, и страница читается
+# диапазоном составного индекса (ключ сортировки, id) вместо OFFSET. page оставлен для совместимости - он работает через OFFSET.
 @api_v1_router.get("/posts/", response_model=ui_schemas.PaginatedPostsResponse)
 async def get_posts_for_ui(
-    page: int = Query(1, ge=1, description="Page number"),
+    page: int = Query(1, ge=1, description="Page number (OFFSET-пагинация; игнорируется, если передан cursor)"),
     limit: int = Query(10, ge=1, le=100, description="Number of items per page"),
-    search_query: Optional[str] = Query(None),
-    sort_by: PostSortByField = Query(PostSortByField.posted_at.value, description="Поле для сортировки"),
+    search_query: Optional[str] = Query(None, description="Полнотекстовый поиск по тексту, подписи и резюме (последнее слово - как префикс)"),
+    sort_by: PostSortByField = Query(PostSortByField.posted_at.value, description="Поле для сортировки (relevance - по ts_rank, только вместе с search_query)"),
     sort_order: str = Query("desc", pattern="^(asc|desc)$", description="Порядок сортировки"),
-    db: AsyncSession = Depends(get_async_db)
+    cursor: Optional[str] = Query(None, description="Курсор next_cursor из предыдущего ответа"),
+    total_mode: str = Query(TOTAL_MODE_EXACT, pattern=TOTAL_MODE_PATTERN, description="Подсчет total_posts: exact - count(*), approx - оценка планировщика, none - не считать"),
+    fields: Optional[str] = Query(None, description="Поля постов через запятую (id отдается всегда); по умолчанию - все поля PostListItem"),
+    db: AsyncSession = Depends(get_async_read_db)
 ):
     skip = (page - 1) * limit
-    endpoint_logger.info(f"GET /api/v1/posts/ - page={page} (skip={skip}), limit={limit}, search_query='{search_query}', sort_by='{sort_by.value}', sort_order='{sort_order}'")
+    endpoint_logger.info(f"GET /api/v1/posts/ - page={page} (skip={skip}), limit={limit}, search_query='{search_query}', sort_by='{sort_by.value}', sort_order='{sort_order}', cursor={'yes' if cursor else 'no'}, total_mode={total_mode}, fields={fields}")
+    cursor_position = None
+    if cursor:
+        try: cursor_position = decode_cursor(cursor, sort_by.value, sort_order)
+        except InvalidCursorError as e: raise HTTPException(status_code=400, detail=str(e))
+    selected_fields = _parse_sparse_fields(fields, _POST_LIST_FIELDS)
     try:
         CurrentPostModel = models_module.Post; CurrentChannelModel = models_module.Channel
-        p_alias = aliased(CurrentPostModel, name="p_for_reactions_cte")
-        reaction_elements_cte_subquery = (select(p_alias.id.label("post_id_in_cte"), cast(func.jsonb_array_elements(p_alias.reactions).op('->>')('count'), SAInteger).label("reaction_item_count")).select_from(p_alias).where(p_alias.reactions.isnot(None)).where(func.jsonb_typeof(p_alias.reactions) == 'array').cte("reaction_elements_cte"))
-        sum_of_reactions_cte = (select(reaction_elements_cte_subquery.c.post_id_in_cte.label("post_id"), func.sum(reaction_elements_cte_subquery.c.reaction_item_count).label("total_reactions_sum")).group_by(reaction_elements_cte_subquery.c.post_id_in_cte).cte("sum_of_reactions_cte"))
-        posts_select_stmt = select(CurrentPostModel)
-        if sort_by == PostSortByField.reactions_total_sum: posts_select_stmt = posts_select_stmt.outerjoin(sum_of_reactions_cte, CurrentPostModel.id == sum_of_reactions_cte.c.post_id).add_columns(sum_of_reactions_cte.c.total_reactions_sum.label("calculated_total_reactions"))
+        ts_query = ts_query_expression(search_query) if search_query else None
+        rank_expression = ts_rank_expression(CurrentPostModel.search_vector, ts_query) if ts_query is not None else None
+        sort_expression = _post_sort_expression(sort_by, rank_expression); descending = sort_order == "desc"
+        # Только колонки запрошенных полей: без полной сущности (media_content_info, search_vector) и без selectinload канала - он уже в JOIN
+        post_columns = [CurrentPostModel.id.label("id"), sort_expression.label("keyset_sort_value")]
+        for field_name in selected_fields:
+            if field_name == "channel": post_columns += [CurrentChannelModel.id.label("channel__id"), CurrentChannelModel.title.label("channel__title"), CurrentChannelModel.username.label("channel__username")]
+            elif field_name not in ("id", "search_rank", "search_snippet"): post_columns.append(getattr(CurrentPostModel, field_name).label(field_name))
+        posts_select_stmt = select(*post_columns)
+        if ts_query is not None and "search_rank" in selected_fields: posts_select_stmt = posts_select_stmt.add_columns(rank_expression.label("search_rank"))
+        if ts_query is not None and "search_snippet" in selected_fields: # ts_headline дорогой, но Postgres вычисляет его уже после LIMIT - только для строк страницы
+            posts_select_stmt = posts_select_stmt.add_columns(ts_headline_expression(func.coalesce(CurrentPostModel.text_content, CurrentPostModel.caption_text, CurrentPostModel.summary_text, ""), ts_query).label("search_snippet"))
         posts_select_stmt = posts_select_stmt.join(CurrentChannelModel, CurrentPostModel.channel_id == CurrentChannelModel.id)
         conditions = [CurrentChannelModel.is_active == True]
-        if search_query: search_pattern = f"%{search_query}%"; search_conditions_list = [CurrentPostModel.text_content.ilike(search_pattern), CurrentPostModel.caption_text.ilike(search_pattern), CurrentPostModel.summary_text.ilike(search_pattern)]; conditions.append(or_(*[cond for cond in search_conditions_list if cond is not None]))
+        if ts_query is not None: conditions.append(CurrentPostModel.search_vector.op("@@")(ts_query)) # GIN ix_posts_search_vector
+        elif search_query: search_pattern = f"%{search_query}%"; search_conditions_list = [CurrentPostModel.text_content.ilike(search_pattern), CurrentPostModel.caption_text.ilike(search_pattern), CurrentPostModel.summary_text.ilike(search_pattern)]; conditions.append(or_(*[cond for cond in search_conditions_list if cond is not None])) # В запросе нет слов (эмодзи, знаки) - ищем подстроку
         posts_with_conditions_stmt = posts_select_stmt.where(*conditions)
-        count_query = select(func.count()).select_from(posts_with_conditions_stmt.with_only_columns(CurrentPostModel.id).alias("sub_count_query"))
-        total_posts_result = await db.execute(count_query); total_posts = total_posts_result.scalar_one_or_none() or 0
-        order_expression = None
-        if sort_by == PostSortByField.reactions_total_sum: order_field = literal_column("calculated_total_reactions"); order_expression = asc(order_field).nullsfirst() if sort_order == "asc" else desc(order_field).nullslast()
-        else:
-            order_field_attr = getattr(CurrentPostModel, sort_by.value, CurrentPostModel.posted_at)
-            if sort_by in [PostSortByField.views_count, PostSortByField.forwards_count, PostSortByField.comments_count]: order_expression = asc(order_field_attr).nullsfirst() if sort_order == "asc" else desc(order_field_attr).nullslast()
-            else: order_expression = asc(order_field_attr) if sort_order == "asc" else desc(order_field_attr)
-        final_posts_query = posts_with_conditions_stmt.order_by(order_expression).options(selectinload(CurrentPostModel.channel)).offset(skip).limit(limit)
-        results = await db.execute(final_posts_query)
-        if sort_by == PostSortByField.reactions_total_sum: posts_scalars = [row[0] for row in results.all()]
-        else: posts_scalars = results.scalars().unique().all()
-        posts_list = [ui_schemas.PostListItem.model_validate(post) for post in posts_scalars]
-        return ui_schemas.PaginatedPostsResponse(total_posts=total_posts, posts=posts_list)
-    except Exception as e: endpoint_logger.error(f"Error in get_posts_for_ui: {e}", exc_info=True);
-    if hasattr(e, 'errors') and callable(e.errors): endpoint_logger.error(f"Pydantic ValidationError details: {e.errors()}")
-    raise HTTPException(status_code=500, detail="Internal server error while fetching posts")
+        total_posts = None; total_is_approximate = False
+        if total_mode == TOTAL_MODE_EXACT:
+            count_query = select(func.count()).select_from(posts_with_conditions_stmt.with_only_columns(CurrentPostModel.id).alias("sub_count_query"))
+            total_posts_result = await db.execute(count_query); total_posts = total_posts_result.scalar_one_or_none() or 0
+        elif total_mode == TOTAL_MODE_APPROX:
+            total_posts = await estimate_row_count(db, posts_with_conditions_stmt.with_only_columns(CurrentPostModel.id)); total_is_approximate = True
+        final_posts_query = posts_with_conditions_stmt.order_by(*keyset_order_by(sort_expression, CurrentPostModel.id, descending))
+        if cursor_position: final_posts_query = final_posts_query.where(keyset_predicate(sort_expression, CurrentPostModel.id, cursor_position[0], cursor_position[1], descending))
+        else: final_posts_query = final_posts_query.offset(skip)
+        rows = (await db.execute(final_posts_query.limit(limit + 1))).all() # +1 строка - признак того, что есть следующая страница
+        next_cursor = encode_cursor(sort_by.value, sort_order, rows[limit - 1].keyset_sort_value, rows[limit - 1].id) if len(rows) > limit else None
+        posts_list = [_sparse_item(row, selected_fields) for row in rows[:limit]]
+        return FastJSONResponse({"total_posts": total_posts, "total_is_approximate": total_is_approximate, "next_cursor": next_cursor, "posts": posts_list})
+    except Exception as e:
+        endpoint_logger.error(f"Error in get_posts_for_ui: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal server error while fetching posts")
 
 @api_v1_router.get("/posts/{post_id}/comments/", response_model=ui_schemas.PaginatedCommentsResponse)
-async def get_comments_for_post_ui(post_id: int, skip: int = Query(0, ge=0), limit: int = Query(10, ge=1, le=100), db: AsyncSession = Depends(get_async_db)):
-    endpoint_logger.info(f"GET /api/v1/posts/{post_id}/comments/ - skip={skip}, limit={limit}")
+async def get_comments_for_post_ui(
+    post_id: int,
+    skip: int = Query(0, ge=0, description="OFFSET-пагинация; игнорируется, если передан cursor"),
+    limit: int = Query(10, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="Курсор next_cursor из предыдущего ответа"),
+    search_query: Optional[str] = Query(None, description="Полнотекстовый поиск по тексту комментариев поста"),
+    total_mode: str = Query(TOTAL_MODE_EXACT, pattern=TOTAL_MODE_PATTERN, description="Подсчет total_comments: exact - count(*), approx - счетчик комментариев поста из Telegram, none - не считать"),
+    fields: Optional[str] = Query(None, description="Поля комментариев через запятую (id отдается всегда); по умолчанию - все поля CommentListItem"),
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    endpoint_logger.info(f"GET /api/v1/posts/{post_id}/comments/ - skip={skip}, limit={limit}, cursor={'yes' if cursor else 'no'}, search_query='{search_query}', total_mode={total_mode}, fields={fields}")
+    cursor_position = None
+    if cursor:
+        try: cursor_position = decode_cursor(cursor, "commented_at", "asc")
+        except InvalidCursorError as e: raise HTTPException(status_code=400, detail=str(e))
+    selected_fields = _parse_sparse_fields(fields, _COMMENT_LIST_FIELDS)
     try:
         CurrentPostModel = models_module.Post; CurrentCommentModel = models_module.Comment
-        post_check_stmt = (select(CurrentPostModel).join(models_module.Channel, CurrentPostModel.channel_id == models_module.Channel.id).where(CurrentPostModel.id == post_id).where(models_module.Channel.is_active == True))
-        post = (await db.execute(post_check_stmt)).scalar_one_or_none()
+        post_check_stmt = (select(CurrentPostModel.id, CurrentPostModel.comments_count).join(models_module.Channel, CurrentPostModel.channel_id == models_module.Channel.id).where(CurrentPostModel.id == post_id).where(models_module.Channel.is_active == True))
+        post = (await db.execute(post_check_stmt)).one_or_none()
         if not post: raise HTTPException(status_code=404, detail=f"Post with ID {post_id} not found or not accessible.")
-        total_comments_stmt = select(func.count(CurrentCommentModel.id)).where(CurrentCommentModel.post_id == post_id)
-        total_comments = (await db.execute(total_comments_stmt)).scalar_one_or_none() or 0
-        comments_stmt = (select(CurrentCommentModel).where(CurrentCommentModel.post_id == post_id).order_by(asc(CurrentCommentModel.commented_at)).offset(skip).limit(limit))
-        comments_scalars = (await db.execute(comments_stmt)).scalars().all()
-        comments_list = [ui_schemas.CommentListItem(id=c.id, author_display_name=get_comment_author_display_name(c), text=c.text_content, commented_at=c.commented_at) for c in comments_scalars]
-        return ui_schemas.PaginatedCommentsResponse(total_comments=total_comments, comments=comments_list)
+        ts_query = ts_query_expression(search_query) if search_query else None
+        comment_conditions = [CurrentCommentModel.post_id == post_id]
+        if ts_query is not None: comment_conditions.append(CurrentCommentModel.search_vector.op("@@")(ts_query))
+        total_comments = None; total_is_approximate = False
+        if total_mode == TOTAL_MODE_EXACT:
+            total_comments_stmt = select(func.count(CurrentCommentModel.id)).where(*comment_conditions)
+            total_comments = (await db.execute(total_comments_stmt)).scalar_one_or_none() or 0
+        elif total_mode == TOTAL_MODE_APPROX and ts_query is None:
+            total_comments = post.comments_count; total_is_approximate = True
+        # Порядок (commented_at, id) читается из индекса ix_comments_keyset_post_commented_at (post_id, commented_at, id); commented_at нужен курсору всегда
+        comment_columns = [CurrentCommentModel.id.label("id"), CurrentCommentModel.commented_at.label("commented_at")]
+        if "author_display_name" in selected_fields: comment_columns += [CurrentCommentModel.user_fullname, CurrentCommentModel.user_username, CurrentCommentModel.telegram_user_id]
+        if "text" in selected_fields: comment_columns.append(CurrentCommentModel.text_content.label("text"))
+        if ts_query is not None and "search_rank" in selected_fields: comment_columns.append(ts_rank_expression(CurrentCommentModel.search_vector, ts_query).label("search_rank"))
+        if ts_query is not None and "search_snippet" in selected_fields: comment_columns.append(ts_headline_expression(func.coalesce(CurrentCommentModel.text_content, ""), ts_query).label("search_snippet"))
+        comments_stmt = select(*comment_columns).where(*comment_conditions).order_by(*keyset_order_by(CurrentCommentModel.commented_at, CurrentCommentModel.id, False))
+        if cursor_position: comments_stmt = comments_stmt.where(keyset_predicate(CurrentCommentModel.commented_at, CurrentCommentModel.id, cursor_position[0], cursor_position[1], False))
+        else: comments_stmt = comments_stmt.offset(skip)
+        comment_rows = (await db.execute(comments_stmt.limit(limit + 1))).all()
+        next_cursor = encode_cursor("commented_at", "asc", comment_rows[limit - 1].commented_at, comment_rows[limit - 1].id) if len(comment_rows) > limit else None
+        comments_list = []
+        for row in comment_rows[:limit]:
+            item = _sparse_item(row, selected_fields)
+            if "author_display_name" in item: item["author_display_name"] = get_comment_author_display_name(row)
+            comments_list.append(item)
+        return FastJSONResponse({"total_comments": total_comments, "total_is_approximate": total_is_approximate, "next_cursor": next_cursor, "comments": comments_list})
+    except HTTPException:
+        raise
     except Exception as e:
         endpoint_logger.error(f"Error in get_comments_for_post_ui (post_id={post_id}): {e}", exc_info=True)
         if hasattr(e, 'errors') and callable(e.errors): endpoint_logger.error(f"Pydantic ValidationError details: {e.errors()}")
         raise HTTPException(status_code=500, detail=f"Internal server error while fetching comments for post {post_id}")
 
+@api_v1_router.get("/comments/search/", response_model=ui_schemas.CommentSearchResponse)
+async def search_comments(
+    q: str = Query(..., min_length=1, description="Поисковый запрос (последнее слово - как префикс)"),
+    channel_id: Optional[int] = Query(None, description="Только комментарии к постам этого канала"),
+    days: Optional[int] = Query(None, ge=1, le=3650, description="Только комментарии за последние N дней"),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="Курсор next_cursor из предыдущего ответа"),
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    """Полнотекстовый поиск по комментариям активных каналов через GIN ix_comments_search_vector, по убыванию ts_rank."""
+    endpoint_logger.info(f"GET /api/v1/comments/search/ - q='{q}', channel_id={channel_id}, days={days}, limit={limit}, cursor={'yes' if cursor else 'no'}")
+    ts_query = ts_query_expression(q)
+    if ts_query is None: return ui_schemas.CommentSearchResponse(comments=[])
+    cursor_position = None
+    if cursor:
+        try: cursor_position = decode_cursor(cursor, "relevance", "desc")
+        except InvalidCursorError as e: raise HTTPException(status_code=400, detail=str(e))
+    try:
+        CurrentCommentModel = models_module.Comment; CurrentPostModel = models_module.Post; CurrentChannelModel = models_module.Channel
+        rank_expression = ts_rank_expression(CurrentCommentModel.search_vector, ts_query)
+        stmt = (
+            select(CurrentCommentModel, CurrentPostModel.link, CurrentChannelModel, rank_expression.label("search_rank"), ts_headline_expression(func.coalesce(CurrentCommentModel.text_content, ""), ts_query).label("search_snippet"))
+            .join(CurrentPostModel, CurrentCommentModel.post_id == CurrentPostModel.id)
+            .join(CurrentChannelModel, CurrentPostModel.channel_id == CurrentChannelModel.id)
+            .where(CurrentChannelModel.is_active == True, CurrentCommentModel.search_vector.op("@@")(ts_query))
+            .order_by(*keyset_order_by(rank_expression, CurrentCommentModel.id, True))
+        )
+        if channel_id is not None: stmt = stmt.where(CurrentChannelModel.id == channel_id)
+        if days is not None: stmt = stmt.where(CurrentCommentModel.commented_at >= datetime.now(timezone.utc) - timedelta(days=days))
+        if cursor_position: stmt = stmt.where(keyset_predicate(rank_expression, CurrentCommentModel.id, cursor_position[0], cursor_position[1], True))
+        rows = (await db.execute(stmt.limit(limit + 1))).all()
+        next_cursor = encode_cursor("relevance", "desc", rows[limit - 1].search_rank, rows[limit - 1][0].id) if len(rows) > limit else None
+        comments_list = [ui_schemas.CommentSearchItem(
+            id=row[0].id, author_display_name=get_comment_author_display_name(row[0]), text=row[0].text_content, commented_at=row[0].commented_at,
+            search_rank=row.search_rank, search_snippet=row.search_snippet, post_id=row[0].post_id, post_link=row.link, channel=ui_schemas.ChannelInfo.model_validate(row[2])
+        ) for row in rows[:limit]]
+        return ui_schemas.CommentSearchResponse(next_cursor=next_cursor, comments=comments_list)
+    except Exception as e:
+        endpoint_logger.error(f"Error in search_comments (q='{q}'): {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal server error while searching comments")
+
+# --- СЕМАНТИЧЕСКИЙ ПОИСК ---
+# Кандидаты и близость - из векторного индекса (app/services/vector_index.py, обновляет tasks.update_semantic_index),
+# тексты и фильтр "канал активен" - из Postgres по id кандидатов.
+async def _semantic_hydrate_posts(db: AsyncSession, scores: Dict[int, float]) -> List[ui_schemas.SemanticSearchHit]:
+    PostModel = models_module.Post; ChannelModel = models_module.Channel
+    rows = (await db.execute(
+        select(PostModel.id, PostModel.link, PostModel.posted_at, PostModel.text_content, PostModel.caption_text, PostModel.summary_text, ChannelModel)
+        .join(ChannelModel, PostModel.channel_id == ChannelModel.id)
+        .where(PostModel.id.in_(list(scores)), ChannelModel.is_active == True)
+    )).all()
+    return [ui_schemas.SemanticSearchHit(
+        kind="post", id=row.id, score=scores[row.id], text=row.text_content or row.caption_text or row.summary_text,
+        channel=ui_schemas.ChannelInfo.model_validate(row.Channel), post_id=row.id, post_link=row.link, published_at=row.posted_at
+    ) for row in rows]
+
+async def _semantic_hydrate_comments(db: AsyncSession, scores: Dict[int, float], since: Optional[datetime], until: Optional[datetime]) -> List[ui_schemas.SemanticSearchHit]:
+    CommentModel = models_module.Comment; PostModel = models_module.Post; ChannelModel = models_module.Channel
+    stmt = (
+        select(CommentModel.id, CommentModel.post_id, CommentModel.commented_at, CommentModel.text_content, PostModel.link, ChannelModel)
+        .join(PostModel, CommentModel.post_id == PostModel.id).join(ChannelModel, PostModel.channel_id == ChannelModel.id)
+        .where(CommentModel.id.in_(list(scores)), ChannelModel.is_active == True)
+    )
+    # Границы по commented_at отсекают секции comments (поиск по id сам по себе обходит все секции)
+    if since is not None: stmt = stmt.where(CommentModel.commented_at >= since)
+    if until is not None: stmt = stmt.where(CommentModel.commented_at < until)
+    return [ui_schemas.SemanticSearchHit(
+        kind="comment", id=row.id, score=scores[row.id], text=row.text_content, channel=ui_schemas.ChannelInfo.model_validate(row.Channel),
+        post_id=row.post_id, post_link=row.link, published_at=row.commented_at
+    ) for row in (await db.execute(stmt)).all()]
+
+async def _semantic_hydrate_insights(
+    db: AsyncSession, scores: Dict[int, float], channel_ids: Optional[List[int]], since: Optional[datetime], until: Optional[datetime]
+) -> List[ui_schemas.SemanticSearchHit]:
+    """
+    Документ инсайта - канонический инсайт (insight_canonicals.id); канала и времени в индексе нет, поэтому упоминания считаются
+    здесь по comment_insights.canonical_id (ix_comment_insights_canonical_commented_at), инсайты без упоминаний в фильтрах отбрасываются.
+    """
+    InsightModel = models_module.CommentInsight; CanonicalModel = models_module.InsightCanonical
+    counts = (
+        select(InsightModel.canonical_id, func.count().label("item_count"))
+        .where(InsightModel.canonical_id.in_(list(scores)), _active_channel_filter(InsightModel.channel_id))
+        .group_by(InsightModel.canonical_id)
+    )
+    if channel_ids: counts = counts.where(InsightModel.channel_id.in_(channel_ids))
+    if since is not None: counts = counts.where(InsightModel.commented_at >= since)
+    if until is not None: counts = counts.where(InsightModel.commented_at < until)
+    counts = counts.subquery()
+    rows = (await db.execute(
+        select(CanonicalModel.id, CanonicalModel.insight_type, CanonicalModel.display_text, counts.c.item_count)
+        .join(counts, counts.c.canonical_id == CanonicalModel.id)
+    )).all()
+    return [ui_schemas.SemanticSearchHit(
+        kind="insight", id=row.id, score=scores[row.id], text=row.display_text, insight_type=row.insight_type, mention_count=row.item_count
+    ) for row in rows]
+
+@api_v1_router.get("/search/semantic", response_model=ui_schemas.SemanticSearchResponse, summary="Семантический поиск по постам, комментариям и инсайтам")
+async def semantic_search(
+    q: str = Query(..., min_length=2, max_length=500, description="Запрос на естественном языке"),
+    kinds: List[str] = Query(["post", "comment", "insight"], description="Виды документов: post, comment, insight (параметр можно повторять)"),
+    channel_ids: Optional[List[int]] = Query(None, description="Только эти каналы (параметр можно повторять)"),
+    days_period: Optional[int] = Query(None, ge=1, le=3650, description="За последние N дней (если не задан start_date)"),
+    start_date: Optional[date] = Query(None, description="С даты (UTC, YYYY-MM-DD)"),
+    end_date: Optional[date] = Query(None, description="По дату включительно (UTC, YYYY-MM-DD)"),
+    limit: int = Query(20, ge=1, le=100),
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    """
+    Поиск по смыслу, а не по словам: запрос векторизуется той же моделью, что и документы, кандидаты - из векторного индекса
+    с фильтрами по каналам и периоду, затем тексты подтягиваются из Postgres. Результаты всех видов - одним списком по близости.
+    """
+    endpoint_logger.info(f"GET /api/v1/search/semantic - q='{q}', kinds={kinds}, channel_ids={channel_ids}, days_period={days_period}, start_date={start_date}, end_date={end_date}, limit={limit}")
+    if not settings.SEMANTIC_SEARCH_ENABLED:
+        raise HTTPException(status_code=503, detail="Семантический поиск выключен (SEMANTIC_SEARCH_ENABLED=False).")
+    unknown_kinds = [kind for kind in kinds if kind not in KIND_BY_NAME]
+    if unknown_kinds:
+        raise HTTPException(status_code=400, detail=f"Неизвестные виды документов: {unknown_kinds}. Допустимые: {list(KIND_BY_NAME)}.")
+    since, until = _export_period_bounds(days_period, start_date, end_date)
+    try:
+        provider = get_embedding_provider()
+        query_vector = (await provider.embed([q], is_query=True))[0]
+        # Запас кандидатов: часть отсеется фильтром активных каналов и (у инсайтов) отсутствием упоминаний за период
+        candidates = await asyncio.to_thread(
+            search_vector_index, query_vector, limit * settings.SEMANTIC_SEARCH_OVERSAMPLE, [KIND_BY_NAME[kind] for kind in kinds],
+            provider.name, provider.model, channel_ids=channel_ids,
+            since_ts=int(since.timestamp()) if since else None, until_ts=int(until.timestamp()) if until else None
+        )
+    except (EmbeddingProviderUnavailableError, VectorIndexUnavailableError) as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        endpoint_logger.error(f"Error in semantic_search (q='{q}'): {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal server error during semantic search")
+    scores_by_kind: Dict[int, Dict[int, float]] = {KIND_POST: {}, KIND_COMMENT: {}, KIND_INSIGHT: {}}
+    for kind, doc_id, score in candidates:
+        scores_by_kind[kind][doc_id] = score
+    try:
+        hits: List[ui_schemas.SemanticSearchHit] = []
+        if scores_by_kind[KIND_POST]: hits += await _semantic_hydrate_posts(db, scores_by_kind[KIND_POST])
+        if scores_by_kind[KIND_COMMENT]: hits += await _semantic_hydrate_comments(db, scores_by_kind[KIND_COMMENT], since, until)
+        if scores_by_kind[KIND_INSIGHT]: hits += await _semantic_hydrate_insights(db, scores_by_kind[KIND_INSIGHT], channel_ids, since, until)
+    except Exception as e:
+        endpoint_logger.error(f"Error in semantic_search hydration (q='{q}'): {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal server error during semantic search")
+    hits.sort(key=lambda hit: -hit.score)
+    return ui_schemas.SemanticSearchResponse(query=q, model=f"{provider.name}/{provider.model}", hits=hits[:limit])
+
+# --- ПОТОКОВАЯ ВЫГРУЗКА ДАННЫХ (CSV / JSONL / Parquet) ---
+# Выгрузка целиком одним запросом серверным курсором вместо постраничного обхода /posts/ через OFFSET.
+# Колонки: (имя в файле, выражение, вид значения для кодировщика - см. app/services/data_export.py)
+def _export_columns_posts():
+    PostModel = models_module.Post; ChannelModel = models_module.Channel
+    return [
+        ("id", PostModel.id, "int"), ("channel_id", PostModel.channel_id, "int"), ("channel_title", ChannelModel.title, "str"),
+        ("telegram_post_id", PostModel.telegram_post_id, "int"), ("link", PostModel.link, "str"), ("posted_at", PostModel.posted_at, "datetime"),
+        ("edited_at", PostModel.edited_at, "datetime"), ("text_content", PostModel.text_content, "str"), ("caption_text", PostModel.caption_text, "str"),
+        ("media_type", PostModel.media_type, "str"), ("views_count", PostModel.views_count, "int"), ("forwards_count", PostModel.forwards_count, "int"),
+        ("comments_count", PostModel.comments_count, "int"), ("reactions_total", PostModel.reactions_total, "int"), ("reactions", PostModel.reactions, "json"),
+        ("summary_text", PostModel.summary_text, "str"), ("post_sentiment_label", PostModel.post_sentiment_label, "str"),
+        ("post_sentiment_score", PostModel.post_sentiment_score, "float"),
+    ]
+
+def _export_columns_comments():
+    CommentModel = models_module.Comment; PostModel = models_module.Post
+    return [
+        ("id", CommentModel.id, "int"), ("post_id", CommentModel.post_id, "int"), ("channel_id", PostModel.channel_id, "int"),
+        ("telegram_comment_id", CommentModel.telegram_comment_id, "int"), ("reply_to_telegram_comment_id", CommentModel.reply_to_telegram_comment_id, "int"),
+        ("telegram_user_id", CommentModel.telegram_user_id, "int"), ("user_username", CommentModel.user_username, "str"), ("user_fullname", CommentModel.user_fullname, "str"),
+        ("commented_at", CommentModel.commented_at, "datetime"), ("edited_at", CommentModel.edited_at, "datetime"), ("text_content", CommentModel.text_content, "str"),
+        ("media_type", CommentModel.media_type, "str"), ("reactions", CommentModel.reactions, "json"),
+        ("sentiment_label", CommentModel.sentiment_label, "str"), ("sentiment_score", CommentModel.sentiment_score, "float"),
+        ("extracted_topics", CommentModel.extracted_topics, "json"), ("extracted_problems", CommentModel.extracted_problems, "json"),
+        ("extracted_questions", CommentModel.extracted_questions, "json"), ("extracted_suggestions", CommentModel.extracted_suggestions, "json"),
+        ("ai_analysis_completed_at", CommentModel.ai_analysis_completed_at, "datetime"), ("near_duplicate_of_id", CommentModel.near_duplicate_of_id, "int"),
+    ]
+
+def _export_columns_comment_insights():
+    InsightModel = models_module.CommentInsight
+    return [
+        ("id", InsightModel.id, "int"), ("comment_id", InsightModel.comment_id, "int"), ("channel_id", InsightModel.channel_id, "int"),
+        ("commented_at", InsightModel.commented_at, "datetime"), ("insight_type", InsightModel.insight_type, "str"),
+        ("display_text", InsightModel.display_text, "str"), ("normalized_text", InsightModel.normalized_text, "str"),
+    ]
+
+def _export_period_bounds(days_period: Optional[int], start_date: Optional[date], end_date: Optional[date]) -> Tuple[Optional[datetime], Optional[datetime]]:
+    """Период выгрузки [since, until) в UTC: start_date/end_date (end_date включительно) важнее days_period; без фильтров - все время."""
+    if start_date and end_date and start_date > end_date:
+        raise HTTPException(status_code=400, detail="start_date не может быть позже end_date.")
+    since = datetime.combine(start_date, datetime.min.time(), tzinfo=timezone.utc) if start_date else None
+    until = datetime.combine(end_date + timedelta(days=1), datetime.min.time(), tzinfo=timezone.utc) if end_date else None
+    if since is None and days_period is not None:
+        since = datetime.now(timezone.utc) - timedelta(days=days_period)
+    return since, until
+
+def _export_select(columns, channel_id_column, time_column, channel_ids: Optional[List[int]], since: Optional[datetime], until: Optional[datetime]):
+    """SELECT колонок выгрузки с фильтрами UI: только активные каналы (и из channel_ids, если заданы) и период по time_column."""
+    stmt = select(*[expression.label(name) for name, expression, _ in columns]).where(_active_channel_filter(channel_id_column))
+    if channel_ids: stmt = stmt.where(channel_id_column.in_(channel_ids))
+    if since is not None: stmt = stmt.where(time_column >= since)
+    if until is not None: stmt = stmt.where(time_column < until)
+    return stmt
+
+async def _export_response(dataset: str, stmt, columns, export_format: str) -> StreamingResponse:
+    try:
+        ensure_export_format_available(export_format)
+    except ExportFormatUnavailableError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    filename = f"{dataset}_{datetime.now(timezone.utc):%Y%m%d_%H%M%S}.{export_format}"
+    _, session_factory = await read_router.choose() # Долгая выгрузка - на реплике, если есть подходящая
+    return StreamingResponse(
+        stream_export(stmt, [(name, kind) for name, _, kind in columns], export_format, log_label=dataset, session_factory=session_factory),
+        media_type=EXPORT_MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "X-Accel-Buffering": "no"}
+    )
+
+@api_v1_router.get("/export/posts", summary="Выгрузка постов активных каналов потоком (CSV / JSONL / Parquet)")
+async def export_posts(
+    export_format: str = Query(EXPORT_FORMAT_CSV, alias="format", pattern=EXPORT_FORMAT_PATTERN),
+    channel_ids: Optional[List[int]] = Query(None, description="Только эти каналы (параметр можно повторять)"),
+    days_period: Optional[int] = Query(None, ge=1, le=3650, description="Посты за последние N дней (если не задан start_date)"),
+    start_date: Optional[date] = Query(None, description="С даты (UTC, YYYY-MM-DD)"),
+    end_date: Optional[date] = Query(None, description="По дату включительно (UTC, YYYY-MM-DD)"),
+):
+    endpoint_logger.info(f"GET /api/v1/export/posts - format={export_format}, channel_ids={channel_ids}, days_period={days_period}, start_date={start_date}, end_date={end_date}")
+    since, until = _export_period_bounds(days_period, start_date, end_date)
+    PostModel = models_module.Post; columns = _export_columns_posts()
+    stmt = (
+        _export_select(columns, PostModel.channel_id, PostModel.posted_at, channel_ids, since, until)
+        .join(models_module.Channel, PostModel.channel_id == models_module.Channel.id)
+        .order_by(PostModel.posted_at, PostModel.id) # ix_posts_keyset_posted_at
+    )
+    return await _export_response("posts", stmt, columns, export_format)
+
+@api_v1_router.get("/export/comments", summary="Выгрузка комментариев к постам активных каналов потоком (CSV / JSONL / Parquet)")
+async def export_comments(
+    export_format: str = Query(EXPORT_FORMAT_CSV, alias="format", pattern=EXPORT_FORMAT_PATTERN),
+    channel_ids: Optional[List[int]] = Query(None, description="Только комментарии к постам этих каналов (параметр можно повторять)"),
+    days_period: Optional[int] = Query(None, ge=1, le=3650, description="Комментарии за последние N дней (если не задан start_date)"),
+    start_date: Optional[date] = Query(None, description="С даты (UTC, YYYY-MM-DD)"),
+    end_date: Optional[date] = Query(None, description="По дату включительно (UTC, YYYY-MM-DD)"),
+):
+    endpoint_logger.info(f"GET /api/v1/export/comments - format={export_format}, channel_ids={channel_ids}, days_period={days_period}, start_date={start_date}, end_date={end_date}")
+    since, until = _export_period_bounds(days_period, start_date, end_date)
+    CommentModel = models_module.Comment; PostModel = models_module.Post; columns = _export_columns_comments()
+    stmt = (
+        _export_select(columns, PostModel.channel_id, CommentModel.commented_at, channel_ids, since, until) # Период по commented_at - отсечение секций comments
+        .select_from(CommentModel).join(PostModel, CommentModel.post_id == PostModel.id)
+        .order_by(CommentModel.commented_at, CommentModel.id)
+    )
+    return await _export_response("comments", stmt, columns, export_format)
+
+@api_v1_router.get("/export/comment_insights", summary="Выгрузка инсайтов комментариев (темы, проблемы, вопросы, предложения) потоком")
+async def export_comment_insights(
+    export_format: str = Query(EXPORT_FORMAT_CSV, alias="format", pattern=EXPORT_FORMAT_PATTERN),
+    insight_type: Optional[str] = Query(None, pattern="^(topic|problem|question|suggestion)$", description="Только инсайты этого типа"),
+    channel_ids: Optional[List[int]] = Query(None, description="Только эти каналы (параметр можно повторять)"),
+    days_period: Optional[int] = Query(None, ge=1, le=3650, description="Инсайты комментариев за последние N дней (если не задан start_date)"),
+    start_date: Optional[date] = Query(None, description="С даты (UTC, YYYY-MM-DD)"),
+    end_date: Optional[date] = Query(None, description="По дату включительно (UTC, YYYY-MM-DD)"),
+):
+    endpoint_logger.info(f"GET /api/v1/export/comment_insights - format={export_format}, insight_type={insight_type}, channel_ids={channel_ids}, days_period={days_period}, start_date={start_date}, end_date={end_date}")
+    since, until = _export_period_bounds(days_period, start_date, end_date)
+    InsightModel = models_module.CommentInsight; columns = _export_columns_comment_insights()
+    stmt = _export_select(columns, InsightModel.channel_id, InsightModel.commented_at, channel_ids, since, until).order_by(InsightModel.id)
+    if insight_type: stmt = stmt.where(InsightModel.insight_type == insight_type)
+    return await _export_response("comment_insights", stmt, columns, export_format)
+
 # --- Эндпоинты для запуска Celery задач ---
 @api_v1_router.post("/run-collection-task/", summary="Запустить задачу сбора данных")
 async def run_collection_task_endpoint():
@@ -864,7 +1581,248 @@ async def run_periodical_comment_analysis_endpoint(
             detail=f"Не удалось запустить задачи AI-анализа комментариев за период: {str(e)}"
         )
 
+# --- ОФФЛАЙН-РЕЖИМ МАССОВОЙ ОБРАБОТКИ БЭКЛОГА (Batch API) ---
+@api_v1_router.post(
+    "/run-llm-bulk-batch/",
+    response_model=ui_schemas.LLMBulkBatchResponse,
+    summary="Отправить бэклог на AI-анализ пакетами (Batch API)",
+    description="Формирует JSONL-файлы запросов для всех необработанных постов/комментариев, отправляет их в Batch API провайдера (или локальную замену) и записывает результаты в БД по завершении пакетов."
+)
+async def run_llm_bulk_batch_endpoint(request_data: ui_schemas.LLMBulkBatchRequest):
+    endpoint_logger.info(f"POST /run-llm-bulk-batch/ - params: {request_data.model_dump(exclude_none=True)}")
+    launched_tasks_info: List[ui_schemas.TaskInfo] = []
+    channel_ids_for_tasks = request_data.channel_ids if request_data.channel_ids and any(request_data.channel_ids) else None
+    try: ensure_batch_backend_allowed((request_data.backend or settings.LLM_BATCH_BACKEND or "openai").lower())
+    except ValueError as e: raise HTTPException(status_code=400, detail=str(e))
+    try:
+        for kind in dict.fromkeys(request_data.kinds): # Без дублей, порядок сохраняется
+            task = submit_llm_bulk_batch_task.delay(
+                kind=kind.value,
+                channel_ids=channel_ids_for_tasks,
+                start_date_iso=request_data.start_date_str,
+                end_date_iso=request_data.end_date_str,
+                backend_name=request_data.backend
+            )
+            launched_tasks_info.append(ui_schemas.TaskInfo(task_type=f"llm_bulk_batch_{kind.value}", task_id=task.id))
+        return ui_schemas.LLMBulkBatchResponse(
+            message="Задачи формирования пакетов AI-анализа поставлены в очередь.",
+            launched_tasks=launched_tasks_info
+        )
+    except Exception as e:
+        endpoint_logger.error(f"Ошибка при постановке задач пакетного (Batch API) анализа: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Не удалось запустить пакетный анализ: {str(e)}")
+
+@api_v1_router.get("/llm-bulk-batches/", response_model=ui_schemas.LLMBatchJobsResponse, summary="Список пакетов Batch API и их статусы")
+async def get_llm_bulk_batches(
+    status: Optional[str] = Query(None, description="Фильтр по статусу пакета"),
+    limit: int = Query(50, ge=1, le=500),
+    db: AsyncSession = Depends(get_async_db)
+):
+    stmt = select(LLMBatchJob).order_by(LLMBatchJob.id.desc()).limit(limit)
+    if status:
+        stmt = stmt.where(LLMBatchJob.status == status)
+    jobs = (await db.execute(stmt)).scalars().all()
+    return ui_schemas.LLMBatchJobsResponse(jobs=[ui_schemas.LLMBatchJobItem.model_validate(job) for job in jobs])
+
+# --- МЕТРИКИ ВЫЗОВОВ LLM ---
+def _finite_or_none(value: Optional[float]) -> Optional[float]:
+    return None if value is None or value == float("inf") else value
+
+@api_v1_router.get("/llm-metrics/", response_model=ui_schemas.LLMMetricsResponse, summary="Метрики вызовов LLM (задержки, токены, стоимость)")
+async def get_llm_metrics_endpoint(caller: Optional[str] = Query(None, description="Фильтр по вызывающей задаче/эндпоинту")):
+    try:
+        snapshot = await get_llm_metrics_snapshot()
+    except Exception as e:
+        endpoint_logger.error(f"Ошибка чтения метрик LLM из Redis: {e}", exc_info=True)
+        raise HTTPException(status_code=503, detail="Метрики LLM временно недоступны.")
+    if caller:
+        snapshot = [series for series in snapshot if series["caller"] == caller]
+    series_items = []
+    for series in snapshot:
+        series_items.append(ui_schemas.LLMMetricsSeries(**{
+            **series,
+            "latency_p50_seconds": _finite_or_none(series["latency_p50_seconds"]),
+            "latency_p95_seconds": _finite_or_none(series["latency_p95_seconds"]),
+            "latency_buckets": [(_finite_or_none(bound), cumulative) for bound, cumulative in series["latency_buckets"]],
+        }))
+    return ui_schemas.LLMMetricsResponse(
+        series=series_items,
+        total_calls=sum(series["count"] for series in snapshot),
+        total_cost_usd=round(sum(series["cost_usd"] for series in snapshot), 6),
+        circuit_breaker=await get_llm_circuit_breaker().get_state(),
+    )
+
+@api_v1_router.get("/llm-metrics/prometheus", response_class=PlainTextResponse, summary="Метрики вызовов LLM в формате Prometheus")
+async def get_llm_metrics_prometheus_endpoint():
+    try:
+        snapshot = await get_llm_metrics_snapshot()
+    except Exception as e:
+        endpoint_logger.error(f"Ошибка чтения метрик LLM из Redis: {e}", exc_info=True)
+        raise HTTPException(status_code=503, detail="Метрики LLM временно недоступны.")
+    return PlainTextResponse(render_prometheus_text(snapshot), media_type="text/plain; version=0.0.4")
+
+@api_v1_router.get("/db/pools", response_model=ui_schemas.DBPoolsResponse, summary="Пулы соединений и маршрутизация чтения на реплики")
+async def get_db_pools():
+    return ui_schemas.DBPoolsResponse(
+        max_replica_lag_seconds=settings.DB_REPLICA_MAX_LAG_SECONDS,
+        slow_checkout_threshold_ms=settings.DB_POOL_SLOW_CHECKOUT_MS,
+        pgbouncer_mode=settings.DB_PGBOUNCER_MODE,
+        pools=[ui_schemas.DBPoolInfo(**item) for item in read_router.snapshot()],
+    )
+
+@api_v1_router.get("/db/pools/prometheus", response_class=PlainTextResponse, summary="Метрики пулов соединений в формате Prometheus")
+async def get_db_pools_prometheus():
+    return PlainTextResponse(render_pool_metrics_prometheus(read_router.snapshot()), media_type="text/plain; version=0.0.4")
+
+@api_v1_router.get("/llm-call-log/summary", response_model=ui_schemas.LLMCallLogSummaryResponse, summary="Стоимость и производительность вызовов LLM по задачам за период")
+async def get_llm_call_log_summary(
+    hours: int = Query(24, ge=1, le=24 * 90),
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    since = datetime.now(timezone.utc) - timedelta(hours=hours)
+    stmt = (
+        select(
+            LLMCallLog.caller,
+            LLMCallLog.model,
+            func.count(LLMCallLog.id).label("calls"),
+            func.count(LLMCallLog.id).filter(LLMCallLog.outcome != "ok").label("error_calls"),
+            func.avg(LLMCallLog.latency_ms).label("avg_latency_ms"),
+            func.percentile_cont(0.95).within_group(LLMCallLog.latency_ms).label("p95_latency_ms"),
+            func.coalesce(func.sum(LLMCallLog.prompt_tokens), 0).label("prompt_tokens"),
+            func.coalesce(func.sum(LLMCallLog.completion_tokens), 0).label("completion_tokens"),
+            func.coalesce(func.sum(LLMCallLog.cost_usd), 0.0).label("cost_usd"),
+        )
+        .where(LLMCallLog.created_at >= since)
+        .group_by(LLMCallLog.caller, LLMCallLog.model)
+        .order_by(desc("cost_usd"))
+    )
+    rows = (await db.execute(stmt)).all()
+    return ui_schemas.LLMCallLogSummaryResponse(
+        period_hours=hours,
+        items=[
+            ui_schemas.LLMCallLogSummaryItem(
+                caller=row.caller, model=row.model, calls=row.calls, error_calls=row.error_calls,
+                avg_latency_ms=float(row.avg_latency_ms) if row.avg_latency_ms is not None else None,
+                p95_latency_ms=float(row.p95_latency_ms) if row.p95_latency_ms is not None else None,
+                prompt_tokens=int(row.prompt_tokens), completion_tokens=int(row.completion_tokens),
+                cost_usd=round(float(row.cost_usd), 6),
+            )
+            for row in rows
+        ]
+    )
+
 # --- НОВЫЙ ЭНДПОИНТ ДЛЯ ГЕНЕРАЦИИ АНАЛИТИЧЕСКОГО ОТЧЕТА (Кнопка 6) ---
+async def _prepare_analytical_report_context(
+    request_data: ui_schemas.AnalyticalReportRequest,
+    db: AsyncSession
+) -> Tuple[Dict[str, Any], Optional[str], Optional[str]]:
+    """
+    Сбор агрегированных данных и промпта для аналитического отчета.
+    Возвращает (данные для отчета, промпт для LLM, готовый текст) - если промпт None, отчет генерировать не из чего.
+    """
+    start_date_report = date.fromisoformat(request_data.start_date_str)
+    end_date_report = date.fromisoformat(request_data.end_date_str)
+
+    # 1. Определяем каналы для обработки
+    active_channels_subquery_report: Optional[Any] = None # Будет subquery или None
+    report_channel_ids: Optional[List[int]] = None # Явный список - для расчета по снимкам; None - все активные
+    channel_filter_applied = False
+
+    if request_data.channel_ids and any(request_data.channel_ids):
+        stmt_check_channels = select(Channel.id).where(Channel.id.in_(request_data.channel_ids)).where(Channel.is_active == True)
+        active_requested_channels_result = await db.execute(stmt_check_channels)
+        active_ids = active_requested_channels_result.scalars().all()
+        if not active_ids:
+            return {"error": "No active channels found from request."}, None, "Не найдено активных каналов среди запрошенных для генерации отчета."
+        active_channels_subquery_report = select(models_module.Channel.id).where(models_module.Channel.id.in_(active_ids)).subquery("active_channels_for_report")
+        report_channel_ids = list(active_ids)
+        channel_filter_applied = True
+        logger.info(f"Генерация отчета для каналов: {active_ids}, Период: {start_date_report.isoformat()} - {end_date_report.isoformat()}")
+    else:
+        active_channels_subquery_report = select(models_module.Channel.id).where(models_module.Channel.is_active == True).subquery("active_channels_for_report")
+        logger.info(f"Генерация отчета для ВСЕХ активных каналов, Период: {start_date_report.isoformat()} - {end_date_report.isoformat()}")
+
+    # 2. Сбор агрегированных данных (базовая версия)
+    data_for_llm_summary: Dict[str, Any] = {
+        "period_start": start_date_report.isoformat(),
+        "period_end": end_date_report.isoformat(),
+        "channels_info": "Выбранные каналы" if channel_filter_applied else "Все активные каналы",
+        "top_n_insights": request_data.top_n_insights
+    }
+
+    start_datetime = datetime(start_date_report.year, start_date_report.month, start_date_report.day, 0, 0, 0, tzinfo=timezone.utc)
+    end_datetime = datetime(end_date_report.year, end_date_report.month, end_date_report.day, 23, 59, 59, 999999, tzinfo=timezone.utc)
+
+    def top_insights_reader(insight_type: ui_schemas.InsightItemType):
+        async def read(session: AsyncSession) -> List[Dict[str, Any]]:
+            top_items = await _fetch_top_comment_insights(
+                session, insight_type.value, start_datetime, request_data.top_n_insights,
+                end_at=end_datetime, channel_ids_subquery=active_channels_subquery_report
+            )
+            return [{"text": item_text, "count": item_count} for item_text, item_count in top_items]
+        return read
+
+    # Четыре независимых агрегата - параллельно на отдельных соединениях
+    report_sections = {
+        "top_topics": ui_schemas.InsightItemType.TOPIC,
+        "top_problems": ui_schemas.InsightItemType.PROBLEM,
+        "top_questions": ui_schemas.InsightItemType.QUESTION,
+        "top_suggestions": ui_schemas.InsightItemType.SUGGESTION,
+    }
+    section_results = await _lake_top_comment_insights(
+        db, [insight_type.value for insight_type in report_sections.values()], start_datetime, request_data.top_n_insights, end_at=end_datetime, channel_ids=report_channel_ids
+    )
+    if section_results is not None: # Длинный период - по колоночным снимкам через DuckDB
+        section_results = [[{"text": item_text, "count": item_count} for item_text, item_count in items] for items in section_results]
+    else:
+        section_results = await run_concurrent_reads(db, *[top_insights_reader(insight_type) for insight_type in report_sections.values()])
+    data_for_llm_summary.update(zip(report_sections.keys(), section_results))
+
+    # 3. Формирование контекста для LLM
+    context_lines = [
+        f"Аналитический отчет за период с {data_for_llm_summary['period_start']} по {data_for_llm_summary['period_end']}.",
+        f"Анализируемые каналы: {data_for_llm_summary['channels_info']}.",
+        f"Представлены топ-{data_for_llm_summary['top_n_insights']} элементов для каждой категории инсайтов из комментариев.",
+        "\nОсновные обсуждаемые темы:"
+    ]
+    if data_for_llm_summary["top_topics"]:
+        for item in data_for_llm_summary["top_topics"]: context_lines.append(f"- \"{item['text']}\" (упоминаний: {item['count']})")
+    else: context_lines.append("- Данные отсутствуют или не проанализированы.")
+
+    context_lines.append("\nКлючевые проблемы, озвученные пользователями:")
+    if data_for_llm_summary["top_problems"]:
+        for item in data_for_llm_summary["top_problems"]: context_lines.append(f"- \"{item['text']}\" (упоминаний: {item['count']})")
+    else: context_lines.append("- Данные отсутствуют или не проанализированы.")
+
+    context_lines.append("\nЧасто задаваемые вопросы:")
+    if data_for_llm_summary["top_questions"]:
+        for item in data_for_llm_summary["top_questions"]: context_lines.append(f"- \"{item['text']}\" (упоминаний: {item['count']})")
+    else: context_lines.append("- Данные отсутствуют или не проанализированы.")
+
+    context_lines.append("\nПредложения от аудитории:")
+    if data_for_llm_summary["top_suggestions"]:
+        for item in data_for_llm_summary["top_suggestions"]: context_lines.append(f"- \"{item['text']}\" (упоминаний: {item['count']})")
+    else: context_lines.append("- Данные отсутствуют или не проанализированы.")
+
+    llm_context = "\n".join(context_lines)
+
+    # 4. Формирование промпта для LLM
+    llm_prompt = (
+        f"Ты — AI-аналитик, специализирующийся на анализе обсуждений в Telegram-каналах. "
+        f"Твоя задача — на основе предоставленных агрегированных данных написать краткий (3-5 абзацев) связный аналитический отчет на русском языке.\n\n"
+        f"ДАННЫЕ ДЛЯ АНАЛИЗА:\n---\n{llm_context}\n---\n\n"
+        f"В отчете ОБЯЗАТЕЛЬНО:\n"
+        f"1. Кратко опиши общую картину обсуждений за указанный период для указанных каналов.\n"
+        f"2. Если есть данные по темам, выдели 1-2 самые главные темы, которые волновали аудиторию.\n"
+        f"3. Если есть данные по проблемам, укажи 1-2 наиболее существенные проблемы или боли, с которыми сталкивались пользователи.\n"
+        f"4. Если были интересные предложения, упомяни одно из них.\n"
+        f"5. Сделай общий вывод о настроениях или ключевых моментах в обсуждениях за этот период.\n"
+        f"Отвечай как профессиональный аналитик, ясно и по существу. Не выдумывай информацию, которой нет в предоставленных данных. Если по какому-то пункту данных нет, так и укажи (например, 'Предложений от аудитории в данный период выявлено не было')."
+        f"Не повторяй просто список данных, а синтезируй из них текстовый отчет."
+    )
+    endpoint_logger.info(f"Промпт для генерации отчета (начало):\n{llm_prompt[:500]}...")
+    return data_for_llm_summary, llm_prompt, None
+
 @api_v1_router.post(
     "/generate-analytical-report/",
     response_model=ui_schemas.AnalyticalReportResponse,
@@ -878,110 +1836,12 @@ async def generate_analytical_report_endpoint(
     endpoint_logger.info(f"POST /generate-analytical-report/ - params: {request_data.model_dump(exclude_none=True)}")
 
     try:
-        start_date_report = date.fromisoformat(request_data.start_date_str)
-        end_date_report = date.fromisoformat(request_data.end_date_str)
-
-        # 1. Определяем каналы для обработки
-        active_channels_subquery_report: Optional[Any] = None # Будет subquery или None
-        channel_filter_applied = False
-
-        if request_data.channel_ids and any(request_data.channel_ids):
-            stmt_check_channels = select(Channel.id).where(Channel.id.in_(request_data.channel_ids)).where(Channel.is_active == True)
-            active_requested_channels_result = await db.execute(stmt_check_channels)
-            active_ids = active_requested_channels_result.scalars().all()
-            if not active_ids:
-                return ui_schemas.AnalyticalReportResponse(
-                    report_text="Не найдено активных каналов среди запрошенных для генерации отчета.",
-                    data_summary_for_report={"error": "No active channels found from request."}
-                )
-            active_channels_subquery_report = select(models_module.Channel.id).where(models_module.Channel.id.in_(active_ids)).subquery("active_channels_for_report")
-            channel_filter_applied = True
-            logger.info(f"Генерация отчета для каналов: {active_ids}, Период: {start_date_report.isoformat()} - {end_date_report.isoformat()}")
-        else:
-            active_channels_subquery_report = select(models_module.Channel.id).where(models_module.Channel.is_active == True).subquery("active_channels_for_report")
-            logger.info(f"Генерация отчета для ВСЕХ активных каналов, Период: {start_date_report.isoformat()} - {end_date_report.isoformat()}")
-
-        # 2. Сбор агрегированных данных (базовая версия)
-        data_for_llm_summary: Dict[str, Any] = {
-            "period_start": start_date_report.isoformat(),
-            "period_end": end_date_report.isoformat(),
-            "channels_info": "Выбранные каналы" if channel_filter_applied else "Все активные каналы",
-            "top_n_insights": request_data.top_n_insights
-        }
-
-        start_datetime = datetime(start_date_report.year, start_date_report.month, start_date_report.day, 0, 0, 0, tzinfo=timezone.utc)
-        end_datetime = datetime(end_date_report.year, end_date_report.month, end_date_report.day, 23, 59, 59, 999999, tzinfo=timezone.utc)
-
-        async def fetch_top_jsonb_array_elements_for_report(jsonb_field_name: str) -> List[Dict[str, Any]]:
-            comment_jsonb_field = getattr(models_module.Comment, jsonb_field_name)
-            item_text_expression = func.jsonb_array_elements_text(comment_jsonb_field).label("item_text")
-
-            stmt = (
-                select(item_text_expression, func.count().label("item_count"))
-                .select_from(models_module.Comment)
-                .join(models_module.Post, models_module.Comment.post_id == models_module.Post.id)
-                .join(active_channels_subquery_report, models_module.Post.channel_id == active_channels_subquery_report.c.id)
-                .where(models_module.Comment.commented_at >= start_datetime)
-                .where(models_module.Comment.commented_at <= end_datetime)
-                .where(models_module.Comment.ai_analysis_completed_at.isnot(None))
-                .where(comment_jsonb_field.isnot(None))
-                .where(func.jsonb_typeof(comment_jsonb_field) == 'array')
-                .where(func.jsonb_array_length(comment_jsonb_field) > 0)
-                .group_by(item_text_expression)
-                .order_by(desc(literal_column("item_count")), literal_column("item_text").asc())
-                .limit(request_data.top_n_insights)
+        data_for_llm_summary, llm_prompt, ready_report_text = await _prepare_analytical_report_context(request_data, db)
+        if llm_prompt is None:
+            return ui_schemas.AnalyticalReportResponse(
+                report_text=ready_report_text,
+                data_summary_for_report=data_for_llm_summary
             )
-            results = await db.execute(stmt)
-            return [{"text": str(row.item_text), "count": row.item_count} for row in results.all()]
-
-        data_for_llm_summary["top_topics"] = await fetch_top_jsonb_array_elements_for_report("extracted_topics")
-        data_for_llm_summary["top_problems"] = await fetch_top_jsonb_array_elements_for_report("extracted_problems")
-        data_for_llm_summary["top_questions"] = await fetch_top_jsonb_array_elements_for_report("extracted_questions")
-        data_for_llm_summary["top_suggestions"] = await fetch_top_jsonb_array_elements_for_report("extracted_suggestions")
-
-        # 3. Формирование контекста для LLM
-        context_lines = [
-            f"Аналитический отчет за период с {data_for_llm_summary['period_start']} по {data_for_llm_summary['period_end']}.",
-            f"Анализируемые каналы: {data_for_llm_summary['channels_info']}.",
-            f"Представлены топ-{data_for_llm_summary['top_n_insights']} элементов для каждой категории инсайтов из комментариев.",
-            "\nОсновные обсуждаемые темы:"
-        ]
-        if data_for_llm_summary["top_topics"]:
-            for item in data_for_llm_summary["top_topics"]: context_lines.append(f"- \"{item['text']}\" (упоминаний: {item['count']})")
-        else: context_lines.append("- Данные отсутствуют или не проанализированы.")
-
-        context_lines.append("\nКлючевые проблемы, озвученные пользователями:")
-        if data_for_llm_summary["top_problems"]:
-            for item in data_for_llm_summary["top_problems"]: context_lines.append(f"- \"{item['text']}\" (упоминаний: {item['count']})")
-        else: context_lines.append("- Данные отсутствуют или не проанализированы.")
-
-        context_lines.append("\nЧасто задаваемые вопросы:")
-        if data_for_llm_summary["top_questions"]:
-            for item in data_for_llm_summary["top_questions"]: context_lines.append(f"- \"{item['text']}\" (упоминаний: {item['count']})")
-        else: context_lines.append("- Данные отсутствуют или не проанализированы.")
-
-        context_lines.append("\nПредложения от аудитории:")
-        if data_for_llm_summary["top_suggestions"]:
-            for item in data_for_llm_summary["top_suggestions"]: context_lines.append(f"- \"{item['text']}\" (упоминаний: {item['count']})")
-        else: context_lines.append("- Данные отсутствуют или не проанализированы.")
-
-        llm_context = "\n".join(context_lines)
-
-        # 4. Формирование промпта для LLM
-        llm_prompt = (
-            f"Ты — AI-аналитик, специализирующийся на анализе обсуждений в Telegram-каналах. "
-            f"Твоя задача — на основе предоставленных агрегированных данных написать краткий (3-5 абзацев) связный аналитический отчет на русском языке.\n\n"
-            f"ДАННЫЕ ДЛЯ АНАЛИЗА:\n---\n{llm_context}\n---\n\n"
-            f"В отчете ОБЯЗАТЕЛЬНО:\n"
-            f"1. Кратко опиши общую картину обсуждений за указанный период для указанных каналов.\n"
-            f"2. Если есть данные по темам, выдели 1-2 самые главные темы, которые волновали аудиторию.\n"
-            f"3. Если есть данные по проблемам, укажи 1-2 наиболее существенные проблемы или боли, с которыми сталкивались пользователи.\n"
-            f"4. Если были интересные предложения, упомяни одно из них.\n"
-            f"5. Сделай общий вывод о настроениях или ключевых моментах в обсуждениях за этот период.\n"
-            f"Отвечай как профессиональный аналитик, ясно и по существу. Не выдумывай информацию, которой нет в предоставленных данных. Если по какому-то пункту данных нет, так и укажи (например, 'Предложений от аудитории в данный период выявлено не было')."
-            f"Не повторяй просто список данных, а синтезируй из них текстовый отчет."
-        )
-        endpoint_logger.info(f"Промпт для генерации отчета (начало):\n{llm_prompt[:500]}...")
 
         # 5. Запрос к LLM
         report_text = await одиночный_запрос_к_llm(
@@ -989,7 +1849,8 @@ async def generate_analytical_report_endpoint(
             модель=settings.OPENAI_DEFAULT_MODEL_FOR_TASKS or "gpt-3.5-turbo-1106",
             температура=0.5,
             макс_токены=1000,
-            is_json_response_expected=False
+            is_json_response_expected=False,
+            caller="api.generate_insights_report"
         )
         if not report_text:
             report_text = "Не удалось сгенерировать отчет с помощью AI. Попробуйте позже или с другими параметрами."
@@ -1002,10 +1863,37 @@ async def generate_analytical_report_endpoint(
 
     except HTTPException:
         raise
+    except LLMThrottledError as e_throttled:
+        endpoint_logger.warning(f"LLM перегружен при генерации аналитического отчета: {e_throttled}")
+        raise HTTPException(status_code=503, detail="AI-сервис сейчас перегружен. Повторите попытку позже.")
     except Exception as e_main:
         endpoint_logger.error(f"Общая ошибка при генерации аналитического отчета: {e_main}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Внутренняя ошибка сервера при генерации отчета: {e_main}")
 
+@api_v1_router.post(
+    "/generate-analytical-report/stream",
+    summary="Сгенерировать аналитический отчет: потоковый ответ (SSE)",
+    description="Сначала отдает агрегированные данные за период (событие 'context'), затем текст отчета по мере генерации LLM (события 'token') и итог ('done')."
+)
+async def generate_analytical_report_stream_endpoint(
+    request_data: ui_schemas.AnalyticalReportRequest,
+    db: AsyncSession = Depends(get_async_db)
+):
+    endpoint_logger.info(f"POST /generate-analytical-report/stream - params: {request_data.model_dump(exclude_none=True)}")
+    try:
+        data_for_llm_summary, llm_prompt, ready_report_text = await _prepare_analytical_report_context(request_data, db)
+    except Exception as e_main:
+        endpoint_logger.error(f"Ошибка при сборе данных для потокового отчета: {e_main}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Внутренняя ошибка сервера при подготовке данных отчета: {e_main}")
+    return _sse_response(_stream_llm_answer_as_sse(
+        data_for_llm_summary, llm_prompt, ready_report_text,
+        caller="api.generate_insights_report_stream",
+        температура=0.5,
+        макс_токены=1000,
+        empty_answer_text="Не удалось сгенерировать отчет с помощью AI. Попробуйте позже или с другими параметрами.",
+        throttled_answer_text="AI-сервис сейчас перегружен. Повторите попытку позже.",
+    ))
+
 
 # --- НОВЫЙ ЭНДПОИНТ ДЛЯ ПОЛУЧЕНИЯ СТАТУСА CELERY ЗАДАЧИ ---
 @api_v1_router.get("/task-status/{task_id}", response_model=TaskStatusResponse, summary="Получить статус Celery задачи")
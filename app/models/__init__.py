@@ -1,2 +1,7 @@
 # app/models/__init__.py
-from .telegram_data import Channel, Post, Comment
\ No newline at end of file
+from .telegram_data import Channel, Post, Comment
+from .llm_batch import LLMBatchJob
+from .llm_call_log import LLMCallLog
+from .comment_insight import CommentInsight
+from .channel_daily_stats import ChannelDailyStats
+from .insight_canonical import InsightCanonical, InsightAlias
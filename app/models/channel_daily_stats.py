@@ -0,0 +1,28 @@
+# app/models/channel_daily_stats.py
+from sqlalchemy import Column, BigInteger, Integer, Date, DateTime, ForeignKey
+from sqlalchemy.sql import func
+from app.db.base_class import Base
+
+class ChannelDailyStats(Base):
+    """
+    Дневные агрегаты по каналу (UTC-день): дашборд читает короткие диапазоны этой таблицы вместо count(*) по posts/comments.
+    Посты учитываются в день posted_at, комментарии - в день commented_at. Строки пересчитываются задачами сбора и анализа
+    (tasks._refresh_channel_daily_stats) и сверяются с сырыми таблицами задачей tasks.reconcile_channel_daily_stats.
+    """
+    __tablename__ = "channel_daily_stats"
+
+    channel_id = Column(BigInteger, ForeignKey("channels.id", ondelete="CASCADE"), primary_key=True)
+    day = Column(Date, primary_key=True, index=True, comment="UTC-день")
+    post_count = Column(Integer, nullable=False, default=0)
+    comment_count = Column(Integer, nullable=False, default=0)
+    posts_sentiment_analyzed = Column(Integer, nullable=False, default=0, comment="Постов с определенной тональностью (любой меткой)")
+    posts_positive = Column(Integer, nullable=False, default=0)
+    posts_negative = Column(Integer, nullable=False, default=0)
+    posts_neutral = Column(Integer, nullable=False, default=0)
+    posts_mixed = Column(Integer, nullable=False, default=0)
+    views_sum = Column(BigInteger, nullable=False, default=0)
+    reactions_sum = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+
+    def __repr__(self):
+        return f"<ChannelDailyStats(channel_id={self.channel_id}, day={self.day}, posts={self.post_count}, comments={self.comment_count})>"
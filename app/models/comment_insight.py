@@ -0,0 +1,36 @@
+# app/models/comment_insight.py
+from sqlalchemy import Column, BigInteger, Integer, String, DateTime, ForeignKey, ForeignKeyConstraint, Index, text
+from app.db.base_class import Base
+
+class CommentInsight(Base):
+    """
+    Нормализованные результаты AI-анализа комментариев: одна строка на (комментарий, тип, инсайт).
+    Заполняется вместе с Comment.extracted_* (tasks._sync_comment_insights), чтобы топы и тренды считались
+    агрегатом по индексу, а не разворачиванием JSONB всех комментариев периода.
+    """
+    __tablename__ = "comment_insights"
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    comment_id = Column(Integer, nullable=False, index=True)
+    insight_type = Column(String(20), nullable=False, comment="topic / problem / question / suggestion")
+    normalized_text = Column(String(300), nullable=False, comment="Ключ группировки: trim, схлопнутые пробелы, нижний регистр")
+    display_text = Column(String(300), nullable=False, comment="Текст инсайта в том виде, в каком его вернул AI")
+    commented_at = Column(DateTime(timezone=True), nullable=False, comment="Копия Comment.commented_at")
+    channel_id = Column(BigInteger, ForeignKey("channels.id", ondelete="CASCADE"), nullable=False, comment="Копия Post.channel_id")
+    canonical_id = Column(Integer, ForeignKey("insight_canonicals.id", ondelete="SET NULL"), nullable=True, comment="Канонический инсайт (insight_canonicals); NULL - еще не канонизирован")
+
+    __table_args__ = (
+        # comments секционирована по commented_at - ссылка по полному первичному ключу
+        ForeignKeyConstraint([comment_id, commented_at], ["comments.id", "comments.commented_at"], ondelete="CASCADE"),
+        # Топ-N за период: index-only scan по диапазону дат одного типа
+        Index("ix_comment_insights_type_commented_at", insight_type, commented_at, postgresql_include=["canonical_id", "normalized_text", "display_text", "channel_id"]),
+        # Тренд конкретного инсайта
+        Index("ix_comment_insights_type_normalized_text", insight_type, normalized_text, commented_at, postgresql_include=["channel_id"]),
+        # Тренд канонического инсайта (все его формулировки)
+        Index("ix_comment_insights_canonical_commented_at", canonical_id, commented_at, postgresql_include=["channel_id"]),
+        # Очередь задачи канонизации
+        Index("ix_comment_insights_not_canonicalized", insight_type, normalized_text, postgresql_where=text("canonical_id IS NULL")),
+    )
+
+    def __repr__(self):
+        return f"<CommentInsight(id={self.id}, comment_id={self.comment_id}, insight_type='{self.insight_type}', normalized_text='{self.normalized_text[:30]}')>"
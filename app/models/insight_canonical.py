@@ -0,0 +1,45 @@
+# app/models/insight_canonical.py
+from sqlalchemy import Column, Integer, String, DateTime, LargeBinary, ForeignKey, UniqueConstraint, Index
+from sqlalchemy.sql import func
+from app.db.base_class import Base
+
+class InsightCanonical(Base):
+    """
+    Канонический инсайт: группа вариантов формулировки одного инсайта (регистр, пунктуация, словоформы, близкие синонимы).
+    Пополняется задачей tasks.canonicalize_insights (app/services/insight_canonicalization.py); топы и тренды группируются
+    по comment_insights.canonical_id - целочисленному ключу вместо текста.
+    """
+    __tablename__ = "insight_canonicals"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    insight_type = Column(String(20), nullable=False, comment="topic / problem / question / suggestion")
+    canonical_key = Column(String(300), nullable=False, comment="Леммы значимых слов по алфавиту (см. canonical_insight_key)")
+    display_text = Column(String(300), nullable=False, comment="Формулировка для показа - первая встреченная")
+    embedding = Column(LargeBinary, nullable=True, comment="Эмбеддинг display_text (float16, L2-нормирован) для присоединения синонимов")
+    embedding_model = Column(String(200), nullable=True, comment="Провайдер/модель эмбеддинга")
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint(insight_type, canonical_key, name="uq_insight_canonicals_type_key"),
+    )
+
+    def __repr__(self):
+        return f"<InsightCanonical(id={self.id}, insight_type='{self.insight_type}', display_text='{self.display_text[:30]}')>"
+
+class InsightAlias(Base):
+    """Словарь: нормализованный текст инсайта (comment_insights.normalized_text) -> канонический инсайт."""
+    __tablename__ = "insight_aliases"
+
+    insight_type = Column(String(20), primary_key=True)
+    normalized_text = Column(String(300), primary_key=True)
+    canonical_id = Column(Integer, ForeignKey("insight_canonicals.id", ondelete="CASCADE"), nullable=False, index=True)
+    similarity = Column(Integer, nullable=True, comment="Близость эмбеддингов x1000, если присоединен по эмбеддингу; NULL - по ключу")
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False, index=True)
+
+    __table_args__ = (
+        # Поиск формулировок по подстроке (тренд в режиме contains, /insights/autocomplete) - триграммы pg_trgm
+        Index("ix_insight_aliases_normalized_text_trgm", normalized_text, postgresql_using="gin", postgresql_ops={"normalized_text": "gin_trgm_ops"}),
+    )
+
+    def __repr__(self):
+        return f"<InsightAlias(insight_type='{self.insight_type}', normalized_text='{self.normalized_text[:30]}', canonical_id={self.canonical_id})>"
@@ -0,0 +1,33 @@
+# app/models/llm_batch.py
+from sqlalchemy import Column, Integer, String, Text, DateTime
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.sql import func
+from app.db.base_class import Base
+
+class LLMBatchJob(Base):
+    __tablename__ = "llm_batch_jobs"
+
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    kind = Column(String(50), nullable=False, index=True, comment="Тип пакета: post_summary / post_sentiment / comment_features")
+    backend = Column(String(20), nullable=False, comment="Исполнитель пакета: openai (Batch API) или local (локальная замена)")
+    provider_batch_id = Column(String(255), nullable=True, index=True, comment="ID пакета у провайдера (или локальный ID)")
+    status = Column(String(30), nullable=False, index=True, comment="submitted / in_progress / completed / ingested / failed / expired / cancelled")
+
+    input_file_path = Column(String(1024), nullable=False, comment="Путь к JSONL-файлу запросов")
+    output_file_id = Column(String(255), nullable=True, comment="ID (или путь) файла результатов у провайдера")
+    item_ids = Column(JSONB, nullable=False, comment="ID постов/комментариев в пакете (чтобы не отправлять их повторно, пока пакет в работе)")
+    filters = Column(JSONB, nullable=True, comment="Параметры отбора бэклога (каналы, даты)")
+
+    request_count = Column(Integer, default=0, nullable=False)
+    succeeded_count = Column(Integer, default=0, nullable=False, comment="Сколько результатов записано в БД")
+    failed_count = Column(Integer, default=0, nullable=False, comment="Сколько запросов завершились ошибкой или невалидным ответом")
+    poll_attempts = Column(Integer, default=0, nullable=False)
+    error = Column(Text, nullable=True)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+    completed_at = Column(DateTime(timezone=True), nullable=True, comment="Когда провайдер завершил пакет")
+    ingested_at = Column(DateTime(timezone=True), nullable=True, comment="Когда результаты записаны в posts/comments")
+
+    def __repr__(self):
+        return f"<LLMBatchJob(id={self.id}, kind='{self.kind}', status='{self.status}', requests={self.request_count})>"
@@ -0,0 +1,22 @@
+# app/models/llm_call_log.py
+from sqlalchemy import Column, BigInteger, Integer, String, Float, DateTime
+from app.db.base_class import Base
+
+class LLMCallLog(Base):
+    __tablename__ = "llm_call_log"
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    created_at = Column(DateTime(timezone=True), nullable=False, index=True, comment="Время вызова (по часам воркера)")
+    caller = Column(String(100), nullable=False, index=True, comment="Вызывающая задача Celery или эндпоинт API")
+    model = Column(String(100), nullable=False, index=True)
+    outcome = Column(String(30), nullable=False, comment="ok / empty / throttled / http_error / network_error / error")
+    status_code = Column(Integer, nullable=True, comment="HTTP-статус ответа провайдера (NULL - ответа не было)")
+    attempt = Column(Integer, nullable=False, comment="Номер попытки в пределах одного логического запроса (с 1)")
+    latency_ms = Column(Float, nullable=False)
+    prompt_tokens = Column(Integer, nullable=False, default=0)
+    completion_tokens = Column(Integer, nullable=False, default=0)
+    estimated_prompt_tokens = Column(Integer, nullable=False, default=0, comment="Локальная оценка tiktoken до отправки")
+    cost_usd = Column(Float, nullable=False, default=0.0, comment="Оценка стоимости по LLM_PRICING_USD_PER_1K_TOKENS")
+
+    def __repr__(self):
+        return f"<LLMCallLog(id={self.id}, caller='{self.caller}', model='{self.model}', outcome='{self.outcome}', latency_ms={self.latency_ms})>"
@@ -1,8 +1,8 @@
 # app/models/telegram_data.py
-from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, ForeignKey, BigInteger, Float
-from sqlalchemy.dialects.postgresql import JSONB # Для хранения JSON данных
+from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, ForeignKey, BigInteger, Float, Index, Computed
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR # JSONB - для хранения JSON данных, TSVECTOR - полнотекстовый поиск
 from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, literal_column
 from app.db.base_class import Base
 # from typing import Optional # Для type hinting в Python, не для SQLAlchemy напрямую - можно убрать, если не используется для типизации внутри файла
 from datetime import datetime as Pydatetime # Чтобы не путать с SQLAlchemy DateTime
@@ -42,11 +42,12 @@ class Post(Base):
     summary_text = Column(Text, nullable=True, comment="Суммаризация поста (AI)")
     post_sentiment_label = Column(String(50), nullable=True, index=True, comment="Метка тональности текста поста") # Добавил index=True
     post_sentiment_score = Column(Float, nullable=True, comment="Числовая оценка тональности текста поста")
+    post_sentiment_source = Column(String(20), nullable=True, index=True, comment="Источник решения о тональности: local / llm / llm_batch / no_text")
+    post_sentiment_confidence = Column(Float, nullable=True, comment="Уверенность локального классификатора тональности (для аудита каскада)")
 
     # --- НОВЫЕ ПОЛЯ ДЛЯ РАСШИРЕННОГО СБОРА ДАННЫХ ---
     reactions = Column(JSONB, nullable=True, comment="Данные о реакциях на пост (список объектов ReactionCount)")
-    # reactions_total_sum - было предложение добавить его в предыдущих шагах для сортировки, если оно есть - хорошо, если нет, можно добавить позже или считать на лету.
-    # Если вы его добавили, оно должно быть здесь. Для примера ниже я его не добавляю, так как его не было в вашем исходном коде.
+    reactions_total = Column(Integer, default=0, server_default="0", nullable=False, index=True, comment="Сумма count по всем реакциям поста (пересчитывается сборщиком при записи reactions)")
     
     media_type = Column(String(50), nullable=True, comment="Тип медиавложения (photo, video, poll, etc.)")
     media_content_info = Column(JSONB, nullable=True, comment="Дополнительная информация о медиа (URL, длительность, варианты опроса и т.д.)")
@@ -67,6 +68,25 @@ class Post(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False, comment="Время добавления в нашу БД")
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
 
+    # Полнотекстовый поиск (русская конфигурация): текст и подпись к медиа - вес A, AI-резюме - вес B.
+    # Колонка генерируется самим Postgres, сборщик ее не пишет
+    search_vector = Column(TSVECTOR, Computed(
+        "setweight(to_tsvector('russian'::regconfig, coalesce(text_content, '') || ' ' || coalesce(caption_text, '')), 'A') || "
+        "setweight(to_tsvector('russian'::regconfig, coalesce(summary_text, '')), 'B')",
+        persisted=True
+    ), nullable=True, comment="tsvector для полнотекстового поиска по тексту, подписи и резюме поста")
+
+    # Keyset-пагинация списка постов: по индексу (ключ сортировки, id) на каждое поле PostSortByField.
+    # Выражения coalesce(..., -1) должны совпадать с _post_sort_expression в main.py
+    __table_args__ = (
+        Index("ix_posts_keyset_posted_at", posted_at, id),
+        Index("ix_posts_keyset_comments_count", comments_count, id),
+        Index("ix_posts_keyset_views_count", func.coalesce(views_count, literal_column("-1")), id),
+        Index("ix_posts_keyset_forwards_count", func.coalesce(forwards_count, literal_column("-1")), id),
+        Index("ix_posts_keyset_reactions_total", reactions_total, id),
+        Index("ix_posts_search_vector", search_vector, postgresql_using="gin"),
+    )
+
     channel = relationship("Channel", back_populates="posts")
     comments = relationship("Comment", back_populates="post", cascade="all, delete-orphan", order_by="Comment.commented_at") # Добавил order_by для комментариев
 
@@ -85,7 +105,8 @@ class Comment(Base):
     user_fullname = Column(String(255), nullable=True, comment="Полное имя пользователя-автора")
     
     text_content = Column(Text, nullable=True, comment="Текст комментария (может быть null, если только медиа)") # Изменил nullable=False на nullable=True
-    commented_at = Column(DateTime(timezone=True), nullable=False, index=True, comment="Время публикации комментария") # Добавил index=True
+    # Ключ секционирования: таблица comments разбита на помесячные секции по commented_at, поэтому он входит в первичный ключ
+    commented_at = Column(DateTime(timezone=True), primary_key=True, nullable=False, index=True, comment="Время публикации комментария") # Добавил index=True
     
     sentiment_score = Column(Float, nullable=True, comment="Оценка тональности (AI) комментария")
     sentiment_label = Column(String(50), nullable=True, index=True, comment="Метка тональности (AI) комментария") # Добавил index=True
@@ -107,6 +128,28 @@ class Comment(Base):
     ai_analysis_completed_at = Column(DateTime(timezone=True), nullable=True, index=True, comment="AI: Время последнего анализа комментария") # Добавил index=True
     # --- КОНЕЦ НОВЫХ ПОЛЕЙ ---
 
+    # Кластеры почти-дубликатов: AI-анализ выполняется только для представителя, результаты копируются участникам
+    text_simhash = Column(BigInteger, nullable=True, index=True, comment="64-битная SimHash-подпись нормализованного текста (знаковая)")
+    # Без внешнего ключа: на секционированную таблицу можно ссылаться только по полному первичному ключу (id, commented_at)
+    near_duplicate_of_id = Column(Integer, nullable=True, index=True, comment="Представитель кластера почти-дубликатов (NULL - комментарий сам представитель)")
+
+    search_vector = Column(TSVECTOR, Computed("to_tsvector('russian'::regconfig, coalesce(text_content, ''))", persisted=True), nullable=True, comment="tsvector для полнотекстового поиска по тексту комментария")
+
+    # Индексы по 16-битным полосам SimHash: кандидаты в почти-дубликаты ищутся по точному совпадению хотя бы одной полосы
+    __table_args__ = (
+        Index("ix_comments_simhash_band_0", text_simhash.op("&")(65535)),
+        Index("ix_comments_simhash_band_1", text_simhash.op(">>")(16).op("&")(65535)),
+        Index("ix_comments_simhash_band_2", text_simhash.op(">>")(32).op("&")(65535)),
+        Index("ix_comments_simhash_band_3", text_simhash.op(">>")(48).op("&")(65535)),
+        # Keyset-пагинация комментариев поста в порядке (commented_at, id)
+        Index("ix_comments_keyset_post_commented_at", post_id, commented_at, id),
+        Index("ix_comments_search_vector", search_vector, postgresql_using="gin"),
+        # Помесячные секции создает и отсоединяет задача tasks.maintain_comment_partitions (см. app/services/partitioning.py)
+        {"postgresql_partition_by": "RANGE (commented_at)"},
+    )
+    # Для ORM комментарий по-прежнему идентифицируется одним id (session.get, bulk UPDATE по id)
+    __mapper_args__ = {"primary_key": [id]}
+
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False, comment="Время добавления в нашу БД")
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
 
@@ -2,7 +2,7 @@
 
 from pydantic import BaseModel, Field, field_validator, model_validator, FieldValidationInfo # UPDATED: Added FieldValidationInfo
 from datetime import datetime, date
-from typing import List, Optional, Any, Dict
+from typing import List, Optional, Any, Dict, Tuple
 from enum import Enum
 from app.core.config import settings # Импортируем settings для доступа к COMMENT_FETCH_LIMIT
 
@@ -27,9 +27,11 @@ class PostListItem(BaseModel):
     summary_text: Optional[str] = None
     post_sentiment_label: Optional[str] = None
     post_sentiment_score: Optional[float] = None
+    post_sentiment_source: Optional[str] = None # local / llm / llm_batch / no_text
     views_count: Optional[int] = None
     forwards_count: Optional[int] = None
     reactions: Optional[List[Dict[str, Any]]] = None
+    reactions_total: int = 0
     media_type: Optional[str] = None
     reply_to_telegram_post_id: Optional[int] = None
     author_signature: Optional[str] = None
@@ -37,12 +39,16 @@ class PostListItem(BaseModel):
     grouped_id: Optional[int] = None
     edited_at: Optional[datetime] = None
     is_pinned: Optional[bool] = None
+    search_rank: Optional[float] = None # Только при search_query: ts_rank
+    search_snippet: Optional[str] = None # Только при search_query: фрагменты с совпадениями в <mark>...</mark>, текст не экранирован
 
     class Config:
         from_attributes = True
 
 class PaginatedPostsResponse(BaseModel):
-    total_posts: int
+    total_posts: Optional[int] = None # None при total_mode=none
+    total_is_approximate: bool = False
+    next_cursor: Optional[str] = None # Курсор следующей страницы; None - страница последняя
     posts: List[PostListItem]
 
 class CommentListItem(BaseModel):
@@ -50,14 +56,44 @@ class CommentListItem(BaseModel):
     author_display_name: str
     text: Optional[str] = None
     commented_at: datetime
+    search_rank: Optional[float] = None # Только при поиске: ts_rank
+    search_snippet: Optional[str] = None # Только при поиске: фрагменты с совпадениями в <mark>...</mark>, текст не экранирован
 
     class Config:
         from_attributes = True
 
 class PaginatedCommentsResponse(BaseModel):
-    total_comments: int
+    total_comments: Optional[int] = None # None при total_mode=none
+    total_is_approximate: bool = False
+    next_cursor: Optional[str] = None
     comments: List[CommentListItem]
 
+class CommentSearchItem(CommentListItem):
+    post_id: int
+    post_link: str
+    channel: ChannelInfo
+
+class CommentSearchResponse(BaseModel):
+    next_cursor: Optional[str] = None
+    comments: List[CommentSearchItem]
+
+class SemanticSearchHit(BaseModel):
+    kind: str # post | comment | insight
+    id: int # id поста / комментария; для инсайта - id канонического инсайта (insight_canonicals)
+    score: float # Косинусная близость к запросу
+    text: Optional[str] = None
+    channel: Optional[ChannelInfo] = None # Для постов и комментариев
+    post_id: Optional[int] = None
+    post_link: Optional[str] = None
+    published_at: Optional[datetime] = None
+    insight_type: Optional[str] = None # Для инсайтов
+    mention_count: Optional[int] = None # Для инсайтов: упоминаний за период в выбранных каналах
+
+class SemanticSearchResponse(BaseModel):
+    query: str
+    model: str
+    hits: List[SemanticSearchHit]
+
 class DashboardStatsResponse(BaseModel):
     total_posts_all_time: int
     total_comments_all_time: int
@@ -138,6 +174,13 @@ class CommentInsightsResponse(BaseModel):
     top_questions: List[InsightItem]
     top_suggestions: List[InsightItem]
 
+class DashboardBundleResponse(BaseModel):
+    stats: DashboardStatsResponse
+    activity: ActivityOverTimeResponse
+    top_channels: TopChannelsResponse
+    sentiment: SentimentDistributionResponse
+    comment_insights: CommentInsightsResponse
+
 class InsightItemType(str, Enum):
     TOPIC = "topic"
     PROBLEM = "problem"
@@ -159,6 +202,16 @@ class InsightItemTrendResponse(BaseModel):
     granularity: TrendGranularity
     trend_data: List[InsightTrendDataPoint]
 
+class InsightAutocompleteItem(BaseModel):
+    insight_type: InsightItemType
+    text: str # Формулировка канонического инсайта
+    matched_text: str # Нормализованная формулировка, совпавшая с запросом
+    canonical_id: int
+
+class InsightAutocompleteResponse(BaseModel):
+    query: str
+    items: List[InsightAutocompleteItem]
+
 class NLQueryRequest(BaseModel):
     query_text: str = Field(..., min_length=3, description="Текст вопроса пользователя на естественном языке")
     days_period: Optional[int] = Field(None, ge=1, le=365, description="Период в днях для контекста (если релевантно)")
@@ -329,4 +382,129 @@ class AnalyticalReportResponse(BaseModel):
     data_summary_for_report: Optional[Dict[str, Any]] = Field(None, description="Краткое содержание данных, использованных для генерации отчета (для отладки или информации)")
     # Можно добавить task_id, если решим сделать это асинхронным в будущем
 
-# --- КОНЕЦ: Схемы для генерации аналитического отчета ---
\ No newline at end of file
+# --- КОНЕЦ: Схемы для генерации аналитического отчета ---
+
+# --- НАЧАЛО: Схемы для оффлайн-режима массовой обработки бэклога (Batch API) ---
+
+class LLMBatchKind(str, Enum):
+    POST_SUMMARY = "post_summary"
+    POST_SENTIMENT = "post_sentiment"
+    COMMENT_FEATURES = "comment_features"
+
+class LLMBulkBatchRequest(BaseModel):
+    kinds: List[LLMBatchKind] = Field(default_factory=lambda: list(LLMBatchKind), description="Какие виды анализа отправить пакетами")
+    channel_ids: Optional[List[int]] = Field(None, description="Список ID каналов. Если None или пустой - все активные (если не заданы даты).")
+    start_date_str: Optional[str] = Field(None, description="Дата начала периода для постов (YYYY-MM-DD), необязательно")
+    end_date_str: Optional[str] = Field(None, description="Дата конца периода для постов (YYYY-MM-DD), необязательно")
+    backend: Optional[str] = Field(None, pattern="^(openai|local)$", description="Исполнитель пакетов; по умолчанию LLM_BATCH_BACKEND")
+
+    @field_validator('start_date_str', 'end_date_str')
+    @classmethod
+    def validate_date_format_bulk_batch(cls, v: Optional[str]) -> Optional[str]: # Уникальное имя
+        if v is None:
+            return v
+        try:
+            date.fromisoformat(v)
+        except ValueError:
+            raise ValueError(f"Неверный формат даты: {v}. Ожидается YYYY-MM-DD.")
+        return v
+
+    @model_validator(mode='after')
+    def check_dates_order_bulk_batch(self) -> 'LLMBulkBatchRequest': # Уникальное имя
+        if self.start_date_str and self.end_date_str:
+            if date.fromisoformat(self.start_date_str) > date.fromisoformat(self.end_date_str):
+                raise ValueError("start_date_str не может быть позже end_date_str")
+        return self
+
+class LLMBulkBatchResponse(BaseModel):
+    message: str
+    launched_tasks: List[TaskInfo] = Field(default_factory=list)
+
+class LLMBatchJobItem(BaseModel):
+    id: int
+    kind: str
+    backend: str
+    provider_batch_id: Optional[str] = None
+    status: str
+    request_count: int
+    succeeded_count: int
+    failed_count: int
+    poll_attempts: int
+    error: Optional[str] = None
+    created_at: datetime
+    completed_at: Optional[datetime] = None
+    ingested_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+class LLMBatchJobsResponse(BaseModel):
+    jobs: List[LLMBatchJobItem]
+
+# --- КОНЕЦ: Схемы для оффлайн-режима массовой обработки бэклога ---
+
+# --- НАЧАЛО: Схемы для метрик вызовов LLM ---
+class LLMMetricsSeries(BaseModel):
+    caller: str
+    model: str
+    outcome: str
+    count: int
+    latency_sum_seconds: float
+    latency_p50_seconds: Optional[float] = None # Оценка по корзинам гистограммы (верхняя граница корзины)
+    latency_p95_seconds: Optional[float] = None
+    latency_buckets: List[Tuple[Optional[float], int]] = Field(default_factory=list, description="Кумулятивные корзины (верхняя граница в сек, None - +Inf; число вызовов)")
+    prompt_tokens: int
+    completion_tokens: int
+    cost_usd: float
+
+class LLMMetricsResponse(BaseModel):
+    series: List[LLMMetricsSeries]
+    total_calls: int
+    total_cost_usd: float
+    circuit_breaker: Dict[str, Any] = Field(default_factory=dict, description="Состояние предохранителя LLM: closed / open / half_open")
+
+class LLMCallLogSummaryItem(BaseModel):
+    caller: str
+    model: str
+    calls: int
+    error_calls: int
+    avg_latency_ms: Optional[float] = None
+    p95_latency_ms: Optional[float] = None
+    prompt_tokens: int
+    completion_tokens: int
+    cost_usd: float
+
+class LLMCallLogSummaryResponse(BaseModel):
+    period_hours: int
+    items: List[LLMCallLogSummaryItem]
+# --- КОНЕЦ: Схемы для метрик вызовов LLM ---
+
+class DBPoolInfo(BaseModel):
+    name: str # primary | replicaN
+    role: str # primary | replica
+    profile: Optional[str] = None # api | worker | backfill
+    pool_size: Optional[int] = None
+    max_overflow: Optional[int] = None
+    pool_timeout_seconds: Optional[float] = None
+    checked_out: Optional[int] = None # Соединений выдано сейчас
+    overflow: Optional[int] = None
+    checked_in: Optional[int] = None # Свободных соединений в пуле
+    checkouts: int = 0 # Выдач соединения с момента запуска процесса
+    checkout_timeouts: int = 0 # Запросы, не дождавшиеся соединения за pool_timeout_seconds
+    slow_checkouts: int = 0 # Выдачи дольше DB_POOL_SLOW_CHECKOUT_MS
+    checkout_wait_avg_ms: Optional[float] = None
+    checkout_wait_max_ms: Optional[float] = None
+    in_use_peak: int = 0 # Наибольшее число одновременно выданных соединений
+    overflow_peak: int = 0
+    healthy: bool # Для реплики: доступна и отставание в пределах порога
+    lag_seconds: Optional[float] = None
+    in_recovery: Optional[bool] = None
+    sessions_routed: int # Читающих сессий выдано с момента запуска процесса
+    fallbacks_to_primary: Optional[int] = None # Только у primary: сколько раз ни одна реплика не подошла
+    last_error: Optional[str] = None
+
+class DBPoolsResponse(BaseModel):
+    max_replica_lag_seconds: float
+    slow_checkout_threshold_ms: float
+    pgbouncer_mode: bool
+    pools: List[DBPoolInfo]
@@ -0,0 +1,214 @@
+# app/services/analytics_lake.py
+
+import asyncio
+import json
+import logging
+import os
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+try:
+    import duckdb
+except ImportError: # duckdb не установлен - тяжелые отчеты считаются в Postgres
+    duckdb = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Колоночные снимки для тяжелых отчетов: {ANALYTICS_LAKE_PATH}/{dataset}/day=YYYY-MM-DD/data.parquet - по файлу на UTC-день
+# (posts - по posted_at, comments и comment_insights - по commented_at), строки внутри отсортированы по channel_id, поэтому
+# фильтр по каналам отсекает row group по статистике. Снимки пишет задача tasks.snapshot_analytics_lake, читает DuckDB.
+# Отдельные каталоги channel_id=N не используются: дни x каналы дают десятки тысяч мелких файлов, и открытие файлов
+# съедает выигрыш колоночного чтения.
+LAKE_DATASET_COLUMNS: Dict[str, List[Tuple[str, str]]] = {
+    "posts": [
+        ("id", "int"), ("channel_id", "int"), ("posted_at", "datetime"), ("views_count", "int"), ("forwards_count", "int"),
+        ("comments_count", "int"), ("reactions_total", "int"), ("post_sentiment_label", "str"), ("post_sentiment_score", "float"),
+    ],
+    "comments": [
+        ("id", "int"), ("post_id", "int"), ("channel_id", "int"), ("commented_at", "datetime"), ("sentiment_label", "str"),
+        ("sentiment_score", "float"), ("near_duplicate_of_id", "int"), ("ai_analysis_completed_at", "datetime"),
+    ],
+    "comment_insights": [
+        ("id", "int"), ("comment_id", "int"), ("channel_id", "int"), ("commented_at", "datetime"), ("insight_type", "str"),
+        ("normalized_text", "str"), ("display_text", "str"), ("canonical_id", "int"),
+    ],
+}
+
+# Изменения ищутся с запасом: транзакция, начатая до снимка, может закоммитить updated_at меньше водяной знака
+WATERMARK_OVERLAP = timedelta(minutes=10)
+
+_STATE_FILE = "_state.json"
+_DATA_FILE = "data.parquet"
+
+
+def analytics_lake_dependencies_available() -> bool:
+    return duckdb is not None and pyarrow is not None
+
+
+def _dataset_dir(dataset: str) -> str:
+    if dataset not in LAKE_DATASET_COLUMNS:
+        raise ValueError(f"Неизвестный набор данных аналитического хранилища: {dataset!r}")
+    return os.path.join(settings.ANALYTICS_LAKE_PATH, dataset)
+
+
+def _day_dir(dataset: str, day: date) -> str:
+    return os.path.join(_dataset_dir(dataset), f"day={day.isoformat()}")
+
+
+def _dataset_glob(dataset: str) -> str:
+    return os.path.join(_dataset_dir(dataset), "day=*", _DATA_FILE)
+
+
+def _atomic_write_bytes(path: str, data: bytes) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as tmp_file:
+        tmp_file.write(data)
+    os.replace(tmp_path, path)
+
+
+# --- Снимки (пишет задача Celery) ---
+
+def write_day_snapshot(dataset: str, day: date, rows: Sequence[Sequence[Any]]) -> int:
+    """
+    Заменяет снимок dataset за UTC-день day строками rows (колонки - LAKE_DATASET_COLUMNS[dataset], отсортированы по channel_id).
+    Файл пишется рядом и подменяется атомарно - читатели видят либо старый, либо новый снимок. Пустой день удаляет файл.
+    """
+    columns = LAKE_DATASET_COLUMNS[dataset]
+    day_dir = _day_dir(dataset, day)
+    path = os.path.join(day_dir, _DATA_FILE)
+    if not rows:
+        if os.path.exists(path):
+            os.remove(path)
+        return 0
+    arrow_types = {
+        "int": pyarrow.int64(), "float": pyarrow.float64(), "str": pyarrow.string(), "datetime": pyarrow.timestamp("us", tz="UTC"),
+    }
+    schema = pyarrow.schema([(name, arrow_types[kind]) for name, kind in columns])
+    arrays = [pyarrow.array([row[position] for row in rows], type=schema.field(position).type) for position in range(len(columns))]
+    os.makedirs(day_dir, exist_ok=True)
+    sink = pyarrow.BufferOutputStream()
+    pyarrow.parquet.write_table(
+        pyarrow.Table.from_arrays(arrays, schema=schema), sink,
+        compression=settings.ANALYTICS_LAKE_COMPRESSION, row_group_size=settings.ANALYTICS_LAKE_ROW_GROUP_SIZE,
+    )
+    _atomic_write_bytes(path, sink.getvalue().to_pybytes())
+    return len(rows)
+
+
+def read_lake_state() -> Optional[Dict[str, Any]]:
+    """Состояние снимков: watermark (с какого момента искать изменения), last_snapshot_at, backfilled (вся история выгружена)."""
+    try:
+        with open(os.path.join(settings.ANALYTICS_LAKE_PATH, _STATE_FILE), "r", encoding="utf-8") as state_file:
+            return json.load(state_file)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Аналитическое хранилище: не удалось прочитать состояние ({type(e).__name__}: {e}).")
+        return None
+
+
+def write_lake_state(state: Dict[str, Any]) -> None:
+    os.makedirs(settings.ANALYTICS_LAKE_PATH, exist_ok=True)
+    _atomic_write_bytes(
+        os.path.join(settings.ANALYTICS_LAKE_PATH, _STATE_FILE),
+        json.dumps(state, ensure_ascii=False, indent=2, default=str).encode("utf-8"),
+    )
+
+
+# --- Чтение (эндпоинты) ---
+
+def analytics_lake_usable_for(start_day: date, end_day: Optional[date] = None) -> bool:
+    """
+    Считать ли отчет за start_day..end_day (по умолчанию - по сегодня) по снимкам: режим включен, зависимости есть, история
+    выгружена целиком, последний снимок не старше ANALYTICS_LAKE_MAX_STALENESS_SECONDS и период не короче
+    ANALYTICS_LAKE_MIN_PERIOD_DAYS (короткие периоды Postgres считает по индексам быстрее, чем DuckDB открывает файлы).
+    """
+    if not settings.ANALYTICS_LAKE_ENABLED or not analytics_lake_dependencies_available():
+        return False
+    if ((end_day or datetime.now(timezone.utc).date()) - start_day).days + 1 < settings.ANALYTICS_LAKE_MIN_PERIOD_DAYS:
+        return False
+    state = read_lake_state()
+    if not state or not state.get("backfilled") or not state.get("last_snapshot_at"):
+        return False
+    snapshot_age = datetime.now(timezone.utc) - datetime.fromisoformat(state["last_snapshot_at"])
+    return snapshot_age.total_seconds() <= settings.ANALYTICS_LAKE_MAX_STALENESS_SECONDS
+
+
+def _run_query(dataset: str, sql: str, params: List[Any]) -> List[Tuple[Any, ...]]:
+    # Отдельное in-memory соединение на запрос: соединение DuckDB нельзя делить между потоками без курсоров, а открытие дешевое
+    connection = duckdb.connect(database=":memory:", config={"threads": settings.ANALYTICS_LAKE_DUCKDB_THREADS})
+    try:
+        # union_by_name: в снимках, записанных до появления колонки (canonical_id), она читается как NULL
+        source = f"read_parquet('{_dataset_glob(dataset)}', hive_partitioning = true, hive_types = {{'day': DATE}}, union_by_name = true)"
+        return connection.execute(sql.replace("{source}", source), params).fetchall()
+    finally:
+        connection.close()
+
+
+def _period_conditions(start_at: datetime, end_at: Optional[datetime], channel_ids: List[int]) -> Tuple[str, List[Any]]:
+    # Условие по day отсекает каталоги дней до чтения файлов, по commented_at - уточняет границы внутри дня
+    conditions = "day >= ? AND commented_at >= ? AND list_contains(?, channel_id)"
+    params: List[Any] = [start_at.astimezone(timezone.utc).date(), start_at, channel_ids]
+    if end_at is not None:
+        conditions += " AND day <= ? AND commented_at <= ?"
+        params += [end_at.astimezone(timezone.utc).date(), end_at]
+    return conditions, params
+
+
+async def query_top_insights(
+    insight_type: str, start_at: datetime, limit: int, channel_ids: List[int], end_at: Optional[datetime] = None
+) -> List[Tuple[Optional[int], str, int]]:
+    """
+    Топ-N инсайтов за период по снимкам - та же семантика, что у main._fetch_top_comment_insights: (canonical_id, текст, число).
+    При INSIGHT_CANONICAL_GROUPING_ENABLED группировка по canonical_id, еще не канонизированные - по нормализованному тексту;
+    текст канонического инсайта для показа подставляет вызывающий.
+    """
+    if not channel_ids:
+        return []
+    conditions, params = _period_conditions(start_at, end_at, channel_ids)
+    if settings.INSIGHT_CANONICAL_GROUPING_ENABLED:
+        group_columns = "canonical_id, CASE WHEN canonical_id IS NULL THEN normalized_text END"
+        selected_id = "canonical_id"
+    else:
+        group_columns, selected_id = "normalized_text", "NULL"
+    sql = (
+        f"SELECT {selected_id} AS canonical_id, min(display_text) AS item_text, count(*) AS item_count FROM {{source}} "
+        f"WHERE insight_type = ? AND {conditions} "
+        f"GROUP BY {group_columns} ORDER BY item_count DESC, min(normalized_text) ASC LIMIT ?"
+    )
+    rows = await asyncio.to_thread(_run_query, "comment_insights", sql, [insight_type, *params, limit])
+    return [(int(canonical_id) if canonical_id is not None else None, str(item_text), int(item_count)) for canonical_id, item_text, item_count in rows]
+
+
+async def query_insight_trend(
+    insight_type: str, normalized_text: str, exact: bool, start_at: datetime, granularity: str, channel_ids: List[int],
+    canonical_id: Optional[int] = None
+) -> Dict[str, int]:
+    """
+    Число упоминаний инсайта по дням ('YYYY-MM-DD') или неделям (ключ как у to_char(..., 'YYYY-WW') в Postgres:
+    год и номер семидневки от 1 января) - те же ключи, что у пути через Postgres в get_insight_item_trend.
+    canonical_id - считать все формулировки канонического инсайта (и еще не канонизированные строки с текстом normalized_text).
+    """
+    if not channel_ids:
+        return {}
+    if granularity == "week":
+        bucket = "strftime(day, '%Y') || '-' || lpad(CAST((dayofyear(day) - 1) // 7 + 1 AS VARCHAR), 2, '0')"
+    else:
+        bucket = "strftime(day, '%Y-%m-%d')"
+    text_condition = "normalized_text = ?" if exact else "contains(normalized_text, ?)"
+    text_params: List[Any] = [normalized_text]
+    if canonical_id is not None:
+        text_condition = "(canonical_id = ? OR (canonical_id IS NULL AND normalized_text = ?))"
+        text_params = [canonical_id, normalized_text]
+    conditions, params = _period_conditions(start_at, None, channel_ids)
+    sql = f"SELECT {bucket} AS bucket, count(*) FROM {{source}} WHERE insight_type = ? AND {text_condition} AND {conditions} GROUP BY bucket"
+    rows = await asyncio.to_thread(_run_query, "comment_insights", sql, [insight_type, *text_params, *params])
+    return {str(bucket_key): int(item_count) for bucket_key, item_count in rows}
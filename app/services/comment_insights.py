@@ -0,0 +1,36 @@
+# app/services/comment_insights.py
+
+import re
+from typing import Dict, Optional
+
+from sqlalchemy import func
+
+# Тип инсайта (значения ui_schemas.InsightItemType) -> JSONB-колонка Comment с результатами AI-анализа
+INSIGHT_TYPE_TO_COMMENT_FIELD: Dict[str, str] = {
+    "topic": "extracted_topics",
+    "problem": "extracted_problems",
+    "question": "extracted_questions",
+    "suggestion": "extracted_suggestions",
+}
+
+INSIGHT_TEXT_MAX_LENGTH = 300
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_insight_text(text: Optional[str]) -> str:
+    """
+    Ключ группировки инсайта: без крайних пробелов, пробелы схлопнуты, нижний регистр, не длиннее INSIGHT_TEXT_MAX_LENGTH.
+    Должен совпадать с normalized_insight_text_sql - им заполняется comment_insights.normalized_text.
+    """
+    return _WHITESPACE_RE.sub(" ", (text or "").strip()).lower()[:INSIGHT_TEXT_MAX_LENGTH]
+
+
+def normalized_insight_text_sql(text_expression):
+    """То же, что normalize_insight_text, но на стороне Postgres (для INSERT ... SELECT из JSONB без выгрузки в Python)."""
+    collapsed = func.regexp_replace(func.btrim(text_expression), r"\s+", " ", "g")
+    return func.left(func.lower(collapsed), INSIGHT_TEXT_MAX_LENGTH)
+
+
+def escape_like_pattern(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
@@ -0,0 +1,190 @@
+# app/services/data_export.py
+
+import csv
+import io
+import json
+import logging
+from datetime import date, datetime
+from typing import Any, AsyncIterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy.sql import Select
+
+from app.core.config import settings
+from app.db.session import AsyncSessionFactory
+
+logger = logging.getLogger(__name__)
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError: # pyarrow не установлен - экспорт в Parquet недоступен, CSV и JSONL работают
+    pyarrow = None
+
+EXPORT_FORMAT_CSV = "csv"
+EXPORT_FORMAT_JSONL = "jsonl"
+EXPORT_FORMAT_PARQUET = "parquet"
+EXPORT_FORMAT_PATTERN = f"^({EXPORT_FORMAT_CSV}|{EXPORT_FORMAT_JSONL}|{EXPORT_FORMAT_PARQUET})$"
+
+EXPORT_MEDIA_TYPES = {
+    EXPORT_FORMAT_CSV: "text/csv; charset=utf-8",
+    EXPORT_FORMAT_JSONL: "application/x-ndjson",
+    EXPORT_FORMAT_PARQUET: "application/vnd.apache.parquet",
+}
+
+# Колонка выгрузки: (имя, вид значения). Виды: int, float, str, bool, datetime, json (JSONB - в CSV/Parquet пишется JSON-строкой)
+ExportColumn = Tuple[str, str]
+
+
+class ExportFormatUnavailableError(RuntimeError):
+    """Формат выгрузки требует зависимости, которая не установлена."""
+
+
+def ensure_export_format_available(export_format: str) -> None:
+    if export_format == EXPORT_FORMAT_PARQUET and pyarrow is None:
+        raise ExportFormatUnavailableError("Экспорт в Parquet недоступен: не установлен pyarrow.")
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def _json_text(value: Any) -> Optional[str]:
+    return None if value is None else json.dumps(value, ensure_ascii=False, default=_json_default)
+
+
+class _CsvEncoder:
+    def __init__(self, columns: Sequence[ExportColumn]):
+        self._json_positions = [i for i, (_, kind) in enumerate(columns) if kind == "json"]
+        self._header = [name for name, _ in columns]
+
+    def _cell(self, value: Any) -> Any:
+        if isinstance(value, datetime):
+            return value.isoformat()
+        return value
+
+    def encode(self, rows: Sequence[Sequence[Any]]) -> bytes:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        if self._header is not None:
+            writer.writerow(self._header)
+            self._header = None
+        for row in rows:
+            values = list(row)
+            for position in self._json_positions:
+                values[position] = _json_text(values[position])
+            writer.writerow([self._cell(value) for value in values]) # None csv пишет пустой строкой
+        return buffer.getvalue().encode("utf-8")
+
+    def finish(self) -> bytes:
+        return self.encode([]) if self._header is not None else b"" # Пустая выгрузка - только заголовок
+
+
+class _JsonlEncoder:
+    def __init__(self, columns: Sequence[ExportColumn]):
+        self._names = [name for name, _ in columns]
+
+    def encode(self, rows: Sequence[Sequence[Any]]) -> bytes:
+        lines = [json.dumps(dict(zip(self._names, row)), ensure_ascii=False, default=_json_default) for row in rows]
+        return ("\n".join(lines) + "\n").encode("utf-8") if lines else b""
+
+    def finish(self) -> bytes:
+        return b""
+
+
+class _ByteSink(io.RawIOBase):
+    """Файл для ParquetWriter, который копит записанные байты до забора в поток ответа (а не держит весь файл)."""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        chunk = bytes(data)
+        self._chunks.append(chunk)
+        self._position += len(chunk)
+        return len(chunk)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+class _ParquetEncoder:
+    """Каждая пачка строк - отдельная row group; в памяти только текущая пачка и метаданные групп для футера."""
+
+    def __init__(self, columns: Sequence[ExportColumn]):
+        arrow_types = {
+            "int": pyarrow.int64(), "float": pyarrow.float64(), "str": pyarrow.string(), "bool": pyarrow.bool_(),
+            "datetime": pyarrow.timestamp("us", tz="UTC"), "json": pyarrow.string(),
+        }
+        self._columns = list(columns)
+        self._schema = pyarrow.schema([(name, arrow_types[kind]) for name, kind in self._columns])
+        self._sink = _ByteSink()
+        self._writer = pyarrow.parquet.ParquetWriter(self._sink, self._schema, compression=settings.EXPORT_PARQUET_COMPRESSION)
+
+    def encode(self, rows: Sequence[Sequence[Any]]) -> bytes:
+        if not rows:
+            return b""
+        arrays = []
+        for position, (_, kind) in enumerate(self._columns):
+            values = [row[position] for row in rows]
+            if kind == "json":
+                values = [_json_text(value) for value in values]
+            arrays.append(pyarrow.array(values, type=self._schema.field(position).type))
+        self._writer.write_table(pyarrow.Table.from_arrays(arrays, schema=self._schema))
+        return self._sink.drain()
+
+    def finish(self) -> bytes:
+        self._writer.close() # Дописывает футер с метаданными row group
+        return self._sink.drain()
+
+
+def _make_encoder(export_format: str, columns: Sequence[ExportColumn]):
+    if export_format == EXPORT_FORMAT_CSV:
+        return _CsvEncoder(columns)
+    if export_format == EXPORT_FORMAT_JSONL:
+        return _JsonlEncoder(columns)
+    ensure_export_format_available(export_format)
+    return _ParquetEncoder(columns)
+
+
+async def stream_export(
+    stmt: Select, columns: Sequence[ExportColumn], export_format: str, chunk_rows: Optional[int] = None, log_label: str = "export",
+    session_factory=None
+) -> AsyncIterator[bytes]:
+    """
+    Выгружает результат stmt (колонки - в порядке columns) потоком байтов в export_format. Строки читаются серверным курсором
+    (AsyncSession.stream + yield_per) пачками по chunk_rows (EXPORT_CHUNK_ROWS) и сразу кодируются, поэтому память не зависит
+    от размера выгрузки. Сессия - своя, из session_factory (по умолчанию AsyncSessionFactory - основная база): генератор
+    работает уже после возврата из эндпоинта.
+    stmt должен выбирать колонки, а не ORM-объекты - без построения сущностей и identity map выгрузка в разы быстрее.
+    """
+    chunk_rows = chunk_rows or settings.EXPORT_CHUNK_ROWS
+    encoder = _make_encoder(export_format, columns)
+    exported_rows = 0
+    started_at = datetime.now()
+    async with (session_factory or AsyncSessionFactory)() as session:
+        result = await session.stream(stmt.execution_options(yield_per=chunk_rows))
+        try:
+            async for rows in result.partitions():
+                exported_rows += len(rows)
+                data = encoder.encode(rows)
+                if data:
+                    yield data
+        finally:
+            await result.close() # Клиент мог оборвать загрузку - курсор и транзакцию закрываем сразу
+    tail = encoder.finish()
+    if tail:
+        yield tail
+    elapsed = (datetime.now() - started_at).total_seconds()
+    logger.info(f"Выгрузка {log_label} ({export_format}): {exported_rows} строк за {elapsed:.1f} с.")
@@ -0,0 +1,126 @@
+# app/services/embeddings.py
+
+import asyncio
+import logging
+import threading
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional, Sequence
+
+import httpx
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy
+except ImportError: # numpy не установлен - семантический поиск недоступен
+    numpy = None
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError: # Локальная модель не установлена - доступны только внешние провайдеры
+    SentenceTransformer = None
+
+
+class EmbeddingProviderUnavailableError(RuntimeError):
+    """Провайдер эмбеддингов не настроен или его зависимости не установлены."""
+
+
+class EmbeddingProvider(ABC):
+    """
+    Провайдер эмбеддингов: embed() возвращает float32-матрицу (len(texts), dimension) с L2-нормированными строками,
+    поэтому косинусная близость - скалярное произведение. is_query различает запрос и документ (модели e5 и подобные
+    обучены с разными префиксами). name и model записываются в индекс: смена модели - полная переиндексация.
+    """
+    name: str = ""
+    model: str = ""
+    dimension: int = 0
+
+    @abstractmethod
+    async def embed(self, texts: Sequence[str], is_query: bool = False):
+        """float32-матрица (len(texts), dimension), строки L2-нормированы."""
+
+
+def _normalized(matrix):
+    matrix = numpy.asarray(matrix, dtype=numpy.float32)
+    norms = numpy.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / numpy.maximum(norms, 1e-12)
+
+
+class LocalEmbeddingProvider(EmbeddingProvider):
+    """Локальная модель sentence-transformers на CPU (по умолчанию многоязычная e5 - тексты в основном на русском)."""
+    name = "local"
+
+    def __init__(self):
+        if SentenceTransformer is None:
+            raise EmbeddingProviderUnavailableError("Локальная модель эмбеддингов недоступна: не установлен sentence-transformers.")
+        self.model = settings.EMBEDDING_LOCAL_MODEL
+        self._model = SentenceTransformer(self.model, device="cpu")
+        self.dimension = int(self._model.get_sentence_embedding_dimension())
+        self._lock = threading.Lock() # encode одной модели из нескольких потоков только тратит ядра на переключения
+
+    def _encode(self, texts: List[str]):
+        with self._lock:
+            return self._model.encode(texts, batch_size=settings.EMBEDDING_BATCH_SIZE, normalize_embeddings=True, convert_to_numpy=True)
+
+    async def embed(self, texts: Sequence[str], is_query: bool = False):
+        prefix = settings.EMBEDDING_QUERY_PREFIX if is_query else settings.EMBEDDING_DOCUMENT_PREFIX
+        return _normalized(await asyncio.to_thread(self._encode, [prefix + text for text in texts]))
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    """Эмбеддинги через OpenAI-совместимый /v1/embeddings (ключ и таймаут - те же, что у llm_service)."""
+    name = "openai"
+
+    def __init__(self):
+        if not settings.OPENAI_API_KEY:
+            raise EmbeddingProviderUnavailableError("Провайдер эмбеддингов openai недоступен: не задан OPENAI_API_KEY.")
+        self.model = settings.EMBEDDING_OPENAI_MODEL
+        self.dimension = settings.EMBEDDING_OPENAI_DIMENSIONS
+
+    async def embed(self, texts: Sequence[str], is_query: bool = False):
+        payload = {"model": self.model, "input": list(texts), "dimensions": self.dimension}
+        headers = {"Authorization": f"Bearer {settings.OPENAI_API_KEY}", "Content-Type": "application/json"}
+        async with httpx.AsyncClient(timeout=settings.OPENAI_TIMEOUT_SECONDS) as client:
+            response = await client.post(settings.EMBEDDING_OPENAI_URL, json=payload, headers=headers)
+            response.raise_for_status()
+        data = sorted(response.json()["data"], key=lambda item: item["index"])
+        return _normalized([item["embedding"] for item in data])
+
+
+_PROVIDER_FACTORIES: Dict[str, Callable[[], EmbeddingProvider]] = {
+    LocalEmbeddingProvider.name: LocalEmbeddingProvider,
+    OpenAIEmbeddingProvider.name: OpenAIEmbeddingProvider,
+}
+_provider_instance: Optional[EmbeddingProvider] = None
+_provider_lock = threading.Lock()
+
+
+def register_embedding_provider(name: str, factory: Callable[[], EmbeddingProvider]) -> None:
+    """Подключает свой провайдер (выбирается настройкой EMBEDDING_PROVIDER=name)."""
+    _PROVIDER_FACTORIES[name] = factory
+
+
+def get_embedding_provider() -> EmbeddingProvider:
+    """Провайдер из EMBEDDING_PROVIDER - один на процесс (локальная модель загружается один раз)."""
+    global _provider_instance
+    if numpy is None:
+        raise EmbeddingProviderUnavailableError("Семантический поиск недоступен: не установлен numpy.")
+    with _provider_lock:
+        if _provider_instance is None or _provider_instance.name != settings.EMBEDDING_PROVIDER:
+            factory = _PROVIDER_FACTORIES.get(settings.EMBEDDING_PROVIDER)
+            if factory is None:
+                raise EmbeddingProviderUnavailableError(f"Неизвестный провайдер эмбеддингов: {settings.EMBEDDING_PROVIDER!r}.")
+            _provider_instance = factory()
+            logger.info(f"Провайдер эмбеддингов: {_provider_instance.name}, модель {_provider_instance.model}, размерность {_provider_instance.dimension}.")
+        return _provider_instance
+
+
+async def embed_in_batches(provider: EmbeddingProvider, texts: Sequence[str], is_query: bool = False):
+    """Эмбеддинги для большого списка текстов пачками по EMBEDDING_BATCH_SIZE."""
+    batch_size = max(1, settings.EMBEDDING_BATCH_SIZE)
+    if not texts:
+        return numpy.zeros((0, provider.dimension), dtype=numpy.float32)
+    parts = [await provider.embed(texts[start:start + batch_size], is_query=is_query) for start in range(0, len(texts), batch_size)]
+    return numpy.vstack(parts)
@@ -0,0 +1,150 @@
+# app/services/insight_canonicalization.py
+
+import logging
+import re
+import threading
+import unicodedata
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from app.core.config import settings
+from app.services.comment_insights import INSIGHT_TEXT_MAX_LENGTH, normalize_insight_text
+
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy
+except ImportError: # numpy не установлен - объединение синонимов по эмбеддингам недоступно, остается лексическая канонизация
+    numpy = None
+
+try:
+    import pymorphy3
+except ImportError: # Нет морфологического анализатора - пробуем стеммер
+    pymorphy3 = None
+
+try:
+    import snowballstemmer
+except ImportError: # Нет и стеммера - слова сравниваются как есть
+    snowballstemmer = None
+
+# Канонизация инсайтов (тексты extracted_* от LLM): "Доставка.", "доставка" и "проблемы с доставкой" должны считаться одним
+# инсайтом. Этапы:
+#   1. канонический ключ - нижний регистр, ё -> е, без пунктуации и служебных слов, леммы (pymorphy3) или основы (Snowball),
+#      без повторов и в алфавитном порядке: варианты формы и порядка слов дают один ключ;
+#   2. новые ключи сравниваются по эмбеддингам (app/services/embeddings.py) с уже известными каноническими инсайтами того же
+#      типа - при близости не ниже INSIGHT_CLUSTER_SIMILARITY_THRESHOLD ключ присоединяется к ближайшему.
+# Словарь - таблицы insight_canonicals и insight_aliases (нормализованный текст -> канонический инсайт), пополняет задача
+# tasks.canonicalize_insights; comment_insights.canonical_id - по нему группируются топы и тренды.
+# Кластеризация "лидерная": канонические инсайты не сливаются задним числом, поэтому уже проставленные canonical_id не меняются.
+
+# Служебные слова, которые не меняют смысл инсайта ("проблемы с доставкой" ~ "проблема доставки"); отрицания ("не", "без")
+# сюда не входят - "не работает" и "работает" разные инсайты
+_STOP_WORDS = frozenset({
+    "а", "бы", "в", "во", "для", "до", "же", "за", "и", "из", "или", "к", "ко", "ли", "на", "над", "о",
+    "об", "от", "по", "под", "при", "про", "с", "со", "так", "то", "у", "что", "это", "как",
+})
+_TOKEN_RE = re.compile(r"[^\W_]+(?:-[^\W_]+)*")
+
+_morph_analyzer = None
+_stemmer = None
+_lemmatizer_lock = threading.Lock()
+
+
+def lemmatizer_name() -> str:
+    """Чем приводятся слова к начальной форме - пишется в словарь: смена способа меняет ключи."""
+    if pymorphy3 is not None:
+        return "pymorphy3"
+    if snowballstemmer is not None:
+        return "snowball"
+    return "none"
+
+
+def _lemmatize(token: str) -> str:
+    global _morph_analyzer, _stemmer
+    if pymorphy3 is not None:
+        if _morph_analyzer is None:
+            with _lemmatizer_lock:
+                if _morph_analyzer is None:
+                    _morph_analyzer = pymorphy3.MorphAnalyzer()
+        return _morph_analyzer.parse(token)[0].normal_form.replace("ё", "е")
+    if snowballstemmer is not None:
+        if _stemmer is None:
+            with _lemmatizer_lock:
+                if _stemmer is None:
+                    _stemmer = snowballstemmer.stemmer("russian")
+        return _stemmer.stemWord(token)
+    return token
+
+
+def canonical_insight_key(text: Optional[str]) -> str:
+    """
+    Канонический ключ инсайта (этап 1). Пустая строка - в тексте нет значимых слов; тогда ключом служит нормализованный текст
+    (инсайт из одних эмодзи или служебных слов не должен слиться со всеми такими же).
+    """
+    normalized = unicodedata.normalize("NFKC", normalize_insight_text(text)).replace("ё", "е")
+    tokens = [token for token in _TOKEN_RE.findall(normalized) if token not in _STOP_WORDS]
+    lemmas = sorted({_lemmatize(token) for token in tokens})
+    return " ".join(lemma for lemma in lemmas if lemma)[:INSIGHT_TEXT_MAX_LENGTH]
+
+
+def embedding_to_bytes(vector) -> bytes:
+    """Эмбеддинг канонического инсайта для insight_canonicals.embedding: float16, L2-нормирован."""
+    return numpy.asarray(vector, dtype=numpy.float16).tobytes()
+
+
+class InsightClusterIndex:
+    """
+    Эмбеддинги канонических инсайтов одного типа в памяти задачи канонизации (этап 2): ближайший по косинусу канонический
+    инсайт для нового ключа. Пополняется по ходу запуска, чтобы синонимы из одной пачки тоже объединялись.
+    """
+
+    def __init__(self, dimension: int):
+        self.dimension = dimension
+        self._ids: List[int] = []
+        self._chunks: List = []
+        self._matrix = numpy.zeros((0, dimension), dtype=numpy.float32)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def add(self, canonical_id: int, vector) -> None:
+        self._ids.append(canonical_id)
+        self._chunks.append(numpy.asarray(vector, dtype=numpy.float32).reshape(1, self.dimension))
+
+    def add_stored(self, rows: Sequence[Tuple[int, bytes]]) -> None:
+        """Эмбеддинги из insight_canonicals.embedding; записи другой размерности (другой модели) пропускаются."""
+        for canonical_id, raw in rows:
+            vector = numpy.frombuffer(raw, dtype=numpy.float16)
+            if len(vector) == self.dimension:
+                self.add(canonical_id, vector)
+
+    def nearest(self, vector) -> Tuple[Optional[int], float]:
+        """(id ближайшего канонического инсайта, косинусная близость); (None, 0.0) - индекс пуст."""
+        if self._chunks:
+            self._matrix = numpy.vstack([self._matrix, *self._chunks])
+            self._chunks = []
+        if len(self._ids) == 0:
+            return None, 0.0
+        similarities = self._matrix @ numpy.asarray(vector, dtype=numpy.float32)
+        best = int(numpy.argmax(similarities))
+        return self._ids[best], float(similarities[best])
+
+    def match(self, vector) -> Tuple[Optional[int], float]:
+        """
+        (канонический инсайт, к которому присоединить ключ с эмбеддингом vector, близость); id None - ближе порога
+        INSIGHT_CLUSTER_SIMILARITY_THRESHOLD никого нет, ключ станет новым каноническим инсайтом.
+        """
+        canonical_id, similarity = self.nearest(vector)
+        return (canonical_id if similarity >= settings.INSIGHT_CLUSTER_SIMILARITY_THRESHOLD else None), similarity
+
+
+def clustering_available() -> bool:
+    return numpy is not None and settings.INSIGHT_EMBEDDING_CLUSTERING_ENABLED
+
+
+def group_by_key(items: Sequence[Tuple[str, str, str]]) -> Dict[Tuple[str, str], List[Tuple[str, str]]]:
+    """(тип, нормализованный текст, текст для показа) -> {(тип, канонический ключ): [(нормализованный текст, текст для показа)]}."""
+    groups: Dict[Tuple[str, str], List[Tuple[str, str]]] = {}
+    for insight_type, normalized_text, display_text in items:
+        key = canonical_insight_key(normalized_text) or normalized_text
+        groups.setdefault((insight_type, key), []).append((normalized_text, display_text))
+    return groups
@@ -0,0 +1,89 @@
+# app/services/keyset_pagination.py
+
+import base64
+import json
+import logging
+from datetime import datetime
+from typing import Any, List, Optional, Tuple
+
+from sqlalchemy import asc, desc, literal, tuple_
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession
+
+logger = logging.getLogger(__name__)
+
+# Режимы подсчета total в ответах списков
+TOTAL_MODE_EXACT = "exact"    # count(*) по всему отфильтрованному набору - как раньше, линейно от размера
+TOTAL_MODE_APPROX = "approx"  # оценка (планировщик Postgres или денормализованный счетчик) - без прохода по данным
+TOTAL_MODE_NONE = "none"
+TOTAL_MODE_PATTERN = f"^({TOTAL_MODE_EXACT}|{TOTAL_MODE_APPROX}|{TOTAL_MODE_NONE})$"
+
+
+class InvalidCursorError(ValueError):
+    """Курсор поврежден или выдан для другой сортировки."""
+
+
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {"dt": value.isoformat()}
+    return value
+
+
+def _decode_value(value: Any) -> Any:
+    if isinstance(value, dict) and "dt" in value:
+        return datetime.fromisoformat(value["dt"])
+    return value
+
+
+def encode_cursor(sort_key: str, sort_order: str, value: Any, row_id: int) -> str:
+    """
+    Непрозрачный курсор: позиция последней отданной строки (значение ключа сортировки, id) и сама сортировка,
+    чтобы курсор нельзя было применить к списку с другим порядком.
+    """
+    payload = {"s": sort_key, "o": sort_order, "v": _encode_value(value), "id": row_id}
+    raw = json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: str, sort_key: str, sort_order: str) -> Tuple[Any, int]:
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8"))
+        if payload["s"] != sort_key or payload["o"] != sort_order:
+            raise InvalidCursorError(f"Курсор выдан для сортировки {payload['s']} {payload['o']}, а запрошена {sort_key} {sort_order}.")
+        return _decode_value(payload["v"]), int(payload["id"])
+    except InvalidCursorError:
+        raise
+    except Exception as e:
+        raise InvalidCursorError(f"Некорректный курсор: {type(e).__name__}") from e
+
+
+def keyset_order_by(sort_expression, id_column, descending: bool) -> List[Any]:
+    """ORDER BY (ключ, id) в одном направлении - ровно так, как лежит составной индекс, чтобы он читался без сортировки."""
+    direction = desc if descending else asc
+    return [direction(sort_expression), direction(id_column)]
+
+
+def keyset_predicate(sort_expression, id_column, value: Any, row_id: int, descending: bool):
+    """Строки строго после курсора: сравнение кортежей (ключ, id) сводится к диапазону по составному индексу."""
+    row = tuple_(sort_expression, id_column)
+    bound = tuple_(literal(value, type_=sort_expression.type), literal(row_id, type_=id_column.type))
+    return row < bound if descending else row > bound
+
+
+async def estimate_row_count(db: AsyncSession, stmt) -> Optional[int]:
+    """
+    Оценка числа строк запроса по плану Postgres (EXPLAIN, без выполнения). Точность зависит от свежести статистики,
+    зато стоимость не растет с размером таблицы. None, если оценить не удалось.
+    """
+    try:
+        compiled = stmt.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True})
+        connection = await db.connection()
+        result = await connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}")
+        plan = result.scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+    except Exception as e:
+        logger.warning(f"Не удалось оценить число строк через EXPLAIN: {type(e).__name__}: {e}")
+        return None
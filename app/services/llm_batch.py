@@ -0,0 +1,396 @@
+# app/services/llm_batch.py
+
+import json
+import logging
+import os
+import re
+import shutil
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import httpx
+
+from app.core.config import settings
+from app.services.token_budget import render_prompt_with_budget, resolve_model
+
+logger = logging.getLogger(__name__)
+
+# Типы пакетов (совпадают с LLMBatchJob.kind и префиксом custom_id)
+KIND_POST_SUMMARY = "post_summary"
+KIND_POST_SENTIMENT = "post_sentiment"
+KIND_COMMENT_FEATURES = "comment_features"
+BATCH_KINDS = (KIND_POST_SUMMARY, KIND_POST_SENTIMENT, KIND_COMMENT_FEATURES)
+
+# Статусы пакета у провайдера, после которых опрашивать больше нечего
+PROVIDER_FINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+
+# --- Шаблоны промптов (общие для синхронных задач и пакетного режима; {text} - место вставки текста) ---
+
+POST_SUMMARY_PROMPT_TEMPLATE = "Текст поста:\n---\n{text}\n---\nНапиши краткое резюме (1-3 предложения на русском) основной мысли этого поста."
+POST_SENTIMENT_PROMPT_TEMPLATE = "Определи тональность текста (JSON: sentiment_label: [positive,negative,neutral,mixed], sentiment_score: [-1.0,1.0]):\n---\n{text}\n---\nJSON_RESPONSE:"
+COMMENT_FEATURES_PROMPT_TEMPLATE = """Ты — продвинутый AI-аналитик. Тебе будет предоставлен текст одного комментария из Telegram-канала. Твоя задача — внимательно проанализировать этот комментарий и вернуть результат в формате JSON со следующими ключами:
+- "topics": список из 1-3 основных тем или предметов обсуждения, затронутых в комментарии (строки). Если тем нет, верни пустой список.
+- "problems": список из 1-3 явных проблем, жалоб или негативных моментов, указанных в комментарии (строки). Если проблем нет, верни пустой список.
+- "questions": список из 1-3 четко сформулированных вопросов, заданных в комментарии (строки). Если вопросов нет, верни пустой список.
+- "suggestions": список из 1-3 конструктивных предложений или идей, высказанных в комментарии (строки). Если предложений нет, верни пустой список.
+
+Убедись, что твой ответ — это СТРОГО JSON и ничего больше. Не добавляй никаких пояснений до или после JSON.
+
+Текст комментария для анализа:
+---
+{text}
+---
+JSON_RESPONSE:"""
+
+POST_SENTIMENT_MAX_TOKENS = 60
+COMMENT_FEATURES_MAX_TOKENS = 350
+SENTIMENT_LABELS = ("positive", "negative", "neutral", "mixed")
+COMMENT_FEATURE_KEYS = ("topics", "problems", "questions", "suggestions")
+
+
+# --- Формирование запросов ---
+
+def make_custom_id(kind: str, item_id: int) -> str:
+    return f"{kind}:{item_id}"
+
+
+def parse_custom_id(custom_id: str) -> Tuple[Optional[str], Optional[int]]:
+    kind, _, raw_id = (custom_id or "").partition(":")
+    try:
+        return kind, int(raw_id)
+    except ValueError:
+        return None, None
+
+
+def build_batch_request_line(
+    custom_id: str,
+    prompt_text: str,
+    model: str,
+    max_tokens: int,
+    temperature: float,
+    is_json_response_expected: bool,
+) -> Dict[str, Any]:
+    """
+    Строка JSONL в формате Batch API: тот же body, что отправляет одиночный_запрос_к_llm.
+    """
+    body: Dict[str, Any] = {
+        "model": model,
+        "messages": [{"role": "user", "content": prompt_text}],
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+    }
+    if is_json_response_expected and ("gpt-3.5-turbo-1106" in model or "gpt-4" in model):
+        body["response_format"] = {"type": "json_object"}
+    return {"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": body}
+
+
+def build_request_for_item(kind: str, item_id: int, text: str, model: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Строит строку пакета для поста/комментария: промпт ужимается до бюджета токенов так же, как в синхронных задачах.
+    """
+    target_model = resolve_model(model)
+    if kind == KIND_POST_SUMMARY:
+        max_tokens = settings.LLM_SUMMARY_MAX_TOKENS
+        prompt = render_prompt_with_budget(POST_SUMMARY_PROMPT_TEMPLATE, text, target_model, max_tokens)
+        return build_batch_request_line(make_custom_id(kind, item_id), prompt, target_model, max_tokens, 0.3, False)
+    if kind == KIND_POST_SENTIMENT:
+        prompt = render_prompt_with_budget(POST_SENTIMENT_PROMPT_TEMPLATE, text, target_model, POST_SENTIMENT_MAX_TOKENS)
+        return build_batch_request_line(make_custom_id(kind, item_id), prompt, target_model, POST_SENTIMENT_MAX_TOKENS, 0.2, True)
+    if kind == KIND_COMMENT_FEATURES:
+        prompt = render_prompt_with_budget(COMMENT_FEATURES_PROMPT_TEMPLATE, text, target_model, COMMENT_FEATURES_MAX_TOKENS)
+        return build_batch_request_line(make_custom_id(kind, item_id), prompt, target_model, COMMENT_FEATURES_MAX_TOKENS, 0.2, True)
+    raise ValueError(f"Неизвестный тип пакета: {kind}")
+
+
+def write_batch_input_file(path: str, request_lines: Iterable[Dict[str, Any]]) -> int:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for line in request_lines:
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+
+def new_input_file_path(kind: str) -> str:
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+    return os.path.join(settings.LLM_BATCH_WORK_DIR, "input", f"{kind}_{stamp}_{uuid.uuid4().hex[:8]}.jsonl")
+
+
+# --- Разбор результатов ---
+
+@dataclass
+class BatchItemResult:
+    custom_id: str
+    content: Optional[str] = None
+    error: Optional[str] = None
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+
+def parse_batch_output(output_text: str) -> List[BatchItemResult]:
+    """
+    Разбирает JSONL результатов (и файл ошибок) Batch API: одна строка - один custom_id.
+    """
+    results: List[BatchItemResult] = []
+    for raw_line in output_text.splitlines():
+        if not raw_line.strip():
+            continue
+        try:
+            line = json.loads(raw_line)
+        except json.JSONDecodeError:
+            logger.warning(f"Пакет LLM: пропущена невалидная строка результата: {raw_line[:200]}")
+            continue
+        item = BatchItemResult(custom_id=line.get("custom_id") or "")
+        response = line.get("response") or {}
+        if line.get("error"):
+            item.error = json.dumps(line["error"], ensure_ascii=False)
+        elif response.get("status_code") != 200:
+            item.error = f"HTTP {response.get('status_code')}: {json.dumps(response.get('body'), ensure_ascii=False)[:300]}"
+        else:
+            body = response.get("body") or {}
+            choices = body.get("choices") or []
+            content = ((choices[0].get("message") or {}).get("content") if choices else None)
+            usage = body.get("usage") or {}
+            item.prompt_tokens = int(usage.get("prompt_tokens") or 0)
+            item.completion_tokens = int(usage.get("completion_tokens") or 0)
+            if content and content.strip():
+                item.content = content.strip()
+            else:
+                item.error = "Пустой ответ модели"
+        results.append(item)
+    return results
+
+
+def _strip_code_fence(text: str) -> str:
+    stripped = text.strip()
+    if stripped.startswith("```"):
+        stripped = stripped.split("\n", 1)[1] if "\n" in stripped else stripped[3:]
+        stripped = stripped.rsplit("```", 1)[0]
+    return stripped.strip()
+
+
+def parse_sentiment_content(content: str) -> Optional[Tuple[str, float]]:
+    try:
+        data = json.loads(_strip_code_fence(content))
+    except (json.JSONDecodeError, TypeError):
+        return None
+    if not isinstance(data, dict):
+        return None
+    label = data.get("sentiment_label")
+    score = data.get("sentiment_score")
+    if label not in SENTIMENT_LABELS:
+        return None
+    if not isinstance(score, (int, float)) or not -1.0 <= float(score) <= 1.0:
+        score = 0.0
+    return label, float(score)
+
+
+def parse_comment_features_content(content: str) -> Optional[Dict[str, List[str]]]:
+    try:
+        data = json.loads(_strip_code_fence(content))
+    except (json.JSONDecodeError, TypeError):
+        return None
+    if not isinstance(data, dict) or not all(isinstance(data.get(key, []), list) for key in COMMENT_FEATURE_KEYS):
+        return None
+    return {key: [str(v).strip() for v in data.get(key, []) if str(v).strip()] for key in COMMENT_FEATURE_KEYS}
+
+
+# --- Исполнители пакетов ---
+
+@dataclass
+class BatchStatus:
+    status: str
+    output_file_id: Optional[str] = None
+    error_file_id: Optional[str] = None
+    request_counts: Dict[str, int] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    @property
+    def is_final(self) -> bool:
+        return self.status in PROVIDER_FINAL_STATUSES
+
+
+class OpenAIBatchBackend:
+    """
+    Batch API провайдера: загрузка JSONL (purpose=batch), создание пакета, опрос статуса и скачивание результатов.
+    """
+    name = "openai"
+
+    def __init__(self):
+        api_url = settings.OPENAI_API_URL or "https://api.openai.com/v1/chat/completions"
+        self.base_url = api_url.rsplit("/chat/completions", 1)[0]
+        self.headers = {"Authorization": f"Bearer {settings.OPENAI_API_KEY}"}
+        self.timeout = settings.OPENAI_TIMEOUT_SECONDS or 60.0
+
+    async def submit(self, input_path: str, metadata: Optional[Dict[str, str]] = None) -> str:
+        async with httpx.AsyncClient(timeout=self.timeout) as client:
+            with open(input_path, "rb") as f:
+                upload = await client.post(
+                    f"{self.base_url}/files", headers=self.headers,
+                    data={"purpose": "batch"}, files={"file": (os.path.basename(input_path), f, "application/jsonl")}
+                )
+            upload.raise_for_status()
+            input_file_id = upload.json()["id"]
+            created = await client.post(
+                f"{self.base_url}/batches", headers=self.headers,
+                json={
+                    "input_file_id": input_file_id,
+                    "endpoint": BATCH_ENDPOINT,
+                    "completion_window": settings.LLM_BATCH_COMPLETION_WINDOW,
+                    "metadata": metadata or {},
+                }
+            )
+            created.raise_for_status()
+            return created.json()["id"]
+
+    async def get_status(self, batch_id: str) -> BatchStatus:
+        async with httpx.AsyncClient(timeout=self.timeout) as client:
+            response = await client.get(f"{self.base_url}/batches/{batch_id}", headers=self.headers)
+            response.raise_for_status()
+            data = response.json()
+        errors = (data.get("errors") or {}).get("data") or []
+        return BatchStatus(
+            status=data.get("status", "unknown"),
+            output_file_id=data.get("output_file_id"),
+            error_file_id=data.get("error_file_id"),
+            request_counts=data.get("request_counts") or {},
+            error="; ".join(e.get("message", "") for e in errors) or None,
+        )
+
+    async def download(self, file_id: str) -> str:
+        async with httpx.AsyncClient(timeout=max(self.timeout, 300.0)) as client:
+            response = await client.get(f"{self.base_url}/files/{file_id}/content", headers=self.headers)
+            response.raise_for_status()
+            return response.text
+
+
+_PROMPT_TEXT_RE = re.compile(r"---\n(.*)\n---", re.DOTALL)
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?…])\s+")
+
+
+def local_stand_in_responder(custom_id: str, body: Dict[str, Any]) -> str:
+    """
+    Детерминированные ответы локальной замены (без сети): первые предложения текста как резюме,
+    нейтральная тональность и пустые списки инсайтов. Формат ответа совпадает с ожидаемым от модели.
+    """
+    kind, _ = parse_custom_id(custom_id)
+    prompt = ((body.get("messages") or [{}])[-1]).get("content") or ""
+    match = _PROMPT_TEXT_RE.search(prompt)
+    text = (match.group(1) if match else prompt).strip()
+    if kind == KIND_POST_SUMMARY:
+        return " ".join(_SENTENCE_END_RE.split(text)[:2])[:500]
+    if kind == KIND_POST_SENTIMENT:
+        return json.dumps({"sentiment_label": "neutral", "sentiment_score": 0.0})
+    if kind == KIND_COMMENT_FEATURES:
+        return json.dumps({key: [] for key in COMMENT_FEATURE_KEYS})
+    return ""
+
+
+class LocalBatchBackend:
+    """
+    Локальная замена Batch API для оффлайн-работы и проверки: пакеты - каталоги в LLM_BATCH_WORK_DIR,
+    входной JSONL обрабатывается при первом опросе, результаты пишутся в output.jsonl в формате провайдера.
+    """
+    name = "local"
+
+    def __init__(self, work_dir: Optional[str] = None, responder: Callable[[str, Dict[str, Any]], str] = local_stand_in_responder):
+        self.work_dir = os.path.join(work_dir or settings.LLM_BATCH_WORK_DIR, "local_provider")
+        self.responder = responder
+
+    def _batch_dir(self, batch_id: str) -> str:
+        return os.path.join(self.work_dir, batch_id)
+
+    def _write_state(self, batch_id: str, state: Dict[str, Any]) -> None:
+        with open(os.path.join(self._batch_dir(batch_id), "state.json"), "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False)
+
+    def _read_state(self, batch_id: str) -> Dict[str, Any]:
+        with open(os.path.join(self._batch_dir(batch_id), "state.json"), encoding="utf-8") as f:
+            return json.load(f)
+
+    async def submit(self, input_path: str, metadata: Optional[Dict[str, str]] = None) -> str:
+        batch_id = f"local_batch_{uuid.uuid4().hex}"
+        os.makedirs(self._batch_dir(batch_id), exist_ok=True)
+        shutil.copyfile(input_path, os.path.join(self._batch_dir(batch_id), "input.jsonl"))
+        self._write_state(batch_id, {"status": "validating", "metadata": metadata or {}})
+        return batch_id
+
+    def _process(self, batch_id: str) -> Dict[str, Any]:
+        batch_dir = self._batch_dir(batch_id)
+        completed = failed = 0
+        with open(os.path.join(batch_dir, "input.jsonl"), encoding="utf-8") as src, \
+             open(os.path.join(batch_dir, "output.jsonl"), "w", encoding="utf-8") as out:
+            for raw_line in src:
+                if not raw_line.strip():
+                    continue
+                custom_id = None
+                try:
+                    request = json.loads(raw_line)
+                    custom_id = request["custom_id"]
+                    body = request["body"]
+                    content = self.responder(custom_id, body)
+                    result = {
+                        "id": f"batch_req_{uuid.uuid4().hex[:12]}",
+                        "custom_id": custom_id,
+                        "response": {"status_code": 200, "body": {
+                            "model": body.get("model"),
+                            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                            "usage": {"prompt_tokens": 0, "completion_tokens": 0},
+                        }},
+                        "error": None,
+                    }
+                    completed += 1
+                except Exception as e:
+                    result = {"id": None, "custom_id": custom_id, "response": None, "error": {"code": "local_stand_in_error", "message": f"{type(e).__name__}: {e}"}}
+                    failed += 1
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+        return {"total": completed + failed, "completed": completed, "failed": failed}
+
+    async def get_status(self, batch_id: str) -> BatchStatus:
+        state = self._read_state(batch_id)
+        if state["status"] not in PROVIDER_FINAL_STATUSES:
+            try:
+                state["request_counts"] = self._process(batch_id)
+                state["status"] = "completed"
+                state["output_file_id"] = os.path.join(self._batch_dir(batch_id), "output.jsonl")
+            except Exception as e:
+                state["status"] = "failed"
+                state["error"] = f"{type(e).__name__}: {e}"
+            self._write_state(batch_id, state)
+        return BatchStatus(
+            status=state["status"],
+            output_file_id=state.get("output_file_id"),
+            request_counts=state.get("request_counts") or {},
+            error=state.get("error"),
+        )
+
+    async def download(self, file_id: str) -> str:
+        with open(file_id, encoding="utf-8") as f:
+            return f.read()
+
+
+def ensure_batch_backend_allowed(backend_name: str) -> None:
+    """
+    Локальная замена отвечает заглушками, а результаты пакетов записываются в рабочие колонки и помечают элементы
+    обработанными навсегда - поэтому она доступна только при явном LLM_BATCH_LOCAL_STAND_IN_ALLOWED.
+    """
+    if backend_name == LocalBatchBackend.name and not settings.LLM_BATCH_LOCAL_STAND_IN_ALLOWED:
+        raise ValueError(
+            "Исполнитель пакетов 'local' - локальная замена с выдуманными ответами; "
+            "для проверки и оффлайн-стенда включите LLM_BATCH_LOCAL_STAND_IN_ALLOWED."
+        )
+
+
+def get_batch_backend(name: Optional[str] = None):
+    backend_name = (name or settings.LLM_BATCH_BACKEND or OpenAIBatchBackend.name).lower()
+    ensure_batch_backend_allowed(backend_name)
+    if backend_name == OpenAIBatchBackend.name:
+        return OpenAIBatchBackend()
+    if backend_name == LocalBatchBackend.name:
+        return LocalBatchBackend()
+    raise ValueError(f"Неизвестный исполнитель пакетов LLM: {backend_name}")
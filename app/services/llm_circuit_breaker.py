@@ -0,0 +1,163 @@
+# app/services/llm_circuit_breaker.py
+
+import logging
+import time
+import uuid
+from typing import Optional, Dict, Any
+
+from app.core.config import settings
+from app.core.redis_client import get_async_redis
+
+logger = logging.getLogger(__name__)
+
+STATE_CLOSED = "closed"        # Запросы идут как обычно
+STATE_OPEN = "open"            # Провайдер деградировал - запросы сразу отклоняются
+STATE_HALF_OPEN = "half_open"  # Пропущен один пробный запрос, ждем его результата
+
+# --- Lua-скрипты: переходы состояния атомарны и общие для всех воркеров ---
+
+# KEYS[1] - hash состояния, KEYS[2] - ключ блокировки пробного запроса; ARGV: now, probe_ttl, probe_token
+# Возвращает: 1 - запрос разрешен, 2 - разрешен как пробный (half-open), 0 - отклонен
+_ALLOW_LUA = """
+local state = redis.call('HGET', KEYS[1], 'state') or 'closed'
+if state == 'closed' then
+  return 1
+end
+local open_until = tonumber(redis.call('HGET', KEYS[1], 'open_until') or '0')
+if tonumber(ARGV[1]) < open_until then
+  return 0
+end
+if redis.call('SET', KEYS[2], ARGV[3], 'NX', 'EX', ARGV[2]) then
+  redis.call('HSET', KEYS[1], 'state', 'half_open')
+  return 2
+end
+return 0
+"""
+
+# KEYS[1] - hash состояния, KEYS[2] - блокировка пробного запроса; ARGV: now, failure_threshold, open_seconds
+# Возвращает 1, если цепь (пере)открыта этим вызовом
+_FAILURE_LUA = """
+local failures = redis.call('HINCRBY', KEYS[1], 'failures', 1)
+local state = redis.call('HGET', KEYS[1], 'state') or 'closed'
+if state == 'half_open' or (state == 'closed' and failures >= tonumber(ARGV[2])) then
+  local now = tonumber(ARGV[1])
+  redis.call('HSET', KEYS[1], 'state', 'open', 'opened_at', tostring(now), 'open_until', tostring(now + tonumber(ARGV[3])))
+  redis.call('HINCRBY', KEYS[1], 'open_count', 1)
+  redis.call('DEL', KEYS[2])
+  return 1
+end
+return 0
+"""
+
+# KEYS[1] - hash состояния, KEYS[2] - блокировка пробного запроса. Пишет в Redis только если было что сбрасывать.
+_SUCCESS_LUA = """
+local failures = tonumber(redis.call('HGET', KEYS[1], 'failures') or '0')
+local state = redis.call('HGET', KEYS[1], 'state') or 'closed'
+if failures == 0 and state == 'closed' then
+  return 0
+end
+redis.call('HSET', KEYS[1], 'state', 'closed', 'failures', '0')
+redis.call('DEL', KEYS[2])
+if state == 'closed' then
+  return 0
+end
+return 1
+"""
+
+
+class LLMCircuitBreaker:
+    """
+    Предохранитель для клиента LLM: после LLM_CIRCUIT_FAILURE_THRESHOLD подряд неудач (5xx, таймауты, сетевые ошибки)
+    цепь размыкается, и запросы LLM_CIRCUIT_OPEN_SECONDS отклоняются сразу, не дожидаясь таймаута.
+    Затем один запрос (пробный вызов tasks.probe_llm_circuit или обычный запрос) проверяет, восстановился ли провайдер.
+    429 на предохранитель не влияет - это квота, ею управляет LLMConcurrencyGovernor.
+    Состояние хранится в Redis и общее для всех воркеров; без Redis предохранитель работает в пределах процесса.
+    """
+
+    def __init__(self, prefix: str = settings.LLM_CIRCUIT_REDIS_PREFIX):
+        self.state_key = f"{prefix}:state"
+        self.probe_key = f"{prefix}:probe"
+        self._local_state: str = STATE_CLOSED
+        self._local_failures: int = 0
+        self._local_open_until: float = 0.0
+
+    async def allow_request(self) -> bool:
+        if not settings.LLM_CIRCUIT_BREAKER_ENABLED:
+            return True
+        now = time.time()
+        try:
+            decision = int(await get_async_redis().eval(
+                _ALLOW_LUA, 2, self.state_key, self.probe_key,
+                now, int(settings.LLM_CIRCUIT_PROBE_TIMEOUT_SECONDS + (settings.OPENAI_TIMEOUT_SECONDS or 60.0)), uuid.uuid4().hex
+            ))
+            if decision == 2:
+                logger.info("LLM circuit breaker: цепь полуоткрыта, пропускаем пробный запрос.")
+            return decision != 0
+        except Exception as e:
+            logger.debug(f"LLM circuit breaker: Redis недоступен ({type(e).__name__}), используется локальное состояние.")
+            if self._local_state == STATE_CLOSED:
+                return True
+            if now < self._local_open_until or self._local_state == STATE_HALF_OPEN:
+                return False
+            self._local_state = STATE_HALF_OPEN
+            return True
+
+    async def should_probe(self) -> bool:
+        """Для фонового пробного вызова: цепь разомкнута, пауза истекла и пробный запрос никто не выполняет."""
+        state = await self.get_state()
+        if state.get("state") == STATE_CLOSED or time.time() < float(state.get("open_until") or 0.0):
+            return False
+        return await self.allow_request()
+
+    async def on_success(self) -> None:
+        if not settings.LLM_CIRCUIT_BREAKER_ENABLED:
+            return
+        try:
+            closed_now = int(await get_async_redis().eval(_SUCCESS_LUA, 2, self.state_key, self.probe_key))
+        except Exception:
+            closed_now = int(self._local_state != STATE_CLOSED)
+            self._local_state, self._local_failures = STATE_CLOSED, 0
+        if closed_now:
+            logger.warning("LLM circuit breaker: провайдер снова отвечает, цепь замкнута.")
+
+    async def on_failure(self, reason: str) -> None:
+        if not settings.LLM_CIRCUIT_BREAKER_ENABLED:
+            return
+        now = time.time()
+        try:
+            opened_now = int(await get_async_redis().eval(
+                _FAILURE_LUA, 2, self.state_key, self.probe_key,
+                now, settings.LLM_CIRCUIT_FAILURE_THRESHOLD, settings.LLM_CIRCUIT_OPEN_SECONDS
+            ))
+        except Exception:
+            self._local_failures += 1
+            opened_now = int(self._local_state == STATE_HALF_OPEN or (
+                self._local_state == STATE_CLOSED and self._local_failures >= settings.LLM_CIRCUIT_FAILURE_THRESHOLD
+            ))
+            if opened_now:
+                self._local_state, self._local_open_until = STATE_OPEN, now + settings.LLM_CIRCUIT_OPEN_SECONDS
+        if opened_now:
+            logger.error(f"LLM circuit breaker: цепь разомкнута на {settings.LLM_CIRCUIT_OPEN_SECONDS} сек. после сбоя ({reason}).")
+
+    async def get_state(self) -> Dict[str, Any]:
+        try:
+            raw = await get_async_redis().hgetall(self.state_key)
+        except Exception:
+            return {"state": self._local_state, "failures": self._local_failures, "open_until": self._local_open_until, "source": "local"}
+        return {
+            "state": raw.get("state", STATE_CLOSED),
+            "failures": int(raw.get("failures", 0)),
+            "open_until": float(raw.get("open_until", 0.0)),
+            "open_count": int(raw.get("open_count", 0)),
+            "source": "redis",
+        }
+
+
+_breaker: Optional[LLMCircuitBreaker] = None
+
+
+def get_llm_circuit_breaker() -> LLMCircuitBreaker:
+    global _breaker
+    if _breaker is None:
+        _breaker = LLMCircuitBreaker()
+    return _breaker
@@ -0,0 +1,270 @@
+# app/services/llm_governor.py
+
+import asyncio
+import logging
+import random
+import time
+import uuid
+from email.utils import parsedate_to_datetime
+from typing import Optional, Mapping, Tuple
+
+from app.core.config import settings
+from app.core.redis_client import get_async_redis
+
+logger = logging.getLogger(__name__)
+
+# Коды ответа, при которых провайдер перегружен и нужно сбросить параллелизм и повторить запрос
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# --- Lua-скрипты: все изменения общего состояния делаются атомарно на стороне Redis ---
+
+# KEYS[1] - zset занятых слотов (score = время истечения аренды), KEYS[2] - hash состояния
+# ARGV: now, lease_id, lease_expire_at, initial_limit
+_ACQUIRE_LUA = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+local now = tonumber(ARGV[1])
+local blocked_until = tonumber(redis.call('HGET', KEYS[2], 'blocked_until') or '0')
+if blocked_until > now then
+  return {0, tostring(blocked_until - now)}
+end
+local limit = tonumber(redis.call('HGET', KEYS[2], 'limit') or ARGV[4])
+local inflight = redis.call('ZCARD', KEYS[1])
+if inflight < math.max(1, math.floor(limit)) then
+  redis.call('ZADD', KEYS[1], ARGV[3], ARGV[2])
+  return {1, tostring(inflight + 1)}
+end
+return {0, '0'}
+"""
+
+# KEYS[1] - hash состояния; ARGV: initial_limit, max_limit, step
+_INCREASE_LUA = """
+local limit = tonumber(redis.call('HGET', KEYS[1], 'limit') or ARGV[1])
+limit = math.min(tonumber(ARGV[2]), limit + tonumber(ARGV[3]) / math.max(limit, 1))
+redis.call('HSET', KEYS[1], 'limit', tostring(limit))
+return tostring(limit)
+"""
+
+# KEYS[1] - hash состояния; ARGV: now, initial_limit, min_limit, factor, cooldown, blocked_until
+_DECREASE_LUA = """
+local now = tonumber(ARGV[1])
+local limit = tonumber(redis.call('HGET', KEYS[1], 'limit') or ARGV[2])
+local last_decrease = tonumber(redis.call('HGET', KEYS[1], 'last_decrease') or '0')
+if now - last_decrease >= tonumber(ARGV[5]) then
+  limit = math.max(tonumber(ARGV[3]), limit * tonumber(ARGV[4]))
+  redis.call('HSET', KEYS[1], 'limit', tostring(limit), 'last_decrease', tostring(now))
+end
+local blocked_until = tonumber(ARGV[6])
+if blocked_until > tonumber(redis.call('HGET', KEYS[1], 'blocked_until') or '0') then
+  redis.call('HSET', KEYS[1], 'blocked_until', tostring(blocked_until))
+end
+return tostring(limit)
+"""
+
+# KEYS[1] - hash состояния; ARGV: blocked_until
+_BLOCK_LUA = """
+local blocked_until = tonumber(ARGV[1])
+if blocked_until > tonumber(redis.call('HGET', KEYS[1], 'blocked_until') or '0') then
+  redis.call('HSET', KEYS[1], 'blocked_until', tostring(blocked_until))
+end
+return 1
+"""
+
+
+def parse_duration_seconds(value: Optional[str]) -> Optional[float]:
+    """
+    Разбирает длительность из заголовков провайдера: '1s', '6m0s', '20ms', '0.5' (секунды).
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    total = 0.0; number = ""; i = 0; matched = False
+    while i < len(value):
+        ch = value[i]
+        if ch.isdigit() or ch == ".":
+            number += ch; i += 1; continue
+        unit = "ms" if value[i:i + 2] == "ms" else ch
+        i += len(unit)
+        if not number:
+            return None
+        multiplier = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}.get(unit)
+        if multiplier is None:
+            return None
+        total += float(number) * multiplier; number = ""; matched = True
+    return total if matched and not number else None
+
+
+def parse_retry_after_seconds(headers: Mapping[str, str]) -> Optional[float]:
+    """
+    Извлекает задержку из 'retry-after-ms' / 'retry-after' (секунды или HTTP-дата).
+    """
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return max(0.0, float(retry_after_ms) / 1000.0)
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+def _parse_int_header(headers: Mapping[str, str], name: str) -> Optional[int]:
+    raw = headers.get(name)
+    if raw is None:
+        return None
+    try:
+        return int(float(raw))
+    except ValueError:
+        return None
+
+
+def backoff_delay_seconds(attempt: int, retry_after: Optional[float] = None) -> float:
+    """
+    Экспоненциальная задержка с полным джиттером; не меньше, чем просит провайдер в retry-after.
+    """
+    cap = min(settings.LLM_RETRY_MAX_DELAY_SECONDS, settings.LLM_RETRY_BASE_DELAY_SECONDS * (2 ** attempt))
+    delay = random.uniform(0, cap)
+    if retry_after is not None:
+        delay = max(delay, retry_after + random.uniform(0, settings.LLM_RETRY_BASE_DELAY_SECONDS))
+    return delay
+
+
+class LLMConcurrencyGovernor:
+    """
+    AIMD-регулятор числа одновременных запросов к LLM.
+    Лимит растет на шаг за каждое "окно" успешных ответов, пока в заголовках x-ratelimit-* есть запас,
+    и умножается на LLM_AIMD_DECREASE_FACTOR при 429/5xx. Состояние хранится в Redis и общее для всех воркеров;
+    если Redis недоступен, регулятор работает локально в пределах процесса.
+    """
+
+    def __init__(self, prefix: str = settings.LLM_GOVERNOR_REDIS_PREFIX):
+        self.inflight_key = f"{prefix}:inflight"
+        self.state_key = f"{prefix}:state"
+        self._local_limit: float = float(settings.LLM_CONCURRENCY_INITIAL)
+        self._local_leases: set = set() # Слоты, выданные локально, пока Redis был недоступен
+        self._local_blocked_until: float = 0.0
+        self._local_last_decrease: float = 0.0
+
+    # --- Захват / освобождение слота ---
+
+    async def acquire(self) -> str:
+        """
+        Ждет свободный слот и возвращает идентификатор аренды (его нужно передать в release()).
+        """
+        lease_id = uuid.uuid4().hex
+        attempt = 0
+        while True:
+            granted, wait_hint = await self._try_acquire(lease_id)
+            if granted:
+                return lease_id
+            # Либо действует блокировка из retry-after, либо все слоты заняты - ждем с джиттером
+            sleep_for = wait_hint if wait_hint > 0 else min(1.0, 0.05 * (2 ** min(attempt, 5)))
+            await asyncio.sleep(sleep_for + random.uniform(0, 0.1))
+            attempt += 1
+
+    async def _try_acquire(self, lease_id: str) -> Tuple[bool, float]:
+        now = time.time()
+        try:
+            redis_client = get_async_redis()
+            granted, extra = await redis_client.eval(
+                _ACQUIRE_LUA, 2, self.inflight_key, self.state_key,
+                now, lease_id, now + settings.LLM_LEASE_TTL_SECONDS, settings.LLM_CONCURRENCY_INITIAL
+            )
+            if int(granted) == 1:
+                return True, 0.0
+            return False, float(extra)
+        except Exception as e:
+            logger.warning(f"LLM governor: Redis недоступен ({type(e).__name__}: {e}), используется локальный лимит.")
+            if self._local_blocked_until > now:
+                return False, self._local_blocked_until - now
+            if len(self._local_leases) < max(1, int(self._local_limit)):
+                self._local_leases.add(lease_id)
+                return True, 0.0
+            return False, 0.0
+
+    async def release(self, lease_id: str) -> None:
+        if lease_id in self._local_leases:
+            self._local_leases.discard(lease_id)
+            return
+        try:
+            await get_async_redis().zrem(self.inflight_key, lease_id)
+        except Exception as e:
+            # Аренда истечет сама через LLM_LEASE_TTL_SECONDS
+            logger.warning(f"LLM governor: не удалось освободить слот {lease_id} в Redis: {e}")
+
+    # --- Обратная связь от ответов провайдера ---
+
+    async def on_success(self, headers: Mapping[str, str]) -> None:
+        """
+        Увеличивает лимит, если в заголовках x-ratelimit-* остался запас; при исчерпанной квоте ставит паузу до сброса.
+        """
+        has_headroom = True
+        for kind in ("requests", "tokens"):
+            limit_val = _parse_int_header(headers, f"x-ratelimit-limit-{kind}")
+            remaining_val = _parse_int_header(headers, f"x-ratelimit-remaining-{kind}")
+            if not limit_val or remaining_val is None:
+                continue
+            if remaining_val <= 0:
+                reset_seconds = parse_duration_seconds(headers.get(f"x-ratelimit-reset-{kind}"))
+                if reset_seconds:
+                    await self._block_until(time.time() + reset_seconds)
+                has_headroom = False
+            elif remaining_val / limit_val < settings.LLM_RATELIMIT_HEADROOM_FRACTION:
+                has_headroom = False
+        if has_headroom:
+            await self._increase()
+
+    async def on_throttled(self, status_code: Optional[int], retry_after: Optional[float]) -> None:
+        """
+        Мультипликативно уменьшает лимит после 429/5xx/таймаута и, если провайдер прислал retry-after, блокирует новые запросы.
+        """
+        now = time.time()
+        blocked_until = now + retry_after if retry_after else 0.0
+        try:
+            new_limit = await get_async_redis().eval(
+                _DECREASE_LUA, 1, self.state_key,
+                now, settings.LLM_CONCURRENCY_INITIAL, settings.LLM_CONCURRENCY_MIN,
+                settings.LLM_AIMD_DECREASE_FACTOR, settings.LLM_AIMD_DECREASE_COOLDOWN_SECONDS, blocked_until
+            )
+            logger.warning(f"LLM governor: перегрузка провайдера (статус {status_code}), лимит параллелизма -> {float(new_limit):.2f}, retry-after={retry_after}.")
+        except Exception:
+            if now - self._local_last_decrease >= settings.LLM_AIMD_DECREASE_COOLDOWN_SECONDS:
+                self._local_limit = max(float(settings.LLM_CONCURRENCY_MIN), self._local_limit * settings.LLM_AIMD_DECREASE_FACTOR)
+                self._local_last_decrease = now
+            self._local_blocked_until = max(self._local_blocked_until, blocked_until)
+
+    async def _increase(self) -> None:
+        try:
+            await get_async_redis().eval(
+                _INCREASE_LUA, 1, self.state_key,
+                settings.LLM_CONCURRENCY_INITIAL, settings.LLM_CONCURRENCY_MAX, settings.LLM_AIMD_INCREASE_STEP
+            )
+        except Exception:
+            self._local_limit = min(float(settings.LLM_CONCURRENCY_MAX), self._local_limit + settings.LLM_AIMD_INCREASE_STEP / max(self._local_limit, 1.0))
+
+    async def _block_until(self, blocked_until: float) -> None:
+        try:
+            await get_async_redis().eval(_BLOCK_LUA, 1, self.state_key, blocked_until)
+        except Exception:
+            self._local_blocked_until = max(self._local_blocked_until, blocked_until)
+
+
+_governor: Optional[LLMConcurrencyGovernor] = None
+
+
+def get_llm_governor() -> LLMConcurrencyGovernor:
+    global _governor
+    if _governor is None:
+        _governor = LLMConcurrencyGovernor()
+    return _governor
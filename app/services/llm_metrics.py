@@ -0,0 +1,226 @@
+# app/services/llm_metrics.py
+
+import json
+import logging
+import time
+from dataclasses import dataclass, asdict, field
+from typing import Optional, Dict, Any, List, Tuple
+
+from app.core.config import settings
+from app.core.redis_client import get_async_redis
+
+logger = logging.getLogger(__name__)
+
+# Исход одного HTTP-вызова LLM (одна попытка)
+OUTCOME_OK = "ok"                      # 2xx с непустым ответом
+OUTCOME_EMPTY = "empty"                # 2xx, но без content/choices
+OUTCOME_THROTTLED = "throttled"        # 429/5xx - будет повтор
+OUTCOME_HTTP_ERROR = "http_error"      # Остальные 4xx
+OUTCOME_NETWORK_ERROR = "network_error" # Таймаут/сетевой сбой - будет повтор
+OUTCOME_ERROR = "error"                # Прочие ошибки (невалидный JSON и т.д.)
+OUTCOME_CIRCUIT_OPEN = "circuit_open"  # Отклонен предохранителем без обращения к провайдеру
+
+UNKNOWN_CALLER = "unknown"
+
+# Метрики агрегируются в Redis (общие для API и всех воркеров Celery), отдельный hash на серию caller|model|outcome
+_SERIES_SET_SUFFIX = "series"
+_SERIES_HASH_SUFFIX = "s"
+_LOG_BUFFER_SUFFIX = "log_buffer"
+
+
+@dataclass
+class LLMCallRecord:
+    caller: str
+    model: str
+    outcome: str
+    status_code: Optional[int]
+    latency_ms: float
+    attempt: int
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    estimated_prompt_tokens: int = 0
+    cost_usd: float = 0.0
+    created_at: float = field(default_factory=time.time)
+
+
+def _key(suffix: str) -> str:
+    return f"{settings.LLM_METRICS_REDIS_PREFIX}:{suffix}"
+
+
+def _bucket_field(bound: float) -> str:
+    return f"le_{bound:g}"
+
+
+def estimate_cost_usd(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """
+    Стоимость вызова по прайсу LLM_PRICING_USD_PER_1K_TOKENS (модель ищется по самому длинному совпадающему префиксу,
+    чтобы 'gpt-4o-mini-2024-07-18' брал цену 'gpt-4o-mini', а не 'gpt-4o'). Неизвестная модель - 0.
+    """
+    best_prefix = ""
+    for prefix in settings.LLM_PRICING_USD_PER_1K_TOKENS:
+        if model.startswith(prefix) and len(prefix) > len(best_prefix):
+            best_prefix = prefix
+    if not best_prefix:
+        return 0.0
+    prompt_price, completion_price = settings.LLM_PRICING_USD_PER_1K_TOKENS[best_prefix][:2]
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000.0
+
+
+async def record_llm_call(record: LLMCallRecord) -> None:
+    """
+    Учитывает вызов в гистограмме задержек и счетчиках серии caller|model|outcome и кладет запись в буфер
+    для таблицы llm_call_log (его разбирает задача tasks.flush_llm_call_log). Ошибки Redis не влияют на вызов LLM.
+    """
+    if not settings.LLM_METRICS_ENABLED:
+        return
+    series_id = f"{record.caller}|{record.model}|{record.outcome}"
+    latency_seconds = record.latency_ms / 1000.0
+    try:
+        redis_client = get_async_redis()
+        series_key = _key(f"{_SERIES_HASH_SUFFIX}:{series_id}")
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.sadd(_key(_SERIES_SET_SUFFIX), series_id)
+        pipe.hincrby(series_key, "count", 1)
+        pipe.hincrbyfloat(series_key, "latency_sum_seconds", latency_seconds)
+        for bound in settings.LLM_LATENCY_BUCKETS_SECONDS:
+            if latency_seconds <= bound:
+                pipe.hincrby(series_key, _bucket_field(bound), 1) # Корзины хранятся некумулятивно
+                break
+        else:
+            pipe.hincrby(series_key, "le_inf", 1)
+        if record.prompt_tokens or record.completion_tokens:
+            pipe.hincrby(series_key, "prompt_tokens", record.prompt_tokens)
+            pipe.hincrby(series_key, "completion_tokens", record.completion_tokens)
+            pipe.hincrbyfloat(series_key, "cost_usd", record.cost_usd)
+        if settings.LLM_CALL_LOG_ENABLED:
+            buffer_key = _key(_LOG_BUFFER_SUFFIX)
+            pipe.rpush(buffer_key, json.dumps(asdict(record), ensure_ascii=False))
+            pipe.ltrim(buffer_key, -settings.LLM_CALL_LOG_BUFFER_MAX, -1) # Если сброс в БД остановился - отбрасываем старые
+        await pipe.execute()
+    except Exception as e:
+        logger.debug(f"Не удалось записать метрики вызова LLM ({series_id}): {type(e).__name__}: {e}")
+
+
+def _quantile_from_buckets(buckets: List[Tuple[float, int]], total: int, quantile: float) -> Optional[float]:
+    """Оценка квантиля по кумулятивной гистограмме - верхняя граница корзины, в которую он попадает."""
+    if total <= 0:
+        return None
+    target = quantile * total
+    for bound, cumulative in buckets:
+        if cumulative >= target:
+            return bound
+    return float("inf")
+
+
+# Кэш квантилей задержки в процессе: хеджированию не нужен свежий до секунды p95, а Redis дергать на каждый запрос незачем
+_QUANTILE_CACHE_TTL_SECONDS = 60.0
+_quantile_cache: Dict[Tuple[str, str, float], Tuple[float, Optional[float]]] = {}
+
+
+async def get_latency_quantile_seconds(caller: str, model: str, quantile: float, min_samples: int) -> Optional[float]:
+    """
+    Оценка квантиля задержки успешных вызовов серии caller|model|ok по гистограмме; None, если вызовов меньше min_samples.
+    """
+    cache_key = (caller, model, quantile)
+    cached = _quantile_cache.get(cache_key)
+    now = time.monotonic()
+    if cached and cached[0] > now:
+        return cached[1]
+    raw = await get_async_redis().hgetall(_key(f"{_SERIES_HASH_SUFFIX}:{caller}|{model}|{OUTCOME_OK}"))
+    count = int(raw.get("count", 0)) if raw else 0
+    value: Optional[float] = None
+    if count >= min_samples:
+        cumulative = 0
+        buckets: List[Tuple[float, int]] = []
+        for bound in settings.LLM_LATENCY_BUCKETS_SECONDS:
+            cumulative += int(raw.get(_bucket_field(bound), 0))
+            buckets.append((float(bound), cumulative))
+        value = _quantile_from_buckets(buckets, count, quantile)
+        if value == float("inf"):
+            value = float(settings.LLM_LATENCY_BUCKETS_SECONDS[-1])
+    _quantile_cache[cache_key] = (now + _QUANTILE_CACHE_TTL_SECONDS, value)
+    return value
+
+
+async def get_llm_metrics_snapshot() -> List[Dict[str, Any]]:
+    """
+    Текущее состояние всех серий: count, сумма задержек, кумулятивные корзины, оценки p50/p95, токены и стоимость.
+    """
+    redis_client = get_async_redis()
+    series_ids = sorted(await redis_client.smembers(_key(_SERIES_SET_SUFFIX)))
+    if not series_ids:
+        return []
+    pipe = redis_client.pipeline(transaction=False)
+    for series_id in series_ids:
+        pipe.hgetall(_key(f"{_SERIES_HASH_SUFFIX}:{series_id}"))
+    raw_series = await pipe.execute()
+
+    snapshot: List[Dict[str, Any]] = []
+    for series_id, raw in zip(series_ids, raw_series):
+        caller, model, outcome = (series_id.split("|", 2) + ["", ""])[:3]
+        count = int(raw.get("count", 0))
+        cumulative = 0
+        buckets: List[Tuple[float, int]] = []
+        for bound in settings.LLM_LATENCY_BUCKETS_SECONDS:
+            cumulative += int(raw.get(_bucket_field(bound), 0))
+            buckets.append((float(bound), cumulative))
+        buckets.append((float("inf"), cumulative + int(raw.get("le_inf", 0))))
+        snapshot.append({
+            "caller": caller,
+            "model": model,
+            "outcome": outcome,
+            "count": count,
+            "latency_sum_seconds": float(raw.get("latency_sum_seconds", 0.0)),
+            "latency_buckets": buckets,
+            "latency_p50_seconds": _quantile_from_buckets(buckets, count, 0.5),
+            "latency_p95_seconds": _quantile_from_buckets(buckets, count, 0.95),
+            "prompt_tokens": int(raw.get("prompt_tokens", 0)),
+            "completion_tokens": int(raw.get("completion_tokens", 0)),
+            "cost_usd": float(raw.get("cost_usd", 0.0)),
+        })
+    return snapshot
+
+
+def render_prometheus_text(snapshot: List[Dict[str, Any]]) -> str:
+    """Текстовый формат экспозиции Prometheus (histogram + counters) из снимка get_llm_metrics_snapshot."""
+    def labels(series: Dict[str, Any], extra: str = "") -> str:
+        base = f'caller="{series["caller"]}",model="{series["model"]}",outcome="{series["outcome"]}"'
+        return "{" + base + (f",{extra}" if extra else "") + "}"
+
+    lines = [
+        "# HELP llm_request_duration_seconds Latency of LLM HTTP calls.",
+        "# TYPE llm_request_duration_seconds histogram",
+    ]
+    for series in snapshot:
+        for bound, cumulative in series["latency_buckets"]:
+            le_label = 'le="+Inf"' if bound == float("inf") else f'le="{bound:g}"'
+            lines.append(f"llm_request_duration_seconds_bucket{labels(series, le_label)} {cumulative}")
+        lines.append(f"llm_request_duration_seconds_sum{labels(series)} {series['latency_sum_seconds']:.6f}")
+        lines.append(f"llm_request_duration_seconds_count{labels(series)} {series['count']}")
+    for metric, key, help_text in (
+        ("llm_prompt_tokens_total", "prompt_tokens", "Prompt tokens reported by the provider."),
+        ("llm_completion_tokens_total", "completion_tokens", "Completion tokens reported by the provider."),
+        ("llm_cost_usd_total", "cost_usd", "Estimated cost of LLM calls in USD."),
+    ):
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} counter")
+        for series in snapshot:
+            lines.append(f"{metric}{labels(series)} {series[key]}")
+    return "\n".join(lines) + "\n"
+
+
+async def drain_call_log_buffer(max_items: int) -> List[Dict[str, Any]]:
+    """Атомарно забирает до max_items записей из буфера llm_call_log (LRANGE + LTRIM в одной транзакции)."""
+    redis_client = get_async_redis()
+    buffer_key = _key(_LOG_BUFFER_SUFFIX)
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.lrange(buffer_key, 0, max_items - 1)
+    pipe.ltrim(buffer_key, max_items, -1)
+    raw_items, _ = await pipe.execute()
+    records: List[Dict[str, Any]] = []
+    for raw_item in raw_items:
+        try:
+            records.append(json.loads(raw_item))
+        except (TypeError, ValueError):
+            logger.warning(f"Пропущена поврежденная запись буфера llm_call_log: {str(raw_item)[:200]}")
+    return records
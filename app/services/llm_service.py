@@ -1,11 +1,23 @@
 # app/services/llm_service.py
 
+import asyncio
 import httpx
 import json # Импортируем json для возможной обработки ошибок
 import logging
-from typing import Optional, Dict, Any
+import threading
+import time
+from typing import Optional, Dict, Any, AsyncIterator, List
 
 from app.core.config import settings # Импортируем ваши настройки
+from app.services.llm_governor import (
+    get_llm_governor, parse_retry_after_seconds, backoff_delay_seconds, RETRYABLE_STATUS_CODES
+)
+from app.services.token_budget import count_tokens, get_context_window
+from app.services.llm_metrics import (
+    LLMCallRecord, record_llm_call, estimate_cost_usd, get_latency_quantile_seconds, UNKNOWN_CALLER,
+    OUTCOME_OK, OUTCOME_EMPTY, OUTCOME_THROTTLED, OUTCOME_HTTP_ERROR, OUTCOME_NETWORK_ERROR, OUTCOME_ERROR, OUTCOME_CIRCUIT_OPEN,
+)
+from app.services.llm_circuit_breaker import get_llm_circuit_breaker
 
 # Настройка логгера
 logger = logging.getLogger(__name__)
@@ -17,17 +29,128 @@ if not logger.handlers: # Чтобы избежать дублирования 
     logger.setLevel(logging.INFO)
 
 
+class LLMThrottledError(Exception):
+    """
+    Провайдер LLM отвечал 429/5xx (или не отвечал) на все попытки.
+    В отличие от None (ответ получен, но пустой/невалидный), вызывающий код должен оставить данные необработанными.
+    """
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class LLMCircuitOpenError(LLMThrottledError):
+    """
+    Предохранитель разомкнут: провайдер недавно подряд отвечал 5xx/таймаутами, запрос отклонен сразу, без ожидания таймаута.
+    """
+
+
+# Накопленный расход токенов по моделям в пределах процесса (по данным 'usage' из ответов провайдера)
+_token_usage_totals: Dict[str, Dict[str, int]] = {}
+_token_usage_lock = threading.Lock()
+
+
+def _record_token_usage(model: str, prompt_tokens: int, completion_tokens: int, estimated_prompt_tokens: int) -> None:
+    with _token_usage_lock:
+        totals = _token_usage_totals.setdefault(model, {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "estimated_prompt_tokens": 0})
+        totals["calls"] += 1
+        totals["prompt_tokens"] += prompt_tokens
+        totals["completion_tokens"] += completion_tokens
+        totals["estimated_prompt_tokens"] += estimated_prompt_tokens
+
+
+def get_token_usage_totals() -> Dict[str, Dict[str, int]]:
+    """
+    Возвращает копию накопленного расхода токенов по моделям: calls, prompt_tokens, completion_tokens, estimated_prompt_tokens.
+    """
+    with _token_usage_lock:
+        return {model: dict(totals) for model, totals in _token_usage_totals.items()}
+
+
 async def одиночный_запрос_к_llm(
     prompt_text: str,
     модель: Optional[str] = None,
     температура: float = 0.2, # Более низкая температура для предсказуемого JSON
     макс_токены: int = 350,    # Достаточно для JSON с извлеченными данными
-    is_json_response_expected: bool = True # Флаг, ожидаем ли мы JSON
+    is_json_response_expected: bool = True, # Флаг, ожидаем ли мы JSON
+    caller: Optional[str] = None, # Имя задачи Celery / эндпоинта - для метрик и журнала llm_call_log
+    hedge: bool = False # Для путей, чувствительных к задержке: дублирующий запрос, если первый дольше p95
 ) -> Optional[str]:
     """
     Выполняет одиночный асинхронный запрос к API OpenAI (или совместимому).
     Возвращает строковый ответ от LLM или None в случае ошибки.
+    Параллелизм регулируется LLMConcurrencyGovernor; на 429/5xx и таймауты запрос повторяется с джиттером,
+    а если все попытки исчерпаны - выбрасывается LLMThrottledError. Если провайдер деградировал и предохранитель
+    разомкнут, сразу выбрасывается LLMCircuitOpenError (подкласс LLMThrottledError).
+    Каждая попытка учитывается в метриках (задержка, статус, токены, стоимость) с меткой caller.
     """
+    request_kwargs: Dict[str, Any] = {
+        "prompt_text": prompt_text, "модель": модель, "температура": температура,
+        "макс_токены": макс_токены, "is_json_response_expected": is_json_response_expected,
+    }
+    if hedge and settings.LLM_HEDGE_ENABLED:
+        return await _запрос_с_хеджированием(request_kwargs, caller or UNKNOWN_CALLER)
+    return await _выполнить_запрос_к_llm(**request_kwargs, caller=caller)
+
+
+async def _hedge_delay_seconds(caller: str, model: str) -> float:
+    """Задержка перед дублирующим запросом - p95 (LLM_HEDGE_QUANTILE) успешных вызовов этого caller/модели."""
+    try:
+        quantile_value = await get_latency_quantile_seconds(caller, model, settings.LLM_HEDGE_QUANTILE, settings.LLM_HEDGE_MIN_SAMPLES)
+    except Exception as e:
+        logger.debug(f"Не удалось получить p95 задержки LLM для хеджирования ({caller}/{model}): {e}")
+        quantile_value = None
+    delay = quantile_value if quantile_value is not None else settings.LLM_HEDGE_DEFAULT_DELAY_SECONDS
+    return min(settings.LLM_HEDGE_MAX_DELAY_SECONDS, max(settings.LLM_HEDGE_MIN_DELAY_SECONDS, delay))
+
+
+async def _запрос_с_хеджированием(request_kwargs: Dict[str, Any], caller: str) -> Optional[str]:
+    """
+    Хеджированный запрос: если основной запрос не ответил за p95, параллельно отправляется второй такой же
+    (в метриках - caller с суффиксом ':hedge'); побеждает первый непустой ответ, второй запрос отменяется.
+    """
+    target_model = request_kwargs["модель"] or settings.OPENAI_DEFAULT_MODEL_FOR_TASKS or settings.OPENAI_DEFAULT_MODEL or ""
+    hedge_delay = await _hedge_delay_seconds(caller, target_model)
+    primary_task = asyncio.create_task(_выполнить_запрос_к_llm(**request_kwargs, caller=caller))
+    done, _ = await asyncio.wait({primary_task}, timeout=hedge_delay)
+    if done:
+        return primary_task.result()
+
+    logger.info(f"LLM ({target_model}, {caller}): нет ответа за {hedge_delay:.2f} сек. (p95), отправляем дублирующий запрос.")
+    hedge_task = asyncio.create_task(_выполнить_запрос_к_llm(**request_kwargs, caller=f"{caller}:hedge"))
+    pending = {primary_task, hedge_task}
+    first_error: Optional[BaseException] = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for finished_task in done:
+                if finished_task.exception() is not None:
+                    first_error = first_error or finished_task.exception()
+                    continue
+                result = finished_task.result()
+                if result:
+                    if finished_task is hedge_task:
+                        logger.info(f"LLM ({target_model}, {caller}): дублирующий запрос ответил первым.")
+                    return result
+        if first_error is not None:
+            raise first_error
+        return None
+    finally:
+        for pending_task in pending:
+            pending_task.cancel()
+        if pending:
+            # Дожидаемся отмены, чтобы проигравший запрос освободил слот governor'а
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def _выполнить_запрос_к_llm(
+    prompt_text: str,
+    модель: Optional[str],
+    температура: float,
+    макс_токены: int,
+    is_json_response_expected: bool,
+    caller: Optional[str] = None
+) -> Optional[str]:
     if not settings.OPENAI_API_KEY:
         logger.error("Ключ OpenAI API не настроен (OPENAI_API_KEY).")
         return None
@@ -66,45 +189,311 @@ async def одиночный_запрос_к_llm(
             logger.warning(f"Модель {target_model} может не поддерживать 'response_format': {{'type': 'json_object'}}. LLM может вернуть JSON не идеально.")
 
 
-    logger.info(f"Отправка запроса к LLM: Модель='{target_model}', URL='{api_url}', JSON_ожидается={is_json_response_expected}, Макс.токены={макс_токены}, Температура={температура}")
+    # Локальная оценка размера промпта: запрос, заведомо не влезающий в окно модели, провайдер отклонит
+    estimated_prompt_tokens = count_tokens(prompt_text, target_model)
+    context_window = get_context_window(target_model)
+    if estimated_prompt_tokens + макс_токены > context_window:
+        logger.warning(f"Промпт ({estimated_prompt_tokens} ток.) + ответ ({макс_токены} ток.) превышают окно модели {target_model} ({context_window} ток.). Используйте render_prompt_with_budget.")
+
+    logger.info(f"Отправка запроса к LLM: Модель='{target_model}', URL='{api_url}', JSON_ожидается={is_json_response_expected}, Макс.токены={макс_токены}, Температура={температура}, Токены промпта (оценка)={estimated_prompt_tokens}")
     # Логгируем только часть промпта для безопасности и краткости
     logger.debug(f"Промпт (начало): {prompt_text[:200]}...") 
 
-    try:
-        async with httpx.AsyncClient(timeout=settings.OPENAI_TIMEOUT_SECONDS or 60.0) as client:
-            response = await client.post(api_url, headers=headers, json=payload)
-        
-        response.raise_for_status() # Вызовет исключение для 4xx/5xx HTTP статусов
-        
-        response_data = response.json()
-        logger.debug(f"Полный ответ от LLM: {response_data}")
-
-        if response_data.get("choices") and len(response_data["choices"]) > 0:
-            message = response_data["choices"][0].get("message", {})
-            message_content = message.get("content")
-            
-            if message_content:
-                logger.info(f"Ответ от LLM ({target_model}) успешно получен.")
-                return message_content.strip()
+    governor = get_llm_governor()
+    breaker = get_llm_circuit_breaker()
+    max_retries = max(0, settings.LLM_MAX_RETRIES)
+    last_status: Optional[int] = None
+
+    for attempt in range(max_retries + 1):
+        retry_after: Optional[float] = None
+        call_outcome = OUTCOME_ERROR
+        call_status: Optional[int] = None
+        call_prompt_tokens = 0
+        call_completion_tokens = 0
+        if not await breaker.allow_request():
+            await record_llm_call(LLMCallRecord(
+                caller=caller or UNKNOWN_CALLER, model=target_model, outcome=OUTCOME_CIRCUIT_OPEN,
+                status_code=None, latency_ms=0.0, attempt=attempt + 1, estimated_prompt_tokens=estimated_prompt_tokens,
+            ))
+            raise LLMCircuitOpenError(
+                f"LLM ({target_model}): предохранитель разомкнут после серии сбоев провайдера, запрос отклонен без ожидания.",
+                status_code=last_status
+            )
+        lease_id = await governor.acquire()
+        call_started_at = time.perf_counter() # Ожидание слота governor'а в задержку не входит
+        try:
+            async with httpx.AsyncClient(timeout=settings.OPENAI_TIMEOUT_SECONDS or 60.0) as client:
+                response = await client.post(api_url, headers=headers, json=payload)
+            call_status = response.status_code
+
+            if response.status_code in RETRYABLE_STATUS_CODES:
+                call_outcome = OUTCOME_THROTTLED
+                last_status = response.status_code
+                retry_after = parse_retry_after_seconds(response.headers)
+                await governor.on_throttled(response.status_code, retry_after)
+                if response.status_code >= 500:
+                    await breaker.on_failure(f"HTTP {response.status_code}")
+                else:
+                    await breaker.on_success() # 429 - провайдер отвечает, это квота, а не деградация
+                logger.warning(f"LLM ({target_model}) вернул {response.status_code} (попытка {attempt + 1}/{max_retries + 1}), retry-after={retry_after}. Тело: {response.text[:300]}")
             else:
-                logger.warning(f"Ответ от LLM ({target_model}): ключ 'content' отсутствует в 'message'. Ответ: {response_data}")
-                return None
-        else:
-            logger.warning(f"Ответ от LLM ({target_model}): массив 'choices' пуст или отсутствует. Ответ: {response_data}")
+                await breaker.on_success() # Любой ответ не-5xx означает, что провайдер доступен
+                response.raise_for_status() # Вызовет исключение для остальных 4xx
+                await governor.on_success(response.headers)
+
+                response_data = response.json()
+                logger.debug(f"Полный ответ от LLM: {response_data}")
+
+                usage = response_data.get("usage") or {}
+                prompt_tokens = int(usage.get("prompt_tokens") or estimated_prompt_tokens)
+                completion_tokens = int(usage.get("completion_tokens") or 0)
+                _record_token_usage(target_model, prompt_tokens, completion_tokens, estimated_prompt_tokens)
+                call_prompt_tokens, call_completion_tokens = prompt_tokens, completion_tokens
+                call_outcome = OUTCOME_EMPTY
+                logger.info(f"Расход токенов LLM ({target_model}): prompt={prompt_tokens} (оценка {estimated_prompt_tokens}), completion={completion_tokens}.")
+
+                if response_data.get("choices") and len(response_data["choices"]) > 0:
+                    message = response_data["choices"][0].get("message", {})
+                    message_content = message.get("content")
+
+                    if message_content:
+                        call_outcome = OUTCOME_OK
+                        logger.info(f"Ответ от LLM ({target_model}) успешно получен.")
+                        return message_content.strip()
+                    else:
+                        logger.warning(f"Ответ от LLM ({target_model}): ключ 'content' отсутствует в 'message'. Ответ: {response_data}")
+                        return None
+                else:
+                    logger.warning(f"Ответ от LLM ({target_model}): массив 'choices' пуст или отсутствует. Ответ: {response_data}")
+                    return None
+
+        except httpx.HTTPStatusError as e:
+            call_outcome = OUTCOME_HTTP_ERROR
+            error_body = "Не удалось прочитать тело ошибки."
+            try:
+                error_body = e.response.text
+            except Exception:
+                pass
+            logger.error(f"Ошибка HTTPStatusError при запросе к LLM ({target_model}): {e.response.status_code} - {error_body}", exc_info=False) # exc_info=False чтобы не дублировать стектрейс от raise_for_status
+            return None
+        except (httpx.TimeoutException, httpx.NetworkError) as e:
+            # Таймауты и сетевые сбои - признак перегрузки, повторяем с отступом
+            last_status = None
+            call_outcome = OUTCOME_NETWORK_ERROR
+            await governor.on_throttled(None, None)
+            await breaker.on_failure(type(e).__name__)
+            logger.warning(f"Сетевая ошибка при запросе к LLM ({target_model}) (попытка {attempt + 1}/{max_retries + 1}): {type(e).__name__}: {e}")
+        except httpx.RequestError as e:
+            logger.error(f"Ошибка RequestError при запросе к LLM ({target_model}): {e}", exc_info=True)
+            return None
+        except json.JSONDecodeError as e:
+            logger.error(f"Ошибка декодирования JSON ответа от LLM ({target_model}): {e}. Ответ: {response.text if 'response' in locals() else 'нет ответа'}", exc_info=True)
+            return None
+        except Exception as e:
+            logger.error(f"Неожиданная ошибка во время вызова LLM ({target_model}): {e}", exc_info=True)
             return None
+        finally:
+            await governor.release(lease_id)
+            await record_llm_call(LLMCallRecord(
+                caller=caller or UNKNOWN_CALLER,
+                model=target_model,
+                outcome=call_outcome,
+                status_code=call_status,
+                latency_ms=(time.perf_counter() - call_started_at) * 1000.0,
+                attempt=attempt + 1,
+                prompt_tokens=call_prompt_tokens,
+                completion_tokens=call_completion_tokens,
+                estimated_prompt_tokens=estimated_prompt_tokens,
+                cost_usd=estimate_cost_usd(target_model, call_prompt_tokens, call_completion_tokens),
+            ))
+
+        if attempt < max_retries:
+            delay = backoff_delay_seconds(attempt, retry_after)
+            logger.info(f"Повтор запроса к LLM ({target_model}) через {delay:.2f} сек.")
+            await asyncio.sleep(delay)
+
+    raise LLMThrottledError(
+        f"LLM ({target_model}) перегружен: запрос не выполнен после {max_retries + 1} попыток (последний статус: {last_status}).",
+        status_code=last_status
+    )
+
+
+async def потоковый_запрос_к_llm(
+    prompt_text: str,
+    модель: Optional[str] = None,
+    температура: float = 0.2,
+    макс_токены: int = 350,
+    caller: Optional[str] = None
+) -> AsyncIterator[str]:
+    """
+    Потоковый вариант одиночный_запрос_к_llm (stream=True): асинхронный генератор фрагментов текста по мере их
+    поступления от провайдера. Предохранитель, governor, повторы и метрики - как в обычном запросе, но повтор возможен
+    только до первого фрагмента; обрыв потока после него выбрасывает LLMThrottledError (часть текста уже отдана).
+    """
+    if not settings.OPENAI_API_KEY:
+        logger.error("Ключ OpenAI API не настроен (OPENAI_API_KEY).")
+        return
+
+    target_model = модель or settings.OPENAI_DEFAULT_MODEL_FOR_TASKS or settings.OPENAI_DEFAULT_MODEL
+    if not target_model:
+        logger.error("Модель LLM не указана и не задана в настройках (OPENAI_DEFAULT_MODEL_FOR_TASKS или OPENAI_DEFAULT_MODEL).")
+        return
+
+    api_url = settings.OPENAI_API_URL or "https://api.openai.com/v1/chat/completions"
+    headers = {
+        "Authorization": f"Bearer {settings.OPENAI_API_KEY}",
+        "Content-Type": "application/json",
+    }
+    payload: Dict[str, Any] = {
+        "model": target_model,
+        "messages": [{"role": "user", "content": prompt_text}],
+        "temperature": температура,
+        "max_tokens": макс_токены,
+        "stream": True,
+        "stream_options": {"include_usage": True}, # Последний фрагмент содержит usage
+    }
+    estimated_prompt_tokens = count_tokens(prompt_text, target_model)
+    logger.info(f"Отправка потокового запроса к LLM: Модель='{target_model}', Макс.токены={макс_токены}, Токены промпта (оценка)={estimated_prompt_tokens}")
 
-    except httpx.HTTPStatusError as e:
-        error_body = "Не удалось прочитать тело ошибки."
+    governor = get_llm_governor()
+    breaker = get_llm_circuit_breaker()
+    max_retries = max(0, settings.LLM_MAX_RETRIES)
+    last_status: Optional[int] = None
+
+    for attempt in range(max_retries + 1):
+        retry_after: Optional[float] = None
+        call_outcome = OUTCOME_ERROR
+        call_status: Optional[int] = None
+        call_prompt_tokens = 0
+        call_completion_tokens = 0
+        streamed_parts: List[str] = []
+        if not await breaker.allow_request():
+            await record_llm_call(LLMCallRecord(
+                caller=caller or UNKNOWN_CALLER, model=target_model, outcome=OUTCOME_CIRCUIT_OPEN,
+                status_code=None, latency_ms=0.0, attempt=attempt + 1, estimated_prompt_tokens=estimated_prompt_tokens,
+            ))
+            raise LLMCircuitOpenError(
+                f"LLM ({target_model}): предохранитель разомкнут после серии сбоев провайдера, запрос отклонен без ожидания.",
+                status_code=last_status
+            )
+        lease_id = await governor.acquire()
+        call_started_at = time.perf_counter()
         try:
-            error_body = e.response.text
-        except Exception:
-            pass
-        logger.error(f"Ошибка HTTPStatusError при запросе к LLM ({target_model}): {e.response.status_code} - {error_body}", exc_info=False) # exc_info=False чтобы не дублировать стектрейс от raise_for_status
+            async with httpx.AsyncClient(timeout=settings.OPENAI_TIMEOUT_SECONDS or 60.0) as client:
+                async with client.stream("POST", api_url, headers=headers, json=payload) as response:
+                    call_status = response.status_code
+                    if response.status_code in RETRYABLE_STATUS_CODES:
+                        call_outcome = OUTCOME_THROTTLED
+                        last_status = response.status_code
+                        retry_after = parse_retry_after_seconds(response.headers)
+                        await response.aread()
+                        await governor.on_throttled(response.status_code, retry_after)
+                        if response.status_code >= 500:
+                            await breaker.on_failure(f"HTTP {response.status_code}")
+                        else:
+                            await breaker.on_success()
+                        logger.warning(f"LLM ({target_model}) вернул {response.status_code} на потоковый запрос (попытка {attempt + 1}/{max_retries + 1}), retry-after={retry_after}.")
+                    else:
+                        await breaker.on_success()
+                        if response.status_code >= 400:
+                            call_outcome = OUTCOME_HTTP_ERROR
+                            error_body = (await response.aread()).decode("utf-8", errors="replace")
+                            logger.error(f"Ошибка HTTP при потоковом запросе к LLM ({target_model}): {response.status_code} - {error_body[:500]}")
+                            return
+                        await governor.on_success(response.headers)
+                        call_outcome = OUTCOME_EMPTY
+                        async for line in response.aiter_lines():
+                            if not line.startswith("data:"):
+                                continue
+                            data = line[len("data:"):].strip()
+                            if data == "[DONE]":
+                                break
+                            chunk = json.loads(data)
+                            usage = chunk.get("usage") or {}
+                            if usage:
+                                call_prompt_tokens = int(usage.get("prompt_tokens") or 0)
+                                call_completion_tokens = int(usage.get("completion_tokens") or 0)
+                            for choice in chunk.get("choices") or []:
+                                delta_text = (choice.get("delta") or {}).get("content")
+                                if not delta_text:
+                                    continue
+                                if not streamed_parts:
+                                    logger.info(f"LLM ({target_model}): первый фрагмент потока через {time.perf_counter() - call_started_at:.2f} сек.")
+                                call_outcome = OUTCOME_OK
+                                streamed_parts.append(delta_text)
+                                yield delta_text
+                        if not call_prompt_tokens:
+                            # Провайдер без stream_options.include_usage - считаем локально
+                            call_prompt_tokens = estimated_prompt_tokens
+                            call_completion_tokens = count_tokens("".join(streamed_parts), target_model)
+                        _record_token_usage(target_model, call_prompt_tokens, call_completion_tokens, estimated_prompt_tokens)
+                        logger.info(f"Потоковый ответ LLM ({target_model}) завершен: prompt={call_prompt_tokens}, completion={call_completion_tokens}.")
+                        return
+        except (httpx.TimeoutException, httpx.NetworkError) as e:
+            last_status = None
+            call_outcome = OUTCOME_NETWORK_ERROR
+            await governor.on_throttled(None, None)
+            await breaker.on_failure(type(e).__name__)
+            if streamed_parts:
+                raise LLMThrottledError(f"LLM ({target_model}): поток оборвался после {len(streamed_parts)} фрагментов: {type(e).__name__}: {e}")
+            logger.warning(f"Сетевая ошибка при потоковом запросе к LLM ({target_model}) (попытка {attempt + 1}/{max_retries + 1}): {type(e).__name__}: {e}")
+        except json.JSONDecodeError as e:
+            logger.error(f"Невалидный фрагмент потока от LLM ({target_model}): {e}", exc_info=True)
+            return
+        finally:
+            await governor.release(lease_id)
+            await record_llm_call(LLMCallRecord(
+                caller=caller or UNKNOWN_CALLER,
+                model=target_model,
+                outcome=call_outcome,
+                status_code=call_status,
+                latency_ms=(time.perf_counter() - call_started_at) * 1000.0,
+                attempt=attempt + 1,
+                prompt_tokens=call_prompt_tokens,
+                completion_tokens=call_completion_tokens,
+                estimated_prompt_tokens=estimated_prompt_tokens,
+                cost_usd=estimate_cost_usd(target_model, call_prompt_tokens, call_completion_tokens),
+            ))
+
+        if attempt < max_retries:
+            delay = backoff_delay_seconds(attempt, retry_after)
+            logger.info(f"Повтор потокового запроса к LLM ({target_model}) через {delay:.2f} сек.")
+            await asyncio.sleep(delay)
+
+    raise LLMThrottledError(
+        f"LLM ({target_model}) перегружен: потоковый запрос не выполнен после {max_retries + 1} попыток (последний статус: {last_status}).",
+        status_code=last_status
+    )
+
+async def probe_llm_provider() -> Optional[bool]:
+    """
+    Фоновая проверка восстановления провайдера при разомкнутом предохранителе: минимальный запрос (1 токен ответа)
+    в обход governor'а. Возвращает None, если проверка сейчас не нужна, иначе - доступен ли провайдер.
+    """
+    breaker = get_llm_circuit_breaker()
+    if not settings.OPENAI_API_KEY or not await breaker.should_probe():
+        return None
+    target_model = settings.OPENAI_DEFAULT_MODEL_FOR_TASKS or settings.OPENAI_DEFAULT_MODEL
+    api_url = settings.OPENAI_API_URL or "https://api.openai.com/v1/chat/completions"
+    payload = {"model": target_model, "messages": [{"role": "user", "content": "ping"}], "max_tokens": 1, "temperature": 0}
+    started_at = time.perf_counter()
+    status_code: Optional[int] = None
+    try:
+        async with httpx.AsyncClient(timeout=settings.LLM_CIRCUIT_PROBE_TIMEOUT_SECONDS) as client:
+            response = await client.post(api_url, headers={"Authorization": f"Bearer {settings.OPENAI_API_KEY}"}, json=payload)
+        status_code = response.status_code
+        provider_available = response.status_code < 500
+        failure_reason = f"HTTP {response.status_code}"
     except httpx.RequestError as e:
-        logger.error(f"Ошибка RequestError при запросе к LLM ({target_model}): {e}", exc_info=True)
-    except json.JSONDecodeError as e:
-        logger.error(f"Ошибка декодирования JSON ответа от LLM ({target_model}): {e}. Ответ: {response.text if 'response' in locals() else 'нет ответа'}", exc_info=True)
-    except Exception as e:
-        logger.error(f"Неожиданная ошибка во время вызова LLM ({target_model}): {e}", exc_info=True)
-    
-    return None
\ No newline at end of file
+        provider_available = False
+        failure_reason = type(e).__name__
+    if provider_available:
+        await breaker.on_success()
+    else:
+        await breaker.on_failure(f"пробный запрос: {failure_reason}")
+    await record_llm_call(LLMCallRecord(
+        caller="circuit_probe", model=target_model or "", outcome=OUTCOME_OK if provider_available else OUTCOME_NETWORK_ERROR,
+        status_code=status_code, latency_ms=(time.perf_counter() - started_at) * 1000.0, attempt=1,
+    ))
+    logger.info(f"Пробный запрос к LLM ({target_model}): провайдер {'доступен' if provider_available else 'недоступен'} (статус {status_code}).")
+    return provider_available
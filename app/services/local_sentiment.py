@@ -0,0 +1,151 @@
+# app/services/local_sentiment.py
+
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+from app.core.config import settings
+
+# Источник решения о тональности (posts.post_sentiment_source)
+SOURCE_LOCAL = "local"        # Локальный классификатор, уверенность >= порога
+SOURCE_LLM = "llm"            # Синхронный вызов LLM
+SOURCE_LLM_BATCH = "llm_batch" # Batch API
+SOURCE_NO_TEXT = "no_text"    # Текста нет - neutral без анализа
+
+# Основы слов (префиксы) с весом полярности. Совпадение ищется по самому длинному префиксу токена,
+# поэтому "отличн" покрывает "отличный", "отлично", "отличная" и т.д.
+_POSITIVE_STEMS: Dict[str, float] = {
+    "хорош": 1.0, "отличн": 1.5, "прекрасн": 1.5, "замечательн": 1.5, "великолепн": 1.8, "превосходн": 1.8,
+    "супер": 1.3, "классн": 1.2, "круто": 1.3, "крут": 1.0, "шикарн": 1.5, "восхит": 1.6, "потрясающ": 1.7,
+    "люблю": 1.3, "любим": 1.0, "нрав": 1.0, "понрав": 1.2, "радует": 1.2, "радост": 1.2,
+    "спасибо": 1.0, "благодар": 1.1, "молодц": 1.3, "браво": 1.3, "успех": 1.0, "успешн": 1.0,
+    "удобн": 0.9, "полезн": 1.0, "интересн": 0.8, "качествен": 0.9, "надежн": 0.9, "выгодн": 0.8,
+    "лучш": 1.1, "идеальн": 1.5, "рекоменд": 0.9, "доволен": 1.2, "довольн": 1.2, "счаст": 1.4,
+    "поддерж": 0.6, "вырос": 0.6, "побед": 1.0, "приятн": 1.0, "годн": 0.9,
+}
+_NEGATIVE_STEMS: Dict[str, float] = {
+    "плох": 1.2, "ужасн": 1.7, "кошмар": 1.7, "отвратит": 1.8, "мерзк": 1.7, "гадк": 1.4, "омерзит": 1.8,
+    "отстой": 1.6, "фигн": 1.2, "хрен": 1.0, "дерьм": 1.8, "позор": 1.6, "бред": 1.3, "чушь": 1.2,
+    "ненавиж": 1.7, "бесит": 1.5, "бесят": 1.5, "раздража": 1.2, "злит": 1.2, "обман": 1.4, "мошенн": 1.6,
+    "развод": 1.2, "жалоб": 0.9, "проблем": 0.8, "ошибк": 0.7, "сломал": 1.1, "слома": 1.0, "глюч": 1.0,
+    "тормоз": 0.9, "вылета": 1.0, "не работает": 1.3, "разочаров": 1.4, "грустн": 1.0, "печальн": 1.1,
+    "жаль": 0.8, "жалко": 0.8, "хуж": 1.1, "худш": 1.3, "провал": 1.3, "кризис": 0.9, "паден": 0.7,
+    "упал": 0.7, "подорож": 0.7, "беспредел": 1.5, "воров": 1.4, "украл": 1.4, "угроз": 0.9,
+    "опасн": 0.8, "кринж": 1.3, "треш": 1.2, "ужас": 1.6, "тупо": 1.1, "тупост": 1.2, "глуп": 1.0, "бесполезн": 1.3,
+}
+_NEGATIONS = {"не", "ни", "нет", "без", "нельзя", "никогда", "никак"}
+_INTENSIFIERS = {"очень": 1.5, "крайне": 1.7, "слишком": 1.3, "совсем": 1.3, "реально": 1.2, "максимально": 1.6, "абсолютно": 1.6}
+
+_POSITIVE_EMOJI = {
+    "👍": 1.0, "❤": 1.2, "❤️": 1.2, "🔥": 1.0, "😍": 1.5, "😊": 1.0, "😀": 1.0, "😃": 1.0, "😄": 1.0, "😁": 1.0,
+    "🥰": 1.5, "👏": 1.2, "🙏": 0.8, "💪": 0.9, "🎉": 1.2, "✅": 0.6, "😂": 0.7, "🤣": 0.7, "💯": 1.0, "🤝": 0.7, "⚡": 0.5,
+}
+_NEGATIVE_EMOJI = {
+    "👎": 1.2, "😡": 1.6, "🤬": 1.8, "😠": 1.4, "💩": 1.6, "🤮": 1.7, "😢": 1.0, "😭": 1.1, "😞": 1.0,
+    "😔": 0.9, "🙄": 0.8, "😒": 0.9, "🤡": 1.2, "❌": 0.7, "😱": 0.8, "💔": 1.2,
+}
+# Текстовые смайлы
+_POSITIVE_EMOTICON_RE = re.compile(r"(?:[:;=]-?\)+|\){2,}|\bxd\b)", re.IGNORECASE)
+_NEGATIVE_EMOTICON_RE = re.compile(r"(?:[:;=]-?\(+|\({2,})")
+
+_TOKEN_RE = re.compile(r"[а-яёa-z]+", re.IGNORECASE)
+_MAX_STEM_LEN = max(len(stem) for stem in list(_POSITIVE_STEMS) + list(_NEGATIVE_STEMS))
+_MULTIWORD_NEGATIVE = {phrase: weight for phrase, weight in _NEGATIVE_STEMS.items() if " " in phrase}
+
+
+@dataclass
+class LocalSentimentResult:
+    label: str          # positive / negative / neutral / mixed
+    score: float        # [-1.0, 1.0]
+    confidence: float   # [0.0, 1.0]; ниже порога - решение отдается LLM
+
+
+def _stem_weight(token: str, lexicon: Dict[str, float]) -> float:
+    for length in range(min(len(token), _MAX_STEM_LEN), 2, -1):
+        weight = lexicon.get(token[:length])
+        if weight is not None:
+            return weight
+    return 0.0
+
+
+def _emoji_scores(text: str) -> tuple:
+    positive = sum(weight * text.count(emoji) for emoji, weight in _POSITIVE_EMOJI.items() if emoji in text)
+    negative = sum(weight * text.count(emoji) for emoji, weight in _NEGATIVE_EMOJI.items() if emoji in text)
+    positive += 0.7 * len(_POSITIVE_EMOTICON_RE.findall(text))
+    negative += 0.7 * len(_NEGATIVE_EMOTICON_RE.findall(text))
+    return positive, negative
+
+
+def classify_text(text: Optional[str]) -> LocalSentimentResult:
+    """
+    Лексиконный классификатор тональности для русского текста: основы слов с весами, отрицания ("не хорошо"),
+    усилители, эмодзи и текстовые смайлы. Уверенность высокая для коротких/однозначных текстов
+    и падает для длинных текстов с редкими или противоречивыми сигналами.
+    """
+    if not text or not text.strip():
+        return LocalSentimentResult("neutral", 0.0, 1.0)
+    lowered = text.lower()
+    tokens = _TOKEN_RE.findall(lowered)
+
+    positive, negative = _emoji_scores(text)
+    emoji_only = not tokens and (positive or negative)
+
+    for phrase, weight in _MULTIWORD_NEGATIVE.items():
+        if phrase in lowered:
+            negative += weight
+    multiplier = 1.0; negate_window = 0
+    for token in tokens:
+        if token in _NEGATIONS:
+            negate_window = 3 # Отрицание действует на ближайшие слова
+            continue
+        if token in _INTENSIFIERS:
+            multiplier = _INTENSIFIERS[token]
+            continue
+        pos_weight = _stem_weight(token, _POSITIVE_STEMS)
+        neg_weight = _stem_weight(token, _NEGATIVE_STEMS)
+        if not (pos_weight or neg_weight) and token.startswith("не") and len(token) > 5:
+            # Слитное отрицание: "неплохо", "неудобно", "нехорошо"
+            pos_weight = _stem_weight(token[2:], _POSITIVE_STEMS)
+            neg_weight = _stem_weight(token[2:], _NEGATIVE_STEMS)
+            if pos_weight or neg_weight:
+                negate_window = 1
+        if pos_weight or neg_weight:
+            pos_weight *= multiplier; neg_weight *= multiplier
+            if negate_window > 0: # "не хорошо" -> негатив (ослабленный), "не плохо" -> слабый позитив
+                pos_weight, neg_weight = neg_weight * 0.5, pos_weight * 0.8
+            positive += pos_weight; negative += neg_weight
+            multiplier = 1.0
+        negate_window = max(0, negate_window - 1)
+
+    total = positive + negative
+    if total == 0:
+        # Нет полярных сигналов: короткие реплики ("ок", "понятно", "+") почти всегда нейтральны
+        confidence = 0.9 if len(tokens) <= settings.SENTIMENT_LOCAL_SHORT_TEXT_TOKENS else max(0.3, 0.75 - 0.01 * len(tokens))
+        return LocalSentimentResult("neutral", 0.0, round(confidence, 3))
+
+    polarity = (positive - negative) / total # [-1, 1]: насколько сигналы согласованы
+    score = max(-1.0, min(1.0, (positive - negative) / (total + 1.0)))
+    if min(positive, negative) >= 1.0 and abs(polarity) < 0.35:
+        label = "mixed"
+    elif polarity > 0:
+        label = "positive"
+    else:
+        label = "negative"
+
+    # Плотность сигнала: сколько полярного веса приходится на слово. Длинный текст с одним "хорошо" - не уверены.
+    density = total / max(1.0, len(tokens) ** 0.5)
+    confidence = min(1.0, abs(polarity) * min(1.0, density / 1.5))
+    if label == "mixed":
+        confidence = min(confidence, 0.6)
+    if emoji_only:
+        confidence = max(confidence, 0.95 if abs(polarity) > 0.5 else 0.7)
+    return LocalSentimentResult(label, round(score, 3), round(confidence, 3))
+
+
+def classify_batch(texts: Sequence[Optional[str]]) -> List[LocalSentimentResult]:
+    """Оценка пачки текстов за один вызов (лексикон загружен один раз, без сетевых запросов)."""
+    return [classify_text(text) for text in texts]
+
+
+def is_confident(result: LocalSentimentResult) -> bool:
+    return settings.SENTIMENT_LOCAL_CLASSIFIER_ENABLED and result.confidence >= settings.SENTIMENT_LOCAL_CONFIDENCE_THRESHOLD
@@ -0,0 +1,92 @@
+# app/services/near_duplicates.py
+
+import hashlib
+import re
+from typing import Iterable, List, Optional
+
+from app.core.config import settings
+
+SIMHASH_BITS = 64
+# 64-битная подпись режется на 4 полосы по 16 бит: при расстоянии Хэмминга <= 3 хотя бы одна полоса
+# совпадает точно (принцип Дирихле), поэтому кандидатов можно искать по равенству полос через индексы.
+SIMHASH_BAND_COUNT = 4
+SIMHASH_BAND_BITS = SIMHASH_BITS // SIMHASH_BAND_COUNT
+SIMHASH_BAND_MASK = (1 << SIMHASH_BAND_BITS) - 1
+
+_URL_RE = re.compile(r"https?://\S+|www\.\S+|t\.me/\S+", re.IGNORECASE)
+_MENTION_RE = re.compile(r"@\w+")
+_WORD_RE = re.compile(r"[^\W\d_]+", re.UNICODE)
+
+
+def normalize_tokens(text: Optional[str]) -> List[str]:
+    """Нормализация для сравнения: нижний регистр, без ссылок, упоминаний, цифр, пунктуации и эмодзи."""
+    if not text:
+        return []
+    cleaned = _MENTION_RE.sub(" ", _URL_RE.sub(" ", text.lower().replace("ё", "е")))
+    return _WORD_RE.findall(cleaned)
+
+
+def _feature_hash(feature: str) -> int:
+    return int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def _to_signed64(value: int) -> int:
+    """BIGINT в Postgres знаковый - храним те же 64 бита в дополнительном коде."""
+    return value - (1 << SIMHASH_BITS) if value >= (1 << (SIMHASH_BITS - 1)) else value
+
+
+def simhash64(text: Optional[str]) -> Optional[int]:
+    """
+    SimHash по словам и биграммам слов (биграммы весят вдвое больше - порядок слов важнее набора).
+    Возвращает знаковое 64-битное число или None, если в тексте нет слов.
+    """
+    tokens = normalize_tokens(text)
+    if not tokens:
+        return None
+    features = [(token, 1) for token in tokens]
+    features += [(f"{a} {b}", 2) for a, b in zip(tokens, tokens[1:])]
+    vector = [0] * SIMHASH_BITS
+    for feature, weight in features:
+        feature_hash = _feature_hash(feature)
+        for bit in range(SIMHASH_BITS):
+            vector[bit] += weight if (feature_hash >> bit) & 1 else -weight
+    fingerprint = 0
+    for bit in range(SIMHASH_BITS):
+        if vector[bit] > 0:
+            fingerprint |= 1 << bit
+    return _to_signed64(fingerprint)
+
+
+def simhash_bands(signature: int) -> List[int]:
+    unsigned = signature & ((1 << SIMHASH_BITS) - 1)
+    return [(unsigned >> (band * SIMHASH_BAND_BITS)) & SIMHASH_BAND_MASK for band in range(SIMHASH_BAND_COUNT)]
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin((a ^ b) & ((1 << SIMHASH_BITS) - 1)).count("1")
+
+
+def max_distance_for(text: Optional[str]) -> int:
+    """Короткие реплики сравниваем только на точное совпадение подписи: у них мало признаков и много ложных совпадений."""
+    return settings.NEAR_DUP_MAX_HAMMING if len(normalize_tokens(text)) >= settings.NEAR_DUP_MIN_TOKENS else 0
+
+
+def find_representative(signature: int, max_distance: int, candidates: Iterable[tuple]) -> Optional[int]:
+    """
+    candidates - пары (id, подпись) представителей кластеров; возвращает id ближайшего в пределах max_distance.
+    """
+    best_id, best_distance = None, max_distance + 1
+    for candidate_id, candidate_signature in candidates:
+        distance = hamming_distance(signature, candidate_signature)
+        if distance < best_distance:
+            best_id, best_distance = candidate_id, distance
+            if distance == 0:
+                break
+    return best_id
+
+
+def simhash_band_expression(column, band: int):
+    """SQL-выражение полосы подписи - в точности как в индексах ix_comments_simhash_band_N, чтобы они использовались."""
+    if band == 0:
+        return column.op("&")(SIMHASH_BAND_MASK)
+    return column.op(">>")(band * SIMHASH_BAND_BITS).op("&")(SIMHASH_BAND_MASK)
@@ -0,0 +1,122 @@
+# app/services/partitioning.py
+
+import logging
+import re
+from datetime import date, datetime, timezone
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+logger = logging.getLogger(__name__)
+
+# Помесячные секции таблиц, секционированных RANGE по времени: {table}_pYYYYMM, границы [1-е число месяца, 1-е число следующего) в UTC.
+# Строки вне всех секций попадают в {table}_default (создается миграцией), чтобы вставка не падала, если секцию не успели создать.
+_PARTITION_NAME_RE = re.compile(r"^(?P<table>[a-z_]+)_p(?P<year>\d{4})(?P<month>\d{2})$")
+_IDENTIFIER_RE = re.compile(r"^[a-z_][a-z0-9_]*$")
+
+
+def month_start(value: date) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, months: int) -> date:
+    month_index = month.year * 12 + (month.month - 1) + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def monthly_partition_name(table: str, month: date) -> str:
+    return f"{table}_p{month.year:04d}{month.month:02d}"
+
+
+def default_partition_name(table: str) -> str:
+    return f"{table}_default"
+
+
+def parse_partition_month(table: str, partition_name: str) -> Optional[date]:
+    match = _PARTITION_NAME_RE.match(partition_name)
+    if not match or match.group("table") != table:
+        return None
+    return date(int(match.group("year")), int(match.group("month")), 1)
+
+
+def _checked_identifier(name: str) -> str:
+    # Имена таблиц подставляются в DDL напрямую (параметры для идентификаторов не поддерживаются) - только из кода, но проверяем
+    if not _IDENTIFIER_RE.match(name):
+        raise ValueError(f"Недопустимое имя таблицы для секционирования: {name!r}")
+    return name
+
+
+def _month_bound_literal(month: date) -> str:
+    return f"'{month.isoformat()} 00:00:00+00'"
+
+
+async def list_monthly_partitions(db: AsyncSession, table: str) -> List[Tuple[str, date]]:
+    """Помесячные секции таблицы (имя, первый день месяца) по возрастанию месяца; секция по умолчанию не включается."""
+    rows = (await db.execute(
+        text(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE parent.relname = :table"
+        ),
+        {"table": table},
+    )).scalars().all()
+    partitions = [(name, parse_partition_month(table, name)) for name in rows]
+    return sorted([(name, month) for name, month in partitions if month is not None], key=lambda item: item[1])
+
+
+async def ensure_monthly_partitions(
+    db: AsyncSession, table: str, partition_column: str, months_ahead: int, from_month: Optional[date] = None
+) -> List[str]:
+    """
+    Создает недостающие помесячные секции table с from_month (по умолчанию - текущий месяц) по текущий + months_ahead.
+    Если в секции по умолчанию уже есть строки из диапазона нового месяца, Postgres не даст создать секцию - такой месяц
+    пропускается с предупреждением (данные остаются доступны, просто без отсечения секций). Возвращает имена созданных секций.
+    """
+    table = _checked_identifier(table)
+    partition_column = _checked_identifier(partition_column)
+    current_month = month_start(datetime.now(timezone.utc).date())
+    first_month = month_start(from_month) if from_month else current_month
+    last_month = add_months(current_month, months_ahead)
+    existing = {name for name, _ in await list_monthly_partitions(db, table)}
+    default_name = default_partition_name(table)
+
+    created: List[str] = []
+    month = first_month
+    while month <= last_month:
+        name = monthly_partition_name(table, month)
+        next_month = add_months(month, 1)
+        if name not in existing:
+            rows_in_default = (await db.execute(text(
+                f"SELECT EXISTS (SELECT 1 FROM {default_name} WHERE {partition_column} >= {_month_bound_literal(month)} "
+                f"AND {partition_column} < {_month_bound_literal(next_month)})"
+            ))).scalar()
+            if rows_in_default:
+                logger.warning(f"Секционирование {table}: в {default_name} есть строки за {month:%Y-%m}, секция {name} не создана.")
+            else:
+                await db.execute(text(
+                    f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} "
+                    f"FOR VALUES FROM ({_month_bound_literal(month)}) TO ({_month_bound_literal(next_month)})"
+                ))
+                created.append(name)
+        month = next_month
+    return created
+
+
+async def detach_monthly_partitions_before(db: AsyncSession, table: str, cutoff_month: date, drop: bool = False) -> List[str]:
+    """
+    Отсоединяет помесячные секции table за месяцы раньше cutoff_month: данные перестают быть видны через table,
+    но остаются отдельной таблицей (ее можно выгрузить pg_dump -t и удалить). drop=True - сразу удаляет.
+    Строки ссылающихся таблиц (внешние ключи на table) вызывающий должен удалить заранее, иначе Postgres откажет.
+    """
+    table = _checked_identifier(table)
+    detached: List[str] = []
+    for name, month in await list_monthly_partitions(db, table):
+        if month >= cutoff_month:
+            continue
+        await db.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+        if drop:
+            await db.execute(text(f"DROP TABLE {name}"))
+        detached.append(name)
+    return detached
@@ -0,0 +1,141 @@
+# app/services/response_cache.py
+
+import asyncio
+import hashlib
+import json
+import logging
+import uuid
+import weakref
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from pydantic import BaseModel
+
+from app.core.config import settings
+from app.core.redis_client import get_async_redis
+
+logger = logging.getLogger(__name__)
+
+# Ключи: {prefix}:data_version - счетчик версии данных; {prefix}:resp:{endpoint}:v{version}:{hash параметров} - готовый JSON ответа;
+# {ключ ответа}:lock - блокировка пересчета (single-flight между процессами API)
+
+# KEYS[1] - блокировка; ARGV[1] - токен владельца. Снимает блокировку, только если она все еще наша.
+_RELEASE_LOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Пересчеты, идущие в этом процессе: ключ ответа -> задача (по event loop, как клиенты Redis)
+_inflight_by_loop: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Task]]" = weakref.WeakKeyDictionary()
+
+
+def _key(suffix: str) -> str:
+    return f"{settings.RESPONSE_CACHE_REDIS_PREFIX}:{suffix}"
+
+
+def _normalize_params(params: Dict[str, Any]) -> str:
+    """Параметры запроса в каноническом виде: сортировка ключей, None отбрасывается, списки сортируются, даты - ISO."""
+    normalized = {}
+    for name, value in params.items():
+        if value is None:
+            continue
+        if isinstance(value, (list, tuple, set)):
+            value = sorted(value, key=str)
+        normalized[name] = value
+    return json.dumps(normalized, sort_keys=True, separators=(",", ":"), default=str, ensure_ascii=False)
+
+
+def get_endpoint_ttl(endpoint: str) -> int:
+    return int(settings.RESPONSE_CACHE_TTL_SECONDS.get(endpoint, settings.RESPONSE_CACHE_DEFAULT_TTL_SECONDS))
+
+
+async def get_data_version() -> Optional[str]:
+    try:
+        return await get_async_redis().get(_key("data_version")) or "0"
+    except Exception as e:
+        logger.debug(f"Response cache: Redis недоступен при чтении версии данных ({type(e).__name__}).")
+        return None
+
+
+async def bump_data_version(reason: str = "") -> None:
+    """
+    Увеличивает версию данных - все закэшированные ответы становятся недостижимыми (старые ключи доживают свой TTL).
+    Вызывается задачами после коммита изменений, которые видны в аналитике. Ошибки Redis не влияют на вызывающего.
+    """
+    if not settings.RESPONSE_CACHE_ENABLED:
+        return
+    try:
+        version = await get_async_redis().incr(_key("data_version"))
+        logger.debug(f"Response cache: версия данных -> {version} ({reason or 'без причины'}).")
+    except Exception as e:
+        logger.warning(f"Response cache: не удалось увеличить версию данных ({reason}): {type(e).__name__}: {e}")
+
+
+async def _compute_and_store(cache_key: str, ttl: int, compute: Callable[[], Awaitable[BaseModel]]) -> str:
+    redis_client = get_async_redis()
+    lock_key = f"{cache_key}:lock"
+    lock_token = uuid.uuid4().hex
+    try:
+        lock_acquired = bool(await redis_client.set(lock_key, lock_token, nx=True, ex=settings.RESPONSE_CACHE_LOCK_TTL_SECONDS))
+    except Exception:
+        lock_acquired = True # Без Redis просто считаем сами
+    if not lock_acquired:
+        # Тот же ответ уже считает другой процесс - ждем его результата, а не нагружаем БД еще одним идентичным запросом
+        waited = 0.0
+        while waited < settings.RESPONSE_CACHE_LOCK_WAIT_SECONDS:
+            await asyncio.sleep(settings.RESPONSE_CACHE_LOCK_POLL_SECONDS)
+            waited += settings.RESPONSE_CACHE_LOCK_POLL_SECONDS
+            try:
+                cached = await redis_client.get(cache_key)
+            except Exception:
+                break
+            if cached is not None:
+                return cached
+        logger.debug(f"Response cache: не дождались пересчета {cache_key}, считаем сами.")
+
+    try:
+        payload = (await compute()).model_dump_json()
+        try:
+            await redis_client.set(cache_key, payload, ex=ttl)
+        except Exception as e:
+            logger.debug(f"Response cache: не удалось сохранить {cache_key}: {type(e).__name__}")
+        return payload
+    finally:
+        if lock_acquired:
+            try:
+                await redis_client.eval(_RELEASE_LOCK_LUA, 1, lock_key, lock_token)
+            except Exception:
+                pass
+
+
+async def get_or_compute_json(endpoint: str, params: Dict[str, Any], compute: Callable[[], Awaitable[BaseModel]]) -> str:
+    """
+    JSON ответа endpoint для params: из Redis, если данные не менялись с момента расчета, иначе compute() с сохранением.
+    Одинаковые запросы, пришедшие одновременно, считаются один раз: внутри процесса ждут общую задачу,
+    между процессами - блокировку в Redis. Без Redis (или при RESPONSE_CACHE_ENABLED=False) просто вызывает compute().
+    compute не должен захватывать ресурсы запроса (сессию БД из Depends): общая задача переживает отключение первого клиента.
+    """
+    if not settings.RESPONSE_CACHE_ENABLED:
+        return (await compute()).model_dump_json()
+    version = await get_data_version()
+    if version is None:
+        return (await compute()).model_dump_json()
+
+    params_hash = hashlib.sha1(_normalize_params(params).encode("utf-8")).hexdigest()
+    cache_key = _key(f"resp:{endpoint}:v{version}:{params_hash}")
+    try:
+        cached = await get_async_redis().get(cache_key)
+    except Exception:
+        cached = None
+    if cached is not None:
+        return cached
+
+    inflight = _inflight_by_loop.setdefault(asyncio.get_running_loop(), {})
+    task = inflight.get(cache_key)
+    if task is None:
+        task = asyncio.ensure_future(_compute_and_store(cache_key, get_endpoint_ttl(endpoint), compute))
+        inflight[cache_key] = task
+        task.add_done_callback(lambda _: inflight.pop(cache_key, None))
+    # shield: отмена одного клиента (разрыв соединения) не должна отменять расчет для остальных ожидающих
+    return await asyncio.shield(task)
@@ -0,0 +1,44 @@
+# app/services/text_search.py
+
+import re
+from typing import Optional
+
+from sqlalchemy import Float, Text, func, literal_column
+
+# Конфигурация должна совпадать с выражениями сгенерированных колонок posts.search_vector / comments.search_vector,
+# иначе запрос нормализуется иначе, чем индекс (стемминг, стоп-слова)
+TS_CONFIG_SQL = "'russian'::regconfig"
+
+# <mark> выделяет совпадения в сниппетах; исходный текст в сниппете не экранируется - фронтенд должен экранировать сам
+HEADLINE_OPTIONS = "StartSel=<mark>, StopSel=</mark>, MaxWords=35, MinWords=12, ShortWord=2, MaxFragments=2, FragmentDelimiter=\" … \""
+
+_SEARCH_WORD_RE = re.compile(r"[^\W_]+", re.UNICODE)
+_MAX_SEARCH_WORDS = 12
+
+
+def build_prefix_tsquery_text(search_query: Optional[str]) -> Optional[str]:
+    """
+    Текст для to_tsquery из пользовательского ввода: все слова через &, последнее - префиксом (:*), так как строка поиска
+    во фронтенде отправляется по мере набора. Слова берутся регуляркой, поэтому операторы tsquery во вводе не сработают
+    и не сломают запрос. None - в запросе нет ни одного слова.
+    """
+    words = _SEARCH_WORD_RE.findall((search_query or "").lower())[:_MAX_SEARCH_WORDS]
+    if not words:
+        return None
+    return " & ".join(words[:-1] + [f"{words[-1]}:*"])
+
+
+def ts_query_expression(search_query: Optional[str]):
+    tsquery_text = build_prefix_tsquery_text(search_query)
+    if tsquery_text is None:
+        return None
+    return func.to_tsquery(literal_column(TS_CONFIG_SQL), tsquery_text)
+
+
+def ts_rank_expression(search_vector_column, ts_query):
+    """ts_rank с нормализацией по длине документа (флаг 1), иначе длинные посты всегда выше коротких."""
+    return func.ts_rank(search_vector_column, ts_query, 1, type_=Float)
+
+
+def ts_headline_expression(document, ts_query):
+    return func.ts_headline(literal_column(TS_CONFIG_SQL), document, ts_query, HEADLINE_OPTIONS, type_=Text)
@@ -0,0 +1,190 @@
+# app/services/token_budget.py
+
+import hashlib
+import logging
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import List, Optional, Sequence, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+except ImportError: # tiktoken не установлен - используем консервативную оценку
+    tiktoken = None
+
+# Размер контекстного окна по префиксу имени модели (проверяются от самого длинного префикса)
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-4o": 128000,
+    "gpt-4-turbo": 128000,
+    "gpt-4-1106": 128000,
+    "gpt-4-0125": 128000,
+    "gpt-4-32k": 32768,
+    "gpt-4": 8192,
+    "gpt-3.5-turbo-1106": 16385,
+    "gpt-3.5-turbo-0125": 16385,
+    "gpt-3.5-turbo-16k": 16385,
+    "gpt-3.5-turbo": 4096,
+}
+DEFAULT_CONTEXT_WINDOW = 4096
+
+TRIM_SEPARATOR = "\n[...]\n"
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?…])\s+|\n+")
+# Запасной "токенизатор": куски до 3 букв/цифр с ведущим пробелом - для кириллицы это не меньше реального числа токенов
+_FALLBACK_TOKEN_RE = re.compile(r"\s?\w{1,3}|\s?[^\w\s]|\s+")
+
+
+class _FallbackEncoding:
+    name = "fallback-regex"
+
+    def encode(self, text: str) -> List[str]:
+        return _FALLBACK_TOKEN_RE.findall(text)
+
+    def decode(self, tokens: Sequence[str]) -> str:
+        return "".join(tokens)
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(model: str):
+    if tiktoken is None:
+        return _FallbackEncoding()
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+class _EncodingCache:
+    """
+    LRU-кэш токенизации по хэшу текста: один и тот же пост/шаблон считается много раз за пачку.
+    """
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._data: "OrderedDict[Tuple[str, str], tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_tokens(self, text: str, model: str) -> tuple:
+        encoding = _get_encoding(model)
+        key = (encoding.name, hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest())
+        with self._lock:
+            cached = self._data.get(key)
+            if cached is not None:
+                self._data.move_to_end(key)
+                return cached
+        tokens = tuple(encoding.encode(text))
+        with self._lock:
+            self._data[key] = tokens
+            if len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+        return tokens
+
+
+_cache = _EncodingCache(settings.LLM_TOKEN_CACHE_SIZE)
+
+
+def resolve_model(model: Optional[str]) -> str:
+    return model or settings.OPENAI_DEFAULT_MODEL_FOR_TASKS or settings.OPENAI_DEFAULT_MODEL or "gpt-3.5-turbo"
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    if not text:
+        return 0
+    return len(_cache.get_tokens(text, resolve_model(model)))
+
+
+def get_context_window(model: Optional[str] = None) -> int:
+    model_name = resolve_model(model)
+    for prefix in sorted(MODEL_CONTEXT_WINDOWS, key=len, reverse=True):
+        if model_name.startswith(prefix):
+            return MODEL_CONTEXT_WINDOWS[prefix]
+    return DEFAULT_CONTEXT_WINDOW
+
+
+def _cut_tokens(text: str, max_tokens: int, model: str, from_end: bool = False) -> str:
+    if max_tokens <= 0:
+        return ""
+    tokens = _cache.get_tokens(text, model)
+    if len(tokens) <= max_tokens:
+        return text
+    encoding = _get_encoding(model)
+    piece = tokens[-max_tokens:] if from_end else tokens[:max_tokens]
+    # Срез по токенам может разрезать многобайтовый символ - убираем "битые" края
+    return encoding.decode(list(piece)).strip("\ufffd")
+
+
+def trim_to_token_budget(text: str, max_tokens: int, model: Optional[str] = None) -> str:
+    """
+    Обрезает текст до max_tokens токенов: сохраняет начало и конец (доля начала - LLM_TRIM_HEAD_FRACTION),
+    режет по границам предложений, а если отдельное предложение не помещается - по токенам.
+    Результат гарантированно не длиннее max_tokens.
+    """
+    model_name = resolve_model(model)
+    if not text or count_tokens(text, model_name) <= max_tokens:
+        return text
+    separator_tokens = count_tokens(TRIM_SEPARATOR, model_name)
+    available = max_tokens - separator_tokens
+    if available <= 0:
+        return _cut_tokens(text, max_tokens, model_name)
+
+    head_budget = int(available * settings.LLM_TRIM_HEAD_FRACTION)
+    tail_budget = available - head_budget
+    sentences = [s for s in _SENTENCE_SPLIT_RE.split(text) if s and s.strip()]
+
+    head_parts: List[str] = []; head_used = 0; head_idx = 0
+    while head_idx < len(sentences):
+        cost = count_tokens(sentences[head_idx] + " ", model_name)
+        if head_used + cost > head_budget:
+            break
+        head_parts.append(sentences[head_idx]); head_used += cost; head_idx += 1
+    if not head_parts: # Первое предложение длиннее бюджета начала
+        head_parts.append(_cut_tokens(sentences[0] if sentences else text, head_budget, model_name))
+        head_used = count_tokens(head_parts[0] + " ", model_name); head_idx = 1
+
+    tail_budget += max(0, head_budget - head_used) # Неиспользованный бюджет начала отдаем концу
+    tail_parts: List[str] = []; tail_used = 0; tail_idx = len(sentences) - 1
+    while tail_idx >= head_idx:
+        cost = count_tokens(sentences[tail_idx] + " ", model_name)
+        if tail_used + cost > tail_budget:
+            break
+        tail_parts.insert(0, sentences[tail_idx]); tail_used += cost; tail_idx -= 1
+    if not tail_parts and tail_idx >= head_idx:
+        tail_parts.append(_cut_tokens(sentences[tail_idx], tail_budget, model_name, from_end=True))
+
+    head_text = " ".join(p for p in head_parts if p).strip()
+    tail_text = " ".join(p for p in tail_parts if p).strip()
+    result = f"{head_text}{TRIM_SEPARATOR}{tail_text}" if tail_text else head_text
+    # Склейка может дать на токен-другой больше суммы частей - страхуемся жестким срезом
+    if count_tokens(result, model_name) > max_tokens:
+        result = _cut_tokens(result, max_tokens, model_name)
+    return result
+
+
+def prompt_token_budget(model: Optional[str], max_completion_tokens: int, reserved_text: str = "") -> int:
+    """
+    Сколько токенов можно отдать под вставляемый текст: окно модели минус ответ, шаблон и служебные токены чата,
+    но не больше LLM_MAX_INPUT_TOKENS (ограничение стоимости).
+    """
+    model_name = resolve_model(model)
+    available = (
+        get_context_window(model_name)
+        - max_completion_tokens
+        - count_tokens(reserved_text, model_name)
+        - settings.LLM_PROMPT_SAFETY_MARGIN_TOKENS
+    )
+    return max(0, min(settings.LLM_MAX_INPUT_TOKENS, available))
+
+
+def render_prompt_with_budget(template: str, text: str, model: Optional[str], max_completion_tokens: int, placeholder: str = "{text}") -> str:
+    """
+    Подставляет text в template вместо placeholder, предварительно ужав его до бюджета модели.
+    """
+    reserved = template.replace(placeholder, "")
+    budget = prompt_token_budget(model, max_completion_tokens, reserved)
+    trimmed = trim_to_token_budget(text or "", budget, model)
+    if trimmed is not text:
+        logger.debug(f"Текст для промпта ужат до {budget} токенов (модель {resolve_model(model)}).")
+    return template.replace(placeholder, trimmed)
@@ -0,0 +1,418 @@
+# app/services/vector_index.py
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy
+except ImportError: # numpy не установлен - семантический поиск недоступен
+    numpy = None
+
+try:
+    import hnswlib
+except ImportError: # hnswlib не установлен - поиск точным перебором по сжатым векторам
+    hnswlib = None
+
+# Индекс для семантического поиска: {SEMANTIC_INDEX_PATH}/state.json + поколение gen-NNNNNN/ с файлами
+#   vectors.bin - векторы подряд (float16 или int8 с масштабом на строку), читаются через memory map;
+#   meta.bin    - запись на слот (вид документа, id, канал, время, хэш текста, масштаб, флаг удаления) - фильтры без Postgres;
+#   hnsw.bin    - граф HNSW (hnswlib), метки = номера слотов; без hnswlib - точный перебор по маске фильтров.
+# Пишет один процесс (задача tasks.update_semantic_index, блокировка writer.lock): новые и измененные документы дописываются
+# в конец, старая версия помечается удаленной; при большой доле удаленных - сжатие в новое поколение.
+# Читатели (API) видят только первые state.count слотов и перечитывают индекс при изменении state.json.
+KIND_POST = 1
+KIND_COMMENT = 2
+KIND_INSIGHT = 3
+KIND_BY_NAME = {"post": KIND_POST, "comment": KIND_COMMENT, "insight": KIND_INSIGHT}
+NAME_BY_KIND = {kind: name for name, kind in KIND_BY_NAME.items()}
+
+_META_DTYPE = numpy.dtype([
+    ("kind", "u1"), ("deleted", "u1"), ("doc_id", "<i8"), ("channel_id", "<i8"), ("ts", "<i8"), ("text_hash", "<i8"), ("scale", "<f4"),
+]) if numpy is not None else None
+
+_STATE_FILE = "state.json"
+_LOCK_FILE = "writer.lock"
+_VECTORS_FILE = "vectors.bin"
+_META_FILE = "meta.bin"
+_HNSW_FILE = "hnsw.bin"
+_SCAN_CHUNK_ROWS = 65536
+
+
+class VectorIndexUnavailableError(RuntimeError):
+    """Индекс не построен, построен другой моделью или не установлены зависимости."""
+
+
+def vector_index_dependencies_available() -> bool:
+    return numpy is not None
+
+
+def _hash63(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "little") & ((1 << 63) - 1)
+
+
+def text_hash(text: str) -> int:
+    return _hash63(text)
+
+
+def _state_path() -> str:
+    return os.path.join(settings.SEMANTIC_INDEX_PATH, _STATE_FILE)
+
+
+def _generation_dir(generation: int) -> str:
+    return os.path.join(settings.SEMANTIC_INDEX_PATH, f"gen-{generation:06d}")
+
+
+def _read_state() -> Optional[Dict[str, Any]]:
+    try:
+        with open(_state_path(), "r", encoding="utf-8") as state_file:
+            return json.load(state_file)
+    except FileNotFoundError:
+        return None
+
+
+def _vector_dtype(name: str):
+    return numpy.int8 if name == "int8" else numpy.float16
+
+
+def _quantize(vectors, dtype_name: str):
+    """Сжатие L2-нормированных float32: int8 - симметрично с масштабом на строку (x4 меньше), float16 - как есть (x2)."""
+    if dtype_name == "int8":
+        scales = numpy.maximum(numpy.abs(vectors).max(axis=1), 1e-12) / 127.0
+        return numpy.clip(numpy.rint(vectors / scales[:, None]), -127, 127).astype(numpy.int8), scales.astype(numpy.float32)
+    return vectors.astype(numpy.float16), numpy.ones(len(vectors), dtype=numpy.float32)
+
+
+def _open_arrays(directory: str, count: int, dim: int, dtype_name: str, mode: str = "r"):
+    if count == 0:
+        return numpy.zeros((0, dim), dtype=_vector_dtype(dtype_name)), numpy.zeros(0, dtype=_META_DTYPE)
+    vectors = numpy.memmap(os.path.join(directory, _VECTORS_FILE), dtype=_vector_dtype(dtype_name), mode=mode, shape=(count, dim))
+    meta = numpy.memmap(os.path.join(directory, _META_FILE), dtype=_META_DTYPE, mode=mode, shape=(count,))
+    return vectors, meta
+
+
+def _dequantized(vectors, meta, start: int, end: int):
+    return vectors[start:end].astype(numpy.float32) * meta["scale"][start:end, None]
+
+
+def _remove_generations_before(generation: int) -> None:
+    # Читатели, еще держащие отображенные файлы удаленного поколения, продолжат работать с ними до перезагрузки индекса
+    oldest_kept = os.path.basename(_generation_dir(generation))
+    for name in os.listdir(settings.SEMANTIC_INDEX_PATH):
+        if name.startswith("gen-") and name < oldest_kept:
+            shutil.rmtree(os.path.join(settings.SEMANTIC_INDEX_PATH, name), ignore_errors=True)
+
+
+class VectorIndexWriter:
+    """
+    Изменение индекса; используется как контекстный менеджер (эксклюзивная блокировка файлом на время работы).
+    Если индекс построен другим провайдером/моделью/типом хранения, начинается новое поколение с нуля (водяные знаки сброшены).
+    """
+
+    def __init__(self, provider_name: str, model: str, dim: int):
+        self.provider_name = provider_name
+        self.model = model
+        self.dim = dim
+        self.dtype_name = settings.SEMANTIC_VECTOR_DTYPE
+        self._lock_file = None
+        self._hnsw = None
+
+    def __enter__(self) -> "VectorIndexWriter":
+        os.makedirs(settings.SEMANTIC_INDEX_PATH, exist_ok=True)
+        self._lock_file = open(os.path.join(settings.SEMANTIC_INDEX_PATH, _LOCK_FILE), "w")
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        state = _read_state()
+        expected = {"provider": self.provider_name, "model": self.model, "dim": self.dim, "dtype": self.dtype_name}
+        if state is None or any(state.get(key) != value for key, value in expected.items()):
+            generation = (state or {}).get("generation", 0) + 1
+            logger.info(f"Индекс семантического поиска: новое поколение {generation} ({expected}) - полная переиндексация.")
+            state = {**expected, "generation": generation, "count": 0, "deleted": 0, "version": (state or {}).get("version", 0) + 1, "watermarks": {}, "hnsw": False}
+            os.makedirs(_generation_dir(generation), exist_ok=True)
+            self._write_state(state)
+            _remove_generations_before(generation - 1)
+        self.state = state
+        self._truncate_uncommitted()
+        return self
+
+    def _truncate_uncommitted(self) -> None:
+        # Прерванный запуск мог дописать строки без записи state.json - обрезаем, иначе следующие строки съедут
+        row_sizes = {_VECTORS_FILE: numpy.dtype(_vector_dtype(self.dtype_name)).itemsize * self.dim, _META_FILE: _META_DTYPE.itemsize}
+        for file_name, row_size in row_sizes.items():
+            path = os.path.join(self._directory, file_name)
+            committed_size = self.state["count"] * row_size
+            if os.path.exists(path) and os.path.getsize(path) > committed_size:
+                os.truncate(path, committed_size)
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+        self._lock_file.close()
+
+    @property
+    def watermarks(self) -> Dict[str, Any]:
+        return self.state["watermarks"]
+
+    @property
+    def _directory(self) -> str:
+        return _generation_dir(self.state["generation"])
+
+    def _write_state(self, state: Dict[str, Any]) -> None:
+        tmp_path = f"{_state_path()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as state_file:
+            json.dump(state, state_file, ensure_ascii=False, indent=2, default=str)
+        os.replace(tmp_path, _state_path())
+
+    def _live_selection(self, meta, kind: int, doc_ids):
+        return numpy.nonzero((meta["kind"] == kind) & (meta["deleted"] == 0) & numpy.isin(meta["doc_id"], doc_ids))[0]
+
+    def changed_mask(self, kind: int, doc_ids: Sequence[int], text_hashes: Sequence[int]):
+        """Маска документов, которых нет в индексе или чей текст изменился (только их нужно векторизовать)."""
+        doc_ids = numpy.asarray(doc_ids, dtype=numpy.int64)
+        _, meta = _open_arrays(self._directory, self.state["count"], self.dim, self.dtype_name)
+        selection = self._live_selection(meta, kind, doc_ids)
+        indexed = dict(zip(meta["doc_id"][selection].tolist(), meta["text_hash"][selection].tolist()))
+        return numpy.array([indexed.get(doc_id) != text_hash_value for doc_id, text_hash_value in zip(doc_ids.tolist(), text_hashes)], dtype=bool)
+
+    def delete_kind(self, kind: int) -> int:
+        """Помечает удаленными все документы вида kind (смена схемы документов этого вида - переиндексация только его)."""
+        _, meta = _open_arrays(self._directory, self.state["count"], self.dim, self.dtype_name)
+        slots = numpy.nonzero((meta["kind"] == kind) & (meta["deleted"] == 0))[0]
+        self._mark_deleted(slots)
+        return len(slots)
+
+    def _load_hnsw(self):
+        if self._hnsw is not None or not settings.SEMANTIC_HNSW_ENABLED or hnswlib is None:
+            return self._hnsw
+        count = self.state["count"]
+        index = hnswlib.Index(space="ip", dim=self.dim)
+        hnsw_path = os.path.join(self._directory, _HNSW_FILE)
+        if self.state.get("hnsw") and os.path.exists(hnsw_path):
+            index.load_index(hnsw_path, max_elements=max(count, 1024))
+            first_missing = self.state.get("hnsw_count", count)
+        else: # HNSW только что включен - строим по уже сохраненным векторам
+            index.init_index(max_elements=max(count, 1024), ef_construction=settings.SEMANTIC_HNSW_EF_CONSTRUCTION, M=settings.SEMANTIC_HNSW_M)
+            first_missing = 0
+        # Слоты, закоммиченные без сохранения графа (промежуточные коммиты, прерванный запуск), и удаления после сохранения
+        vectors, meta = _open_arrays(self._directory, count, self.dim, self.dtype_name)
+        for start in range(first_missing, count, _SCAN_CHUNK_ROWS):
+            end = min(start + _SCAN_CHUNK_ROWS, count)
+            index.add_items(_dequantized(vectors, meta, start, end), numpy.arange(start, end))
+        for slot in numpy.nonzero(meta["deleted"])[0].tolist():
+            try:
+                index.mark_deleted(slot)
+            except RuntimeError: # Уже помечен в сохраненном графе
+                pass
+        self._hnsw = index
+        return index
+
+    def _mark_deleted(self, slots) -> None:
+        if len(slots) == 0:
+            return
+        # Граф загружается до записи флагов: иначе _load_hnsw сам пометит эти слоты, и повторная пометка ниже упадет
+        hnsw = self._load_hnsw()
+        _, meta = _open_arrays(self._directory, self.state["count"], self.dim, self.dtype_name, mode="r+")
+        meta["deleted"][slots] = 1
+        meta.flush()
+        if hnsw is not None:
+            for slot in slots.tolist():
+                hnsw.mark_deleted(slot)
+        self.state["deleted"] += len(slots)
+
+    def upsert(self, kind: int, doc_ids: Sequence[int], channel_ids: Sequence[int], timestamps: Sequence[int], text_hashes: Sequence[int], vectors) -> int:
+        """Дописывает документы (векторы L2-нормированы); прежние версии тех же документов помечаются удаленными."""
+        if len(doc_ids) == 0:
+            return 0
+        doc_ids = numpy.asarray(doc_ids, dtype=numpy.int64)
+        if self.state["count"]:
+            _, meta = _open_arrays(self._directory, self.state["count"], self.dim, self.dtype_name)
+            self._mark_deleted(self._live_selection(meta, kind, doc_ids))
+        stored, scales = _quantize(numpy.asarray(vectors, dtype=numpy.float32), self.dtype_name)
+        new_meta = numpy.zeros(len(doc_ids), dtype=_META_DTYPE)
+        new_meta["kind"] = kind
+        new_meta["doc_id"] = doc_ids
+        new_meta["channel_id"] = numpy.asarray(channel_ids, dtype=numpy.int64)
+        new_meta["ts"] = numpy.asarray(timestamps, dtype=numpy.int64)
+        new_meta["text_hash"] = numpy.asarray(text_hashes, dtype=numpy.int64)
+        new_meta["scale"] = scales
+        with open(os.path.join(self._directory, _VECTORS_FILE), "ab") as vectors_file:
+            vectors_file.write(stored.tobytes())
+        with open(os.path.join(self._directory, _META_FILE), "ab") as meta_file:
+            meta_file.write(new_meta.tobytes())
+        first_slot = self.state["count"]
+        hnsw = self._load_hnsw()
+        if hnsw is not None:
+            required = first_slot + len(doc_ids)
+            if required > hnsw.get_max_elements():
+                hnsw.resize_index(max(required, int(hnsw.get_max_elements() * 1.5)))
+            hnsw.add_items(stored.astype(numpy.float32) * scales[:, None], numpy.arange(first_slot, required))
+        self.state["count"] = first_slot + len(doc_ids)
+        return len(doc_ids)
+
+    def commit(self, save_graph: bool = True) -> None:
+        """
+        Записывает состояние - только после этого читатели увидят новые слоты. save_graph=False - без сохранения графа HNSW
+        (дорого на больших индексах): новые слоты до следующего сохранения находятся только точным перебором.
+        """
+        if self._hnsw is not None and save_graph:
+            tmp_path = os.path.join(self._directory, f"{_HNSW_FILE}.tmp")
+            self._hnsw.save_index(tmp_path)
+            os.replace(tmp_path, os.path.join(self._directory, _HNSW_FILE))
+            self.state["hnsw"] = True
+            self.state["hnsw_count"] = self.state["count"]
+        self.state["version"] += 1
+        self._write_state(self.state)
+
+    def compact_if_needed(self) -> bool:
+        """Если удаленных слотов больше SEMANTIC_COMPACT_DELETED_RATIO, живые слоты переписываются в новое поколение."""
+        count, deleted = self.state["count"], self.state["deleted"]
+        if count < 1000 or deleted <= count * settings.SEMANTIC_COMPACT_DELETED_RATIO:
+            return False
+        vectors, meta = _open_arrays(self._directory, count, self.dim, self.dtype_name)
+        new_generation = self.state["generation"] + 1
+        new_directory = _generation_dir(new_generation)
+        os.makedirs(new_directory, exist_ok=True)
+        live_count = 0
+        with open(os.path.join(new_directory, _VECTORS_FILE), "wb") as vectors_file, open(os.path.join(new_directory, _META_FILE), "wb") as meta_file:
+            for start in range(0, count, _SCAN_CHUNK_ROWS):
+                end = min(start + _SCAN_CHUNK_ROWS, count)
+                live = numpy.nonzero(meta["deleted"][start:end] == 0)[0] + start
+                vectors_file.write(numpy.ascontiguousarray(vectors[live]).tobytes())
+                meta_file.write(numpy.ascontiguousarray(meta[live]).tobytes())
+                live_count += len(live)
+        previous_generation = self.state["generation"]
+        self.state = {**self.state, "generation": new_generation, "count": live_count, "deleted": 0, "hnsw": False}
+        self._hnsw = None
+        self._load_hnsw() # Граф строится заново по живым слотам
+        self.commit()
+        _remove_generations_before(previous_generation)
+        logger.info(f"Индекс семантического поиска сжат: {count} -> {live_count} слотов, поколение {new_generation}.")
+        return True
+
+
+class _VectorIndexReader:
+    """Индекс для поиска в процессе API: memory map файлов текущего поколения, перечитывается при изменении state.json."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state_mtime_ns: Optional[int] = None
+        self.state: Optional[Dict[str, Any]] = None
+        self._vectors = None
+        self._meta = None
+        self._hnsw = None
+
+    def refresh(self) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            try:
+                mtime_ns = os.stat(_state_path()).st_mtime_ns
+            except FileNotFoundError:
+                self.state = None
+                return None
+            if mtime_ns == self._state_mtime_ns:
+                return self.state
+            state = _read_state()
+            directory = _generation_dir(state["generation"])
+            self._vectors, self._meta = _open_arrays(directory, state["count"], state["dim"], state["dtype"])
+            self._hnsw = None
+            hnsw_path = os.path.join(directory, _HNSW_FILE)
+            if state.get("hnsw") and settings.SEMANTIC_HNSW_ENABLED and hnswlib is not None and os.path.exists(hnsw_path):
+                hnsw = hnswlib.Index(space="ip", dim=state["dim"])
+                hnsw.load_index(hnsw_path)
+                hnsw.set_ef(settings.SEMANTIC_HNSW_EF_SEARCH)
+                self._hnsw = hnsw
+            self.state = state
+            self._state_mtime_ns = mtime_ns
+            return state
+
+    @staticmethod
+    def _filter_mask(meta, kinds: Sequence[int], channel_ids: Optional[Sequence[int]], since_ts: Optional[int], until_ts: Optional[int]):
+        live = (meta["deleted"] == 0) & numpy.isin(meta["kind"], list(kinds))
+        # Канал и время есть только у постов и комментариев; канонические инсайты фильтруются при подсчете упоминаний в Postgres
+        scoped = meta["kind"] != KIND_INSIGHT
+        conditions = numpy.ones(len(meta), dtype=bool)
+        if channel_ids:
+            conditions &= numpy.isin(meta["channel_id"], list(channel_ids))
+        if since_ts is not None:
+            conditions &= meta["ts"] >= since_ts
+        if until_ts is not None:
+            conditions &= meta["ts"] < until_ts
+        return live & (~scoped | conditions)
+
+    @staticmethod
+    def _exact_search(vectors, meta, query, candidates, k: int) -> List[Tuple[int, float]]:
+        best_slots = numpy.zeros(0, dtype=numpy.int64)
+        best_scores = numpy.zeros(0, dtype=numpy.float32)
+        for start in range(0, len(candidates), _SCAN_CHUNK_ROWS):
+            slots = candidates[start:start + _SCAN_CHUNK_ROWS]
+            scores = (vectors[slots].astype(numpy.float32) @ query) * meta["scale"][slots]
+            best_slots = numpy.concatenate([best_slots, slots])
+            best_scores = numpy.concatenate([best_scores, scores])
+            if len(best_slots) > k:
+                keep = numpy.argpartition(-best_scores, k)[:k]
+                best_slots, best_scores = best_slots[keep], best_scores[keep]
+        order = numpy.argsort(-best_scores)
+        return list(zip(best_slots[order].tolist(), best_scores[order].tolist()))
+
+    def search(self, query, k: int, kinds: Sequence[int], channel_ids: Optional[Sequence[int]] = None,
+               since_ts: Optional[int] = None, until_ts: Optional[int] = None) -> List[Tuple[int, int, float]]:
+        with self._lock:
+            state, vectors, meta, hnsw = self.state, self._vectors, self._meta, self._hnsw
+        count = (state or {}).get("count", 0)
+        if count == 0:
+            return []
+        mask = self._filter_mask(meta, kinds, channel_ids, since_ts, until_ts)
+        candidates = numpy.nonzero(mask)[0]
+        if len(candidates) == 0:
+            return []
+        k = min(k, len(candidates))
+        query = numpy.asarray(query, dtype=numpy.float32)
+        hits: Optional[List[Tuple[int, float]]] = None
+        # Узкий фильтр (канал, короткий период) - точный перебор отобранных слотов быстрее обхода графа с отбраковкой
+        if hnsw is not None and len(candidates) > settings.SEMANTIC_EXACT_SCAN_MAX_ROWS:
+            try:
+                filter_needed = len(candidates) < count - state["deleted"]
+                labels, distances = hnsw.knn_query(
+                    query[None, :], k=k, filter=(lambda label: label < count and bool(mask[label])) if filter_needed else None
+                )
+                # Флаги удаления в meta.bin свежее загруженного графа - удаленные после загрузки слоты отбрасываются здесь
+                hits = [(int(label), 1.0 - float(distance)) for label, distance in zip(labels[0], distances[0]) if label < count and mask[label]]
+                # Слоты, добавленные после сохранения графа, ищутся перебором и сливаются с результатом графа
+                graph_count = state.get("hnsw_count", count)
+                if graph_count < count:
+                    hits = sorted(hits + self._exact_search(vectors, meta, query, candidates[candidates >= graph_count], k), key=lambda hit: -hit[1])[:k]
+            except RuntimeError as e: # hnswlib не набрал k результатов (слишком строгий фильтр) - перебор
+                logger.debug(f"HNSW: {e}; точный перебор.")
+        if hits is None:
+            hits = self._exact_search(vectors, meta, query, candidates, k)
+        return [(int(meta["kind"][slot]), int(meta["doc_id"][slot]), score) for slot, score in hits]
+
+
+_reader: Optional[_VectorIndexReader] = None
+_reader_lock = threading.Lock()
+
+
+def search_vector_index(query, k: int, kinds: Sequence[int], provider_name: str, model: str, channel_ids: Optional[Sequence[int]] = None,
+                        since_ts: Optional[int] = None, until_ts: Optional[int] = None) -> List[Tuple[int, int, float]]:
+    """
+    Top-k документов видов kinds по косинусной близости к query (L2-нормированный вектор запроса той же модели):
+    [(вид, id документа, близость)], по убыванию близости. Синхронная - из async-кода вызывать через asyncio.to_thread.
+    """
+    global _reader
+    if numpy is None:
+        raise VectorIndexUnavailableError("Семантический поиск недоступен: не установлен numpy.")
+    with _reader_lock:
+        if _reader is None:
+            _reader = _VectorIndexReader()
+    state = _reader.refresh()
+    if state is None:
+        raise VectorIndexUnavailableError("Индекс семантического поиска еще не построен.")
+    if state["provider"] != provider_name or state["model"] != model:
+        raise VectorIndexUnavailableError(f"Индекс построен моделью {state['provider']}/{state['model']} и перестраивается под {provider_name}/{model}.")
+    return _reader.search(query, k, kinds, channel_ids=channel_ids, since_ts=since_ts, until_ts=until_ts)
@@ -6,19 +6,20 @@ import time
 import traceback
 import json
 from datetime import timezone, datetime, timedelta, date
-from typing import List, Dict, Any, Optional, Tuple, AsyncGenerator
+from typing import List, Dict, Any, Optional, Tuple, AsyncGenerator, Iterable, Set
 import logging
 
 import openai
 from openai import OpenAIError 
 
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import sessionmaker, aliased
 from sqlalchemy.future import select
-from sqlalchemy import desc, func, update, cast, literal_column, nullslast, Integer as SAInteger, or_
+from sqlalchemy import desc, func, update, insert, delete, cast, literal_column, nullslast, Integer as SAInteger, or_
 from sqlalchemy.orm import aliased
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.dialects.postgresql import JSONB, ARRAY as PG_ARRAY, insert as pg_insert
+from sqlalchemy import Date as SQLDate, tuple_, all_, bindparam
 from sqlalchemy import text # Добавлено для SQL запроса
 
 import telegram
@@ -44,12 +45,50 @@ from telethon.requestiter import RequestIter
 from app.celery_app import celery_instance
 from app.core.config import settings
 from app.models.telegram_data import Channel, Post, Comment 
-from app.db.session import get_async_session_context_manager 
+from app.models.llm_batch import LLMBatchJob
+from app.models.llm_call_log import LLMCallLog
+from app.models.comment_insight import CommentInsight
+from app.models.channel_daily_stats import ChannelDailyStats
+from app.models.insight_canonical import InsightCanonical, InsightAlias
+from app.db.session import get_async_session_context_manager, make_async_engine 
 from app.schemas.ui_schemas import PostRefreshMode, CommentRefreshMode 
+from app.services.token_budget import render_prompt_with_budget
+from app.services.llm_metrics import drain_call_log_buffer
+from app.services.response_cache import bump_data_version
+from app.services.partitioning import ensure_monthly_partitions, detach_monthly_partitions_before, list_monthly_partitions, month_start, add_months
+from app.services.embeddings import EmbeddingProviderUnavailableError, get_embedding_provider, embed_in_batches
+from app.services.vector_index import (
+    KIND_POST, KIND_COMMENT, KIND_INSIGHT, VectorIndexWriter, text_hash, vector_index_dependencies_available,
+)
+from app.services.insight_canonicalization import InsightClusterIndex, clustering_available, embedding_to_bytes, group_by_key, lemmatizer_name
+from app.services.analytics_lake import (
+    LAKE_DATASET_COLUMNS, WATERMARK_OVERLAP, analytics_lake_dependencies_available, write_day_snapshot, read_lake_state, write_lake_state,
+)
+from app.services.local_sentiment import (
+    classify_batch as classify_local_sentiment_batch, is_confident as is_local_sentiment_confident,
+    SOURCE_LOCAL as SENTIMENT_SOURCE_LOCAL, SOURCE_LLM as SENTIMENT_SOURCE_LLM,
+    SOURCE_LLM_BATCH as SENTIMENT_SOURCE_LLM_BATCH, SOURCE_NO_TEXT as SENTIMENT_SOURCE_NO_TEXT,
+)
+from app.services.llm_batch import (
+    BATCH_KINDS, KIND_POST_SUMMARY, KIND_POST_SENTIMENT, KIND_COMMENT_FEATURES,
+    POST_SUMMARY_PROMPT_TEMPLATE, POST_SENTIMENT_PROMPT_TEMPLATE,
+    build_request_for_item, write_batch_input_file, new_input_file_path, get_batch_backend,
+    parse_batch_output, parse_custom_id, parse_sentiment_content, parse_comment_features_content,
+)
+from app.services.near_duplicates import (
+    SIMHASH_BAND_COUNT, simhash64, simhash_bands, simhash_band_expression, max_distance_for, find_representative,
+)
+from app.services.comment_insights import INSIGHT_TYPE_TO_COMMENT_FIELD, INSIGHT_TEXT_MAX_LENGTH, normalized_insight_text_sql
 
 try:
-    from app.services.llm_service import одиночный_запрос_к_llm
+    from app.services.llm_service import одиночный_запрос_к_llm, LLMThrottledError, probe_llm_provider
 except ImportError:
+    class LLMThrottledError(Exception):
+        pass
+
+    async def probe_llm_provider() -> Optional[bool]:
+        return None
+
     async def одиночный_запрос_к_llm(prompt: str, модель: str, is_json_response_expected: bool = False, **kwargs) -> Optional[str]:
         current_logger = logging.getLogger(__name__)
         prompt_preview = prompt[:100].replace('\n', ' ')
@@ -125,6 +164,11 @@ async def _process_reactions_for_db(message_reactions_attr: Optional[MessageRepl
         if reaction_val: processed_reactions.append({"reaction": reaction_val, "count": reaction_count_obj.count})
     return processed_reactions if processed_reactions else None
 
+def _sum_reactions_count(reactions_data: Optional[List[Dict[str, Any]]]) -> int:
+    """Значение для Post.reactions_total - считается при каждой записи reactions, чтобы сортировка шла по индексу, а не по jsonb_array_elements."""
+    if not reactions_data: return 0
+    return sum(int(item.get("count") or 0) for item in reactions_data)
+
 
 async def _helper_fetch_and_process_comments_for_post(
     tg_client: TelegramClient,
@@ -136,6 +180,7 @@ async def _helper_fetch_and_process_comments_for_post(
 ) -> Tuple[int, List[int]]: 
     new_comments_count_for_post = 0
     new_comment_ids_for_post: List[int] = []
+    new_comment_objects_for_post: List[Comment] = []
     existing_comment_tg_ids_stmt = select(Comment.telegram_comment_id).where(Comment.post_id == post_db_obj.id)
     existing_comment_tg_ids_res = await db.execute(existing_comment_tg_ids_stmt)
     existing_comment_tg_ids_set = set(existing_comment_tg_ids_res.scalars().all())
@@ -183,6 +228,7 @@ async def _helper_fetch_and_process_comments_for_post(
                 db.add(new_comment_db)
                 await db.flush() 
                 if new_comment_db.id: new_comment_ids_for_post.append(new_comment_db.id)
+                new_comment_objects_for_post.append(new_comment_db)
                 new_comments_count_for_post += 1
                 existing_comment_tg_ids_set.add(tg_comment_msg.id) 
 
@@ -205,10 +251,298 @@ async def _helper_fetch_and_process_comments_for_post(
         except Exception as e_c:
             logger.error(f"{log_prefix}    Ошибка сбора комм. для поста {post_db_obj.telegram_post_id} (DB ID: {post_db_obj.id}): {type(e_c).__name__} - {e_c}", exc_info=True)
             break
+
+    if new_comment_objects_for_post:
+        near_duplicates_count = await _assign_near_duplicate_clusters(db, new_comment_objects_for_post, log_prefix=log_prefix)
+        if near_duplicates_count:
+            logger.info(f"{log_prefix}    Пост ID {post_db_obj.id}: {near_duplicates_count} из {len(new_comment_objects_for_post)} новых комментариев - почти-дубликаты, AI-анализ для них не потребуется.")
+        await _refresh_channel_daily_stats(db, {(post_db_obj.channel_id, _utc_date(c.commented_at)) for c in new_comment_objects_for_post})
             
     return new_comments_count_for_post, new_comment_ids_for_post
 
 
+async def _assign_near_duplicate_clusters(db: AsyncSession, comments: List[Comment], log_prefix: str = "[NearDup]") -> int:
+    """
+    Считает SimHash-подписи комментариев и привязывает почти-дубликаты к представителю кластера.
+    Представитель ищется среди уже сохраненных комментариев (по совпадению хотя бы одной 16-битной полосы подписи,
+    затем по расстоянию Хэмминга) и среди комментариев этой же пачки. Комментарии должны иметь id (после flush).
+    Возвращает количество комментариев, оказавшихся почти-дубликатами.
+    """
+    if not settings.NEAR_DUP_ENABLED or not comments:
+        return 0
+    pending: List[Tuple[Comment, int, int]] = []
+    for comment in comments:
+        comment_text = comment.text_content or comment.caption_text
+        signature = simhash64(comment_text)
+        comment.text_simhash = signature
+        if signature is not None:
+            pending.append((comment, signature, max_distance_for(comment_text)))
+    if not pending:
+        await db.flush()
+        return 0
+
+    bands_by_position: List[set] = [set() for _ in range(SIMHASH_BAND_COUNT)]
+    for _, signature, _ in pending:
+        for position, band_value in enumerate(simhash_bands(signature)):
+            bands_by_position[position].add(band_value)
+    oldest_commented_at = min((c.commented_at for c, _, _ in pending if c.commented_at), default=datetime.now(timezone.utc))
+    lookback_start = oldest_commented_at - timedelta(days=settings.NEAR_DUP_LOOKBACK_DAYS)
+    pending_ids = [c.id for c, _, _ in pending if c.id]
+
+    candidates_stmt = (
+        select(Comment.id, Comment.text_simhash)
+        .where(Comment.near_duplicate_of_id.is_(None))
+        .where(Comment.text_simhash.isnot(None))
+        .where(Comment.commented_at >= lookback_start)
+        .where(or_(*[
+            simhash_band_expression(Comment.text_simhash, position).in_(list(band_values))
+            for position, band_values in enumerate(bands_by_position)
+        ]))
+        .order_by(Comment.id)
+        .limit(settings.NEAR_DUP_MAX_CANDIDATES)
+    )
+    if pending_ids:
+        candidates_stmt = candidates_stmt.where(Comment.id.notin_(pending_ids))
+    candidates: List[Tuple[int, int]] = [(row.id, row.text_simhash) for row in (await db.execute(candidates_stmt)).all()]
+
+    matched_representative_ids = set()
+    near_duplicates_count = 0
+    for comment, signature, max_distance in pending:
+        representative_id = find_representative(signature, max_distance, candidates)
+        if representative_id is None:
+            candidates.append((comment.id, signature)) # Сам становится представителем для следующих в пачке
+            continue
+        comment.near_duplicate_of_id = representative_id
+        matched_representative_ids.add(representative_id)
+        near_duplicates_count += 1
+    await db.flush()
+
+    if matched_representative_ids:
+        # Если представитель уже проанализирован - новые дубликаты получают его результаты сразу
+        propagated = await _propagate_comment_features_to_near_duplicates(db, list(matched_representative_ids))
+        if propagated:
+            logger.debug(f"{log_prefix}    Скопированы результаты AI-анализа представителей в {propagated} почти-дубликатов.")
+    return near_duplicates_count
+
+
+async def _propagate_comment_features_to_near_duplicates(db: AsyncSession, representative_ids: List[int]) -> int:
+    """
+    Копирует результаты AI-анализа (extracted_* и ai_analysis_completed_at) от проанализированных представителей
+    всем участникам их кластеров - счетчики тем/проблем по комментариям остаются прежними без отдельных вызовов LLM.
+    """
+    if not representative_ids:
+        return 0
+    representative = aliased(Comment)
+    propagated_total = 0
+    chunk_size = settings.LLM_BATCH_INGEST_CHUNK_SIZE
+    for start in range(0, len(representative_ids), chunk_size):
+        chunk = representative_ids[start:start + chunk_size]
+        stmt = (
+            update(Comment)
+            .where(Comment.near_duplicate_of_id == representative.id)
+            .where(representative.id.in_(chunk))
+            .where(representative.ai_analysis_completed_at.isnot(None))
+            .values(
+                extracted_topics=representative.extracted_topics,
+                extracted_problems=representative.extracted_problems,
+                extracted_questions=representative.extracted_questions,
+                extracted_suggestions=representative.extracted_suggestions,
+                ai_analysis_completed_at=representative.ai_analysis_completed_at,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        result = await db.execute(stmt)
+        propagated_total += result.rowcount or 0
+        if result.rowcount:
+            await _sync_comment_insights(db, near_duplicates_of_ids=chunk)
+    return propagated_total
+
+
+async def _sync_comment_insights(db: AsyncSession, comment_ids: Optional[List[int]] = None, near_duplicates_of_ids: Optional[List[int]] = None) -> int:
+    """
+    Пересобирает строки comment_insights для комментариев comment_ids (или почти-дубликатов near_duplicates_of_ids)
+    из их текущих extracted_*: DELETE + INSERT ... SELECT целиком на стороне Postgres. Повторяющийся в одном комментарии
+    инсайт записывается один раз. Вызывать после каждой записи extracted_*. Возвращает число вставленных строк.
+    """
+    if comment_ids:
+        comment_condition = Comment.id.in_(comment_ids)
+    elif near_duplicates_of_ids:
+        comment_condition = Comment.near_duplicate_of_id.in_(near_duplicates_of_ids)
+    else:
+        return 0
+    await db.execute(
+        delete(CommentInsight)
+        .where(CommentInsight.comment_id.in_(select(Comment.id).where(comment_condition)))
+        .execution_options(synchronize_session=False)
+    )
+    inserted_total = 0
+    for insight_type, field_name in INSIGHT_TYPE_TO_COMMENT_FIELD.items():
+        jsonb_field = getattr(Comment, field_name)
+        raw_elements = (
+            select(Comment.id.label("comment_id"), Comment.commented_at.label("commented_at"), Post.channel_id.label("channel_id"),
+                   func.jsonb_array_elements_text(jsonb_field).label("raw_text"))
+            .join(Post, Comment.post_id == Post.id)
+            .where(comment_condition)
+            .where(jsonb_field.isnot(None))
+            .where(func.jsonb_typeof(jsonb_field) == 'array')
+            .subquery(f"raw_{insight_type}_insights")
+        )
+        normalized_elements = select(
+            raw_elements.c.comment_id, raw_elements.c.commented_at, raw_elements.c.channel_id,
+            normalized_insight_text_sql(raw_elements.c.raw_text).label("normalized_text"),
+            func.left(func.btrim(raw_elements.c.raw_text), INSIGHT_TEXT_MAX_LENGTH).label("display_text"),
+        ).subquery(f"normalized_{insight_type}_insights")
+        # Уже известные формулировки сразу получают канонический инсайт; новые - NULL до запуска tasks.canonicalize_insights
+        canonical_id_lookup = (
+            select(InsightAlias.canonical_id)
+            .where(InsightAlias.insight_type == insight_type, InsightAlias.normalized_text == normalized_elements.c.normalized_text)
+            .scalar_subquery()
+        )
+        insights_select = (
+            select(
+                normalized_elements.c.comment_id, literal_column(f"'{insight_type}'"), normalized_elements.c.normalized_text,
+                normalized_elements.c.display_text, normalized_elements.c.commented_at, normalized_elements.c.channel_id, canonical_id_lookup,
+            )
+            .distinct(normalized_elements.c.comment_id, normalized_elements.c.normalized_text)
+            .where(normalized_elements.c.normalized_text != "")
+        )
+        result = await db.execute(
+            insert(CommentInsight).from_select(
+                ["comment_id", "insight_type", "normalized_text", "display_text", "commented_at", "channel_id", "canonical_id"], insights_select
+            )
+        )
+        inserted_total += result.rowcount or 0
+    return inserted_total
+
+
+def _utc_date(value: datetime) -> date:
+    return (value if value.tzinfo else value.replace(tzinfo=timezone.utc)).astimezone(timezone.utc).date()
+
+
+def _utc_day_expression(column):
+    # 'UTC' - литералом: с параметром выражение в SELECT и GROUP BY получит разные плейсхолдеры и Postgres его не сопоставит
+    return cast(func.timezone(literal_column("'UTC'"), column), SQLDate)
+
+
+_CHANNEL_STATS_VALUE_FIELDS = (
+    "post_count", "comment_count", "posts_sentiment_analyzed", "posts_positive", "posts_negative", "posts_neutral", "posts_mixed",
+    "views_sum", "reactions_sum",
+)
+
+
+async def _comments_archived_before(db: AsyncSession) -> Optional[date]:
+    """
+    Первый день самой ранней подключенной помесячной секции comments: более ранние месяцы могли быть отсоединены
+    tasks.maintain_comment_partitions, и их комментарии через comments уже не видны. None - comments не секционирована.
+    """
+    partitions = await list_monthly_partitions(db, Comment.__tablename__)
+    return partitions[0][1] if partitions else None
+
+
+async def _recompute_channel_daily_stats(db: AsyncSession, start_day: date, end_day: date, channel_ids: Optional[List[int]] = None) -> int:
+    """
+    Пересчитывает channel_daily_stats за UTC-дни [start_day, end_day] (для channel_ids или всех каналов) по posts/comments:
+    upsert посчитанных строк и удаление строк, для которых данных больше нет. Возвращает число записанных строк.
+    Для дней раньше самой ранней подключенной секции comments (архивные месяцы) comment_count не пересчитывается - остается
+    прежним: посты за эти дни есть, а комментарии отсоединены вместе с секцией.
+    """
+    start_at = datetime(start_day.year, start_day.month, start_day.day, tzinfo=timezone.utc)
+    end_at = datetime(end_day.year, end_day.month, end_day.day, tzinfo=timezone.utc) + timedelta(days=1)
+    post_day = _utc_day_expression(Post.posted_at)
+    posts_stmt = (
+        select(
+            Post.channel_id.label("channel_id"), post_day.label("day"),
+            func.count().label("post_count"),
+            func.count(Post.post_sentiment_label).label("posts_sentiment_analyzed"),
+            func.count().filter(Post.post_sentiment_label == "positive").label("posts_positive"),
+            func.count().filter(Post.post_sentiment_label == "negative").label("posts_negative"),
+            func.count().filter(Post.post_sentiment_label == "neutral").label("posts_neutral"),
+            func.count().filter(Post.post_sentiment_label == "mixed").label("posts_mixed"),
+            func.coalesce(func.sum(Post.views_count), 0).label("views_sum"),
+            func.coalesce(func.sum(Post.reactions_total), 0).label("reactions_sum"),
+        )
+        .where(Post.posted_at >= start_at, Post.posted_at < end_at)
+        .group_by(Post.channel_id, post_day)
+    )
+    comment_day = _utc_day_expression(Comment.commented_at)
+    comments_stmt = (
+        select(Post.channel_id.label("channel_id"), comment_day.label("day"), func.count(Comment.id).label("comment_count"))
+        .join(Post, Comment.post_id == Post.id)
+        .where(Comment.commented_at >= start_at, Comment.commented_at < end_at)
+        .group_by(Post.channel_id, comment_day)
+    )
+    if channel_ids:
+        posts_stmt = posts_stmt.where(Post.channel_id.in_(channel_ids))
+        comments_stmt = comments_stmt.where(Post.channel_id.in_(channel_ids))
+
+    stats_by_key: Dict[Tuple[int, date], Dict[str, Any]] = {}
+    def _row_for(channel_id: int, day_value: date) -> Dict[str, Any]:
+        return stats_by_key.setdefault((channel_id, day_value), {"channel_id": channel_id, "day": day_value, **{field_name: 0 for field_name in _CHANNEL_STATS_VALUE_FIELDS}})
+    for row in (await db.execute(posts_stmt)).mappings().all():
+        _row_for(row["channel_id"], row["day"]).update({field_name: row[field_name] for field_name in _CHANNEL_STATS_VALUE_FIELDS if field_name != "comment_count"})
+    for row in (await db.execute(comments_stmt)).all():
+        _row_for(row.channel_id, row.day)["comment_count"] = row.comment_count
+
+    archived_before = await _comments_archived_before(db) if start_day < month_start(datetime.now(timezone.utc).date()) else None
+    def _is_archived(day_value: date) -> bool:
+        return archived_before is not None and day_value < archived_before
+    post_value_fields = [field_name for field_name in _CHANNEL_STATS_VALUE_FIELDS if field_name != "comment_count"]
+
+    rows = list(stats_by_key.values())
+    chunk_size = 1000
+    for archived, updated_fields in ((False, _CHANNEL_STATS_VALUE_FIELDS), (True, post_value_fields)):
+        group = [row for row in rows if _is_archived(row["day"]) == archived]
+        for start in range(0, len(group), chunk_size):
+            upsert_stmt = pg_insert(ChannelDailyStats).values(group[start:start + chunk_size])
+            await db.execute(upsert_stmt.on_conflict_do_update(
+                index_elements=[ChannelDailyStats.channel_id, ChannelDailyStats.day],
+                set_={**{field_name: upsert_stmt.excluded[field_name] for field_name in updated_fields}, "updated_at": func.now()},
+            ))
+
+    existing_stmt = select(ChannelDailyStats.channel_id, ChannelDailyStats.day).where(ChannelDailyStats.day.between(start_day, end_day))
+    if channel_ids:
+        existing_stmt = existing_stmt.where(ChannelDailyStats.channel_id.in_(channel_ids))
+    stale_keys = [(row.channel_id, row.day) for row in (await db.execute(existing_stmt)).all() if (row.channel_id, row.day) not in stats_by_key]
+    archived_stale_keys = [key for key in stale_keys if _is_archived(key[1])]
+    stale_keys = [key for key in stale_keys if not _is_archived(key[1])]
+    for start in range(0, len(stale_keys), chunk_size):
+        await db.execute(delete(ChannelDailyStats).where(tuple_(ChannelDailyStats.channel_id, ChannelDailyStats.day).in_(stale_keys[start:start + chunk_size])))
+    for start in range(0, len(archived_stale_keys), chunk_size):
+        # Архивный день без постов: строка с сохраненным comment_count остается, обнуляются только поля постов
+        key_condition = tuple_(ChannelDailyStats.channel_id, ChannelDailyStats.day).in_(archived_stale_keys[start:start + chunk_size])
+        await db.execute(update(ChannelDailyStats).where(key_condition).values({**{field_name: 0 for field_name in post_value_fields}, "updated_at": func.now()}))
+        await db.execute(delete(ChannelDailyStats).where(key_condition, ChannelDailyStats.comment_count == 0))
+    return len(rows)
+
+
+async def _refresh_channel_daily_stats(db: AsyncSession, channel_days: Iterable[Tuple[int, date]]) -> int:
+    """
+    Инкрементальное обновление дашбордных агрегатов: пересчитывает только затронутые (канал, UTC-день) в той же транзакции,
+    что и изменение сырых данных. Вызывать после записи постов/комментариев/тональности.
+    """
+    if not settings.CHANNEL_STATS_ENABLED:
+        return 0
+    days_by_channel: Dict[int, Set[date]] = {}
+    for channel_id, day_value in channel_days:
+        if channel_id is not None and day_value is not None:
+            days_by_channel.setdefault(channel_id, set()).add(day_value)
+    if not days_by_channel:
+        return 0
+    await db.flush() # Сессии задач создаются с autoflush=False - агрегаты должны видеть изменения ORM-объектов
+    refreshed = 0
+    for channel_id, days in days_by_channel.items():
+        refreshed += await _recompute_channel_daily_stats(db, min(days), max(days), channel_ids=[channel_id])
+    return refreshed
+
+
+async def _channel_days_for_posts(db: AsyncSession, post_ids: List[int]) -> Set[Tuple[int, date]]:
+    if not post_ids:
+        return set()
+    post_day = _utc_day_expression(Post.posted_at)
+    rows = (await db.execute(select(Post.channel_id, post_day).where(Post.id.in_(post_ids)).distinct())).all()
+    return {(row[0], row[1]) for row in rows}
+
+
 async def _helper_fetch_and_process_posts_for_channel(
     tg_client: TelegramClient,
     db: AsyncSession,
@@ -221,6 +555,7 @@ async def _helper_fetch_and_process_posts_for_channel(
     newly_created_post_objects: List[Post] = []
     new_posts_count_channel = 0
     updated_posts_count_channel = 0
+    stats_days_changed: Set[Tuple[int, date]] = set()
     latest_post_id_tg_seen_this_run = channel_db.last_processed_post_id or 0
 
     message_iterator: RequestIter = tg_client.iter_messages(**iter_params)
@@ -252,7 +587,7 @@ async def _helper_fetch_and_process_posts_for_channel(
                 telegram_post_id=tg_message.id, channel_id=channel_db.id, link=link_val,
                 text_content=post_text_content, caption_text=post_caption_text,
                 views_count=tg_message.views, comments_count=api_comments_count, 
-                posted_at=posted_at_val, reactions=reactions_data, media_type=media_type,
+                posted_at=posted_at_val, reactions=reactions_data, reactions_total=_sum_reactions_count(reactions_data), media_type=media_type,
                 media_content_info=media_info, reply_to_telegram_post_id=reply_to_id,
                 forwards_count=tg_message.forwards, author_signature=tg_message.post_author,
                 sender_user_id=sender_id_val, grouped_id=tg_message.grouped_id,
@@ -263,6 +598,7 @@ async def _helper_fetch_and_process_posts_for_channel(
         elif update_existing_info_flag:
             existing_post_db.views_count = tg_message.views
             existing_post_db.reactions = reactions_data
+            existing_post_db.reactions_total = _sum_reactions_count(reactions_data)
             existing_post_db.forwards_count = tg_message.forwards
             existing_post_db.edited_at = edited_at_val
             existing_post_db.comments_count = api_comments_count 
@@ -284,7 +620,9 @@ async def _helper_fetch_and_process_posts_for_channel(
                 db.add(existing_post_db)
 
         if post_for_comments_scan_candidate: posts_for_comment_scan_candidates.append(post_for_comments_scan_candidate)
+        if not existing_post_db or update_existing_info_flag: stats_days_changed.add((channel_db.id, _utc_date(posted_at_val)))
 
+    await _refresh_channel_daily_stats(db, stats_days_changed)
     return posts_for_comment_scan_candidates, newly_created_post_objects, new_posts_count_channel, updated_posts_count_channel, latest_post_id_tg_seen_this_run
 
 # --- ЗАДАЧИ CELERY ---
@@ -321,7 +659,7 @@ def collect_telegram_data_task(self):
             if not ASYNC_DB_URL_TASK.startswith("postgresql+asyncpg://"):
                 ASYNC_DB_URL_TASK = ASYNC_DB_URL_TASK.replace("postgresql://", "postgresql+asyncpg://", 1)
             
-            local_engine = create_async_engine(ASYNC_DB_URL_TASK, echo=False, pool_pre_ping=True)
+            local_engine = make_async_engine(ASYNC_DB_URL_TASK, "worker")
             LocalAsyncSessionFactory_Task = sessionmaker(
                 bind=local_engine, class_=AsyncSession, expire_on_commit=False, autoflush=False, autocommit=False
             )
@@ -399,6 +737,7 @@ def collect_telegram_data_task(self):
                         logger.debug(f"{log_prefix} Пауза 1 сек перед обработкой следующего канала.")
                         await asyncio.sleep(1)
                 await db.commit()
+                await bump_data_version("collect_telegram_data")
                 summary = f"Сбор данных завершен. Каналов: {total_ch_proc}, Новых постов: {total_new_p}, Новых комм. собрано (только для новых постов): {total_new_c}."
                 logger.info(f"{log_prefix} {summary}")
                 
@@ -497,7 +836,7 @@ def summarize_posts_batch_task(
             if not ASYNC_DB_URL_TASK.startswith("postgresql+asyncpg://"):
                 ASYNC_DB_URL_TASK = ASYNC_DB_URL_TASK.replace("postgresql://", "postgresql+asyncpg://", 1)
 
-            local_engine = create_async_engine(ASYNC_DB_URL_TASK, echo=False, pool_pre_ping=True)
+            local_engine = make_async_engine(ASYNC_DB_URL_TASK, "worker")
             LocalAsyncSessionFactory_Task = sessionmaker(
                 bind=local_engine, class_=AsyncSession, expire_on_commit=False, autoflush=False, autocommit=False
             )
@@ -570,13 +909,19 @@ def summarize_posts_batch_task(
                     else:
                         logger.info(f"{log_prefix}  Суммаризация поста ID {post_obj.id} ({post_obj.link})...")
                         try:
-                            summary_prompt = f"Текст поста:\n---\n{text_to_summarize[:settings.LLM_MAX_PROMPT_LENGTH]}\n---\nНапиши краткое резюме (1-3 предложения на русском) основной мысли этого поста."
+                            summary_model = settings.OPENAI_DEFAULT_MODEL_FOR_TASKS or "gpt-3.5-turbo"
+                            summary_max_tokens = settings.LLM_SUMMARY_MAX_TOKENS or 250 # Используем настройку или дефолт
+                            summary_prompt = render_prompt_with_budget(
+                                POST_SUMMARY_PROMPT_TEMPLATE,
+                                text_to_summarize, summary_model, summary_max_tokens
+                            )
                             summary = await одиночный_запрос_к_llm(
                                 summary_prompt,
-                                модель=settings.OPENAI_DEFAULT_MODEL_FOR_TASKS or "gpt-3.5-turbo",
+                                модель=summary_model,
                                 температура=0.3,
-                                макс_токены=settings.LLM_SUMMARY_MAX_TOKENS or 250, # Используем настройку или дефолт
-                                is_json_response_expected=False
+                                макс_токены=summary_max_tokens,
+                                is_json_response_expected=False,
+                                caller=self.name
                             )
                             if summary and summary.strip():
                                 post_obj.summary_text = summary.strip()
@@ -593,6 +938,10 @@ def summarize_posts_batch_task(
                                 processed_count_in_batch += 1 # Все равно считаем обработанным
                                 current_progress_info_ref['processed_count'] = processed_count_in_batch
 
+                        except LLMThrottledError as e_throttled:
+                            # Провайдер перегружен даже после повторов: оставшиеся посты не трогаем, их возьмет следующий запуск
+                            logger.error(f"{log_prefix}    !!! LLM перегружен при суммаризации поста ID {post_obj.id}: {e_throttled}. Прерываем пачку, оставшиеся {total_posts_for_batch - i} постов остаются без резюме.")
+                            break
                         except OpenAIError as e_llm:
                             logger.error(f"{log_prefix}    !!! Ошибка OpenAI API при суммаризации поста ID {post_obj.id}: {type(e_llm).__name__} - {e_llm}")
                             # Пропускаем этот пост, он останется без резюме для этой попытки
@@ -613,6 +962,7 @@ def summarize_posts_batch_task(
                 # Коммит, если были какие-либо изменения (суммаризированные или помеченные как обработанные пустые/короткие посты)
                 if processed_count_in_batch > 0: # processed_count_in_batch инкрементируется в обоих случаях (успех LLM или пропуск короткого)
                     await db_session.commit()
+                    await bump_data_version("summarize_posts_batch")
                     logger.info(f"{log_prefix}  Обработано (суммаризировано/пропущено) {processed_count_in_batch} постов в этой пачке.")
 
             result_message = f"Суммаризация для пачки завершена. Обработано (суммаризировано/пропущено): {processed_count_in_batch} из {total_posts_for_batch} постов."
@@ -686,7 +1036,7 @@ def send_daily_digest_task(self, hours_ago_posts=24, top_n_metrics=3):
             if not ASYNC_DB_URL_TASK.startswith("postgresql+asyncpg://"):
                 ASYNC_DB_URL_TASK = ASYNC_DB_URL_TASK.replace("postgresql://", "postgresql+asyncpg://", 1)
             
-            local_engine = create_async_engine(ASYNC_DB_URL_TASK, echo=False, pool_pre_ping=True)
+            local_engine = make_async_engine(ASYNC_DB_URL_TASK, "worker")
             LocalAsyncSessionFactory_Task = sessionmaker(
                 bind=local_engine, class_=AsyncSession, expire_on_commit=False, autoflush=False, autocommit=False
             )
@@ -700,16 +1050,11 @@ def send_daily_digest_task(self, hours_ago_posts=24, top_n_metrics=3):
                 new_posts_count = (await db_session.execute(stmt_new_posts_count)).scalar_one_or_none() or 0
                 message_parts.append(helpers.escape_markdown(f"📰 Всего новых постов (из активных каналов): {new_posts_count}\n", version=2))
 
-                async def get_top_posts_by_metric(metric_column_or_expr_name: str, metric_display_name: str, is_sum_from_jsonb_flag=False):
+                async def get_top_posts_by_metric(metric_column_or_expr_name: str, metric_display_name: str):
                     top_posts_list = []; p_alias = aliased(Post, name=f"p_digest_{''.join(filter(str.isalnum, metric_display_name.lower()))}")
                     select_fields = [p_alias.link, p_alias.summary_text, p_alias.post_sentiment_label, Channel.title.label("channel_title")]; stmt_top = select(*select_fields); order_by_col = None
-                    if is_sum_from_jsonb_flag:
-                        rx_elements_cte = (select(p_alias.id.label("post_id_for_reactions"), cast(func.jsonb_array_elements(p_alias.reactions).op('->>')('count'), SAInteger).label("reaction_item_count")).select_from(p_alias).where(p_alias.reactions.isnot(None)).where(func.jsonb_typeof(p_alias.reactions) == 'array').cte(f"rx_elements_cte_{''.join(filter(str.isalnum, metric_display_name.lower()))}"))
-                        sum_reactions_cte = (select(rx_elements_cte.c.post_id_for_reactions.label("post_id"), func.sum(rx_elements_cte.c.reaction_item_count).label("metric_value_for_digest")).group_by(rx_elements_cte.c.post_id_for_reactions).cte(f"sum_rx_cte_{''.join(filter(str.isalnum, metric_display_name.lower()))}"))
-                        stmt_top = stmt_top.add_columns(sum_reactions_cte.c.metric_value_for_digest).outerjoin(sum_reactions_cte, p_alias.id == sum_reactions_cte.c.post_id); order_by_col = sum_reactions_cte.c.metric_value_for_digest
-                    else:
-                        actual_metric_column = getattr(p_alias, metric_column_or_expr_name)
-                        stmt_top = stmt_top.add_columns(actual_metric_column.label("metric_value_for_digest")); order_by_col = actual_metric_column
+                    actual_metric_column = getattr(p_alias, metric_column_or_expr_name)
+                    stmt_top = stmt_top.add_columns(actual_metric_column.label("metric_value_for_digest")); order_by_col = actual_metric_column
                     stmt_top = stmt_top.join(Channel, p_alias.channel_id == Channel.id).where(Channel.is_active == True).where(p_alias.posted_at >= time_threshold_posts).where(p_alias.summary_text.isnot(None)).order_by(order_by_col.desc().nullslast()).limit(top_n_metrics)
                     for row in (await db_session.execute(stmt_top)).all():
                         top_posts_list.append({"link": row.link, "summary": row.summary_text, "sentiment": row.post_sentiment_label, "channel_title": row.channel_title, "metric_value": row.metric_value_for_digest})
@@ -718,10 +1063,10 @@ def send_daily_digest_task(self, hours_ago_posts=24, top_n_metrics=3):
                 tops_to_include = [
                     {"metric_name": "comments_count", "label": "💬 Топ по комментариям", "emoji": "🗣️", "unit": "Комм."},
                     {"metric_name": "views_count", "label": "👀 Топ по просмотрам", "emoji": "👁️", "unit": "Просмотров"},
-                    {"metric_name": "reactions", "label": "❤️ Топ по сумме реакций", "emoji": "👍", "unit": "Реакций", "is_sum_jsonb": True}
+                    {"metric_name": "reactions_total", "label": "❤️ Топ по сумме реакций", "emoji": "👍", "unit": "Реакций"}
                 ]
                 for top_conf in tops_to_include:
-                    posts_data = await get_top_posts_by_metric(top_conf["metric_name"], top_conf["label"], is_sum_from_jsonb_flag=top_conf.get("is_sum_jsonb", False))
+                    posts_data = await get_top_posts_by_metric(top_conf["metric_name"], top_conf["label"])
                     if posts_data:
                         message_parts.append(f"\n{helpers.escape_markdown(top_conf['label'], version=2)} \\(с AI\\-резюме, топ\\-{len(posts_data)}\\):\n")
                         for i, p_data in enumerate(posts_data):
@@ -802,6 +1147,8 @@ def analyze_posts_sentiment_task(
     async def _async_logic(task_instance, current_progress_info_ref: Dict[str, Any]):
         analyzed_count_in_batch = 0
         total_posts_for_batch = 0
+        local_decisions_count = 0 # Решено локальным классификатором (без LLM)
+        llm_decisions_count = 0
         local_engine = None
 
         current_progress_info_ref.update({
@@ -817,7 +1164,7 @@ def analyze_posts_sentiment_task(
             if not ASYNC_DB_URL_TASK.startswith("postgresql+asyncpg://"):
                 ASYNC_DB_URL_TASK = ASYNC_DB_URL_TASK.replace("postgresql://", "postgresql+asyncpg://", 1)
 
-            local_engine = create_async_engine(ASYNC_DB_URL_TASK, echo=False, pool_pre_ping=True)
+            local_engine = make_async_engine(ASYNC_DB_URL_TASK, "worker")
             LocalAsyncSessionFactory_Task = sessionmaker(
                 bind=local_engine, class_=AsyncSession, expire_on_commit=False, autoflush=False, autocommit=False
             )
@@ -878,23 +1225,47 @@ def analyze_posts_sentiment_task(
                     task_instance.update_state(state='SUCCESS', meta=current_progress_info_ref)
                     return result_message
 
+                # Каскад: локальный классификатор оценивает всю пачку сразу, в LLM уходят только неуверенные посты
+                texts_for_analysis = [
+                    p.caption_text if p.caption_text and p.caption_text.strip() else p.text_content for p in posts_to_process
+                ]
+                local_sentiment_results = classify_local_sentiment_batch(texts_for_analysis)
+
                 for i, post_obj in enumerate(posts_to_process):
-                    text_for_analysis = post_obj.caption_text if post_obj.caption_text and post_obj.caption_text.strip() else post_obj.text_content
+                    text_for_analysis = texts_for_analysis[i]
+                    local_result = local_sentiment_results[i]
                     if not text_for_analysis or not text_for_analysis.strip():
                         logger.info(f"{log_prefix}  Пост ID {post_obj.id} ({post_obj.link}) не имеет текста/подписи или текст пустой. Помечаем как 'neutral' без вызова LLM.")
                         post_obj.post_sentiment_label = "neutral"
                         post_obj.post_sentiment_score = 0.0
+                        post_obj.post_sentiment_source = SENTIMENT_SOURCE_NO_TEXT
+                        post_obj.post_sentiment_confidence = None
                         post_obj.updated_at = datetime.now(timezone.utc)
                         db_session.add(post_obj)
                         analyzed_count_in_batch += 1 # Считаем как обработанный, хотя LLM не вызывался
                         current_progress_info_ref['processed_count'] = analyzed_count_in_batch
                         # LLM не вызывался, поэтому переходим к логике обновления прогресса
+                    elif is_local_sentiment_confident(local_result):
+                        post_obj.post_sentiment_label = local_result.label
+                        post_obj.post_sentiment_score = local_result.score
+                        post_obj.post_sentiment_source = SENTIMENT_SOURCE_LOCAL
+                        post_obj.post_sentiment_confidence = local_result.confidence
+                        post_obj.updated_at = datetime.now(timezone.utc)
+                        db_session.add(post_obj)
+                        analyzed_count_in_batch += 1
+                        local_decisions_count += 1
+                        current_progress_info_ref['processed_count'] = analyzed_count_in_batch
+                        logger.info(f"{log_prefix}  Тональность поста ID {post_obj.id} определена локально: {local_result.label} ({local_result.score:.2f}, уверенность {local_result.confidence:.2f}), LLM не вызывался.")
                     else:
-                        logger.info(f"{log_prefix}  Анализ тональности поста ID {post_obj.id} ({post_obj.link})...")
+                        logger.info(f"{log_prefix}  Анализ тональности поста ID {post_obj.id} ({post_obj.link}) через LLM (локальная уверенность {local_result.confidence:.2f})...")
                         s_label, s_score = "neutral", 0.0 # По умолчанию
                         try:
-                            prompt = f"Определи тональность текста (JSON: sentiment_label: [positive,negative,neutral,mixed], sentiment_score: [-1.0,1.0]):\n---\n{text_for_analysis[:settings.LLM_MAX_PROMPT_LENGTH]}\n---\nJSON_RESPONSE:"
-                            llm_response_str = await одиночный_запрос_к_llm(prompt, модель=settings.OPENAI_DEFAULT_MODEL_FOR_TASKS or "gpt-3.5-turbo-1106", температура=0.2, макс_токены=60, is_json_response_expected=True)
+                            sentiment_model = settings.OPENAI_DEFAULT_MODEL_FOR_TASKS or "gpt-3.5-turbo-1106"
+                            prompt = render_prompt_with_budget(
+                                POST_SENTIMENT_PROMPT_TEMPLATE,
+                                text_for_analysis, sentiment_model, 60
+                            )
+                            llm_response_str = await одиночный_запрос_к_llm(prompt, модель=sentiment_model, температура=0.2, макс_токены=60, is_json_response_expected=True, caller=self.name)
                             if llm_response_str:
                                 try:
                                     data = json.loads(llm_response_str)
@@ -907,6 +1278,10 @@ def analyze_posts_sentiment_task(
                                     if s_label_candidate is None and s_score_candidate_raw is None : s_label = "neutral" # Оба отсутствуют, считаем neutral
                                 except (json.JSONDecodeError, TypeError, ValueError) as e_json: logger.error(f"{log_prefix}    Ошибка парсинга JSON от LLM для поста ID {post_obj.id} ({type(e_json).__name__}: {e_json}). Ответ LLM: '{llm_response_str}'")
                             else: logger.warning(f"{log_prefix}    LLM вернул пустой ответ для анализа тональности поста ID {post_obj.id}. Устанавливаем 'neutral'.")
+                        except LLMThrottledError as e_throttled:
+                            # Не помечаем пост как neutral: он останется непроанализированным до следующего запуска
+                            logger.error(f"{log_prefix}    !!! LLM перегружен при анализе тональности поста ID {post_obj.id}: {e_throttled}. Прерываем пачку, оставшиеся {total_posts_for_batch - i} постов остаются без анализа.")
+                            break
                         except OpenAIError as e_llm_sentiment:
                             logger.error(f"{log_prefix}    !!! Ошибка OpenAI API при анализе тональности поста ID {post_obj.id}: {type(e_llm_sentiment).__name__} - {e_llm_sentiment}");
                             # Пропускаем этот пост, он останется без анализа тональности для этой попытки
@@ -918,9 +1293,12 @@ def analyze_posts_sentiment_task(
 
                         post_obj.post_sentiment_label = s_label
                         post_obj.post_sentiment_score = s_score
+                        post_obj.post_sentiment_source = SENTIMENT_SOURCE_LLM
+                        post_obj.post_sentiment_confidence = local_result.confidence
                         post_obj.updated_at = datetime.now(timezone.utc)
                         db_session.add(post_obj)
                         analyzed_count_in_batch += 1
+                        llm_decisions_count += 1
                         current_progress_info_ref['processed_count'] = analyzed_count_in_batch
                         logger.info(f"{log_prefix}    Тональность поста ID {post_obj.id}: {s_label} ({s_score:.2f}) сохранена.")
 
@@ -940,11 +1318,13 @@ def analyze_posts_sentiment_task(
                 if analyzed_count_in_batch > 0 or any(
                     (p.post_sentiment_label == "neutral" and not p.text_content and not p.caption_text) for p in posts_to_process
                 ):
+                    await _refresh_channel_daily_stats(db_session, {(p.channel_id, _utc_date(p.posted_at)) for p in posts_to_process})
                     await db_session.commit()
+                    await bump_data_version("analyze_posts_sentiment")
                     logger.info(f"{log_prefix}  Обновлено {current_progress_info_ref['processed_count']} постов в этой пачке (включая помеченные neutral).")
 
 
-            result_message = f"Анализ тональности для пачки завершен. Обработано (с LLM или помечено neutral): {current_progress_info_ref['processed_count']} из {total_posts_for_batch} постов."
+            result_message = f"Анализ тональности для пачки завершен. Обработано: {current_progress_info_ref['processed_count']} из {total_posts_for_batch} постов (локально: {local_decisions_count}, через LLM: {llm_decisions_count})."
             current_progress_info_ref.update({
                 'current_step': 'Завершено',
                 'progress': 100,
@@ -1019,7 +1399,7 @@ def analyze_single_comment_ai_features_task(self, comment_id: int):
             if not ASYNC_DB_URL_TASK.startswith("postgresql+asyncpg://"):
                 ASYNC_DB_URL_TASK = ASYNC_DB_URL_TASK.replace("postgresql://", "postgresql+asyncpg://", 1)
             
-            local_engine = create_async_engine(ASYNC_DB_URL_TASK, echo=False, pool_pre_ping=True)
+            local_engine = make_async_engine(ASYNC_DB_URL_TASK, "worker")
             LocalAsyncSessionFactory_Task = sessionmaker(
                 bind=local_engine, class_=AsyncSession, expire_on_commit=False, autoflush=False, autocommit=False
             )
@@ -1045,8 +1425,11 @@ def analyze_single_comment_ai_features_task(self, comment_id: int):
                 }
                 update_stmt = update(Comment).where(Comment.id == comment_id).values(**update_values)
                 await db_session.execute(update_stmt)
+                await _sync_comment_insights(db_session, comment_ids=[comment_id])
+                propagated_count = await _propagate_comment_features_to_near_duplicates(db_session, [comment_id])
                 await db_session.commit()
-                logger.info(f"{log_prefix} Комментарий ID {comment_id} помечен как обработанный (LLM вызов пропущен).")
+                await bump_data_version("analyze_single_comment_ai_features")
+                logger.info(f"{log_prefix} Комментарий ID {comment_id} помечен как обработанный (LLM вызов пропущен). Результаты скопированы в {propagated_count} почти-дубликатов.")
                 return f"Comment ID {comment_id} mock-processed (LLM call skipped)."
 
         except Exception as e_general_comment_analysis:
@@ -1124,7 +1507,7 @@ def enqueue_comments_for_ai_feature_analysis_task(
             if not ASYNC_DB_URL_TASK.startswith("postgresql+asyncpg://"):
                 ASYNC_DB_URL_TASK = ASYNC_DB_URL_TASK.replace("postgresql://", "postgresql+asyncpg://", 1)
 
-            local_engine = create_async_engine(ASYNC_DB_URL_TASK, echo=False, pool_pre_ping=True)
+            local_engine = make_async_engine(ASYNC_DB_URL_TASK, "worker")
             LocalAsyncSessionFactory_Task = sessionmaker(
                 bind=local_engine, class_=AsyncSession, expire_on_commit=False, autoflush=False, autocommit=False
             )
@@ -1139,6 +1522,7 @@ def enqueue_comments_for_ai_feature_analysis_task(
                             .where(Comment.id.in_(comment_ids_to_process))\
                             .where(Comment.text_content.isnot(None))\
                             .where(Comment.text_content != "")\
+                            .where(Comment.near_duplicate_of_id.is_(None))\
                             .where(Comment.ai_analysis_completed_at.is_(None)) # Только те, что еще не анализировались
 
                         filtered_ids_result = await db_session.execute(stmt_filter_ids)
@@ -1149,6 +1533,8 @@ def enqueue_comments_for_ai_feature_analysis_task(
                 else:
                     # Базовый запрос для комментариев, которые еще не анализировались или устарели
                     stmt = select(Comment.id).where(Comment.text_content.isnot(None)).where(Comment.text_content != "")
+                    # Почти-дубликаты не анализируются: результаты им копируются от представителя кластера
+                    stmt = stmt.where(Comment.near_duplicate_of_id.is_(None))
 
                     # Присоединяем Post для фильтрации по каналу или датам постов
                     # Это нужно делать только если есть соответствующие фильтры
@@ -1351,7 +1737,7 @@ def advanced_data_refresh_task(
             if not ASYNC_DB_URL.startswith("postgresql+asyncpg://"):
                 ASYNC_DB_URL = ASYNC_DB_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
             
-            local_engine = create_async_engine(ASYNC_DB_URL, echo=False, pool_pre_ping=True)
+            local_engine = make_async_engine(ASYNC_DB_URL, "backfill") # Перезагрузка истории - долгий массовый проход
             LocalAsyncSessionFactory = sessionmaker(
                 bind=local_engine, class_=AsyncSession, expire_on_commit=False, autoflush=False, autocommit=False
             )
@@ -1475,7 +1861,7 @@ def advanced_data_refresh_task(
                                                 if update_existing_posts_info: 
                                                     if post_in_db.views_count != tg_message.views: info_changed_for_post = True; post_in_db.views_count = tg_message.views
                                                     new_reactions = await _process_reactions_for_db(tg_message.reactions)
-                                                    if post_in_db.reactions != new_reactions : info_changed_for_post = True; post_in_db.reactions = new_reactions
+                                                    if post_in_db.reactions != new_reactions : info_changed_for_post = True; post_in_db.reactions = new_reactions; post_in_db.reactions_total = _sum_reactions_count(new_reactions)
                                                     if post_in_db.forwards_count != tg_message.forwards: info_changed_for_post = True; post_in_db.forwards_count = tg_message.forwards
                                                     new_edited_at = tg_message.edit_date.replace(tzinfo=timezone.utc) if tg_message.edit_date else None
                                                     if post_in_db.edited_at != new_edited_at: info_changed_for_post = True; post_in_db.edited_at = new_edited_at
@@ -1517,6 +1903,9 @@ def advanced_data_refresh_task(
                                                     posts_to_scan_comments_for.append(post_in_db)
                                                 else:
                                                     logger.debug(f"{log_prefix}      Пост TG ID {post_in_db.telegram_post_id}: счетчик комм. не увеличился (API: {api_comments_count_tg}, DB было: {db_comment_count}). Сбор недостающих комм. не требуется.")
+
+                                        if update_existing_posts_info: # Просмотры/реакции в агрегатах дашборда
+                                            await _refresh_channel_daily_stats(db, {(p.channel_id, _utc_date(p.posted_at)) for p, _ in db_posts_map_with_counts.values()})
                             else:
                                 logger.info(f"{log_prefix}    Нет постов в БД для канала {channel_db_obj.title} для обновления статистики (согласно фильтрам).")
 
@@ -1597,6 +1986,7 @@ def advanced_data_refresh_task(
                         await asyncio.sleep(1) 
                 
                 await db.commit() 
+                await bump_data_version("advanced_data_refresh")
                 
                 final_summary = f"Обновление завершено. Каналов обработано: {processed_channels_count}, Новых постов: {total_new_posts_task}, Обновлено инфо о постах: {total_updated_posts_info_task}, Новых комментариев собрано: {total_new_comments_collected_task}."
                 logger.info(f"{log_prefix} {final_summary}")
@@ -1682,4 +2072,947 @@ def advanced_data_refresh_task(
                 raise e_task_level from None
         except Exception as e_retry_logic: 
             logger.error(f"Celery: Исключение в логике retry для {self.request.id} (с ЛОКАЛЬНЫМ ENGINE): {type(e_retry_logic).__name__}", exc_info=True)
-            raise e_task_level from e_retry_logic
\ No newline at end of file
+            raise e_task_level from e_retry_logic
+
+# --- ОФФЛАЙН-РЕЖИМ: МАССОВАЯ ОБРАБОТКА БЭКЛОГА ЧЕРЕЗ BATCH API ---
+
+# Пакеты в этих статусах еще не записаны в БД - их элементы не отправляются повторно
+LLM_BATCH_PENDING_STATUSES = ("submitted", "in_progress", "completed")
+
+
+def _make_task_session_factory(pool_profile: str = "worker"):
+    """Движок и фабрика сессий на запуск задачи; pool_profile "backfill" - для долгих массовых проходов (см. make_async_engine)."""
+    ASYNC_DB_URL_TASK = settings.DATABASE_URL
+    if not ASYNC_DB_URL_TASK.startswith("postgresql+asyncpg://"):
+        ASYNC_DB_URL_TASK = ASYNC_DB_URL_TASK.replace("postgresql://", "postgresql+asyncpg://", 1)
+    local_engine = make_async_engine(ASYNC_DB_URL_TASK, pool_profile)
+    LocalAsyncSessionFactory_Task = sessionmaker(
+        bind=local_engine, class_=AsyncSession, expire_on_commit=False, autoflush=False, autocommit=False
+    )
+    return local_engine, LocalAsyncSessionFactory_Task
+
+
+def _apply_backlog_filters(stmt, channel_ids: Optional[List[int]], start_date_iso: Optional[str], end_date_iso: Optional[str]):
+    """Фильтры по каналам и дате публикации поста (stmt уже должен содержать Post)."""
+    if channel_ids:
+        stmt = stmt.where(Post.channel_id.in_(channel_ids))
+    elif not start_date_iso and not end_date_iso:
+        stmt = stmt.join(Channel, Post.channel_id == Channel.id).where(Channel.is_active == True)
+    if start_date_iso:
+        dt_start_naive = date.fromisoformat(start_date_iso.split('T')[0])
+        stmt = stmt.where(Post.posted_at >= datetime(dt_start_naive.year, dt_start_naive.month, dt_start_naive.day, tzinfo=timezone.utc))
+    if end_date_iso:
+        dt_end_naive = date.fromisoformat(end_date_iso.split('T')[0])
+        stmt = stmt.where(Post.posted_at <= datetime(dt_end_naive.year, dt_end_naive.month, dt_end_naive.day, 23, 59, 59, 999999, tzinfo=timezone.utc))
+    return stmt
+
+
+async def _select_llm_batch_backlog(
+    db_session: AsyncSession, kind: str, exclude_ids: set,
+    channel_ids: Optional[List[int]], start_date_iso: Optional[str], end_date_iso: Optional[str],
+) -> List[Tuple[int, Optional[str]]]:
+    """Возвращает (id, текст) элементов бэклога; текст None - анализировать нечего."""
+    if kind == KIND_COMMENT_FEATURES:
+        stmt = (
+            select(Comment.id, Comment.text_content, Comment.caption_text)
+            .join(Post, Comment.post_id == Post.id)
+            .where(Comment.ai_analysis_completed_at.is_(None))
+            .where(Comment.near_duplicate_of_id.is_(None)) # Почти-дубликаты получат результаты представителя
+            .order_by(Comment.id.asc())
+        )
+    else:
+        pending_column = Post.summary_text if kind == KIND_POST_SUMMARY else Post.post_sentiment_label
+        stmt = (
+            select(Post.id, Post.text_content, Post.caption_text)
+            .where(pending_column.is_(None))
+            .order_by(Post.id.asc())
+        )
+    stmt = _apply_backlog_filters(stmt, channel_ids, start_date_iso, end_date_iso)
+    if exclude_ids:
+        id_column = Comment.id if kind == KIND_COMMENT_FEATURES else Post.id
+        # Один параметр-массив вместо параметра на id: незавершенных элементов бывает больше лимита asyncpg (32767 параметров)
+        stmt = stmt.where(id_column != all_(bindparam("exclude_ids", sorted(exclude_ids), type_=PG_ARRAY(SAInteger))))
+    stmt = stmt.limit(settings.LLM_BATCH_MAX_ITEMS_PER_RUN)
+
+    backlog: List[Tuple[int, Optional[str]]] = []
+    for item_id, text_content, caption_text in (await db_session.execute(stmt)).all():
+        if kind == KIND_COMMENT_FEATURES:
+            text_value = (text_content or "")
+            if caption_text:
+                text_value = f"{text_value}\n[Подпись к медиа]: {caption_text}"
+        else:
+            text_value = caption_text if caption_text and caption_text.strip() else text_content
+        text_value = (text_value or "").strip()
+        if kind == KIND_POST_SUMMARY and len(text_value) < settings.MIN_POST_LENGTH_FOR_SUMMARY:
+            text_value = ""
+        backlog.append((item_id, text_value or None))
+    return backlog
+
+
+def _no_text_values(kind: str, now: datetime) -> Dict[str, Any]:
+    """Значения для элементов без текста - как в синхронных задачах (пустое резюме / neutral / пустые списки)."""
+    if kind == KIND_POST_SUMMARY:
+        return {"summary_text": "", "updated_at": now}
+    if kind == KIND_POST_SENTIMENT:
+        return {"post_sentiment_label": "neutral", "post_sentiment_score": 0.0, "post_sentiment_source": SENTIMENT_SOURCE_NO_TEXT, "updated_at": now}
+    return {
+        "extracted_topics": [], "extracted_problems": [], "extracted_questions": [], "extracted_suggestions": [],
+        "ai_analysis_completed_at": now, "updated_at": now,
+    }
+
+
+async def _bulk_update_by_id(db_session: AsyncSession, kind: str, rows: List[Dict[str, Any]]) -> int:
+    """
+    Bulk UPDATE по первичному ключу (executemany) пачками LLM_BATCH_INGEST_CHUNK_SIZE.
+    Пропускает удаленные и уже обработанные (например, синхронной задачей) элементы.
+    """
+    if not rows:
+        return 0
+    if kind == KIND_COMMENT_FEATURES:
+        model, pending_column = Comment, Comment.ai_analysis_completed_at
+    else:
+        model, pending_column = Post, (Post.summary_text if kind == KIND_POST_SUMMARY else Post.post_sentiment_label)
+    updated = 0
+    chunk_size = max(1, settings.LLM_BATCH_INGEST_CHUNK_SIZE)
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        still_pending = set((await db_session.execute(
+            select(model.id).where(model.id.in_([r["id"] for r in chunk])).where(pending_column.is_(None))
+        )).scalars().all())
+        chunk = [r for r in chunk if r["id"] in still_pending]
+        if chunk:
+            await db_session.execute(update(model), chunk)
+            updated += len(chunk)
+            if kind == KIND_POST_SENTIMENT:
+                await _refresh_channel_daily_stats(db_session, await _channel_days_for_posts(db_session, [r["id"] for r in chunk]))
+    return updated
+
+
+@celery_instance.task(name="tasks.submit_llm_bulk_batch", bind=True, max_retries=2, default_retry_delay=300)
+def submit_llm_bulk_batch_task(
+    self,
+    kind: str,
+    channel_ids: Optional[List[int]] = None,
+    start_date_iso: Optional[str] = None,
+    end_date_iso: Optional[str] = None,
+    backend_name: Optional[str] = None,
+):
+    """
+    Формирует JSONL-файлы запросов для всего бэклога (kind: post_summary / post_sentiment / comment_features),
+    отправляет их исполнителю пакетов и ставит задачи опроса. Результаты записывает poll_llm_bulk_batch_task.
+    """
+    task_start_time = time.time()
+    log_prefix = f"[LLMBulkSubmit:{kind}]"
+    logger.info(f"{log_prefix} Запущен Celery таск '{self.name}' (ID: {self.request.id}). Каналы: {channel_ids or 'все активные'}, период: {start_date_iso} - {end_date_iso}.")
+
+    if kind not in BATCH_KINDS:
+        raise ValueError(f"Неизвестный тип пакета: {kind}. Допустимые: {', '.join(BATCH_KINDS)}")
+
+    progress_info_ref: Dict[str, Any] = {"processed_count": 0, "total_to_process": 0, "current_step": "Инициализация", "progress": 0}
+
+    async def _async_logic(task_instance, current_progress_info_ref: Dict[str, Any]) -> Tuple[str, List[int], str]:
+        local_engine = None
+        try:
+            backend = get_batch_backend(backend_name)
+            if backend.name == "openai" and not settings.OPENAI_API_KEY:
+                raise ConnectionRefusedError("OPENAI_API_KEY не настроен - Batch API недоступен.")
+            local_engine, LocalAsyncSessionFactory_Task = _make_task_session_factory()
+
+            async with LocalAsyncSessionFactory_Task() as db_session:
+                pending_jobs = await db_session.execute(
+                    select(LLMBatchJob.item_ids).where(LLMBatchJob.kind == kind).where(LLMBatchJob.status.in_(LLM_BATCH_PENDING_STATUSES))
+                )
+                in_flight_ids = {item_id for ids in pending_jobs.scalars().all() for item_id in (ids or [])}
+                backlog = await _select_llm_batch_backlog(db_session, kind, in_flight_ids, channel_ids, start_date_iso, end_date_iso)
+                current_progress_info_ref.update({'total_to_process': len(backlog), 'current_step': f'Найдено {len(backlog)} элементов бэклога', 'progress': 10})
+                task_instance.update_state(state='PROGRESS', meta=current_progress_info_ref)
+                logger.info(f"{log_prefix} Бэклог: {len(backlog)} элементов (исключено {len(in_flight_ids)} из незавершенных пакетов).")
+
+                now = datetime.now(timezone.utc)
+                no_text_rows = [{"id": item_id, **_no_text_values(kind, now)} for item_id, text_value in backlog if text_value is None]
+                marked_without_llm = await _bulk_update_by_id(db_session, kind, no_text_rows)
+
+                to_submit = [(item_id, text_value) for item_id, text_value in backlog if text_value is not None]
+                marked_locally = 0
+                if kind == KIND_POST_SENTIMENT and to_submit:
+                    # Каскад: уверенно классифицированные локально посты в пакет не попадают
+                    local_results = classify_local_sentiment_batch([text_value for _, text_value in to_submit])
+                    local_rows = [
+                        {"id": item_id, "post_sentiment_label": result.label, "post_sentiment_score": result.score,
+                         "post_sentiment_source": SENTIMENT_SOURCE_LOCAL, "post_sentiment_confidence": result.confidence, "updated_at": now}
+                        for (item_id, _), result in zip(to_submit, local_results) if is_local_sentiment_confident(result)
+                    ]
+                    marked_locally = await _bulk_update_by_id(db_session, kind, local_rows)
+                    local_ids = {row["id"] for row in local_rows}
+                    to_submit = [(item_id, text_value) for item_id, text_value in to_submit if item_id not in local_ids]
+                filters = {"channel_ids": channel_ids, "start_date_iso": start_date_iso, "end_date_iso": end_date_iso}
+                created_jobs: List[LLMBatchJob] = []
+                chunk_size = max(1, settings.LLM_BATCH_MAX_REQUESTS_PER_FILE)
+                for start in range(0, len(to_submit), chunk_size):
+                    chunk = to_submit[start:start + chunk_size]
+                    input_path = new_input_file_path(kind)
+                    request_count = write_batch_input_file(input_path, (build_request_for_item(kind, item_id, text_value) for item_id, text_value in chunk))
+                    provider_batch_id = await backend.submit(input_path, metadata={"kind": kind, "source": "insight_compass"})
+                    job = LLMBatchJob(
+                        kind=kind, backend=backend.name, provider_batch_id=provider_batch_id, status="submitted",
+                        input_file_path=input_path, item_ids=[item_id for item_id, _ in chunk], filters=filters,
+                        request_count=request_count, succeeded_count=0, failed_count=0, poll_attempts=0,
+                    )
+                    db_session.add(job)
+                    created_jobs.append(job)
+                    current_progress_info_ref.update({
+                        'processed_count': start + len(chunk),
+                        'current_step': f'Отправлено пакетов: {len(created_jobs)} ({start + len(chunk)}/{len(to_submit)} запросов)',
+                        'progress': 10 + int((start + len(chunk)) / len(to_submit) * 85),
+                    })
+                    task_instance.update_state(state='PROGRESS', meta=current_progress_info_ref)
+                    logger.info(f"{log_prefix}  Пакет {provider_batch_id} ({backend.name}): {request_count} запросов, файл {input_path}.")
+
+                await db_session.commit()
+                job_ids = [job.id for job in created_jobs]
+
+            result_message = f"Отправлено пакетов: {len(job_ids)} ({len(to_submit)} запросов), без текста помечено {marked_without_llm}, локальным классификатором - {marked_locally}."
+            current_progress_info_ref.update({'current_step': 'Завершено', 'progress': 100, 'result_summary': result_message})
+            task_instance.update_state(state='SUCCESS', meta=current_progress_info_ref)
+            return result_message, job_ids, backend.name
+        finally:
+            if local_engine:
+                await local_engine.dispose()
+
+    try:
+        result_message, job_ids, used_backend = asyncio.run(_async_logic(self, progress_info_ref))
+        # Задачи опроса ставим после коммита, чтобы они увидели записи пакетов
+        first_poll_countdown = 5 if used_backend == "local" else settings.LLM_BATCH_POLL_INTERVAL_SECONDS
+        for job_id in job_ids:
+            poll_llm_bulk_batch_task.apply_async(args=[job_id], countdown=first_poll_countdown)
+        task_duration = time.time() - task_start_time
+        logger.info(f"{log_prefix} Celery таск '{self.name}' УСПЕШНО завершен за {task_duration:.2f} сек. Результат: {result_message}")
+        return result_message
+    except Exception as e_task_main:
+        task_duration = time.time() - task_start_time
+        logger.error(f"{log_prefix} !!! КРИТИЧЕСКАЯ ОШИБКА в таске '{self.name}' (за {task_duration:.2f} сек): {type(e_task_main).__name__} - {e_task_main}", exc_info=True)
+        self.update_state(state='FAILURE', meta={**progress_info_ref, 'error': str(e_task_main), 'progress': 100, 'current_step': f"Ошибка: {progress_info_ref.get('current_step')}"})
+        if isinstance(e_task_main, (ValueError, ConnectionRefusedError)):
+            raise # Ошибки конфигурации повтором не исправить
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=e_task_main, countdown=int(self.default_retry_delay * (2 ** self.request.retries)))
+        raise
+
+
+async def _ingest_llm_batch_results(db_session: AsyncSession, job: LLMBatchJob, output_text: str) -> Tuple[int, int]:
+    """Разбирает результаты пакета и записывает их в posts/comments bulk UPDATE. Возвращает (записано, ошибок)."""
+    now = datetime.now(timezone.utc)
+    rows: List[Dict[str, Any]] = []
+    failed = 0
+    for item in parse_batch_output(output_text):
+        item_kind, item_id = parse_custom_id(item.custom_id)
+        if item_kind != job.kind or item_id is None or item.content is None:
+            failed += 1
+            if item.error:
+                logger.warning(f"[LLMBulkPoll:{job.id}]  Ошибка запроса {item.custom_id}: {item.error[:300]}")
+            continue
+        if job.kind == KIND_POST_SUMMARY:
+            rows.append({"id": item_id, "summary_text": item.content, "updated_at": now})
+        elif job.kind == KIND_POST_SENTIMENT:
+            parsed_sentiment = parse_sentiment_content(item.content)
+            if parsed_sentiment is None:
+                failed += 1
+                continue
+            rows.append({
+                "id": item_id, "post_sentiment_label": parsed_sentiment[0], "post_sentiment_score": parsed_sentiment[1],
+                "post_sentiment_source": SENTIMENT_SOURCE_LLM_BATCH, "updated_at": now,
+            })
+        else:
+            parsed_features = parse_comment_features_content(item.content)
+            if parsed_features is None:
+                failed += 1
+                continue
+            rows.append({
+                "id": item_id,
+                "extracted_topics": parsed_features["topics"],
+                "extracted_problems": parsed_features["problems"],
+                "extracted_questions": parsed_features["questions"],
+                "extracted_suggestions": parsed_features["suggestions"],
+                "ai_analysis_completed_at": now,
+                "updated_at": now,
+            })
+    written = await _bulk_update_by_id(db_session, job.kind, rows)
+    if job.kind == KIND_COMMENT_FEATURES and rows:
+        ingested_ids = [row["id"] for row in rows]
+        chunk_size = max(1, settings.LLM_BATCH_INGEST_CHUNK_SIZE)
+        for start in range(0, len(ingested_ids), chunk_size):
+            await _sync_comment_insights(db_session, comment_ids=ingested_ids[start:start + chunk_size])
+        propagated = await _propagate_comment_features_to_near_duplicates(db_session, [row["id"] for row in rows])
+        if propagated:
+            logger.info(f"[LLMBulkPoll:{job.id}]  Результаты скопированы в {propagated} почти-дубликатов комментариев.")
+    return written, failed
+
+
+@celery_instance.task(name="tasks.poll_llm_bulk_batch", bind=True, max_retries=5, default_retry_delay=120)
+def poll_llm_bulk_batch_task(self, job_id: int):
+    """
+    Опрашивает статус пакета; пока он не завершен - перепланирует себя, после завершения записывает результаты в БД.
+    Элементы, не получившие результата (ошибки, истекшее окно), остаются в бэклоге и попадут в следующий пакет.
+    """
+    log_prefix = f"[LLMBulkPoll:{job_id}]"
+
+    async def _async_logic() -> Tuple[str, bool]:
+        local_engine = None
+        try:
+            local_engine, LocalAsyncSessionFactory_Task = _make_task_session_factory()
+            async with LocalAsyncSessionFactory_Task() as db_session:
+                job = await db_session.get(LLMBatchJob, job_id)
+                if job is None:
+                    return f"Пакет {job_id} не найден.", False
+                if job.status not in LLM_BATCH_PENDING_STATUSES:
+                    return f"Пакет {job_id} уже в финальном статусе '{job.status}'.", False
+
+                backend = get_batch_backend(job.backend)
+                provider_status = await backend.get_status(job.provider_batch_id)
+                job.poll_attempts = (job.poll_attempts or 0) + 1
+                logger.info(f"{log_prefix} Статус пакета {job.provider_batch_id}: {provider_status.status}, счетчики: {provider_status.request_counts} (опрос #{job.poll_attempts}).")
+
+                if not provider_status.is_final:
+                    if job.poll_attempts >= settings.LLM_BATCH_MAX_POLL_ATTEMPTS:
+                        job.status = "failed"
+                        job.error = f"Пакет не завершился за {job.poll_attempts} опросов (последний статус: {provider_status.status})."
+                        await db_session.commit()
+                        return job.error, False
+                    job.status = "in_progress"
+                    await db_session.commit()
+                    return f"Пакет {job_id} в работе ({provider_status.status}).", True
+
+                job.completed_at = datetime.now(timezone.utc)
+                job.output_file_id = provider_status.output_file_id
+                job.status = "completed"
+                await db_session.commit() # Фиксируем завершение до (долгой) загрузки результатов
+
+                output_text = await backend.download(provider_status.output_file_id) if provider_status.output_file_id else ""
+                if provider_status.error_file_id:
+                    output_text += "\n" + await backend.download(provider_status.error_file_id)
+                written, failed = await _ingest_llm_batch_results(db_session, job, output_text)
+
+                job.succeeded_count = written
+                job.failed_count = failed
+                job.ingested_at = datetime.now(timezone.utc)
+                job.status = "ingested" if provider_status.status == "completed" else provider_status.status
+                job.error = provider_status.error
+                await db_session.commit()
+                await bump_data_version(f"llm batch {job_id} ingested")
+                return f"Пакет {job_id} ({job.kind}) обработан: записано {written}, ошибок {failed}, статус провайдера '{provider_status.status}'.", False
+        finally:
+            if local_engine:
+                await local_engine.dispose()
+
+    try:
+        result_message, needs_another_poll = asyncio.run(_async_logic())
+    except Exception as e_task_main:
+        logger.error(f"{log_prefix} !!! Ошибка опроса пакета: {type(e_task_main).__name__} - {e_task_main}", exc_info=True)
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=e_task_main, countdown=int(self.default_retry_delay * (2 ** self.request.retries)))
+        raise
+    if needs_another_poll:
+        poll_llm_bulk_batch_task.apply_async(args=[job_id], countdown=settings.LLM_BATCH_POLL_INTERVAL_SECONDS)
+    logger.info(f"{log_prefix} {result_message}")
+    return result_message
+
+
+# --- Почти-дубликаты комментариев: заполнение подписей для комментариев, собранных до появления кластеризации ---
+
+@celery_instance.task(name="tasks.backfill_comment_simhash", bind=True, max_retries=2, default_retry_delay=120)
+def backfill_comment_simhash_task(self, batch_size: int = 2000, max_batches: int = 50):
+    """
+    Считает SimHash-подписи для еще не проанализированных комментариев без подписи (в порядке сбора) и
+    привязывает почти-дубликаты к представителям - чтобы накопленный бэклог тоже анализировался по одному разу на кластер.
+    """
+    log_prefix = "[NearDupBackfill]"
+
+    async def _async_logic() -> str:
+        local_engine, LocalAsyncSessionFactory_Task = _make_task_session_factory("backfill")
+        processed_total = 0
+        near_duplicates_total = 0
+        last_comment_id = 0
+        try:
+            async with LocalAsyncSessionFactory_Task() as db_session:
+                for batch_number in range(max_batches):
+                    stmt = (
+                        select(Comment)
+                        .where(Comment.text_simhash.is_(None))
+                        .where(Comment.ai_analysis_completed_at.is_(None))
+                        .where(Comment.text_content.isnot(None))
+                        .where(Comment.text_content != "")
+                        .where(Comment.id > last_comment_id)
+                        .order_by(Comment.id.asc())
+                        .limit(batch_size)
+                    )
+                    comments_batch = (await db_session.execute(stmt)).scalars().all()
+                    if not comments_batch:
+                        break
+                    last_comment_id = comments_batch[-1].id # Комментарии без слов остаются без подписи - не выбираем их повторно
+                    near_duplicates_total += await _assign_near_duplicate_clusters(db_session, list(comments_batch), log_prefix=log_prefix)
+                    processed_total += len(comments_batch)
+                    await db_session.commit()
+                    self.update_state(state='PROGRESS', meta={
+                        'current_step': f'Обработано комментариев: {processed_total}',
+                        'processed_count': processed_total, 'progress': int((batch_number + 1) * 100 / max_batches),
+                    })
+            return f"Подписи посчитаны для {processed_total} комментариев, почти-дубликатов: {near_duplicates_total}."
+        finally:
+            await local_engine.dispose()
+
+    try:
+        result_message = asyncio.run(_async_logic())
+    except Exception as e_task_main:
+        logger.error(f"{log_prefix} !!! Ошибка заполнения подписей: {type(e_task_main).__name__} - {e_task_main}", exc_info=True)
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=e_task_main, countdown=int(self.default_retry_delay * (2 ** self.request.retries)))
+        raise
+    logger.info(f"{log_prefix} {result_message}")
+    return result_message
+
+
+# --- Журнал вызовов LLM: перенос записей из буфера Redis в llm_call_log и очистка по сроку хранения ---
+
+_LLM_CALL_LOG_FIELDS = (
+    "caller", "model", "outcome", "status_code", "attempt", "latency_ms",
+    "prompt_tokens", "completion_tokens", "estimated_prompt_tokens", "cost_usd",
+)
+
+
+@celery_instance.task(name="tasks.flush_llm_call_log", bind=True, max_retries=2, default_retry_delay=60)
+def flush_llm_call_log_task(self, max_batches: int = 20):
+    """
+    Забирает накопленные в Redis записи о вызовах LLM пачками LLM_CALL_LOG_FLUSH_BATCH_SIZE, вставляет их в llm_call_log
+    одним INSERT на пачку и удаляет записи старше LLM_CALL_LOG_RETENTION_DAYS. Запускается Celery Beat.
+    Журнал - телеметрия: если вставка пачки упала, эта пачка теряется (счетчики в Redis при этом не страдают).
+    """
+    log_prefix = "[LLMCallLogFlush]"
+
+    async def _async_logic() -> str:
+        local_engine, LocalAsyncSessionFactory_Task = _make_task_session_factory()
+        inserted_total = 0
+        try:
+            async with LocalAsyncSessionFactory_Task() as db_session:
+                for _ in range(max_batches):
+                    records = await drain_call_log_buffer(settings.LLM_CALL_LOG_FLUSH_BATCH_SIZE)
+                    if not records:
+                        break
+                    rows = []
+                    for record in records:
+                        row = {field_name: record.get(field_name) for field_name in _LLM_CALL_LOG_FIELDS}
+                        row["caller"] = str(row["caller"] or "unknown")[:100]
+                        row["model"] = str(row["model"] or "unknown")[:100]
+                        row["created_at"] = datetime.fromtimestamp(float(record.get("created_at") or time.time()), tz=timezone.utc)
+                        rows.append(row)
+                    await db_session.execute(insert(LLMCallLog), rows)
+                    await db_session.commit()
+                    inserted_total += len(rows)
+
+                retention_threshold = datetime.now(timezone.utc) - timedelta(days=settings.LLM_CALL_LOG_RETENTION_DAYS)
+                delete_result = await db_session.execute(delete(LLMCallLog).where(LLMCallLog.created_at < retention_threshold))
+                await db_session.commit()
+            return f"В llm_call_log записано {inserted_total} вызовов, удалено устаревших: {delete_result.rowcount or 0}."
+        finally:
+            await local_engine.dispose()
+
+    try:
+        result_message = asyncio.run(_async_logic())
+    except Exception as e_task_main:
+        logger.error(f"{log_prefix} !!! Ошибка переноса журнала вызовов LLM: {type(e_task_main).__name__} - {e_task_main}", exc_info=True)
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=e_task_main, countdown=int(self.default_retry_delay * (2 ** self.request.retries)))
+        raise
+    logger.info(f"{log_prefix} {result_message}")
+    return result_message
+
+
+@celery_instance.task(name="tasks.reconcile_channel_daily_stats", bind=True, max_retries=2, default_retry_delay=300)
+def reconcile_channel_daily_stats_task(self, days_back: Optional[int] = None, full: bool = False):
+    """
+    Сверка channel_daily_stats с posts/comments: пересчитывает последние days_back (CHANNEL_STATS_RECONCILE_DAYS) UTC-дней
+    по всем каналам (full=True - всю историю, по месяцам). Ловит то, что не прошло через инкрементальное обновление:
+    удаленные строки, записи в обход задач, сбои. Запускается Celery Beat.
+    """
+    log_prefix = "[ChannelStatsReconcile]"
+    days_back = days_back or settings.CHANNEL_STATS_RECONCILE_DAYS
+
+    async def _async_logic() -> str:
+        local_engine, LocalAsyncSessionFactory_Task = _make_task_session_factory("backfill")
+        try:
+            async with LocalAsyncSessionFactory_Task() as db_session:
+                end_day = datetime.now(timezone.utc).date()
+                if full:
+                    first_posted_at = (await db_session.execute(select(func.min(Post.posted_at)))).scalar_one_or_none()
+                    first_commented_at = (await db_session.execute(select(func.min(Comment.commented_at)))).scalar_one_or_none()
+                    known_starts = [_utc_date(value) for value in (first_posted_at, first_commented_at) if value is not None]
+                    start_day = min(known_starts) if known_starts else end_day
+                else:
+                    start_day = end_day - timedelta(days=days_back - 1)
+                written_total = 0
+                window_start = start_day
+                while window_start <= end_day: # Окнами по 31 день - по коммиту на окно, без долгой транзакции на всю историю
+                    window_end = min(window_start + timedelta(days=30), end_day)
+                    written_total += await _recompute_channel_daily_stats(db_session, window_start, window_end)
+                    await db_session.commit()
+                    window_start = window_end + timedelta(days=1)
+                if written_total:
+                    await bump_data_version("reconcile_channel_daily_stats")
+            return f"Агрегаты channel_daily_stats сверены за {start_day.isoformat()} - {end_day.isoformat()}: записано строк {written_total}."
+        finally:
+            await local_engine.dispose()
+
+    try:
+        result_message = asyncio.run(_async_logic())
+    except Exception as e_task_main:
+        logger.error(f"{log_prefix} !!! Ошибка сверки дневных агрегатов: {type(e_task_main).__name__} - {e_task_main}", exc_info=True)
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=e_task_main, countdown=int(self.default_retry_delay * (2 ** self.request.retries)))
+        raise
+    logger.info(f"{log_prefix} {result_message}")
+    return result_message
+
+
+@celery_instance.task(name="tasks.maintain_comment_partitions", bind=True, max_retries=2, default_retry_delay=600)
+def maintain_comment_partitions_task(self):
+    """
+    Обслуживание помесячных секций comments: создает секции на COMMENTS_PARTITION_PREMAKE_MONTHS месяцев вперед и,
+    если задан COMMENTS_PARTITION_RETENTION_MONTHS, отсоединяет (или удаляет) секции старше срока хранения.
+    Перед отсоединением удаляются ссылающиеся на эти комментарии строки comment_insights и ссылки почти-дубликатов.
+    Агрегаты channel_daily_stats за архивные месяцы сохраняются: пересчет (_recompute_channel_daily_stats) не трогает comment_count
+    за дни раньше самой ранней подключенной секции. Запускается Celery Beat.
+    """
+    log_prefix = "[CommentPartitions]"
+
+    async def _async_logic() -> str:
+        local_engine, LocalAsyncSessionFactory_Task = _make_task_session_factory()
+        try:
+            async with LocalAsyncSessionFactory_Task() as db_session:
+                created = await ensure_monthly_partitions(db_session, Comment.__tablename__, "commented_at", settings.COMMENTS_PARTITION_PREMAKE_MONTHS)
+                await db_session.commit()
+
+                detached: List[str] = []
+                if settings.COMMENTS_PARTITION_RETENTION_MONTHS:
+                    cutoff_month = add_months(month_start(datetime.now(timezone.utc).date()), -settings.COMMENTS_PARTITION_RETENTION_MONTHS)
+                    cutoff_at = datetime(cutoff_month.year, cutoff_month.month, 1, tzinfo=timezone.utc)
+                    # Внешний ключ comment_insights -> comments не даст отсоединить секцию со ссылками на нее
+                    await db_session.execute(delete(CommentInsight).where(CommentInsight.commented_at < cutoff_at))
+                    archived_ids = select(Comment.id).where(Comment.commented_at < cutoff_at)
+                    await db_session.execute(
+                        update(Comment).where(Comment.commented_at >= cutoff_at, Comment.near_duplicate_of_id.in_(archived_ids))
+                        .values(near_duplicate_of_id=None).execution_options(synchronize_session=False)
+                    )
+                    detached = await detach_monthly_partitions_before(db_session, Comment.__tablename__, cutoff_month, drop=settings.COMMENTS_PARTITION_DROP_DETACHED)
+                    await db_session.commit()
+                    if detached:
+                        await bump_data_version("comment partitions detached")
+            action = "удалено" if settings.COMMENTS_PARTITION_DROP_DETACHED else "отсоединено"
+            return f"Секций comments создано: {len(created)} {created}, {action}: {len(detached)} {detached}."
+        finally:
+            await local_engine.dispose()
+
+    try:
+        result_message = asyncio.run(_async_logic())
+    except Exception as e_task_main:
+        logger.error(f"{log_prefix} !!! Ошибка обслуживания секций: {type(e_task_main).__name__} - {e_task_main}", exc_info=True)
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=e_task_main, countdown=int(self.default_retry_delay * (2 ** self.request.retries)))
+        raise
+    logger.info(f"{log_prefix} {result_message}")
+    return result_message
+
+
+def _analytics_lake_select(dataset: str, day: date):
+    """SELECT строк снимка dataset за UTC-день day: колонки в порядке LAKE_DATASET_COLUMNS, сортировка по каналу."""
+    day_start = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+    day_end = day_start + timedelta(days=1)
+    if dataset == "posts":
+        columns = [Post.id, Post.channel_id, Post.posted_at, Post.views_count, Post.forwards_count, Post.comments_count,
+                   Post.reactions_total, Post.post_sentiment_label, Post.post_sentiment_score]
+        stmt = select(*columns).where(Post.posted_at >= day_start, Post.posted_at < day_end).order_by(Post.channel_id, Post.id)
+    elif dataset == "comments":
+        columns = [Comment.id, Comment.post_id, Post.channel_id, Comment.commented_at, Comment.sentiment_label, Comment.sentiment_score,
+                   Comment.near_duplicate_of_id, Comment.ai_analysis_completed_at]
+        stmt = (
+            select(*columns).select_from(Comment).join(Post, Comment.post_id == Post.id)
+            .where(Comment.commented_at >= day_start, Comment.commented_at < day_end).order_by(Post.channel_id, Comment.id)
+        )
+    else:
+        columns = [CommentInsight.id, CommentInsight.comment_id, CommentInsight.channel_id, CommentInsight.commented_at,
+                   CommentInsight.insight_type, CommentInsight.normalized_text, CommentInsight.display_text, CommentInsight.canonical_id]
+        stmt = (
+            select(*columns).where(CommentInsight.commented_at >= day_start, CommentInsight.commented_at < day_end)
+            .order_by(CommentInsight.channel_id, CommentInsight.insight_type, CommentInsight.normalized_text)
+        )
+    assert [column.key for column in columns] == [name for name, _ in LAKE_DATASET_COLUMNS[dataset]], dataset
+    return stmt
+
+
+async def _analytics_lake_changed_days(db: AsyncSession, since: datetime) -> Set[date]:
+    """
+    UTC-дни, данные которых могли измениться после since: сбор и анализ постов обновляют channel_daily_stats
+    (updated_at), AI-анализ комментариев - comments.ai_analysis_completed_at (индекс) вместе с comment_insights.
+    """
+    stats_days = (await db.execute(select(ChannelDailyStats.day).where(ChannelDailyStats.updated_at > since).distinct())).scalars().all()
+    analyzed_days = (await db.execute(
+        select(_utc_day_expression(Comment.commented_at)).where(Comment.ai_analysis_completed_at > since).distinct()
+    )).scalars().all()
+    # Канонизация проставляет canonical_id уже записанным инсайтам - дни с формулировками, попавшими в словарь после since
+    canonicalized_days = (await db.execute(
+        select(_utc_day_expression(CommentInsight.commented_at))
+        .join(InsightAlias, (InsightAlias.insight_type == CommentInsight.insight_type) & (InsightAlias.normalized_text == CommentInsight.normalized_text))
+        .where(InsightAlias.created_at > since).distinct()
+    )).scalars().all()
+    return set(stats_days) | set(analyzed_days) | set(canonicalized_days)
+
+
+@celery_instance.task(name="tasks.snapshot_analytics_lake", bind=True, max_retries=2, default_retry_delay=300)
+def snapshot_analytics_lake_task(self, full: bool = False):
+    """
+    Обновляет колоночные снимки (Parquet по UTC-дням) для отчетов через DuckDB: первый запуск и full=True выгружают
+    всю историю, дальше переснимаются только дни с изменениями после прошлого снимка и последние ANALYTICS_LAKE_RESNAPSHOT_DAYS.
+    Удаленные каналы из снимков не вычищаются - отчеты все равно фильтруют по активным каналам из Postgres. Запускается Celery Beat.
+    """
+    log_prefix = "[AnalyticsLake]"
+    if not settings.ANALYTICS_LAKE_ENABLED:
+        return "Аналитическое хранилище выключено (ANALYTICS_LAKE_ENABLED=False)."
+    if not analytics_lake_dependencies_available():
+        return "Аналитическое хранилище недоступно: не установлены duckdb и/или pyarrow."
+
+    async def _async_logic() -> str:
+        started_at = datetime.now(timezone.utc)
+        state = read_lake_state()
+        backfill = full or not state or not state.get("backfilled")
+        local_engine, LocalAsyncSessionFactory_Task = _make_task_session_factory("backfill")
+        try:
+            async with LocalAsyncSessionFactory_Task() as db_session:
+                today = started_at.date()
+                if backfill:
+                    first_posted_at = (await db_session.execute(select(func.min(Post.posted_at)))).scalar_one_or_none()
+                    first_commented_at = (await db_session.execute(select(func.min(Comment.commented_at)))).scalar_one_or_none()
+                    known_starts = [_utc_date(value) for value in (first_posted_at, first_commented_at) if value is not None]
+                    first_day = min(known_starts) if known_starts else today
+                    days = [first_day + timedelta(days=offset) for offset in range((today - first_day).days + 1)]
+                else:
+                    watermark = datetime.fromisoformat(state["watermark"]) - WATERMARK_OVERLAP
+                    days = sorted(
+                        await _analytics_lake_changed_days(db_session, watermark)
+                        | {today - timedelta(days=offset) for offset in range(settings.ANALYTICS_LAKE_RESNAPSHOT_DAYS)}
+                    )
+                rows_written = 0
+                for day in days:
+                    for dataset in LAKE_DATASET_COLUMNS:
+                        rows = (await db_session.execute(_analytics_lake_select(dataset, day))).all()
+                        rows_written += await asyncio.to_thread(write_day_snapshot, dataset, day, rows)
+                    await db_session.rollback() # Не держим одну транзакцию (и снимок MVCC) на все дни
+            write_lake_state({
+                "watermark": started_at.isoformat(),
+                "last_snapshot_at": datetime.now(timezone.utc).isoformat(),
+                "backfilled": True,
+            })
+            mode = "полная выгрузка" if backfill else "инкрементально"
+            return f"Снимки обновлены ({mode}): дней {len(days)}, строк {rows_written}, за {(datetime.now(timezone.utc) - started_at).total_seconds():.1f} с."
+        finally:
+            await local_engine.dispose()
+
+    try:
+        result_message = asyncio.run(_async_logic())
+    except Exception as e_task_main:
+        logger.error(f"{log_prefix} !!! Ошибка обновления снимков: {type(e_task_main).__name__} - {e_task_main}", exc_info=True)
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=e_task_main, countdown=int(self.default_retry_delay * (2 ** self.request.retries)))
+        raise
+    logger.info(f"{log_prefix} {result_message}")
+    return result_message
+
+
+# Посты переиндексируются по updated_at с запасом назад: транзакция, начатая до прошлого запуска, могла закоммититься позже;
+# повторно прочитанные посты с тем же текстом не векторизуются (сверка хэша текста в индексе)
+_SEMANTIC_POSTS_OVERLAP = timedelta(minutes=10)
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _semantic_text(*parts: Optional[str]) -> Optional[str]:
+    text_value = "\n".join(part.strip() for part in parts if part and part.strip())
+    if len(text_value) < settings.SEMANTIC_MIN_TEXT_CHARS:
+        return None
+    return text_value[:settings.SEMANTIC_MAX_TEXT_CHARS]
+
+
+async def _semantic_fetch_posts(db: AsyncSession, watermark: List[Any]) -> Tuple[List[Tuple[int, int, int, str]], Optional[List[Any]]]:
+    """Пачка постов после водяного знака (updated_at, id): документы (id, канал, время, текст) и новый водяной знак."""
+    updated_after, id_after = datetime.fromisoformat(watermark[0]), watermark[1]
+    rows = (await db.execute(
+        select(Post.id, Post.channel_id, Post.posted_at, Post.updated_at, Post.summary_text, Post.text_content, Post.caption_text)
+        .where(tuple_(Post.updated_at, Post.id) > tuple_(updated_after, id_after))
+        .order_by(Post.updated_at, Post.id).limit(settings.SEMANTIC_INDEX_BATCH_ROWS)
+    )).all()
+    if not rows:
+        return [], None
+    docs = []
+    for row in rows:
+        post_text = _semantic_text(row.summary_text, row.text_content or row.caption_text) # Резюме AI - в начале, оно плотнее по смыслу
+        if post_text:
+            docs.append((row.id, row.channel_id, int(row.posted_at.timestamp()), post_text))
+    return docs, [rows[-1].updated_at.isoformat(), rows[-1].id]
+
+
+async def _semantic_fetch_comments(db: AsyncSession, watermark: int) -> Tuple[List[Tuple[int, int, int, str]], Optional[int]]:
+    """Пачка новых комментариев по id; почти-дубликаты не индексируются - в выдаче их представляет представитель кластера."""
+    rows = (await db.execute(
+        select(Comment.id, Post.channel_id, Comment.commented_at, Comment.text_content)
+        .join(Post, Comment.post_id == Post.id)
+        .where(Comment.id > watermark, Comment.near_duplicate_of_id.is_(None))
+        .order_by(Comment.id).limit(settings.SEMANTIC_INDEX_BATCH_ROWS)
+    )).all()
+    if not rows:
+        return [], None
+    docs = [(row.id, row.channel_id, int(row.commented_at.timestamp()), _semantic_text(row.text_content)) for row in rows]
+    return [doc for doc in docs if doc[3]], rows[-1].id
+
+
+async def _semantic_fetch_insights(db: AsyncSession, watermark: int) -> Tuple[List[Tuple[int, int, int, str]], Optional[int]]:
+    """
+    Пачка новых канонических инсайтов (insight_canonicals) по id: документ - канонический инсайт, его id стабилен (строки
+    comment_insights пересоздаются при повторном анализе и удаляются при хранении по сроку). Канала и времени у документа нет -
+    упоминания в фильтрах поиска считаются по comment_insights.canonical_id. Инсайты попадают в поиск после tasks.canonicalize_insights.
+    """
+    rows = (await db.execute(
+        select(InsightCanonical.id, InsightCanonical.display_text)
+        .where(InsightCanonical.id > watermark).order_by(InsightCanonical.id).limit(settings.SEMANTIC_INDEX_BATCH_ROWS)
+    )).all()
+    if not rows:
+        return [], None
+    docs = [(row.id, 0, 0, _semantic_text(row.display_text)) for row in rows]
+    return [doc for doc in docs if doc[3]], rows[-1].id
+
+
+async def _semantic_index_docs(writer: VectorIndexWriter, provider, kind: int, docs: List[Tuple]) -> int:
+    """Векторизует и записывает документы, которых нет в индексе или чей текст изменился."""
+    if not docs:
+        return 0
+    hashes = [text_hash(doc[3]) for doc in docs]
+    changed = writer.changed_mask(kind, [doc[0] for doc in docs], hashes)
+    selected = [(doc, doc_hash) for doc, doc_hash, is_changed in zip(docs, hashes, changed) if is_changed]
+    if not selected:
+        return 0
+    vectors = await embed_in_batches(provider, [doc[3] for doc, _ in selected])
+    return writer.upsert(
+        kind, [doc[0] for doc, _ in selected], [doc[1] for doc, _ in selected], [doc[2] for doc, _ in selected],
+        [doc_hash for _, doc_hash in selected], vectors,
+    )
+
+
+@celery_instance.task(name="tasks.update_semantic_index", bind=True, max_retries=2, default_retry_delay=300)
+def update_semantic_index_task(self):
+    """
+    Инкрементальное обновление индекса семантического поиска: новые и измененные посты (updated_at - в том числе появившееся
+    резюме AI), новые комментарии и новые инсайты. Не больше SEMANTIC_INDEX_MAX_ROWS_PER_RUN строк каждого вида за запуск,
+    индекс коммитится после каждой пачки - первичная индексация большой базы продолжается следующими запусками (Celery Beat).
+    """
+    log_prefix = "[SemanticIndex]"
+    if not settings.SEMANTIC_SEARCH_ENABLED:
+        return "Семантический поиск выключен (SEMANTIC_SEARCH_ENABLED=False)."
+    if not vector_index_dependencies_available():
+        return "Семантический поиск недоступен: не установлен numpy."
+
+    async def _async_logic() -> str:
+        try:
+            provider = get_embedding_provider()
+        except EmbeddingProviderUnavailableError as e:
+            return f"Индекс не обновлен: {e}"
+        indexed = {"posts": 0, "comments": 0, "insight_canonicals": 0}
+        local_engine, LocalAsyncSessionFactory_Task = _make_task_session_factory("backfill")
+        try:
+            async with LocalAsyncSessionFactory_Task() as db_session:
+                with VectorIndexWriter(provider.name, provider.model, provider.dimension) as writer:
+                    if "insights" in writer.watermarks:
+                        # Прежние документы инсайтов ссылались на строки comment_insights - переиндексируются по insight_canonicals
+                        removed = writer.delete_kind(KIND_INSIGHT)
+                        writer.watermarks.pop("insights")
+                        writer.commit(save_graph=False)
+                        logger.info(f"{log_prefix} Удалено {removed} документов инсайтов прежней схемы.")
+                    post_watermark = writer.watermarks.get("posts", [_EPOCH.isoformat(), 0])
+                    post_watermark = [(datetime.fromisoformat(post_watermark[0]) - _SEMANTIC_POSTS_OVERLAP).isoformat(), 0]
+                    sources = (
+                        ("posts", KIND_POST, _semantic_fetch_posts, post_watermark),
+                        ("comments", KIND_COMMENT, _semantic_fetch_comments, writer.watermarks.get("comments", 0)),
+                        ("insight_canonicals", KIND_INSIGHT, _semantic_fetch_insights, writer.watermarks.get("insight_canonicals", 0)),
+                    )
+                    for source_name, kind, fetch, watermark in sources:
+                        rows_seen = 0
+                        while rows_seen < settings.SEMANTIC_INDEX_MAX_ROWS_PER_RUN:
+                            docs, next_watermark = await fetch(db_session, watermark)
+                            await db_session.rollback() # Векторизация может быть долгой - транзакцию не держим
+                            if next_watermark is None:
+                                break
+                            indexed[source_name] += await _semantic_index_docs(writer, provider, kind, docs)
+                            watermark = next_watermark
+                            writer.watermarks[source_name] = watermark
+                            writer.commit(save_graph=False)
+                            rows_seen += settings.SEMANTIC_INDEX_BATCH_ROWS
+                    writer.commit()
+                    writer.compact_if_needed()
+                    total_vectors, deleted_vectors = writer.state["count"], writer.state["deleted"]
+        finally:
+            await local_engine.dispose()
+        return f"Проиндексировано: {indexed}; в индексе слотов {total_vectors}, из них удаленных {deleted_vectors}."
+
+    try:
+        result_message = asyncio.run(_async_logic())
+    except Exception as e_task_main:
+        logger.error(f"{log_prefix} !!! Ошибка обновления индекса: {type(e_task_main).__name__} - {e_task_main}", exc_info=True)
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=e_task_main, countdown=int(self.default_retry_delay * (2 ** self.request.retries)))
+        raise
+    logger.info(f"{log_prefix} {result_message}")
+    return result_message
+
+
+async def _insight_cluster_index(db: AsyncSession, insight_type: str, embedding_model: str, dimension: int) -> InsightClusterIndex:
+    """Эмбеддинги канонических инсайтов типа insight_type, посчитанные текущей моделью."""
+    cluster_index = InsightClusterIndex(dimension)
+    rows = (await db.execute(
+        select(InsightCanonical.id, InsightCanonical.embedding)
+        .where(InsightCanonical.insight_type == insight_type, InsightCanonical.embedding_model == embedding_model, InsightCanonical.embedding.isnot(None))
+    )).all()
+    cluster_index.add_stored([(row.id, row.embedding) for row in rows])
+    return cluster_index
+
+
+async def _canonicalize_insight_batch(db: AsyncSession, provider, cluster_indexes: Dict[str, InsightClusterIndex]) -> Optional[Dict[str, int]]:
+    """
+    Одна пачка очереди канонизации - формулировки (тип, нормализованный текст) строк comment_insights без canonical_id:
+    ключ -> существующий канонический инсайт с тем же ключом, иначе ближайший по эмбеддингу (provider не None), иначе новый.
+    Затем словарь insight_aliases пополняется и canonical_id проставляется строкам. None - очередь пуста.
+    """
+    queue_rows = (await db.execute(
+        select(CommentInsight.insight_type, CommentInsight.normalized_text, func.min(CommentInsight.display_text).label("display_text"))
+        .where(CommentInsight.canonical_id.is_(None)) # ix_comment_insights_not_canonicalized
+        .group_by(CommentInsight.insight_type, CommentInsight.normalized_text)
+        .limit(settings.INSIGHT_CANONICALIZATION_BATCH_TEXTS)
+    )).all()
+    if not queue_rows:
+        return None
+    pairs = [(row.insight_type, row.normalized_text) for row in queue_rows]
+    known_pairs = {
+        (row.insight_type, row.normalized_text)
+        for row in (await db.execute(
+            select(InsightAlias.insight_type, InsightAlias.normalized_text).where(tuple_(InsightAlias.insight_type, InsightAlias.normalized_text).in_(pairs))
+        )).all()
+    } # Формулировка попала в словарь после вставки строки - достаточно проставить canonical_id
+    groups = group_by_key([(row.insight_type, row.normalized_text, row.display_text) for row in queue_rows if (row.insight_type, row.normalized_text) not in known_pairs])
+    canonical_by_key: Dict[Tuple[str, str], int] = {}
+    if groups:
+        canonical_by_key = {
+            (row.insight_type, row.canonical_key): row.id
+            for row in (await db.execute(
+                select(InsightCanonical.id, InsightCanonical.insight_type, InsightCanonical.canonical_key)
+                .where(tuple_(InsightCanonical.insight_type, InsightCanonical.canonical_key).in_(list(groups)))
+            )).all()
+        }
+    new_keys = [group_key for group_key in groups if group_key not in canonical_by_key]
+    vectors = None
+    if new_keys and provider is not None:
+        vectors = await embed_in_batches(provider, [groups[group_key][0][1] for group_key in new_keys])
+    embedding_model = f"{provider.name}/{provider.model}" if provider is not None else None
+    stats = {"texts": len(pairs), "new_canonicals": 0, "merged_by_embedding": 0, "rows": 0}
+    similarity_by_key: Dict[Tuple[str, str], int] = {}
+    for position, group_key in enumerate(new_keys):
+        insight_type, canonical_key = group_key
+        if vectors is not None:
+            if insight_type not in cluster_indexes:
+                cluster_indexes[insight_type] = await _insight_cluster_index(db, insight_type, embedding_model, provider.dimension)
+            canonical_id, similarity = cluster_indexes[insight_type].match(vectors[position])
+            if canonical_id is not None:
+                canonical_by_key[group_key] = canonical_id
+                similarity_by_key[group_key] = int(round(similarity * 1000))
+                stats["merged_by_embedding"] += 1
+                continue
+        canonical_id = (await db.execute(
+            pg_insert(InsightCanonical).values(
+                insight_type=insight_type, canonical_key=canonical_key, display_text=groups[group_key][0][1],
+                embedding=embedding_to_bytes(vectors[position]) if vectors is not None else None, embedding_model=embedding_model,
+            ).on_conflict_do_nothing(constraint="uq_insight_canonicals_type_key").returning(InsightCanonical.id)
+        )).scalar_one_or_none()
+        if canonical_id is None: # Ключ успел появиться (параллельный запуск)
+            canonical_id = (await db.execute(
+                select(InsightCanonical.id).where(InsightCanonical.insight_type == insight_type, InsightCanonical.canonical_key == canonical_key)
+            )).scalar_one()
+        else:
+            stats["new_canonicals"] += 1
+            if vectors is not None:
+                cluster_indexes[insight_type].add(canonical_id, vectors[position])
+        canonical_by_key[group_key] = canonical_id
+    alias_rows = [
+        {"insight_type": insight_type, "normalized_text": normalized_text, "canonical_id": canonical_by_key[(insight_type, canonical_key)],
+         "similarity": similarity_by_key.get((insight_type, canonical_key))}
+        for (insight_type, canonical_key), variants in groups.items() for normalized_text, _ in variants
+    ]
+    if alias_rows:
+        await db.execute(pg_insert(InsightAlias).values(alias_rows).on_conflict_do_nothing())
+    result = await db.execute(
+        update(CommentInsight)
+        .where(CommentInsight.canonical_id.is_(None), tuple_(CommentInsight.insight_type, CommentInsight.normalized_text).in_(pairs))
+        .values(canonical_id=select(InsightAlias.canonical_id).where(
+            InsightAlias.insight_type == CommentInsight.insight_type, InsightAlias.normalized_text == CommentInsight.normalized_text
+        ).scalar_subquery())
+        .execution_options(synchronize_session=False)
+    )
+    stats["rows"] = result.rowcount or 0
+    return stats
+
+
+@celery_instance.task(name="tasks.canonicalize_insights", bind=True, max_retries=2, default_retry_delay=300)
+def canonicalize_insights_task(self):
+    """
+    Канонизация инсайтов (app/services/insight_canonicalization.py): новые формулировки из comment_insights получают канонический
+    инсайт, словарь insight_aliases пополняется, строкам проставляется canonical_id. Каждая пачка - отдельная транзакция,
+    не больше INSIGHT_CANONICALIZATION_MAX_TEXTS_PER_RUN формулировок за запуск. Запускается Celery Beat.
+    """
+    log_prefix = "[InsightCanonicalization]"
+    if not settings.INSIGHT_CANONICALIZATION_ENABLED:
+        return "Канонизация инсайтов выключена (INSIGHT_CANONICALIZATION_ENABLED=False)."
+
+    async def _async_logic() -> str:
+        provider = None
+        if clustering_available():
+            try:
+                provider = get_embedding_provider()
+            except EmbeddingProviderUnavailableError as e:
+                logger.warning(f"{log_prefix} Объединение по эмбеддингам пропущено: {e}")
+        totals = {"texts": 0, "new_canonicals": 0, "merged_by_embedding": 0, "rows": 0}
+        cluster_indexes: Dict[str, InsightClusterIndex] = {}
+        local_engine, LocalAsyncSessionFactory_Task = _make_task_session_factory("backfill")
+        try:
+            async with LocalAsyncSessionFactory_Task() as db_session:
+                while totals["texts"] < settings.INSIGHT_CANONICALIZATION_MAX_TEXTS_PER_RUN:
+                    batch_stats = await _canonicalize_insight_batch(db_session, provider, cluster_indexes)
+                    if batch_stats is None:
+                        break
+                    await db_session.commit()
+                    for key, value in batch_stats.items():
+                        totals[key] += value
+        finally:
+            await local_engine.dispose()
+        if totals["rows"]:
+            await bump_data_version("canonicalize_insights")
+        return f"Канонизация инсайтов (лемматизация: {lemmatizer_name()}, эмбеддинги: {'да' if provider else 'нет'}): {totals}."
+
+    try:
+        result_message = asyncio.run(_async_logic())
+    except Exception as e_task_main:
+        logger.error(f"{log_prefix} !!! Ошибка канонизации: {type(e_task_main).__name__} - {e_task_main}", exc_info=True)
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=e_task_main, countdown=int(self.default_retry_delay * (2 ** self.request.retries)))
+        raise
+    logger.info(f"{log_prefix} {result_message}")
+    return result_message
+
+
+@celery_instance.task(name="tasks.probe_llm_circuit")
+def probe_llm_circuit_task():
+    """Фоновая проверка восстановления провайдера LLM, пока предохранитель разомкнут (Celery Beat)."""
+    provider_available = asyncio.run(probe_llm_provider())
+    if provider_available is None:
+        return "Предохранитель LLM замкнут или проверка уже выполняется - пробный запрос не нужен."
+    return f"Пробный запрос к LLM: провайдер {'доступен, цепь замкнута' if provider_available else 'недоступен, цепь остается разомкнутой'}."
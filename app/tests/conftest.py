@@ -0,0 +1,13 @@
+# app/tests/conftest.py
+# Запуск из корня репозитория: python -m pytest app/tests
+
+import os
+import sys
+
+# Пакет app импортируется как в контейнере (PYTHONPATH - каталог над app)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+# Settings требует параметры БД; чистым функциям они не нужны
+os.environ.setdefault("POSTGRES_USER", "test")
+os.environ.setdefault("POSTGRES_PASSWORD", "test")
+os.environ.setdefault("POSTGRES_DB", "test")
@@ -0,0 +1,23 @@
+# app/tests/test_embeddings.py
+
+import pytest
+
+from app.services.embeddings import EmbeddingProvider
+
+
+def test_provider_without_embed_cannot_be_instantiated():
+    class HalfImplementedProvider(EmbeddingProvider):
+        name = "half"
+
+    with pytest.raises(TypeError):
+        HalfImplementedProvider()
+
+
+def test_provider_with_embed_can_be_instantiated():
+    class EchoProvider(EmbeddingProvider):
+        name = "echo"
+
+        async def embed(self, texts, is_query=False):
+            return texts
+
+    assert EchoProvider().name == "echo"
@@ -0,0 +1,43 @@
+# app/tests/test_insight_canonicalization.py
+
+import pytest
+
+from app.services.insight_canonicalization import canonical_insight_key, group_by_key, lemmatizer_name
+
+needs_lemmatizer = pytest.mark.skipif(lemmatizer_name() == "none", reason="нет ни pymorphy3, ни snowballstemmer")
+
+
+def test_word_order_does_not_change_key():
+    assert canonical_insight_key("долгая доставка") == canonical_insight_key("доставка долгая")
+
+
+def test_case_punctuation_and_yo_are_normalized():
+    assert canonical_insight_key("  Ещё   ДОСТАВКА!!! ") == canonical_insight_key("еще доставка")
+
+
+def test_stop_words_are_dropped_but_negation_is_kept():
+    assert canonical_insight_key("проблемы с доставкой и оплатой") == canonical_insight_key("проблемы доставкой оплатой")
+    assert canonical_insight_key("приложение не работает") != canonical_insight_key("приложение работает")
+
+
+def test_text_without_meaningful_words_has_empty_key():
+    assert canonical_insight_key("😀👍") == ""
+    assert canonical_insight_key("и с на") == ""
+    assert canonical_insight_key(None) == ""
+
+
+@needs_lemmatizer
+def test_word_forms_share_key():
+    assert canonical_insight_key("проблемы с доставкой") == canonical_insight_key("проблема доставки")
+
+
+def test_group_by_key_falls_back_to_normalized_text():
+    groups = group_by_key([
+        ("problem", "доставка долгая", "Доставка долгая"),
+        ("problem", "долгая доставка", "Долгая доставка"),
+        ("topic", "долгая доставка", "Долгая доставка"),
+        ("topic", "😀", "😀"),
+    ])
+    assert len(groups[("problem", canonical_insight_key("долгая доставка"))]) == 2
+    assert ("topic", "😀") in groups
+    assert len(groups) == 3
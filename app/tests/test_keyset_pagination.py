@@ -0,0 +1,73 @@
+# app/tests/test_keyset_pagination.py
+
+import base64
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import Column, DateTime, Integer, MetaData, Table, func, literal_column
+from sqlalchemy.dialects import postgresql
+
+from app.services.keyset_pagination import InvalidCursorError, decode_cursor, encode_cursor, keyset_predicate
+
+posts = Table(
+    "posts", MetaData(),
+    Column("id", Integer, primary_key=True), Column("posted_at", DateTime(timezone=True)), Column("views_count", Integer),
+)
+
+
+def _compiled(expression):
+    compiled = expression.compile(dialect=postgresql.dialect())
+    return str(compiled), list(compiled.params.values())
+
+
+def test_datetime_round_trip_keeps_timezone():
+    posted_at = datetime(2024, 3, 31, 23, 59, 59, 123456, tzinfo=timezone(timedelta(hours=3)))
+    token = encode_cursor("posted_at", "desc", posted_at, 42)
+    value, row_id = decode_cursor(token, "posted_at", "desc")
+    assert value == posted_at
+    assert value.utcoffset() == timedelta(hours=3)
+    assert row_id == 42
+
+
+def test_token_is_url_safe_without_padding():
+    token = encode_cursor("posted_at", "asc", "значение с пробелами/и+знаками", 7)
+    assert "=" not in token and "+" not in token and "/" not in token
+    assert decode_cursor(token, "posted_at", "asc") == ("значение с пробелами/и+знаками", 7)
+
+
+@pytest.mark.parametrize("sort_key, sort_order", [("views_count", "desc"), ("posted_at", "asc")])
+def test_cursor_for_another_sort_is_rejected(sort_key, sort_order):
+    token = encode_cursor("posted_at", "desc", datetime(2024, 1, 1, tzinfo=timezone.utc), 1)
+    with pytest.raises(InvalidCursorError, match="сортировки"):
+        decode_cursor(token, sort_key, sort_order)
+
+
+@pytest.mark.parametrize("token", [
+    "",
+    "not-a-cursor",
+    "%%%",
+    base64.urlsafe_b64encode(b"{\"s\": \"posted_at\"").decode("ascii"),                    # Обрезанный JSON
+    base64.urlsafe_b64encode(json.dumps({"s": "posted_at", "o": "desc", "v": 1}).encode()).decode("ascii"),  # Нет id
+    base64.urlsafe_b64encode(json.dumps({"s": "posted_at", "o": "desc", "v": 1, "id": "x"}).encode()).decode("ascii"),
+])
+def test_tampered_cursor_is_rejected(token):
+    with pytest.raises(InvalidCursorError):
+        decode_cursor(token, "posted_at", "desc")
+
+
+def test_predicate_direction_follows_sort_order():
+    after_desc, _ = _compiled(keyset_predicate(posts.c.posted_at, posts.c.id, datetime(2024, 1, 1, tzinfo=timezone.utc), 5, True))
+    after_asc, _ = _compiled(keyset_predicate(posts.c.posted_at, posts.c.id, datetime(2024, 1, 1, tzinfo=timezone.utc), 5, False))
+    assert "(posts.posted_at, posts.id) <" in after_desc
+    assert "(posts.posted_at, posts.id) >" in after_asc
+
+
+def test_null_views_sentinel_stays_a_literal_and_round_trips():
+    # Ключ сортировки по просмотрам - coalesce(views_count, -1) литералом, как в индексе ix_posts_keyset_views;
+    # строка с NULL просмотров отдает в курсор -1, и следующая страница продолжается от него
+    sort_expression = func.coalesce(posts.c.views_count, literal_column("-1"))
+    value, row_id = decode_cursor(encode_cursor("views_count", "desc", -1, 9), "views_count", "desc")
+    sql, params = _compiled(keyset_predicate(sort_expression, posts.c.id, value, row_id, True))
+    assert "coalesce(posts.views_count, -1)" in sql
+    assert params == [-1, 9]
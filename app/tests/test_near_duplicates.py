@@ -0,0 +1,59 @@
+# app/tests/test_near_duplicates.py
+
+from app.core.config import settings
+from app.services.near_duplicates import (
+    SIMHASH_BAND_BITS, find_representative, hamming_distance, max_distance_for, simhash64, simhash_bands,
+)
+
+TEXT = "Подскажите, когда будет доставка заказа в Казань, жду уже вторую неделю"
+
+
+def test_signature_ignores_case_punctuation_links_and_mentions():
+    variant = "подскажите когда будет ДОСТАВКА заказа в казань жду уже вторую неделю!!! https://t.me/shop @shop_support"
+    assert simhash64(variant) == simhash64(TEXT)
+
+
+def test_signature_is_signed_64_bit_and_deterministic():
+    signature = simhash64(TEXT)
+    assert -(1 << 63) <= signature < (1 << 63)
+    assert simhash64(TEXT) == signature
+
+
+def test_text_without_words_has_no_signature():
+    assert simhash64(None) is None
+    assert simhash64("") is None
+    assert simhash64("123 !!! 😀 https://example.com") is None
+
+
+def test_unrelated_texts_are_far_apart():
+    other = simhash64("Отличный канал, спасибо за полезные обзоры техники и новости")
+    assert hamming_distance(simhash64(TEXT), other) > settings.NEAR_DUP_MAX_HAMMING
+
+
+def test_bands_reassemble_unsigned_signature():
+    signature = simhash64(TEXT)
+    reassembled = sum(band << (position * SIMHASH_BAND_BITS) for position, band in enumerate(simhash_bands(signature)))
+    assert reassembled == signature & ((1 << 64) - 1)
+
+
+def test_short_texts_require_exact_match():
+    assert max_distance_for("спасибо") == 0
+    assert max_distance_for(TEXT) == settings.NEAR_DUP_MAX_HAMMING
+
+
+def test_find_representative_picks_nearest_within_distance():
+    signature = 0b1111_0000
+    candidates = [(1, 0b1111_0111), (2, 0b1111_0001), (3, 0b0000_0000)] # Расстояния 3, 1, 4
+    assert find_representative(signature, 3, candidates) == 2
+
+
+def test_find_representative_prefers_exact_match_and_respects_limit():
+    signature = simhash64(TEXT)
+    assert find_representative(signature, 0, [(10, signature ^ 1), (11, signature), (12, signature)]) == 11
+    assert find_representative(signature, 2, [(10, signature ^ 0b111)]) is None
+    assert find_representative(signature, 3, []) is None
+
+
+def test_hamming_distance_handles_negative_signatures():
+    assert hamming_distance(-1, 0) == 64
+    assert hamming_distance(-1, -1) == 0
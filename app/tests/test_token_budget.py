@@ -0,0 +1,36 @@
+# app/tests/test_token_budget.py
+
+import pytest
+
+from app.services.token_budget import TRIM_SEPARATOR, count_tokens, trim_to_token_budget
+
+MODEL = "gpt-4o-mini"
+HEAD = "Первое предложение про доставку."
+TAIL = "Последнее предложение с выводом!"
+LONG_TEXT = " ".join([HEAD] + [f"Промежуточное предложение номер {n} с подробностями." for n in range(200)] + [TAIL])
+
+
+def test_text_within_budget_is_returned_unchanged():
+    assert trim_to_token_budget(HEAD, 100, MODEL) is HEAD
+    assert trim_to_token_budget("", 10, MODEL) == ""
+
+
+@pytest.mark.parametrize("max_tokens", [1, 3, 20, 57, 200, 1000])
+def test_result_never_exceeds_budget(max_tokens):
+    assert count_tokens(trim_to_token_budget(LONG_TEXT, max_tokens, MODEL), MODEL) <= max_tokens
+
+
+def test_trimming_keeps_head_and_tail_around_separator():
+    trimmed = trim_to_token_budget(LONG_TEXT, 200, MODEL)
+    head, separator, tail = trimmed.partition(TRIM_SEPARATOR)
+    assert separator == TRIM_SEPARATOR
+    assert head.startswith(HEAD)
+    assert tail.endswith(TAIL)
+    assert "номер 100 " not in trimmed
+
+
+def test_single_oversized_sentence_is_cut_by_tokens():
+    sentence = "слово " * 500
+    trimmed = trim_to_token_budget(sentence, 50, MODEL)
+    assert 0 < count_tokens(trimmed, MODEL) <= 50
+    assert trimmed.startswith("слово")
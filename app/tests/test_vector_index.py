@@ -0,0 +1,52 @@
+# app/tests/test_vector_index.py
+
+import pytest
+
+numpy = pytest.importorskip("numpy")
+pytest.importorskip("hnswlib")
+
+from app.core.config import settings
+from app.services.vector_index import KIND_POST, VectorIndexWriter, search_vector_index, text_hash
+
+DIM = 8
+
+
+@pytest.fixture(autouse=True)
+def index_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "SEMANTIC_INDEX_PATH", str(tmp_path))
+    monkeypatch.setattr(settings, "SEMANTIC_HNSW_ENABLED", True)
+    monkeypatch.setattr(settings, "SEMANTIC_EXACT_SCAN_MAX_ROWS", 0) # Поиск через граф, а не перебором
+
+
+def _unit(position: int):
+    vector = numpy.zeros((1, DIM), dtype=numpy.float32)
+    vector[0, position] = 1.0
+    return vector
+
+
+def _upsert_post(doc_id: int, text: str, vector) -> None:
+    with VectorIndexWriter("test", "unit", DIM) as writer:
+        writer.upsert(KIND_POST, [doc_id], [1], [0], [text_hash(text)], vector)
+        writer.commit()
+
+
+def test_reindexing_changed_document_in_new_session():
+    _upsert_post(1, "первая версия", _unit(0))
+    _upsert_post(1, "вторая версия", _unit(1)) # Прежний слот помечается удаленным в графе, загруженном из файла
+
+    with VectorIndexWriter("test", "unit", DIM) as writer:
+        assert writer.state["count"] == 2
+        assert writer.state["deleted"] == 1
+        assert not writer.changed_mask(KIND_POST, [1], [text_hash("вторая версия")]).any()
+
+    hits = search_vector_index(_unit(1)[0], 5, [KIND_POST], "test", "unit")
+    assert [(kind, doc_id) for kind, doc_id, _ in hits] == [(KIND_POST, 1)]
+
+
+def test_delete_kind_after_reopening():
+    _upsert_post(1, "пост", _unit(0))
+    _upsert_post(2, "другой пост", _unit(1))
+    with VectorIndexWriter("test", "unit", DIM) as writer:
+        assert writer.delete_kind(KIND_POST) == 2
+        writer.commit()
+        assert writer.state["deleted"] == 2
@@ -72,18 +72,61 @@ export const fetchCommentsAPI = async (postId, page = 1) => {
   return fetchData(url);
 };
 
+// Параметры виджетов дашборда по умолчанию - с ними виджеты получают данные из одного запроса /dashboard/bundle
+const DASHBOARD_BUNDLE_DEFAULTS = {
+  activityDays: 7,
+  topChannelsMetric: 'posts',
+  topChannelsLimit: 5,
+  topChannelsDays: 7,
+  sentimentDays: 7,
+  insightsDays: 30,
+  insightsTopN: 5,
+};
+const DASHBOARD_BUNDLE_REUSE_MS = 5000; // Виджеты монтируются одновременно - все они должны получить один и тот же запрос
+
+let dashboardBundleRequest = null;
+
+/**
+ * Загружает все виджеты дашборда одним запросом. Одновременные вызовы разделяют один запрос.
+ */
+export const fetchDashboardBundleAPI = async () => {
+  const now = Date.now();
+  if (!dashboardBundleRequest || now - dashboardBundleRequest.startedAt > DASHBOARD_BUNDLE_REUSE_MS) {
+    const params = new URLSearchParams({
+      activity_days: DASHBOARD_BUNDLE_DEFAULTS.activityDays.toString(),
+      top_channels_metric: DASHBOARD_BUNDLE_DEFAULTS.topChannelsMetric,
+      top_channels_limit: DASHBOARD_BUNDLE_DEFAULTS.topChannelsLimit.toString(),
+      top_channels_days: DASHBOARD_BUNDLE_DEFAULTS.topChannelsDays.toString(),
+      sentiment_days: DASHBOARD_BUNDLE_DEFAULTS.sentimentDays.toString(),
+      insights_days: DASHBOARD_BUNDLE_DEFAULTS.insightsDays.toString(),
+      insights_top_n: DASHBOARD_BUNDLE_DEFAULTS.insightsTopN.toString(),
+    });
+    const promise = fetchData(`${API_BASE_URL}/dashboard/bundle?${params.toString()}`);
+    dashboardBundleRequest = { startedAt: now, promise };
+    promise.catch(() => {
+      if (dashboardBundleRequest && dashboardBundleRequest.promise === promise) {
+        dashboardBundleRequest = null; // Ошибку не кэшируем - следующий вызов повторит запрос
+      }
+    });
+  }
+  return dashboardBundleRequest.promise;
+};
+
 /**
  * Загружает общую статистику для дашборда.
  */
 export const fetchDashboardStatsAPI = async () => {
-  const url = `${API_BASE_URL}/dashboard/stats`;
-  return fetchData(url);
+  const bundle = await fetchDashboardBundleAPI();
+  return bundle.stats;
 };
 
 /**
  * Загружает данные об активности по времени для дашборда.
  */
 export const fetchActivityOverTimeAPI = async (days = 7) => {
+  if (days === DASHBOARD_BUNDLE_DEFAULTS.activityDays) {
+    return (await fetchDashboardBundleAPI()).activity;
+  }
   const url = `${API_BASE_URL}/dashboard/activity_over_time?days=${days}`;
   return fetchData(url);
 };
@@ -92,6 +135,9 @@ export const fetchActivityOverTimeAPI = async (days = 7) => {
  * Загружает топ каналов по указанной метрике.
  */
 export const fetchTopChannelsAPI = async (metric = 'posts', limit = 5, daysPeriod = 7) => {
+  if (metric === DASHBOARD_BUNDLE_DEFAULTS.topChannelsMetric && limit === DASHBOARD_BUNDLE_DEFAULTS.topChannelsLimit && daysPeriod === DASHBOARD_BUNDLE_DEFAULTS.topChannelsDays) {
+    return (await fetchDashboardBundleAPI()).top_channels;
+  }
   const url = `${API_BASE_URL}/dashboard/top_channels?metric=${metric}&limit=${limit}&days_period=${daysPeriod}`;
   return fetchData(url);
 };
@@ -100,6 +146,9 @@ export const fetchTopChannelsAPI = async (metric = 'posts', limit = 5, daysPerio
  * Загружает данные о распределении тональности постов.
  */
 export const fetchSentimentDistributionAPI = async (daysPeriod = 7) => {
+  if (daysPeriod === DASHBOARD_BUNDLE_DEFAULTS.sentimentDays) {
+    return (await fetchDashboardBundleAPI()).sentiment;
+  }
   const url = `${API_BASE_URL}/dashboard/sentiment_distribution?days_period=${daysPeriod}`;
   return fetchData(url);
 };
@@ -143,6 +192,9 @@ export const fetchChannelDetailsAPI = async (channelId) => {
  * Загружает агрегированные AI-инсайты из комментариев.
  */
 export const fetchCommentInsightsAPI = async (daysPeriod = 7, topN = 10) => {
+  if (daysPeriod === DASHBOARD_BUNDLE_DEFAULTS.insightsDays && topN === DASHBOARD_BUNDLE_DEFAULTS.insightsTopN) {
+    return (await fetchDashboardBundleAPI()).comment_insights;
+  }
   const url = `${API_BASE_URL}/dashboard/comment_insights?days_period=${daysPeriod}&top_n=${topN}`;
   return fetchData(url);
 };